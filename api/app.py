@@ -1,11 +1,17 @@
-from flask import Flask, g, jsonify
-from flask_oidc import OpenIDConnect
-from okta.client import Client as OktaClient
+from flask import Flask, Response, g, jsonify, request
 from dotenv import find_dotenv, load_dotenv
-from flask_migrate import Migrate
-from models.models import initialize_model
-from api.database import db
+from api.database import db, engine_options, init_database
+from api.async_db import async_db
+from api.ingestion import rating_ingestor
+from api.experiments import experiments
+from api.scoring import (
+    content_engines, predict_batcher, recommendation_pipelines,
+    scoring_executor)
 from api.extensions import bcrypt, mail, login_manager
+from api.model_loader import ModelLoader
+from api.serialization import compress_response
+from recommendation_engine.instrumentation import (
+    REGISTRY, server_timing_header, start_request_timing)
 import os
 import uuid
 import logging
@@ -26,8 +32,6 @@ def configure_api_key():
         print(f"Generated and stored API key: {api_key}")
 
 
-configure_api_key()
-
 ENV_FILE = find_dotenv()
 if ENV_FILE:
     load_dotenv()
@@ -35,7 +39,38 @@ if ENV_FILE:
 logging.basicConfig(level=logging.DEBUG)
 
 
-def create_app():
+def _int_env(name):
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+def create_app(lazy_startup=None, load_model=True, ingest_ratings=True):
+    """
+    Create and configure the Flask application.
+
+    Args:
+        lazy_startup (bool, optional): Load the recommendation model in a
+        background thread so health and static routes can be served while
+        it is being built. Defaults to the LAZY_STARTUP environment variable.
+        load_model (bool): Load (or attach to) the recommendation model.
+        Command-line tools that only need the database pass False.
+        ingest_ratings (bool): Start the rating consumer when
+        RATING_INGESTION is set. Command-line tools pass False so that a
+        short-lived process does not claim or replay the rating logs.
+
+    Returns:
+        Flask: The configured application.
+    """
+    # Heavy third-party packages are imported here rather than at module
+    # level so that importing api.app stays cheap.
+    from flask_oidc import OpenIDConnect
+    from flask_migrate import Migrate
+
+    configure_api_key()
+
+    if lazy_startup is None:
+        lazy_startup = os.getenv("LAZY_STARTUP") == 'True'
+
     app = Flask(
         __name__,
         template_folder="../frontend/templates",
@@ -44,6 +79,17 @@ def create_app():
     app.config.from_mapping(
         SQLALCHEMY_DATABASE_URI=os.getenv("DATABASE_URL"),
         SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        SQLALCHEMY_ENGINE_OPTIONS=engine_options(
+            os.getenv("DATABASE_URL"),
+            pool_size=_int_env("DATABASE_POOL_SIZE"),
+            max_overflow=_int_env("DATABASE_MAX_OVERFLOW"),
+            pool_timeout=_int_env("DATABASE_POOL_TIMEOUT"),
+            pool_recycle=_int_env("DATABASE_POOL_RECYCLE"),
+            pool_pre_ping=os.getenv("DATABASE_POOL_PRE_PING") != 'False',
+            statement_timeout_ms=_int_env("DATABASE_STATEMENT_TIMEOUT_MS")),
+        READ_REPLICA_URI=os.getenv("READ_REPLICA_URL"),
+        DATABASE_STATEMENT_TIMEOUT_MS=_int_env(
+            "DATABASE_STATEMENT_TIMEOUT_MS"),
         SECURITY_PASSWORD_SALT=os.getenv("SECURITY_PASSWORD_SALT"),
         MAIL_SERVER=os.getenv("MAIL_SERVER"),
         MAIL_PORT=int(
@@ -69,9 +115,65 @@ def create_app():
             "profile"],
         API_KEY=os.getenv("API_KEY"),
         SECRET_KEY=os.getenv('SECRET_KEY'),
-        BCRYPT_LOG_ROUNDS=13)
+        BCRYPT_LOG_ROUNDS=13,
+        SERVER_TIMING=os.getenv("SERVER_TIMING") == 'True',
+        RESPONSE_COMPRESSION=os.getenv("RESPONSE_COMPRESSION") == 'True',
+        COMPRESS_MIN_SIZE=int(os.getenv("COMPRESS_MIN_SIZE", "1024")),
+        ASYNC_DATABASE=os.getenv("ASYNC_DATABASE") == 'True',
+        ASYNC_DATABASE_URI=os.getenv("ASYNC_DATABASE_URL"),
+        ASYNC_DATABASE_POOL_SIZE=int(
+            os.getenv("ASYNC_DATABASE_POOL_SIZE", "20")),
+        ASYNC_DATABASE_MAX_OVERFLOW=int(
+            os.getenv("ASYNC_DATABASE_MAX_OVERFLOW", "20")),
+        SCORING_WORKERS=int(os.getenv("SCORING_WORKERS", "0")) or None,
+        SCORING_MAX_PENDING=int(os.getenv("SCORING_MAX_PENDING", "0")) or None,
+        PREDICT_BATCHING=os.getenv("PREDICT_BATCHING", "True") == 'True',
+        PREDICT_BATCH_MAX_SIZE=int(os.getenv("PREDICT_BATCH_MAX_SIZE", "64")),
+        PREDICT_BATCH_MAX_WAIT_MS=float(
+            os.getenv("PREDICT_BATCH_MAX_WAIT_MS", "2")),
+        COLD_START=os.getenv("COLD_START", "True") == 'True',
+        COLD_START_MIN_RATINGS=int(os.getenv("COLD_START_MIN_RATINGS", "5")),
+        CONTENT_TOP_K=int(os.getenv("CONTENT_TOP_K", "20")),
+        CONTENT_REFRESH_INTERVAL=float(
+            os.getenv("CONTENT_REFRESH_INTERVAL", "60")),
+        RECOMMENDATION_PIPELINE=os.getenv(
+            "RECOMMENDATION_PIPELINE") == 'True',
+        PIPELINE_MAX_CANDIDATES=int(
+            os.getenv("PIPELINE_MAX_CANDIDATES", "300")),
+        RECOMMENDATION_DIVERSITY=float(
+            os.getenv("RECOMMENDATION_DIVERSITY", "0")),
+        HYBRID_WEIGHTS=os.getenv("HYBRID_WEIGHTS"),
+        MODEL_SHARE_DIR=os.getenv("MODEL_SHARE_DIR"),
+        MODEL_SHARE_POLL_INTERVAL=float(
+            os.getenv("MODEL_SHARE_POLL_INTERVAL", "1.0")),
+        MODEL_SHARE_WAIT=float(os.getenv("MODEL_SHARE_WAIT", "300")),
+        MODEL_SERVER_SOCKET=os.getenv("MODEL_SERVER_SOCKET"),
+        MODEL_SERVER_TIMEOUT=float(os.getenv("MODEL_SERVER_TIMEOUT", "30")),
+        MODEL_SERVER_WAIT=float(os.getenv("MODEL_SERVER_WAIT", "300")),
+        RATING_INGESTION=(ingest_ratings
+                          and os.getenv("RATING_INGESTION") == 'True'),
+        INGESTION_LOG_DIR=os.getenv("INGESTION_LOG_DIR", "ingestion_log"),
+        INGESTION_BATCH_SIZE=int(os.getenv("INGESTION_BATCH_SIZE", "500")),
+        INGESTION_FLUSH_INTERVAL_MS=float(
+            os.getenv("INGESTION_FLUSH_INTERVAL_MS", "5")),
+        INGESTION_LOG_MAX_BYTES=int(
+            os.getenv("INGESTION_LOG_MAX_BYTES", str(16 * 1024 * 1024))),
+        EXPERIMENTS_CONFIG=os.getenv("EXPERIMENTS_CONFIG"),
+        EXPERIMENT_RELOAD_INTERVAL=float(
+            os.getenv("EXPERIMENT_RELOAD_INTERVAL", "10")),
+        EXPERIMENT_SHADOW_WORKERS=int(
+            os.getenv("EXPERIMENT_SHADOW_WORKERS", "1")),
+        EXPERIMENT_SHADOW_QUEUE=int(
+            os.getenv("EXPERIMENT_SHADOW_QUEUE", "16")))
 
-    db.init_app(app)
+    init_database(app)
+    async_db.init_app(app)
+    scoring_executor.init_app(app)
+    predict_batcher.init_app(app)
+    recommendation_pipelines.init_app(app)
+    content_engines.init_app(app)
+    rating_ingestor.init_app(app)
+    experiments.init_app(app)
     bcrypt.init_app(app)
     mail.init_app(app)
     migrate = Migrate(app, db)
@@ -83,15 +185,41 @@ def create_app():
     def load_user(user_id):
         return User.query.get(int(user_id))
 
-    oidc = OpenIDConnect(app, OktaClient({
-        "orgUrl": os.getenv("OKTA_ORG_URL"),
-        "token": os.getenv("OKTA_CLIENT_SECRET")
-    }))
+    # flask_oidc does not use the Okta client it is handed, so building it
+    # (and importing the Okta SDK) is skipped under lazy startup.
+    okta_client = None
+    if not lazy_startup:
+        from okta.client import Client as OktaClient
+        okta_client = OktaClient({
+            "orgUrl": os.getenv("OKTA_ORG_URL"),
+            "token": os.getenv("OKTA_CLIENT_SECRET")
+        })
+    oidc = OpenIDConnect(app, okta_client)
+
+    @app.before_request
+    def begin_request_timing():
+        if app.config['SERVER_TIMING']:
+            start_request_timing()
 
     @app.before_request
     async def before_request():
         g.user = oidc.user_getfield("email") if oidc.user_loggedin else None
 
+    @app.after_request
+    def add_server_timing(response):
+        if app.config['SERVER_TIMING']:
+            header = server_timing_header()
+            if header:
+                response.headers['Server-Timing'] = header
+        return response
+
+    @app.after_request
+    def compress(response):
+        if app.config['RESPONSE_COMPRESSION']:
+            compress_response(response, request.headers.get('Accept-Encoding'),
+                              app.config['COMPRESS_MIN_SIZE'])
+        return response
+
     @app.errorhandler(404)
     def not_found(error):
         return jsonify({"error": "Not found"}), 404
@@ -100,6 +228,21 @@ def create_app():
     def unauthorized(error):
         return jsonify({"error": "Unauthorized"}), 401
 
+    @app.route("/health")
+    def health():
+        return jsonify({"status": "ok"}), 200
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(REGISTRY.render(),
+                        mimetype="text/plain; version=0.0.4")
+
+    @app.route("/ready")
+    def ready():
+        status = app.extensions['model_loader'].status
+        code = 200 if status == ModelLoader.READY else 503
+        return jsonify({"status": status}), code
+
     from api.v1.endpoints import api_v1
     app.register_blueprint(api_v1)
 
@@ -107,20 +250,17 @@ def create_app():
     def oidc_callback():
         return oidc.callback_to()
 
-    with app.app_context():
-        logging.debug("Entering app context to initialize the model.")
-        # Capture the returned model instance and known user IDs
-        model_instance, known_user_ids = initialize_model()
-        logging.debug("Model initialization function called.")
-
-        if model_instance is None or known_user_ids is None:
-            logging.error(
-                "Failed to initialize the recommendation model or known user IDs.")
-        else:
-            logging.info(
-                "Recommendation model and known user IDs initialized and ready for use.")
-            app.config['MODEL_INSTANCE'] = model_instance
-            app.config['KNOWN_USER_IDS'] = known_user_ids
+    model_loader = ModelLoader(app)
+    app.extensions['model_loader'] = model_loader
+    if load_model and lazy_startup:
+        model_loader.start()
+    elif load_model:
+        model_loader.load()
+
+    if load_model and model_loader.reader is not None:
+        @app.before_request
+        def refresh_shared_model():
+            model_loader.refresh()
 
     return app
 
@@ -0,0 +1,147 @@
+"""
+This module runs read-only database queries on an async SQLAlchemy engine.
+
+The async engine and its connection pool live on one dedicated event loop
+thread, so a single pool is shared by every request no matter which event
+loop (or worker thread) the Flask view runs on. Query functions are written
+once against a synchronous ``Session`` interface and executed through
+``AsyncSession.run_sync``. When the async engine is disabled they run on the
+regular (or read replica) session instead, which keeps the sync path
+available for comparison.
+
+Under a WSGI server an async Flask view still occupies one worker thread
+for the whole request: Flask runs the coroutine to completion on a new
+event loop in that thread. Awaiting the database here frees the thread's
+event loop, not the thread, so concurrency per process stays bounded by
+the server's thread count (gunicorn ``--threads``), not by this pool.
+Serving many more concurrent requests per process needs an ASGI server
+and framework.
+
+Example:
+    >>> def rated_movie_ids(session, user_id):
+    ...     return session.execute(select(Rating.movie_id).filter_by(
+    ...         user_id=user_id)).scalars().all()
+    >>> movie_ids = await async_db.run(rated_movie_ids, user_id)
+"""
+
+import asyncio
+import logging
+import threading
+
+from sqlalchemy.engine import make_url
+
+from api.database import read_session
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+
+def async_database_uri(uri):
+    """
+    Derive the async-driver URL for a synchronous database URL.
+
+    Args:
+        uri (str): Database URL, e.g. ``postgresql://user@host/db``.
+
+    Returns:
+        str: The URL with an async driver, e.g. ``postgresql+asyncpg://...``.
+    """
+    url = make_url(uri)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend!r}.")
+    return url.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(
+        hide_password=False)
+
+
+class AsyncDatabase:
+    """
+    Async engine and session factory bound to a background event loop.
+
+    Attributes:
+        engine (sqlalchemy.ext.asyncio.AsyncEngine): The async engine, or
+        None while disabled.
+    """
+
+    def __init__(self):
+        self.engine = None
+        self._sessionmaker = None
+        self._loop = None
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return self.engine is not None
+
+    def init_app(self, app):
+        """
+        Create the async engine if ASYNC_DATABASE is enabled in the config.
+
+        Pool settings are read from ASYNC_DATABASE_POOL_SIZE and
+        ASYNC_DATABASE_MAX_OVERFLOW. Since every query run here is read-only,
+        the engine points at the read replica when READ_REPLICA_URI is set.
+        """
+        if not app.config.get('ASYNC_DATABASE'):
+            return
+
+        from sqlalchemy.ext.asyncio import (
+            async_sessionmaker, create_async_engine)
+
+        uri = app.config.get('ASYNC_DATABASE_URI') or async_database_uri(
+            app.config.get('READ_REPLICA_URI')
+            or app.config['SQLALCHEMY_DATABASE_URI'])
+        options = {}
+        if not uri.startswith('sqlite'):
+            options.update(
+                pool_size=app.config.get('ASYNC_DATABASE_POOL_SIZE', 20),
+                max_overflow=app.config.get('ASYNC_DATABASE_MAX_OVERFLOW', 20),
+                pool_pre_ping=True)
+        timeout_ms = app.config.get('DATABASE_STATEMENT_TIMEOUT_MS')
+        if timeout_ms and uri.startswith('postgresql+asyncpg'):
+            options['connect_args'] = {
+                'server_settings': {'statement_timeout': str(timeout_ms)}}
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="async-db", daemon=True)
+        self._thread.start()
+
+        self.engine = create_async_engine(uri, **options)
+        self._sessionmaker = async_sessionmaker(
+            self.engine, expire_on_commit=False)
+        logging.info(f"Async database engine started for {self.engine.url!r}")
+
+    async def run(self, query_function, *args):
+        """
+        Run ``query_function(session, *args)`` and return its result.
+
+        With the async engine enabled the query runs on the background loop
+        and the caller's event loop is free while it waits; otherwise it
+        runs synchronously on ``read_session()``.
+
+        Args:
+            query_function (callable): Function taking a Session first.
+            *args: Further arguments for the query function.
+        """
+        if not self.enabled:
+            return query_function(read_session(), *args)
+        future = asyncio.run_coroutine_threadsafe(
+            self._run_sync(query_function, *args), self._loop)
+        return await asyncio.wrap_future(future)
+
+    async def _run_sync(self, query_function, *args):
+        async with self._sessionmaker() as session:
+            return await session.run_sync(query_function, *args)
+
+    def close(self):
+        if not self.enabled:
+            return
+        asyncio.run_coroutine_threadsafe(
+            self.engine.dispose(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self.engine = None
+
+
+async_db = AsyncDatabase()
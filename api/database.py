@@ -1,3 +1,114 @@
+import time
+
+from flask import current_app, g
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import Session
+
+from recommendation_engine.instrumentation import observe
 
 db = SQLAlchemy()
+
+READ_REPLICA_BIND = 'read_replica'
+
+
+def engine_options(uri, pool_size=None, max_overflow=None, pool_timeout=None,
+                   pool_recycle=None, pool_pre_ping=True,
+                   statement_timeout_ms=None):
+    """
+    Build SQLALCHEMY_ENGINE_OPTIONS for the given database URL.
+
+    Pool settings only apply to server databases; SQLite keeps SQLAlchemy's
+    default pool. A statement timeout is passed to Postgres as a connection
+    option so runaway queries are cancelled by the server.
+
+    Args:
+        uri (str): Database URL.
+        pool_size (int, optional): Connections kept open in the pool.
+        max_overflow (int, optional): Extra connections allowed at peak.
+        pool_timeout (int, optional): Seconds to wait for a free connection.
+        pool_recycle (int, optional): Seconds after which a connection is
+        replaced, to avoid server-side idle disconnects.
+        pool_pre_ping (bool): Check connections before handing them out.
+        statement_timeout_ms (int, optional): Postgres statement_timeout.
+
+    Returns:
+        dict: Keyword arguments for ``create_engine``.
+    """
+    if not uri:
+        return {}
+    backend = make_url(uri).get_backend_name()
+    if backend == 'sqlite':
+        return {}
+
+    options = {'pool_pre_ping': pool_pre_ping}
+    for key, value in (('pool_size', pool_size),
+                       ('max_overflow', max_overflow),
+                       ('pool_timeout', pool_timeout),
+                       ('pool_recycle', pool_recycle)):
+        if value is not None:
+            options[key] = value
+    if statement_timeout_ms and backend == 'postgresql':
+        options['connect_args'] = {
+            'options': f'-c statement_timeout={int(statement_timeout_ms)}'}
+    return options
+
+
+def init_database(app):
+    """
+    Attach the database to the app, with a read replica bind if
+    READ_REPLICA_URI is configured.
+    """
+    replica_uri = app.config.get('READ_REPLICA_URI')
+    if replica_uri:
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        binds[READ_REPLICA_BIND] = replica_uri
+        app.config['SQLALCHEMY_BINDS'] = binds
+    db.init_app(app)
+    app.teardown_appcontext(close_read_session)
+    instrument_queries()
+
+
+def read_session():
+    """
+    Session for read-only queries.
+
+    Returns a session on the read replica when one is configured, otherwise
+    the regular Flask-SQLAlchemy session. Only use it for queries that can
+    tolerate replication lag; anything that reads back its own writes must
+    use ``db.session``.
+    """
+    binds = current_app.config.get('SQLALCHEMY_BINDS') or {}
+    if READ_REPLICA_BIND not in binds:
+        return db.session
+    if 'read_session' not in g:
+        g.read_session = Session(bind=db.engines[READ_REPLICA_BIND])
+    return g.read_session
+
+
+def close_read_session(exception=None):
+    session = g.pop('read_session', None)
+    if session is not None:
+        session.close()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    start = conn.info['query_start_time'].pop()
+    observe("db_query", time.perf_counter() - start)
+
+
+def instrument_queries():
+    """
+    Record the duration of every SQL statement in the db_query histogram.
+    """
+    if not event.contains(Engine, "before_cursor_execute",
+                          _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
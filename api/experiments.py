@@ -0,0 +1,505 @@
+"""
+This module runs A/B experiments on the recommendation endpoints.
+
+Users are bucketed into variants by a hash of the experiment's salt and
+their ID, so a user gets the same variant on every request and in every
+worker process. Each variant is a model configuration: attribute
+overrides of the serving model (``k``, ``sim_threshold``,
+``similarity_metric``, ...) refitted on a copy of it, and optionally a
+different ``engine`` ("user_cf" or "implicit") built from the database.
+Sharded models and model server clients do not hold their own ratings and
+are never copied; their variants must name an engine, without overrides.
+Variant models are built in the background; until one is ready its users
+are served by the serving model.
+
+An optional shadow variant ranks the user's candidates again on its own
+small thread pool after the response is computed. Shadow jobs are never
+awaited and are dropped, not queued, once the pool is busy, so they do not
+add latency to the request. Serving latency is recorded per variant
+(experiment_latency_seconds), shadow latency per shadow variant
+(experiment_shadow_latency_seconds), and the overlap of the shadow's top
+movies with the served ones as experiment_overlap_items_total out of
+experiment_compared_items_total.
+
+The experiment is a JSON file, EXPERIMENTS_CONFIG, checked for changes
+every EXPERIMENT_RELOAD_INTERVAL seconds:
+
+    {
+        "name": "neighbours",
+        "salt": "2026-10",
+        "variants": [
+            {"name": "control", "weight": 50},
+            {"name": "k50", "weight": 50,
+             "model": {"k": 50, "sim_threshold": 0.1}}
+        ],
+        "shadow": {"name": "implicit", "model": {"engine": "implicit"},
+                   "sample_rate": 0.1}
+    }
+
+Example:
+    >>> variant = experiments.assign(user_id)
+    >>> model = experiments.model_for(variant, serving_model)
+    >>> experiments.record(variant, elapsed)
+    >>> experiments.shadow(user_id, served_ids, candidates, serving_model)
+
+Classes:
+    Variant: One arm of an experiment.
+    Experiment: A parsed experiment configuration.
+    ExperimentRouter: Assigns users to variants, builds their models and
+    runs the shadow variant.
+"""
+
+import bisect
+import copy
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from recommendation_engine.instrumentation import count, observe
+
+ENGINES = ('user_cf', 'implicit')
+# Users are hashed into this many buckets.
+BUCKETS = 10000
+
+
+def bucket(salt, user_id):
+    """
+    The user's bucket in [0, BUCKETS), stable across processes and
+    restarts (unlike hash()).
+    """
+    digest = hashlib.sha256(f"{salt}:{user_id}".encode()).digest()
+    return int.from_bytes(digest[:8], 'big') % BUCKETS
+
+
+class Variant:
+    """
+    One arm of an experiment.
+
+    Attributes:
+        name (str): Name of the variant, used as a metric label.
+        weight (float): Relative share of users.
+        model (dict): Model configuration; empty for the serving model.
+        sample_rate (float): Share of requests scored, for a shadow
+        variant.
+    """
+
+    def __init__(self, name, weight=1.0, model=None, sample_rate=1.0):
+        if not name or not isinstance(name, str):
+            raise ValueError("Variant names must be non-empty strings.")
+        weight, sample_rate = float(weight), float(sample_rate)
+        if weight < 0:
+            raise ValueError(f"Variant {name} has a negative weight.")
+        if not 0 <= sample_rate <= 1:
+            raise ValueError(
+                f"Variant {name} has a sample rate outside [0, 1].")
+        self.name = name
+        self.weight = weight
+        self.model = dict(model or {})
+        self.sample_rate = sample_rate
+        engine = self.model.get('engine')
+        if engine is not None and engine not in ENGINES:
+            raise ValueError(
+                f"Variant {name} has unknown engine {engine!r}; expected "
+                f"one of {', '.join(ENGINES)}.")
+
+    @classmethod
+    def from_config(cls, config):
+        if not isinstance(config, dict):
+            raise ValueError("Variants must be JSON objects.")
+        return cls(config.get('name'), weight=config.get('weight', 1.0),
+                   model=config.get('model'),
+                   sample_rate=config.get('sample_rate', 1.0))
+
+    @property
+    def key(self):
+        """
+        The model configuration as a hashable, order-independent value.
+        """
+        return json.dumps(self.model, sort_keys=True)
+
+
+class Experiment:
+    """
+    A parsed experiment configuration.
+
+    Attributes:
+        name (str): Name of the experiment, used as a metric label.
+        salt (str): Mixed into the user hash; changing it reshuffles the
+        users.
+        variants (list): The Variant arms users are assigned to.
+        shadow (Variant): Variant scored off the request path, or None.
+    """
+
+    def __init__(self, name, variants, salt=None, shadow=None):
+        if not variants:
+            raise ValueError("An experiment needs at least one variant.")
+        names = [variant.name for variant in variants]
+        if shadow is not None:
+            names.append(shadow.name)
+        if len(set(names)) != len(names):
+            raise ValueError("Variant names must be unique.")
+        total = sum(variant.weight for variant in variants)
+        if total <= 0:
+            raise ValueError("Variant weights must add up to more than 0.")
+        self.name = name
+        self.salt = name if salt is None else str(salt)
+        self.variants = variants
+        self.shadow = shadow
+        # Upper bucket bound of each variant.
+        self._bounds = []
+        cumulative = 0.0
+        for variant in variants:
+            cumulative += variant.weight
+            self._bounds.append(round(BUCKETS * cumulative / total))
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Parse an experiment from its JSON object.
+
+        Raises:
+            ValueError: If the configuration is invalid.
+        """
+        if not isinstance(config, dict) or not config.get('name'):
+            raise ValueError("An experiment must be a JSON object with a name.")
+        shadow = config.get('shadow')
+        return cls(
+            str(config['name']),
+            [Variant.from_config(variant)
+             for variant in config.get('variants') or []],
+            salt=config.get('salt'),
+            shadow=Variant.from_config(shadow) if shadow else None)
+
+    def assign(self, user_id):
+        """
+        The variant of a user.
+        """
+        position = bisect.bisect_right(
+            self._bounds, bucket(self.salt, user_id))
+        return self.variants[min(position, len(self.variants) - 1)]
+
+
+class ExperimentRouter:
+    """
+    Assigns users to the variants of the current experiment, builds the
+    variants' models and scores the shadow variant.
+
+    Attributes:
+        path (str): The experiment's JSON file, or None.
+        reload_interval (float): Seconds between checks of the file.
+        shadow_workers (int): Threads scoring the shadow variant.
+        shadow_queue (int): Shadow jobs queued plus running before new
+        ones are dropped.
+        experiment (Experiment): The current experiment, or None.
+    """
+
+    def __init__(self, path=None, reload_interval=10.0, shadow_workers=1,
+                 shadow_queue=16):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.shadow_workers = shadow_workers
+        self.shadow_queue = shadow_queue
+        self.experiment = None
+        self.app = None
+        self._mtime = None
+        self._checked_at = 0.0
+        # Variant name -> (serving model, configuration key, model or None
+        # while it is built).
+        self._models = {}
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.path = app.config.get('EXPERIMENTS_CONFIG') or self.path
+        reload_interval = app.config.get('EXPERIMENT_RELOAD_INTERVAL')
+        if reload_interval is not None:
+            self.reload_interval = reload_interval
+        self.shadow_workers = app.config.get(
+            'EXPERIMENT_SHADOW_WORKERS') or self.shadow_workers
+        self.shadow_queue = app.config.get(
+            'EXPERIMENT_SHADOW_QUEUE') or self.shadow_queue
+        if self.path:
+            self.maybe_reload(force=True)
+
+    def configure(self, config):
+        """
+        Replace the experiment with ``config`` (a parsed JSON object, or
+        None to stop experimenting).
+
+        Raises:
+            ValueError: If the configuration is invalid.
+        """
+        experiment = Experiment.from_config(config) \
+            if config is not None else None
+        with self._lock:
+            self.experiment = experiment
+            arms = [] if experiment is None else experiment.variants + (
+                [experiment.shadow] if experiment.shadow else [])
+            names = {variant.name for variant in arms}
+            for name in list(self._models):
+                if name not in names:
+                    del self._models[name]
+        if experiment is None:
+            logging.info("No experiment is running.")
+        else:
+            logging.info(
+                f"Running experiment {experiment.name} with variants "
+                f"{', '.join(variant.name for variant in experiment.variants)}"
+                + (f" and shadow {experiment.shadow.name}"
+                   if experiment.shadow else ""))
+
+    def maybe_reload(self, force=False):
+        """
+        Re-read the experiment file if it changed. Cheap enough to call on
+        every request: the file is only checked once per reload_interval.
+
+        A file that cannot be parsed is logged and the running experiment
+        kept; a removed file stops the experiment.
+        """
+        if not self.path:
+            return
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            if self._mtime is not None or force:
+                logging.warning(
+                    f"Experiment file {self.path} not found; "
+                    "serving without an experiment.")
+                self._mtime = None
+                self.configure(None)
+            return
+        if mtime == self._mtime and not force:
+            return
+        self._mtime = mtime
+        try:
+            with open(self.path) as config_file:
+                self.configure(json.load(config_file))
+        except (OSError, TypeError, ValueError) as e:
+            logging.error(
+                f"Ignoring invalid experiment file {self.path}: {e}")
+
+    def assign(self, user_id):
+        """
+        The user's variant, or None when no experiment is running.
+        """
+        self.maybe_reload()
+        experiment = self.experiment
+        if experiment is None:
+            return None
+        variant = experiment.assign(user_id)
+        count("experiment_assignments_total", experiment=experiment.name,
+              variant=variant.name)
+        return variant
+
+    def model_for(self, variant, serving_model):
+        """
+        The model of a variant.
+
+        Variants without a model configuration use the serving model. The
+        others get theirs built in the background on first use; until it
+        is ready, and if it cannot be built, this returns None.
+
+        Args:
+            variant (Variant): The variant.
+            serving_model: The model currently serving, which the variant's
+            overrides apply to.
+        """
+        if not variant.model:
+            return serving_model
+        key = variant.key
+        with self._lock:
+            entry = self._models.get(variant.name)
+            if entry is not None and entry[0] is serving_model \
+                    and entry[1] == key:
+                return entry[2]
+            self._models[variant.name] = (serving_model, key, None)
+        threading.Thread(
+            target=self._build, args=(variant, serving_model, key),
+            name=f"experiment-{variant.name}", daemon=True).start()
+        return None
+
+    def _build(self, variant, serving_model, key):
+        started = time.perf_counter()
+        try:
+            model = self.build_model(variant.model, serving_model)
+        except Exception as e:
+            logging.error(
+                f"Could not build the model of variant {variant.name}: "
+                f"{type(e).__name__}: {e}")
+            return
+        with self._lock:
+            entry = self._models.get(variant.name)
+            # Dropped if the experiment or the serving model changed.
+            current = entry is not None and entry[0] is serving_model \
+                and entry[1] == key
+            if current:
+                self._models[variant.name] = (serving_model, key, model)
+        if not current and hasattr(model, 'close'):
+            model.close()
+        logging.info(
+            f"Model of variant {variant.name} built in "
+            f"{time.perf_counter() - started:.1f}s.")
+
+    def build_model(self, options, serving_model):
+        """
+        Build and fit the model for a variant's configuration.
+
+        Args:
+            options (dict): An optional "engine" and attribute overrides.
+            serving_model: The model the overrides apply to when there is
+            no engine.
+
+        Raises:
+            ValueError: If an override is not an attribute of the model, or
+            the model cannot be refitted with overrides.
+        """
+        options = dict(options)
+        engine = options.pop('engine', None)
+        if engine is None:
+            # A model with close() owns shard processes or a model server
+            # connection rather than its ratings. A copy would share them
+            # and fit() would close them under the serving model.
+            if not hasattr(serving_model, 'fit') \
+                    or hasattr(serving_model, 'close'):
+                raise ValueError(
+                    f"{type(serving_model).__name__} cannot be refitted on "
+                    f"a copy; give the variant an engine.")
+            # Shares the ratings with the serving model; fit() only
+            # replaces the neighbour structures.
+            model = copy.copy(serving_model)
+        else:
+            # Deferred so that the numeric stack is imported only when a
+            # model is actually built.
+            from models.models import initialize_model
+
+            with self.app.app_context():
+                model, _ = initialize_model(implicit=engine == 'implicit')
+            if model is None:
+                raise ValueError(f"No {engine} model could be built.")
+            if not options:
+                return model
+            if hasattr(model, 'close'):
+                # Already fitted, and it hands its ratings to the shards.
+                model.close()
+                raise ValueError(
+                    f"{type(model).__name__} takes no option overrides.")
+        for name, value in options.items():
+            if not hasattr(model, name):
+                raise ValueError(
+                    f"{type(model).__name__} has no option {name!r}.")
+            setattr(model, name, value)
+        model.fit()
+        return model
+
+    def record(self, variant, elapsed, fallback=False):
+        """
+        Record the serving latency of a request in a variant, or, with
+        ``fallback``, that the serving model answered because the variant's
+        model was not ready.
+        """
+        experiment = self.experiment
+        labels = {'experiment': experiment.name if experiment else "",
+                  'variant': variant.name}
+        if fallback:
+            count("experiment_fallback_total", **labels)
+        else:
+            observe("experiment_latency", elapsed, **labels)
+
+    def shadow(self, user_id, served_ids, candidates, serving_model):
+        """
+        Rank the user's candidates with the shadow variant on the shadow
+        pool and compare its top movies with the served ones. Returns
+        immediately; the job is dropped when the pool is busy or the
+        shadow's model is not built yet.
+
+        Args:
+            user_id (int): ID of the user.
+            served_ids (list): Movie IDs served, best first.
+            candidates (callable): Returns the candidate movie IDs; called
+            on the shadow thread.
+            serving_model: The model currently serving.
+
+        Returns:
+            concurrent.futures.Future: The job, or None if none was
+            submitted.
+        """
+        experiment = self.experiment
+        if experiment is None or experiment.shadow is None:
+            return None
+        variant = experiment.shadow
+        if variant.sample_rate < 1 and random.random() >= variant.sample_rate:
+            return None
+        model = self.model_for(variant, serving_model)
+        if model is None:
+            return None
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._slots = threading.BoundedSemaphore(
+                        self.shadow_queue)
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.shadow_workers,
+                        thread_name_prefix="shadow")
+        if not self._slots.acquire(blocking=False):
+            count("experiment_shadow_dropped_total",
+                  experiment=experiment.name, variant=variant.name)
+            return None
+        try:
+            future = self._executor.submit(
+                self._score_shadow, experiment.name, variant, model,
+                user_id, list(served_ids), candidates)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _score_shadow(self, experiment_name, variant, model, user_id,
+                      served_ids, candidates):
+        # Imported here: the app defers NumPy-heavy imports.
+        import numpy as np
+
+        labels = {'experiment': experiment_name, 'variant': variant.name}
+        try:
+            started = time.perf_counter()
+            movie_ids = [movie_id for movie_id in candidates()
+                         if movie_id in model.movie_index]
+            predictions = np.asarray(
+                model.predict_many(user_id, movie_ids), dtype=np.float64)
+            valid = np.flatnonzero(~np.isnan(predictions))
+            order = valid[np.argsort(-predictions[valid], kind='stable')]
+            shadow_ids = [movie_ids[i] for i in order[:len(served_ids)]]
+            observe("experiment_shadow_latency",
+                    time.perf_counter() - started, **labels)
+        except Exception as e:
+            count("experiment_shadow_errors_total", **labels)
+            logging.error(
+                f"Shadow variant {variant.name} failed for user {user_id}: "
+                f"{type(e).__name__}: {e}")
+            return None
+        overlap = len(set(shadow_ids) & set(served_ids))
+        count("experiment_overlap_items_total", overlap, **labels)
+        count("experiment_compared_items_total", len(served_ids), **labels)
+        logging.debug(
+            f"Shadow variant {variant.name} for user {user_id}: "
+            f"{overlap} of {len(served_ids)} served movies in its top.")
+        return shadow_ids
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+experiments = ExperimentRouter()
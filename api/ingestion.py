@@ -0,0 +1,568 @@
+"""
+This module ingests rating events through a write-ahead log.
+
+With RATING_INGESTION enabled, /rate and /onboarding append their ratings
+to a local append-only log and return; a consumer thread applies them in
+batches to the database and to the model's in-memory state:
+
+1. appenders write fixed-size records (user, movie, rating, time and a
+   CRC32) with one ``write`` call each;
+2. the consumer fsyncs everything appended since its last round in one
+   call (group commit), then reads up to INGESTION_BATCH_SIZE records;
+3. the batch is upserted into the ratings table (one bulk update and one
+   bulk insert), movie_stats is updated with one increment per movie, and
+   the transaction is committed;
+4. the offset after the batch is saved as the checkpoint, and the batch is
+   applied to the model's movie statistics and stored ratings.
+
+Every process has a log of its own in INGESTION_LOG_DIR, named after its
+PID and held with an exclusive flock, so worker processes never read,
+checkpoint or truncate each other's records. A log whose lock is free
+belongs to a process that exited: the next consumer to start replays it
+from its checkpoint and removes it; a torn record at the end is cut off.
+Replaying a batch that was committed but not checkpointed is harmless:
+each rating is written as a replacement of the value the database holds,
+so the movie statistics do not change twice. Once every record is
+applied and a log has outgrown INGESTION_LOG_MAX_BYTES, it is truncated.
+
+Example:
+    >>> rating_ingestor.submit([(user_id, movie_id, 4.5, time.time())])
+"""
+
+import fcntl
+import glob
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from recommendation_engine.instrumentation import count, timer
+
+# user ID, movie ID, rating, time (seconds since the epoch), then the CRC32
+# of those 32 bytes.
+RECORD = struct.Struct('<qqddI')
+
+
+def encode_events(events):
+    """
+    Encode (user_id, movie_id, rating, rated_at) events as log records.
+    """
+    parts = []
+    for user_id, movie_id, rating, rated_at in events:
+        body = RECORD.pack(user_id, movie_id, rating, rated_at, 0)[:-4]
+        parts.append(body + struct.pack('<I', zlib.crc32(body)))
+    return b''.join(parts)
+
+
+def decode_events(data):
+    """
+    Decode log records up to the first incomplete or corrupt one.
+
+    Returns:
+        tuple: The events, as (user_id, movie_id, rating, rated_at) tuples,
+        and the number of bytes they take.
+    """
+    usable = len(data) - len(data) % RECORD.size
+    events = []
+    for position, record in enumerate(
+            RECORD.iter_unpack(memoryview(data)[:usable])):
+        start = position * RECORD.size
+        if zlib.crc32(data[start:start + RECORD.size - 4]) != record[4]:
+            logging.warning(f"Corrupt rating log record at byte {start}")
+            break
+        events.append(record[:4])
+    return events, len(events) * RECORD.size
+
+
+def log_names(directory):
+    """
+    Names of the write-ahead logs in a directory.
+    """
+    return sorted(os.path.basename(path)[:-len(".wal")]
+                  for path in glob.glob(os.path.join(directory, "*.wal")))
+
+
+class WriteAheadLog:
+    """
+    Append-only log of rating events with a checkpoint of the applied
+    offset, locked by the process that opens it.
+
+    Args:
+        directory (str): Directory of the log and checkpoint files.
+        name (str): Base name of the files.
+
+    Raises:
+        BlockingIOError: If another process holds the log.
+
+    Attributes:
+        name (str): Base name of the files.
+        end (int): Size of the log in bytes.
+        synced (int): Offset up to which the log is fsynced.
+        checkpoint (int): Offset up to which the log has been applied.
+    """
+
+    def __init__(self, directory, name="ratings"):
+        os.makedirs(directory, exist_ok=True)
+        self.name = name
+        self.path = os.path.join(directory, f"{name}.wal")
+        self.checkpoint_path = os.path.join(directory, f"{name}.checkpoint")
+        self._fd = self._open_locked()
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self.checkpoint = self._read_checkpoint()
+        self.end = self._recover()
+        self.synced = self.end
+
+    def _open_locked(self):
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                raise
+            # Another process may have replayed and removed the log between
+            # the open and the lock; then open the file now at the path.
+            try:
+                if os.stat(self.path).st_ino == os.fstat(fd).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    def _read_checkpoint(self):
+        try:
+            with open(self.checkpoint_path) as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _recover(self):
+        """
+        Validate the records after the checkpoint and cut off a torn tail.
+
+        Returns:
+            int: The size of the valid log.
+        """
+        size = os.fstat(self._fd).st_size
+        if self.checkpoint > size:
+            # Crashed between truncating the log and resetting the
+            # checkpoint; everything in the log is unapplied.
+            self.checkpoint = 0
+        _, length = decode_events(os.pread(
+            self._fd, size - self.checkpoint, self.checkpoint))
+        end = self.checkpoint + length
+        if end < size:
+            logging.warning(
+                f"Truncating {size - end} bytes of incomplete records from {self.path}")
+            os.ftruncate(self._fd, end)
+        return end
+
+    def append(self, events):
+        """
+        Append events with a single write.
+
+        Returns:
+            int: The log offset after the events.
+        """
+        data = encode_events(events)
+        with self._lock:
+            os.write(self._fd, data)
+            self.end += len(data)
+            return self.end
+
+    def sync(self):
+        """
+        fsync everything appended so far.
+
+        Returns:
+            int: The synced offset.
+        """
+        with self._sync_lock:
+            end = self.end
+            if end > self.synced:
+                os.fsync(self._fd)
+                self.synced = end
+            return self.synced
+
+    def read(self, start, max_events):
+        """
+        Up to max_events synced events from offset start.
+
+        Returns:
+            tuple: The events and the offset after them.
+        """
+        size = min(self.synced - start, max_events * RECORD.size)
+        if size <= 0:
+            return [], start
+        events, length = decode_events(os.pread(self._fd, size, start))
+        return events, start + length
+
+    def save_checkpoint(self, offset):
+        """
+        Durably record that the log is applied up to offset.
+        """
+        temporary = f"{self.checkpoint_path}.tmp"
+        with open(temporary, 'w') as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.checkpoint_path)
+        self.checkpoint = offset
+
+    def truncate_applied(self, max_bytes):
+        """
+        Empty the log if every record is applied and it is larger than
+        max_bytes.
+
+        Returns:
+            bool: True if the log was truncated.
+        """
+        with self._lock:
+            if self.end <= max_bytes or self.checkpoint != self.end:
+                return False
+            os.ftruncate(self._fd, 0)
+            os.fsync(self._fd)
+            self.end = self.synced = 0
+            self.save_checkpoint(0)
+            return True
+
+    def remove(self):
+        """
+        Delete the log and its checkpoint, then close it.
+        """
+        for path in (self.path, self.checkpoint_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.close()
+
+    def close(self):
+        # Closing the descriptor releases the lock.
+        os.close(self._fd)
+
+
+def _to_datetime(seconds):
+    # Timestamps are stored as naive UTC datetimes.
+    return datetime.fromtimestamp(seconds, tz=timezone.utc).replace(tzinfo=None)
+
+
+def upsert_ratings(session, events, global_mean=None):
+    """
+    Write a batch of rating events to the ratings and movie_stats tables.
+
+    The last event of each (user, movie) pair wins. Existing ratings are
+    updated and new ones inserted in bulk; movie_stats is updated relative
+    to the rating the table held, so applying a batch twice changes
+    nothing. The caller commits.
+
+    Args:
+        session (sqlalchemy.orm.Session): Session to write with.
+        events (list): (user_id, movie_id, rating, rated_at) tuples, oldest
+        first, with rated_at in seconds since the epoch.
+        global_mean (float, optional): See record_movie_ratings.
+
+    Returns:
+        list: (user_id, movie_id, rating, previous_rating, rated_at) per
+        written pair.
+    """
+    # Imported here so that importing the app does not load the ORM models.
+    from models.models import Rating, record_movie_ratings
+
+    latest = {}
+    for user_id, movie_id, rating, rated_at in events:
+        latest[(user_id, movie_id)] = (rating, rated_at)
+    existing = {
+        (user_id, movie_id): (rating_id, rating)
+        for rating_id, user_id, movie_id, rating in session.execute(
+            select(Rating.id, Rating.user_id, Rating.movie_id, Rating.rating)
+            .where(Rating.user_id.in_({user for user, _ in latest}),
+                   Rating.movie_id.in_({movie for _, movie in latest})))}
+
+    updates, inserts, writes = [], [], []
+    for (user_id, movie_id), (rating, rated_at) in latest.items():
+        timestamp = _to_datetime(rated_at)
+        rating_id, previous_rating = existing.get((user_id, movie_id),
+                                                  (None, None))
+        if rating_id is None:
+            inserts.append({'user_id': user_id, 'movie_id': movie_id,
+                            'rating': rating, 'timestamp': timestamp})
+        else:
+            updates.append({'id': rating_id, 'rating': rating,
+                            'timestamp': timestamp})
+        writes.append((user_id, movie_id, rating, previous_rating, rated_at))
+    if updates:
+        session.bulk_update_mappings(Rating, updates)
+    if inserts:
+        session.bulk_insert_mappings(Rating, inserts)
+    record_movie_ratings(
+        session, [(movie_id, rating, previous_rating, _to_datetime(rated_at))
+                  for _, movie_id, rating, previous_rating, rated_at in writes],
+        global_mean=global_mean)
+    return writes
+
+
+def apply_to_model(model, writes):
+    """
+    Apply committed rating writes to the model's movie statistics and the
+    ratings it already stores.
+    """
+    if model is None:
+        return
+    stats = getattr(model, 'movie_stats', None)
+    if stats is not None:
+        for _, movie_id, rating, previous_rating, rated_at in writes:
+            stats.apply(movie_id, rating, previous_rating, rated_at)
+    matrix = getattr(model, 'ratings_matrix', None)
+    # A shared model maps its ratings read-only; it picks the ratings up
+    # when the loader process publishes its next generation.
+    if hasattr(model, 'set_ratings') and matrix is not None \
+            and matrix.data.flags.writeable:
+        user_ids, movie_ids, ratings, _, rated_at = zip(*writes)
+        model.set_ratings(user_ids, movie_ids, ratings, rated_at)
+
+
+class RatingIngestor:
+    """
+    Appends rating events to a WriteAheadLog and applies them from a
+    consumer thread.
+
+    Attributes:
+        log (WriteAheadLog): The log, None until started.
+        batch_size (int): Maximum number of events applied together.
+        flush_interval (float): Seconds the consumer waits for more events
+        before a round.
+        max_log_bytes (int): Size past which a fully applied log is
+        truncated.
+    """
+
+    def __init__(self, batch_size=500, flush_interval=0.005,
+                 max_log_bytes=16 * 1024 * 1024):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_log_bytes = max_log_bytes
+        self.log = None
+        self.app = None
+        self._appended = 0
+        self._applied = 0
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._thread = None
+
+    def init_app(self, app):
+        self.batch_size = app.config.get(
+            'INGESTION_BATCH_SIZE') or self.batch_size
+        flush_interval = app.config.get('INGESTION_FLUSH_INTERVAL_MS')
+        if flush_interval is not None:
+            self.flush_interval = flush_interval / 1000
+        self.max_log_bytes = app.config.get(
+            'INGESTION_LOG_MAX_BYTES') or self.max_log_bytes
+        if app.config.get('RATING_INGESTION'):
+            self.start(app, app.config['INGESTION_LOG_DIR'])
+
+    @property
+    def enabled(self):
+        return self._thread is not None
+
+    def start(self, app, directory):
+        """
+        Open this process's log, replay what it holds past the checkpoint
+        and start the consumer thread, which first replays the logs of
+        processes that exited.
+        """
+        self.app = app
+        self.log = self._open_log(directory)
+        pending = (self.log.end - self.log.checkpoint) // RECORD.size
+        if pending:
+            logging.info(f"Replaying {pending} rating events from {self.log.path}")
+        # Replayed events count as submitted before this start.
+        self._appended, self._applied = pending, 0
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self._run, name="rating-ingestor", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _open_log(directory):
+        # Processes in different PID namespaces can share a PID, so a
+        # locked name is skipped rather than shared.
+        name = f"ratings-{os.getpid()}"
+        for attempt in range(100):
+            try:
+                return WriteAheadLog(
+                    directory, f"{name}-{attempt}" if attempt else name)
+            except BlockingIOError:
+                continue
+        raise RuntimeError(f"No free rating log name in {directory}")
+
+    def replay_orphans(self):
+        """
+        Apply and remove the logs of processes that exited.
+
+        Returns:
+            int: Number of events replayed.
+        """
+        directory = os.path.dirname(self.log.path)
+        replayed = 0
+        for name in log_names(directory):
+            if name == self.log.name:
+                continue
+            try:
+                log = WriteAheadLog(directory, name)
+            except BlockingIOError:
+                # Its process is alive.
+                continue
+            try:
+                events, offset = log.read(log.checkpoint, self.batch_size)
+                while events and not self._stopping:
+                    self._apply(events)
+                    log.save_checkpoint(offset)
+                    replayed += len(events)
+                    events, offset = log.read(offset, self.batch_size)
+                if events:
+                    # Stopped; the rest is left for the next consumer.
+                    log.close()
+                    return replayed
+                log.remove()
+            except Exception as e:
+                # Left for the next consumer that starts.
+                logging.error(f"Replaying {log.path} failed: {type(e).__name__}: {e}")
+                log.close()
+                continue
+            logging.info(f"Replayed and removed the rating log {log.path}")
+        return replayed
+
+    def submit(self, events):
+        """
+        Append events to the log.
+
+        Args:
+            events (list): (user_id, movie_id, rating, rated_at) tuples,
+            with rated_at in seconds since the epoch.
+
+        Returns:
+            int: Sequence number to pass to wait() for the events to be
+            applied.
+        """
+        with timer("rating_log_append"):
+            self.log.append(events)
+        count("rating_events_total", len(events))
+        with self._condition:
+            self._appended += len(events)
+            self._condition.notify_all()
+            return self._appended
+
+    def wait(self, sequence, timeout=None):
+        """
+        Wait until the events up to a submit() sequence number are applied.
+
+        Returns:
+            bool: True if they were applied before the timeout.
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: self._applied >= sequence, timeout)
+
+    def _run(self):
+        self.replay_orphans()
+        offset = self.log.checkpoint
+        while True:
+            with self._condition:
+                if self._stopping:
+                    return
+                if self.log.end == offset:
+                    self._condition.wait(self.flush_interval)
+                    if self._stopping:
+                        return
+                    continue
+            # Let appends accumulate into one fsync and one batch.
+            time.sleep(self.flush_interval)
+            self.log.sync()
+            events, next_offset = self.log.read(offset, self.batch_size)
+            if not events:
+                continue
+            try:
+                self._apply(events)
+            except Exception as e:
+                # Nothing was committed; the consumer must stay alive, or
+                # /rate would keep accepting events nobody applies.
+                logging.error(f"Applying {len(events)} rating events failed, retrying: {type(e).__name__}: {e}")
+                time.sleep(1.0)
+                continue
+            self.log.save_checkpoint(next_offset)
+            offset = next_offset
+            with self._condition:
+                self._applied += len(events)
+                self._condition.notify_all()
+            if self.log.truncate_applied(self.max_log_bytes):
+                offset = 0
+
+    def _apply(self, events):
+        with self.app.app_context():
+            from api.database import db
+
+            model = self.app.config.get('MODEL_INSTANCE')
+            stats = getattr(model, 'movie_stats', None)
+            global_mean = stats.global_mean if stats is not None \
+                and len(stats) else None
+            with timer("rating_ingest_batch"):
+                try:
+                    writes = upsert_ratings(db.session, events, global_mean)
+                    db.session.commit()
+                except IntegrityError as e:
+                    db.session.rollback()
+                    logging.warning(f"Rating batch rejected ({e.orig}); applying events one by one.")
+                    writes = self._apply_each(db.session, events, global_mean)
+                except SQLAlchemyError:
+                    db.session.rollback()
+                    raise
+            count("rating_ingest_batches_total")
+            if writes:
+                # The batch is committed, so it is checkpointed even if
+                # the model cannot take it; the next fit reads it.
+                try:
+                    apply_to_model(model, writes)
+                except Exception as e:
+                    count("rating_model_update_errors_total")
+                    logging.error(f"Applying {len(writes)} committed ratings to the model failed: {type(e).__name__}: {e}")
+
+    @staticmethod
+    def _apply_each(session, events, global_mean):
+        """
+        Apply events separately, dropping those the database rejects
+        (e.g. unknown users), so one bad event cannot block the log.
+        """
+        writes = []
+        for event in events:
+            try:
+                written = upsert_ratings(session, [event], global_mean)
+                session.commit()
+                writes.extend(written)
+            except IntegrityError as e:
+                session.rollback()
+                count("rating_events_rejected_total")
+                logging.error(f"Dropping rating event {event}: {e.orig}")
+        return writes
+
+    def stop(self):
+        """
+        Stop the consumer after its current batch and close the log.
+        """
+        if self._thread is None:
+            return
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        self._thread.join()
+        self._thread = None
+        self.log.close()
+
+
+rating_ingestor = RatingIngestor()
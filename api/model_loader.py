@@ -0,0 +1,156 @@
+"""
+This module builds the recommendation model for the Flask application,
+either synchronously or in a background thread, attaches to a model
+published by a separate loader process (see
+recommendation_engine.shared_model), or connects to a separate model
+server process (see recommendation_engine.model_server).
+
+Classes:
+    ModelLoader: Loads the model into the app config and reports readiness.
+"""
+
+import logging
+import threading
+import time
+
+
+class ModelLoader:
+    """
+    Build the recommendation model and publish it into the app config.
+
+    Attributes:
+        app (flask.Flask): The application the model is loaded for.
+        status (str): One of LOADING, READY or FAILED.
+    """
+
+    LOADING = "loading"
+    READY = "ready"
+    FAILED = "failed"
+
+    def __init__(self, app):
+        self.app = app
+        self.status = self.LOADING
+        self._thread = None
+        self.reader = None
+        self.client = None
+
+        server_socket = app.config.get('MODEL_SERVER_SOCKET')
+        share_dir = app.config.get('MODEL_SHARE_DIR')
+        if server_socket:
+            from recommendation_engine.model_server import ModelClient
+            self.client = ModelClient(
+                server_socket, timeout=app.config.get('MODEL_SERVER_TIMEOUT', 30))
+        elif share_dir:
+            from recommendation_engine.shared_model import (
+                SharedModelReader, SharedModelStore)
+            self.reader = SharedModelReader(
+                SharedModelStore(share_dir),
+                poll_interval=app.config.get('MODEL_SHARE_POLL_INTERVAL', 1.0))
+
+    def load(self):
+        """
+        Initialize the model inside an app context and store it, together
+        with the known user IDs, in the app config.
+
+        With MODEL_SHARE_DIR set, the model is not built here; the loader
+        waits up to MODEL_SHARE_WAIT seconds for a published generation and
+        attaches to it instead. With MODEL_SERVER_SOCKET set, a ModelClient
+        of the model server takes the place of the model, once the server
+        answers (waiting up to MODEL_SERVER_WAIT seconds).
+        """
+        if self.client is not None:
+            self._connect_server()
+            return
+        if self.reader is not None:
+            self._attach_shared()
+            return
+
+        # Deferred so that the model's numeric dependencies are only
+        # imported when a model is actually built.
+        from models.models import initialize_model
+
+        with self.app.app_context():
+            logging.debug("Entering app context to initialize the model.")
+            model_instance, known_user_ids = initialize_model()
+            logging.debug("Model initialization function called.")
+
+            if model_instance is None or known_user_ids is None:
+                logging.error(
+                    "Failed to initialize the recommendation model or known user IDs.")
+                self.status = self.FAILED
+            else:
+                logging.info(
+                    "Recommendation model and known user IDs initialized and ready for use.")
+                self.app.config['MODEL_INSTANCE'] = model_instance
+                self.app.config['KNOWN_USER_IDS'] = known_user_ids
+                self.status = self.READY
+
+    def _connect_server(self):
+        if not self.client.wait_until_ready(
+                self.app.config.get('MODEL_SERVER_WAIT', 300)):
+            logging.error(
+                f"Model server at {self.client.path} did not answer before MODEL_SERVER_WAIT expired.")
+            self.status = self.FAILED
+            return
+        self.app.config['MODEL_INSTANCE'] = self.client
+        self.app.config['KNOWN_USER_IDS'] = self.client.known_user_ids
+        self.status = self.READY
+
+    def _attach_shared(self):
+        deadline = time.monotonic() + self.app.config.get(
+            'MODEL_SHARE_WAIT', 300)
+        while not self.refresh(force=True):
+            if time.monotonic() >= deadline:
+                logging.error(
+                    "No shared model was published before MODEL_SHARE_WAIT expired.")
+                self.status = self.FAILED
+                return
+            time.sleep(self.reader.poll_interval)
+
+    def refresh(self, force=False):
+        """
+        Switch to a newer shared model generation if one was published.
+
+        Cheap enough to call on every request: the store is only checked
+        once per MODEL_SHARE_POLL_INTERVAL.
+
+        Returns:
+            bool: True if a new generation was attached.
+        """
+        if self.reader is None or not self.reader.refresh(force=force):
+            return False
+        self.app.config['MODEL_INSTANCE'] = self.reader.model
+        self.app.config['KNOWN_USER_IDS'] = self.reader.known_user_ids
+        self.status = self.READY
+        return True
+
+    def start(self):
+        """
+        Start loading the model in a daemon thread and return immediately.
+        """
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="model-loader", daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout=None):
+        """
+        Block until a background load has finished.
+
+        Args:
+            timeout (float, optional): Maximum number of seconds to wait.
+
+        Returns:
+            bool: True if the loader is no longer loading.
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.status != self.LOADING
+
+    def _run(self):
+        try:
+            self.load()
+        except Exception as e:
+            logging.error(f"Background model loading failed: {e}")
+            self.status = self.FAILED
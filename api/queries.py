@@ -0,0 +1,162 @@
+"""
+Read-only queries used by the recommendation and browsing endpoints.
+
+Every function takes a SQLAlchemy ``Session`` as its first argument and
+returns plain rows, so it can run on the Flask-SQLAlchemy session or inside
+``AsyncSession.run_sync`` (see api.async_db).
+"""
+
+from sqlalchemy import desc, func, select, text
+
+from models.models import Movie, MovieStats, Rating, Tag, User
+
+
+def get_user(session, user_id):
+    return session.execute(
+        select(User.id, User.preferences, User.first_name, User.last_name,
+               User.email).where(User.id == user_id)).first()
+
+
+def get_rated_movie_ids(session, user_id):
+    return session.execute(
+        select(Rating.movie_id).where(Rating.user_id == user_id)
+    ).scalars().all()
+
+
+def get_user_ratings(session, user_id):
+    """
+    The user's ratings.
+
+    Returns:
+        list: (movie_id, rating) rows.
+    """
+    return session.execute(
+        select(Rating.movie_id, Rating.rating).where(
+            Rating.user_id == user_id)).all()
+
+
+def get_candidate_movies(session, user_id, preferred_genre=None):
+    """
+    Movies the user has not rated, optionally restricted to one genre.
+
+    Returns:
+        list: (movie_id, title, genres) rows.
+    """
+    rated = select(Rating.movie_id).where(Rating.user_id == user_id)
+    query = select(Movie.movie_id, Movie.title, Movie.genres).where(
+        Movie.movie_id.not_in(rated))
+    if preferred_genre:
+        query = query.where(
+            Movie.genres.op("SIMILAR TO")(f"%{preferred_genre}%"))
+    return session.execute(query).all()
+
+
+def get_movie_catalog(session):
+    """
+    Every movie, for building the recommendation pipeline.
+
+    Returns:
+        list: (movie_id, title, genres) rows.
+    """
+    return session.execute(
+        select(Movie.movie_id, Movie.title, Movie.genres)).all()
+
+
+def get_tags_after(session, after_id=None):
+    """
+    Tags with an id greater than ``after_id`` (all tags for None).
+
+    Returns:
+        list: (id, movie_id, tag) rows, ordered by id.
+    """
+    query = select(Tag.id, Tag.movie_id, Tag.tag)
+    if after_id is not None:
+        query = query.where(Tag.id > after_id)
+    return session.execute(query.order_by(Tag.id)).all()
+
+
+MOVIE_COLUMNS = ('id', 'movie_id', 'title', 'genres', 'imdb_id', 'tmdb_id')
+
+
+def get_movies_after(session, after_movie_id, limit, columns=MOVIE_COLUMNS):
+    """
+    One keyset page of movies, ordered by movie_id.
+
+    Uses the unique index on movie_id, so the cost does not depend on how
+    deep into the catalogue the page is.
+
+    Args:
+        after_movie_id (int): Return movies with a larger movie_id; None
+        for the first page.
+        limit (int): Maximum number of rows.
+        columns (tuple): Names of the Movie columns to select.
+
+    Returns:
+        list: Rows with the requested columns, in order.
+    """
+    query = select(*(getattr(Movie, name) for name in columns))
+    if after_movie_id is not None:
+        query = query.where(Movie.movie_id > after_movie_id)
+    return session.execute(
+        query.order_by(Movie.movie_id).limit(limit)).all()
+
+
+def estimate_movie_count(session):
+    """
+    Approximate number of movies.
+
+    On Postgres this reads the planner's row estimate instead of counting
+    the table; other databases fall back to COUNT(*).
+    """
+    if session.get_bind().dialect.name == 'postgresql':
+        estimate = session.execute(text(
+            "SELECT reltuples::bigint FROM pg_class "
+            "WHERE oid = 'public.movies'::regclass")).scalar()
+        # reltuples is -1 (or 0) until the table has been analyzed.
+        if estimate and estimate > 0:
+            return int(estimate)
+    return session.execute(select(func.count(Movie.id))).scalar()
+
+
+def get_popular_movies(session, count):
+    """
+    Returns:
+        list: (movie_id, title) rows ordered by Bayesian mean rating, then
+        by number of ratings, read from movie_stats.
+    """
+    return session.execute(
+        select(Movie.movie_id, Movie.title)
+        .join(MovieStats, Movie.movie_id == MovieStats.movie_id)
+        .order_by(desc(MovieStats.bayesian_mean),
+                  desc(MovieStats.rating_count))
+        .limit(count)).all()
+
+
+def get_movie_details(session, movie_id):
+    """
+    A single lookup on the unique movie_id index of movies, joined with
+    movie_stats.
+
+    Returns:
+        tuple: The movie row and its average rating (or None), or
+        (None, None) if the movie does not exist.
+    """
+    movie = session.execute(
+        select(Movie.movie_id, Movie.title, Movie.genres, Movie.imdb_id,
+               Movie.tmdb_id, MovieStats.mean_rating)
+        .outerjoin(MovieStats, Movie.movie_id == MovieStats.movie_id)
+        .where(Movie.movie_id == movie_id)).first()
+    if movie is None:
+        return None, None
+    return movie, movie.mean_rating
+
+
+def get_rated_movies(session, user_id):
+    """
+    Returns:
+        list: (movie_id, title, genres, rating) rows for the user's ratings.
+    """
+    return session.execute(
+        select(Movie.movie_id, Movie.title, Movie.genres, Rating.rating)
+        .join(Rating, Movie.movie_id == Rating.movie_id)
+        .where(Rating.user_id == user_id)).all()
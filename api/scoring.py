@@ -0,0 +1,246 @@
+"""
+This module offloads CPU-bound scoring from async views to a bounded
+thread pool, so the event loop keeps serving other requests while NumPy
+and SciPy do the work, and holds the micro-batcher that scores concurrent
+single-pair predictions together, the retrieve-then-rerank pipeline of
+the current model and the content-based similarity engine.
+
+Example:
+    >>> predictions = await scoring_executor.run(
+    ...     model.predict_many, user_id, movie_ids)
+    >>> prediction = predict_batcher.predict(model, user_id, movie_id)
+    >>> pipeline = recommendation_pipelines.get(model)
+    >>> engine = content_engines.engine
+"""
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from recommendation_engine.batching import MicroBatcher
+from recommendation_engine.profiling import PROFILER
+
+
+class ScoringOverloaded(Exception):
+    """
+    Raised when more scoring jobs are pending than the executor allows.
+    """
+
+
+def _profiled(function, *args):
+    with PROFILER.profile_worker():
+        return function(*args)
+
+
+class ScoringExecutor:
+    """
+    Thread pool with a cap on the number of queued and running jobs.
+
+    Attributes:
+        max_workers (int): Number of scoring threads.
+        max_pending (int): Maximum number of queued plus running jobs.
+    """
+
+    def __init__(self, max_workers=None, max_pending=None):
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.max_pending = max_pending or self.max_workers * 16
+        self._executor = None
+        self._slots = None
+
+    def init_app(self, app):
+        self.max_workers = app.config.get(
+            'SCORING_WORKERS') or self.max_workers
+        self.max_pending = app.config.get(
+            'SCORING_MAX_PENDING') or self.max_workers * 16
+        self._start()
+
+    def _start(self):
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="scoring")
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+
+    async def run(self, function, *args):
+        """
+        Run ``function(*args)`` on the pool and await its result.
+
+        The job runs in a copy of the caller's context, so its timers reach
+        the request's Server-Timing header and, when the request is being
+        profiled, the job is profiled into the request's profile.
+
+        Raises:
+            ScoringOverloaded: If max_pending jobs are already in flight.
+        """
+        if self._executor is None:
+            self._start()
+        if not self._slots.acquire(blocking=False):
+            raise ScoringOverloaded(
+                f"{self.max_pending} scoring jobs already pending")
+        try:
+            future = self._executor.submit(
+                contextvars.copy_context().run, _profiled, function, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+class PipelineCache:
+    """
+    The RecommendationPipeline of each model in use, built once per model.
+
+    Besides the serving model, experiment variants (see api.experiments)
+    have models of their own; the pipelines of the max_models most
+    recently built models are kept.
+
+    Attributes:
+        options (dict): Keyword arguments for RecommendationPipeline.
+        max_models (int): Number of pipelines kept.
+    """
+
+    def __init__(self, max_models=4, **options):
+        self.options = options
+        self.max_models = max_models
+        self._pipelines = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.options = {
+            'max_candidates': app.config.get('PIPELINE_MAX_CANDIDATES') or 300,
+            'diversity': app.config.get('RECOMMENDATION_DIVERSITY') or 0.0,
+        }
+        weights = app.config.get('HYBRID_WEIGHTS')
+        if weights:
+            # Imported here: the scorer pulls in NumPy, which the app
+            # defers.
+            from recommendation_engine.hybrid import HybridScorer
+
+            self.options['scorer'] = HybridScorer.from_config(weights)
+
+    @property
+    def uses_content(self):
+        """
+        Whether the pipeline's scorer needs the content-based engine.
+        """
+        scorer = self.options.get('scorer')
+        return scorer is not None and 'content' in scorer.features
+
+    def get(self, model):
+        """
+        The pipeline built for ``model``, or None if there is none yet.
+        """
+        pipeline = self._pipelines.get(id(model))
+        if pipeline is not None and pipeline.model is model:
+            return pipeline
+        return None
+
+    def build(self, model, movies, content=None):
+        """
+        Build (or return the already built) pipeline for ``model``.
+
+        Args:
+            model (UserBasedCF): The model in use.
+            movies (list): (movie_id, title, genres) rows of the catalogue.
+            content (ContentBasedEngine, optional): Content-based engine for
+            the scorer's "content" feature.
+        """
+        # Imported here: the pipeline pulls in SciPy, which the app defers.
+        from recommendation_engine.pipeline import RecommendationPipeline
+
+        with self._lock:
+            pipeline = self.get(model)
+            if pipeline is None:
+                pipeline = RecommendationPipeline(
+                    model, movies, content=content, **self.options)
+                # Dicts keep insertion order: the first key is the oldest.
+                self._pipelines.pop(id(model), None)
+                self._pipelines[id(model)] = pipeline
+                while len(self._pipelines) > self.max_models:
+                    del self._pipelines[next(iter(self._pipelines))]
+            return pipeline
+
+
+class ContentCache:
+    """
+    The ContentBasedEngine, built once and kept up to date with new tags.
+
+    Attributes:
+        top_k (int): Content neighbours kept per movie.
+        refresh_interval (float): Seconds between checks for new tags.
+        engine (ContentBasedEngine): The engine, None until built.
+        last_tag_id (int): ID of the newest tag in the engine.
+    """
+
+    def __init__(self, top_k=20, refresh_interval=60.0):
+        self.top_k = top_k
+        self.refresh_interval = refresh_interval
+        self.engine = None
+        self.last_tag_id = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.top_k = app.config.get('CONTENT_TOP_K') or self.top_k
+        refresh_interval = app.config.get('CONTENT_REFRESH_INTERVAL')
+        if refresh_interval is not None:
+            self.refresh_interval = refresh_interval
+
+    def due(self):
+        """
+        Whether it is time to look for new tags.
+        """
+        return time.monotonic() - self._checked_at >= self.refresh_interval
+
+    def build(self, movies, tags):
+        """
+        Build the engine (unless already built).
+
+        Args:
+            movies (list): (movie_id, title, genres) rows.
+            tags (list): (id, movie_id, tag) rows, ordered by id.
+        """
+        # Imported here: the engine pulls in SciPy, which the app defers.
+        from recommendation_engine.content_based import ContentBasedEngine
+
+        with self._lock:
+            if self.engine is None:
+                self.engine = ContentBasedEngine(
+                    movies, [(movie_id, tag) for _, movie_id, tag in tags],
+                    top_k=self.top_k)
+                self._advance(tags)
+            return self.engine
+
+    def add(self, tags):
+        """
+        Fold tags newer than last_tag_id into the engine.
+
+        Args:
+            tags (list): (id, movie_id, tag) rows, ordered by id.
+        """
+        with self._lock:
+            tags = [tag for tag in tags
+                    if self.last_tag_id is None or tag[0] > self.last_tag_id]
+            if tags:
+                self.engine.add_tags(
+                    [(movie_id, tag) for _, movie_id, tag in tags])
+            self._advance(tags)
+            return self.engine
+
+    def _advance(self, tags):
+        if tags:
+            self.last_tag_id = tags[-1][0]
+        self._checked_at = time.monotonic()
+
+
+scoring_executor = ScoringExecutor()
+predict_batcher = MicroBatcher()
+recommendation_pipelines = PipelineCache()
+content_engines = ContentCache()
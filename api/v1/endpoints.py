@@ -1,39 +1,41 @@
 from flask import Blueprint, request, url_for, redirect, jsonify, current_app as app, render_template, current_app
-from marshmallow import EXCLUDE, Schema, fields, ValidationError
-from recommendation_engine.collaborative_filtering import UserBasedCF
-from data.loader import load_data
-from data.preprocessing import normalize_ratings
+from marshmallow import EXCLUDE, Schema, fields, validate, ValidationError
 import numpy as np
+import asyncio
+import inspect
 import os
-from functools import lru_cache, wraps
-from models.models import Movie, Rating, User, initialize_model
-from api.database import db
+import time
+from functools import lru_cache, partial, wraps
+from models.models import (
+    INTERACTION_WEIGHTS, Interaction, Movie, Rating, User, record_movie_rating)
+from api.database import db, read_session
+from api import queries
+from api.async_db import async_db
+from api.experiments import experiments
+from api.ingestion import rating_ingestor
+from api.serialization import (
+    MOVIE_FRAGMENTS, SCORE_FRAGMENTS, encode_recommendations, json_response,
+    rows_to_dicts)
+from api.scoring import (
+    ScoringOverloaded, content_engines, predict_batcher,
+    recommendation_pipelines, scoring_executor)
+from recommendation_engine.cold_start import (
+    ColdStartRecommender, needs_cold_start)
+from recommendation_engine.instrumentation import timer, trace
+from recommendation_engine.profiling import PROFILER
 from api.utils import generate_confirmation_token, confirm_token, send_confirmation_email
 from sqlalchemy.exc import IntegrityError
 import logging
-from dotenv import load_dotenv
-from okta.client import Client as OktaClient
-from okta.models.user import User as OktaUser
-from okta.models.user_profile import UserProfile
-from okta.models.user_credentials import UserCredentials
-from okta.models.password_credential import PasswordCredential
-from datetime import datetime
+from datetime import datetime, timezone
 from flask_oidc import OpenIDConnect
-import aiohttp
-import asyncio
-from typing import Union, Tuple
-from okta.errors.okta_api_error import OktaAPIError
-from jose import jwt, JWTError
+from typing import Tuple
 from urllib.parse import urlencode
 from api.extensions import bcrypt
 from sqlalchemy.exc import SQLAlchemyError
 from flask_login import current_user
-from sqlalchemy import and_
 from flask_login import login_required
 from api.app import login_manager
 from flask_login import login_user, logout_user, login_required, current_user
-import requests
-from sklearn.metrics.pairwise import cosine_similarity
 from flask import flash
 
 
@@ -59,14 +61,23 @@ OKTA_API_TOKEN = os.getenv("OKTA_API_TOKEN")
 API_KEY = os.getenv("API_KEY")
 
 
-# Create the Okta Client configuration
-config = {
-    'orgUrl': OKTA_ORG_URL,
-    'token': OKTA_CLIENT_SECRET,
-    'clientId': OKTA_CLIENT_ID,
-    'issuer': f'{OKTA_ORG_URL}/oauth2/default',
-}
-okta_client = OktaClient(config)  # Create the OktaClient instance
+@lru_cache(maxsize=1)
+def get_okta_client():
+    """
+    Create the Okta client on first use.
+
+    The Okta SDK is expensive to import, so it is loaded lazily instead of
+    when this module is imported.
+    """
+    from okta.client import Client as OktaClient
+
+    config = {
+        'orgUrl': OKTA_ORG_URL,
+        'token': OKTA_CLIENT_SECRET,
+        'clientId': OKTA_CLIENT_ID,
+        'issuer': f'{OKTA_ORG_URL}/oauth2/default',
+    }
+    return OktaClient(config)
 
 
 class MovieSchema(Schema):
@@ -92,6 +103,7 @@ class PredictionRequestSchema(Schema):
 class RecommendationRequestSchema(Schema):
     userId = fields.Integer(required=True, validate=lambda val: val > 0)
     num_recommendations = fields.Int(required=True, validate=lambda n: n > 0)
+    diversity = fields.Float(validate=validate.Range(min=0, max=1))
 
     class Meta:
         unknown = EXCLUDE
@@ -118,6 +130,16 @@ class RatingSchema(Schema):
         unknown = EXCLUDE
 
 
+class InteractionSchema(Schema):
+    userId = fields.Int(required=True)
+    movieId = fields.Int(required=True)
+    kind = fields.Str(required=True,
+                      validate=validate.OneOf(sorted(INTERACTION_WEIGHTS)))
+
+    class Meta:
+        unknown = EXCLUDE
+
+
 class UserSchema(Schema):
     id = fields.Int(required=True)
     email = fields.Email(required=True)
@@ -143,24 +165,53 @@ class OnboardingSchema(Schema):
         unknown = EXCLUDE
 
 
-@lru_cache(maxsize=1)
-def get_ratings_matrix():
-    ratings = load_data()
-    normalized_ratings = normalize_ratings(ratings)
-    ratings_matrix = normalized_ratings.fillna(0).values
-    return ratings_matrix
+def has_valid_api_key():
+    provided_key = request.headers.get('X-API-KEY')
+    return bool(provided_key) and provided_key == os.getenv('API_KEY')
 
 
 def require_api_key(view_function):
+    if inspect.iscoroutinefunction(view_function):
+        @wraps(view_function)
+        async def decorated_coroutine(*args, **kwargs):
+            if not has_valid_api_key():
+                return jsonify({'error': 'Unauthorized'}), 401
+            return await view_function(*args, **kwargs)
+        return decorated_coroutine
+
     @wraps(view_function)
     def decorated_function(*args, **kwargs):
-        provided_key = request.headers.get('X-API-KEY')
-        if not provided_key or provided_key != os.getenv('API_KEY'):
+        if not has_valid_api_key():
             return jsonify({'error': 'Unauthorized'}), 401
         return view_function(*args, **kwargs)
     return decorated_function
 
 
+def profile_request(view_function):
+    """
+    Capture a cProfile profile for a sampled fraction of requests, or when
+    the client sends ``X-Profile: 1`` and profiling is enabled.
+    """
+    if inspect.iscoroutinefunction(view_function):
+        @wraps(view_function)
+        async def decorated_coroutine(*args, **kwargs):
+            forced = request.headers.get('X-Profile') == '1'
+            if not PROFILER.should_profile(forced):
+                return await view_function(*args, **kwargs)
+            with PROFILER.profile(request.endpoint):
+                return await view_function(*args, **kwargs)
+        return decorated_coroutine
+
+    @wraps(view_function)
+    def decorated_function(*args, **kwargs):
+        forced = request.headers.get('X-Profile') == '1'
+        if not PROFILER.should_profile(forced):
+            return view_function(*args, **kwargs)
+        with PROFILER.profile(request.endpoint):
+            return view_function(*args, **kwargs)
+    return decorated_function
+
+
 @api_v1.route('/')
 def index():
     try:
@@ -171,6 +222,7 @@ def index():
 
 @api_v1.route('/predict', methods=['POST'])
 @require_api_key
+@profile_request
 def predict(user_id=None, movie_id=None):
     model_instance = current_app.config.get('MODEL_INSTANCE')
     if user_id is None or movie_id is None:
@@ -185,146 +237,415 @@ def predict(user_id=None, movie_id=None):
         return jsonify(
             {'error': 'User ID and Movie ID must be positive integers'}), 400
 
-    ratings_matrix = get_ratings_matrix()
+    if model_instance is None:
+        return jsonify({"error": "Recommendation model is not initialized."}), 500
 
-    if user_id > ratings_matrix.shape[0] or movie_id > ratings_matrix.shape[1]:
+    # The model is keyed by user and movie IDs, so it answers the bounds
+    # check without reloading the ratings.
+    if user_id not in model_instance.user_index \
+            or movie_id not in model_instance.movie_index:
         return jsonify({'error': 'User ID or Movie ID is out of bounds'}), 400
 
     try:
-        prediction = model_instance.predict(user_id - 1, movie_id - 1)
+        # Concurrent requests are scored together by the micro-batcher;
+        # models without predict_pairs (e.g. a model server client, which
+        # batches on its side) are called directly.
+        if current_app.config.get('PREDICT_BATCHING') and hasattr(
+                model_instance, 'predict_pairs'):
+            prediction = predict_batcher.predict(
+                model_instance, user_id, movie_id)
+        else:
+            prediction = model_instance.predict(user_id, movie_id)
         if np.isnan(prediction):
             prediction = None
-        return prediction  # Return just the prediction value
+        # The implicit-feedback model's preferences are not ratings.
+        if not predicts_ratings(model_instance):
+            return jsonify({'score': prediction})
+        return jsonify({'predicted_rating': prediction})
     except Exception as e:
         raise Exception(f"Prediction error: {str(e)}")
 
 
-@api_v1.route('/recommendations', methods=['POST'])
-@require_api_key
-def get_recommendations():
-    logging.debug("Entering get_recommendations endpoint")
+async def rank_recommendations(user_id, num_recommendations, diversity=None):
+    """
+    Score the user's unrated candidate movies and return the top ones.
+
+    Database reads go through the async engine when it is enabled and
+    scoring runs on the bounded scoring executor.
+
+    Args:
+        user_id (int): ID of the user.
+        num_recommendations (int): Number of recommendations to return.
+        diversity (float, optional): MMR diversity of the top movies, 0
+        (by predicted rating) to 1; defaults to RECOMMENDATION_DIVERSITY.
+
+    Returns:
+        tuple: The top movie rows, their scores (both lists, best first)
+        and the scores' response field (see score_key), and None; or None
+        and an (error body, HTTP status) pair.
 
+    With an experiment running (see api.experiments), the user's variant
+    picks the model, and the shadow variant is handed the served movies
+    once they are ranked.
+    """
     model_instance, known_user_ids = current_app.config.get(
         'MODEL_INSTANCE'), current_app.config.get('KNOWN_USER_IDS')
 
     if model_instance is None or known_user_ids is None:
         logging.warning(
             "Recommendation model or known user IDs are not initialized.")
-        return jsonify(
-            {"error": "Recommendation model or known user IDs are not initialized."}), 500
+        return None, ({"error": "Recommendation model or known user IDs are not initialized."}, 500)
+
+    variant = experiments.assign(user_id)
+    if variant is None:
+        return await rank_with_model(
+            model_instance, known_user_ids, user_id, num_recommendations,
+            diversity)
+
+    # None while the variant's model is built (or if it failed to build).
+    model = experiments.model_for(variant, model_instance)
+    started = time.perf_counter()
+    result, error = await rank_with_model(
+        model or model_instance, known_user_ids, user_id,
+        num_recommendations, diversity)
+    experiments.record(variant, time.perf_counter() - started,
+                       fallback=model is None)
+    if result is not None:
+        experiments.shadow(
+            user_id, [movie.movie_id for movie in result[0]],
+            partial(shadow_candidates, current_app._get_current_object(),
+                    user_id), model_instance)
+    return result, error
+
+
+def shadow_candidates(app, user_id):
+    """
+    The candidate movie IDs of the exhaustive path, for the shadow variant.
+    Runs on the shadow thread, so it reads synchronously in its own app
+    context.
+    """
+    with app.app_context():
+        session = read_session()
+        user = queries.get_user(session, user_id)
+        genres = user.preferences.split(",") \
+            if user is not None and user.preferences else []
+        return [movie.movie_id for movie in queries.get_candidate_movies(
+            session, user_id, genres[0] if genres else None)]
 
-    try:
-        data = RecommendationRequestSchema().load(request.json)
-    except ValidationError as err:
-        logging.error(f"Validation error: {err.messages}")
-        return jsonify(err.messages), 400
 
-    logging.debug(f"Request data for recommendations: {data}")
+def predicts_ratings(model_instance):
+    """
+    Whether a model's scores are predicted ratings; the implicit-feedback
+    model's are preferences, around 0 to 1.
+    """
+    return getattr(model_instance, 'predicts_ratings', True)
 
-    user_id = data["userId"]
-    num_recommendations = request.json.get('num_recommendations', 10)
+
+def score_key(model_instance):
+    """
+    Response field of a model's scores: "predictedRating", or "score" for
+    scores that are not on the rating scale.
+    """
+    return "predictedRating" if predicts_ratings(model_instance) \
+        else SCORE_FRAGMENTS.score_key
+
+
+async def rank_with_model(model_instance, known_user_ids, user_id,
+                          num_recommendations, diversity=None):
+    """
+    rank_recommendations with the given model.
+    """
+    # Age the rating weights of a time-decayed model, at most once per its
+    # refresh interval.
+    time_decay = getattr(model_instance, 'time_decay', None)
+    if time_decay is not None:
+        time_decay.maybe_refresh()
 
     logging.debug(f"Fetching user with ID: {user_id}")
-    user = User.query.get(user_id)
+    user = await async_db.run(queries.get_user, user_id)
     if not user:
         logging.error(f"User ID {user_id} not found")
-        return jsonify({"error": "User not found"}), 404
+        return None, ({"error": "User not found"}, 404)
+
+    preferred_genres = user.preferences.split(",") if user.preferences else []
+    logging.debug(f"Preferred genres: {preferred_genres}")
+
+    # Users the model has (almost) no ratings for, including users who
+    # joined after it was fitted, are served from their onboarding ratings.
+    if current_app.config.get('COLD_START') and needs_cold_start(
+            model_instance, user_id,
+            current_app.config['COLD_START_MIN_RATINGS']):
+        return await rank_cold_start(
+            model_instance, user_id, num_recommendations, preferred_genres)
 
     if user_id not in known_user_ids:
         logging.warning(
             f"User ID {user_id} is new and not in the known range.")
-        return jsonify(
-            {"error": "User is new and no recommendations available yet."}), 404
+        return None, ({"error": "User is new and no recommendations available yet."}, 404)
 
-    preferred_genres = user.preferences.split(",") if user.preferences else []
-    logging.debug(f"Preferred genres: {preferred_genres}")
+    # Models that hold their ratings (not a model server client) can
+    # retrieve a few hundred candidates and rerank only those.
+    if current_app.config.get('RECOMMENDATION_PIPELINE') and hasattr(
+            model_instance, 'ratings_matrix'):
+        return await rank_with_pipeline(
+            model_instance, user_id, num_recommendations, preferred_genres,
+            diversity)
 
-    user_rated_movies = db.session.query(
-        Rating.movie_id).filter_by(
-        user_id=user_id).all()
-    rated_movie_ids = [r[0] for r in user_rated_movies]
+    logging.debug("Fetching unrated movies based on user preferences")
+    with timer("candidate_generation"):
+        unrated_movies = await async_db.run(
+            queries.get_candidate_movies, user_id,
+            preferred_genres[0] if preferred_genres else None)
+    logging.debug(f"Unrated movies count: {len(unrated_movies)}")
 
-    logging.debug(f"User Rated movie IDs: {rated_movie_ids}")
+    if user_id not in model_instance.user_index:
+        logging.error(f"User ID {user_id} out of range")
+        unrated_movies = []
+    else:
+        unrated_movies = [movie for movie in unrated_movies
+                          if movie.movie_id in model_instance.movie_index]
+
+    with timer("scoring"):
+        predicted_ratings = await scoring_executor.run(
+            model_instance.predict_many, user_id,
+            [movie.movie_id for movie in unrated_movies])
+
+    with timer("ranking"):
+        predicted_ratings = np.asarray(predicted_ratings, dtype=np.float64)
+        valid = np.flatnonzero(~np.isnan(predicted_ratings))
+        if len(valid) < len(predicted_ratings):
+            trace("Skipping %d movies with NaN predicted ratings.",
+                  len(predicted_ratings) - len(valid))
+        # Stable sort, so ties keep candidate order
+        order = valid[np.argsort(-predicted_ratings[valid], kind='stable')]
+        if diversity is None:
+            diversity = current_app.config.get('RECOMMENDATION_DIVERSITY')
+        if diversity:
+            from recommendation_engine.diversity import genre_vectors, mmr
+
+            order = order[mmr(
+                predicted_ratings[order],
+                genre_vectors([unrated_movies[i].genres for i in order]),
+                num_recommendations, diversity)]
+        top = order[:num_recommendations]
+        movies = [unrated_movies[i] for i in top]
+        scores = predicted_ratings[top].tolist()
+
+    if not movies:
+        logging.debug("No valid recommendations found.")
+        return None, ({"error": "No valid recommendations found."}, 404)
 
-    logging.debug("Fetching unrated movies based on user preferences")
-    unrated_movies = (
-        db.session.query(Movie) .filter(
-            ~Movie.movie_id.in_(rated_movie_ids),
-            Movie.genres.op("SIMILAR TO")(f"%{preferred_genres[0]}%") if preferred_genres else True,
-        ) .all())
+    trace("Top recommendations: %s",
+          list(zip((movie.movie_id for movie in movies), scores)))
+    return (movies, scores, score_key(model_instance)), None
 
-    top_recommendations_with_details = []
-    logging.debug(f"Unrated movies count: {len(unrated_movies)}")
-    for unrated_movie in unrated_movies:
-        try:
-            if user_id in model_instance.user_index and unrated_movie.movie_id in model_instance.movie_index:
-                predicted_rating = model_instance.predict(
-                    user_id, unrated_movie.movie_id)
-                logging.debug(
-                    f"Predicted rating for movie {unrated_movie.movie_id}: {predicted_rating}")
-                if not np.isnan(predicted_rating):
-                    movie_details = {
-                        "movieId": unrated_movie.movie_id,
-                        "title": unrated_movie.title,
-                        "genres": unrated_movie.genres,
-                        "predictedRating": float(predicted_rating)
-                    }
-                    top_recommendations_with_details.append(movie_details)
-                else:
-                    logging.warning(
-                        f"Predicted rating for movie {unrated_movie.movie_id} is NaN. Skipping this movie.")
-            else:
-                logging.error(
-                    f"User ID {user_id} or movie ID {unrated_movie.movie_id} out of range")
-        except Exception as e:
-            logging.error(
-                f"Error processing movie {unrated_movie.movie_id}: {str(e)}")
-            continue
-
-    if not top_recommendations_with_details:
+
+async def rank_with_pipeline(model_instance, user_id, num_recommendations,
+                             preferred_genres, diversity=None):
+    """
+    rank_recommendations through the retrieve-then-rerank pipeline.
+
+    """
+    pipeline = await get_pipeline(model_instance)
+    with timer("scoring"):
+        movie_ids, scores = await scoring_executor.run(
+            pipeline.recommend, user_id, num_recommendations,
+            preferred_genres, False, diversity)
+    return ranked_movies(pipeline, movie_ids, scores)
+
+
+async def rank_cold_start(model_instance, user_id, num_recommendations,
+                          preferred_genres):
+    """
+    rank_recommendations for users with few or no ratings in the model.
+
+    The user's ratings are read from the database and folded in through
+    the pipeline's item-neighbour table, where the model has one; the
+    model is not refitted. /onboarding has usually just written them, so
+    they and the user's genres are read from the primary rather than
+    through async_db, which may read from a lagging replica.
+    """
+    pipeline = await get_pipeline(model_instance)
+    ratings = dict(queries.get_user_ratings(db.session, user_id))
+    user = queries.get_user(db.session, user_id)
+    if user is not None and user.preferences:
+        preferred_genres = user.preferences.split(",")
+    logging.debug(f"Cold start for user {user_id} from {len(ratings)} ratings")
+    with timer("scoring"):
+        movie_ids, scores = await scoring_executor.run(
+            ColdStartRecommender(pipeline).recommend, ratings,
+            preferred_genres, num_recommendations)
+    return ranked_movies(pipeline, movie_ids, scores)
+
+
+async def get_pipeline(model_instance):
+    """
+    The model's recommendation pipeline, built from the movie catalogue on
+    first use for each model.
+    """
+    # Also keeps the content engine up to date with new tags.
+    content = await get_content_engine() \
+        if recommendation_pipelines.uses_content else None
+    pipeline = recommendation_pipelines.get(model_instance)
+    if pipeline is None:
+        movies = await async_db.run(queries.get_movie_catalog)
+        pipeline = await scoring_executor.run(
+            recommendation_pipelines.build, model_instance, movies, content)
+    return pipeline
+
+
+def ranked_movies(pipeline, movie_ids, scores):
+    """
+    rank_recommendations' result for movie IDs picked by a pipeline,
+    whose scores are on the rating scale.
+    """
+    if not len(movie_ids):
         logging.debug("No valid recommendations found.")
-        return jsonify({"error": "No valid recommendations found."}), 404
+        return None, ({"error": "No valid recommendations found."}, 404)
+
+    movies = [pipeline.rows[movie_id] for movie_id in movie_ids.tolist()]
+    scores = scores.tolist()
+    trace("Top recommendations: %s",
+          list(zip((movie.movie_id for movie in movies), scores)))
+    return (movies, scores, MOVIE_FRAGMENTS.score_key), None
 
-    top_recommendations_with_details = sorted(
-        top_recommendations_with_details,
-        key=lambda x: x["predictedRating"],
-        reverse=True)
-    top_recommendations_with_details = top_recommendations_with_details[:num_recommendations]
 
-    logging.debug(f"Top recommendations: {top_recommendations_with_details}")
+async def build_recommendations(user_id, num_recommendations):
+    """
+    Top recommendations for a user as a response body.
 
-    response = jsonify({'recommendations': top_recommendations_with_details})
-    logging.debug(f"Response: {response.get_json()}")
+    Returns:
+        tuple: Response body (dict) and HTTP status code.
+    """
+    ranked, error = await rank_recommendations(user_id, num_recommendations)
+    if error is not None:
+        return error
+    movies, scores, key = ranked
+    return {'recommendations': [
+        {
+            "movieId": movie.movie_id,
+            "title": movie.title,
+            "genres": movie.genres,
+            key: score
+        }
+        for movie, score in zip(movies, scores)
+    ]}, 200
+
+
+@api_v1.route('/recommendations', methods=['POST'])
+@require_api_key
+@profile_request
+async def get_recommendations():
+    logging.debug("Entering get_recommendations endpoint")
+
+    try:
+        data = RecommendationRequestSchema().load(request.json)
+    except ValidationError as err:
+        logging.error(f"Validation error: {err.messages}")
+        return jsonify(err.messages), 400
+
+    logging.debug(f"Request data for recommendations: {data}")
+
+    user_id = data["userId"]
+    num_recommendations = request.json.get('num_recommendations', 10)
+
+    try:
+        ranked, error = await rank_recommendations(
+            user_id, num_recommendations, data.get("diversity"))
+    except ScoringOverloaded as e:
+        logging.warning(f"Rejecting recommendation request: {e}")
+        return jsonify({"error": "Server is busy, please retry."}), 503
+
+    if error is not None:
+        return jsonify(error[0]), error[1]
+
+    movies, scores, key = ranked
+    fragments = SCORE_FRAGMENTS if key == SCORE_FRAGMENTS.score_key \
+        else MOVIE_FRAGMENTS
+    with timer("serialization"):
+        response = app.response_class(
+            encode_recommendations(fragments, movies, scores),
+            mimetype='application/json')
 
     logging.debug("Exiting get_recommendations endpoint")
 
-    return response
+    return response, 200
+
+
+MAX_MOVIES_PER_PAGE = 100
+MOVIE_COUNT_TTL = 300
+_movie_count_cache = {'value': None, 'expires': 0.0}
+
+
+async def cached_movie_count():
+    """
+    Estimated number of movies, refreshed at most every MOVIE_COUNT_TTL
+    seconds.
+    """
+    now = time.monotonic()
+    if _movie_count_cache['value'] is None or now >= _movie_count_cache['expires']:
+        _movie_count_cache['value'] = await async_db.run(
+            queries.estimate_movie_count)
+        _movie_count_cache['expires'] = now + MOVIE_COUNT_TTL
+    return _movie_count_cache['value']
+
+
+def parse_movie_fields(value):
+    """
+    Parse the ``fields`` query parameter into Movie column names.
+
+    Raises:
+        ValidationError: If an unknown field is requested.
+    """
+    if not value:
+        return queries.MOVIE_COLUMNS
+    requested = tuple(dict.fromkeys(
+        name.strip() for name in value.split(',') if name.strip()))
+    unknown = [name for name in requested if name not in queries.MOVIE_COLUMNS]
+    if unknown or not requested:
+        raise ValidationError(
+            {'fields': [f"Unknown fields: {', '.join(unknown)}"
+                        if unknown else "No fields requested"]})
+    return requested
 
 
 @api_v1.route('/movies', methods=['GET'])
-def get_movies():
+async def get_movies():
+    """
+    List movies.
+
+    Passing ``cursor`` (empty for the first page) selects keyset pagination
+    on movie_id: each page costs the same regardless of depth, ``total`` is
+    a cached estimate and the response carries ``next_cursor``. Without it
+    the original page/per_page offset pagination is used. Both modes accept
+    ``fields=movie_id,title,...`` and answer conditional GETs with 304.
+    """
     try:
+        fields_requested = parse_movie_fields(request.args.get('fields'))
+
+        if 'cursor' in request.args:
+            return await get_movies_by_cursor(fields_requested)
+
         # Get page number, default to 1
         page = request.args.get('page', 1, type=int)
         # Items per page, default to 10
         per_page = request.args.get('per_page', 10, type=int)
 
-        movies = Movie.query.paginate(
+        # Select only the requested columns and serialize the rows as-is
+        movies = Movie.query.with_entities(
+            *(getattr(Movie, name) for name in fields_requested)).paginate(
             page=page, per_page=per_page, error_out=False)
-
-        movie_schema = MovieSchema(many=True)
-        # Serialize only the items for the current page
-        result = movie_schema.dump(movies.items)
+        result = rows_to_dicts(movies.items, fields_requested)
 
         # Add pagination information to the response
-        return jsonify({
+        return json_response({
             'movies': result,
             'total': movies.total,
             'page': movies.page,
             'per_page': movies.per_page,
             'has_next': movies.has_next,
             'has_prev': movies.has_prev
-        }), 200
+        }, conditional=True)
     except SQLAlchemyError as e:
         return jsonify({'error': 'Database error'}), 500
 
@@ -337,19 +658,46 @@ def get_movies():
         return jsonify({'error': str(e)}), 500
 
 
+async def get_movies_by_cursor(fields_requested):
+    cursor = request.args.get('cursor')
+    try:
+        after_movie_id = int(cursor) if cursor else None
+    except ValueError:
+        raise ValidationError({'cursor': ['Invalid cursor']})
+    per_page = min(max(request.args.get('per_page', 10, type=int), 1),
+                   MAX_MOVIES_PER_PAGE)
+
+    # movie_id is always selected because the next cursor is built from it.
+    columns = fields_requested
+    if 'movie_id' not in columns:
+        columns = ('movie_id',) + columns
+    # One extra row tells us whether there is a next page.
+    rows = await async_db.run(
+        queries.get_movies_after, after_movie_id, per_page + 1, columns)
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+
+    movies = rows_to_dicts(rows, columns)
+    if 'movie_id' not in fields_requested:
+        for movie in movies:
+            del movie['movie_id']
+
+    return json_response({
+        'movies': movies,
+        'total': await cached_movie_count(),
+        'per_page': per_page,
+        'has_next': has_next,
+        'next_cursor': str(rows[-1].movie_id) if has_next else None,
+    }, conditional=True)
+
+
 @api_v1.route('/movies/<int:movie_id>', methods=['GET'])
 @require_api_key
-def get_movie_details(movie_id):
-    movie = Movie.query.filter_by(movie_id=movie_id).first()
+async def get_movie_details(movie_id):
+    movie, avg_rating = await async_db.run(queries.get_movie_details, movie_id)
     if not movie:
         return jsonify({"error": "Movie not found"}), 404
 
-    avg_rating = (
-        db.session.query(db.func.avg(Rating.rating))
-        .filter_by(movie_id=movie_id)
-        .scalar()
-    )
-
     movie_details = MovieDetailsSchema().dump({
         "movie_id": movie.movie_id,
         "title": movie.title,
@@ -361,6 +709,35 @@ def get_movie_details(movie_id):
     return jsonify(movie_details), 200
 
 
+def _movie_stats_mirror():
+    model_instance = current_app.config.get('MODEL_INSTANCE')
+    return getattr(model_instance, 'movie_stats', None)
+
+
+def record_rating_stats(writes, rated_at):
+    """
+    Update movie_stats in the current session for a batch of rating
+    writes, given as (movie_id, rating, previous_rating) tuples.
+    """
+    mirror = _movie_stats_mirror()
+    global_mean = mirror.global_mean if mirror is not None and len(mirror) else None
+    for movie_id, rating, previous_rating in writes:
+        record_movie_rating(db.session, movie_id, rating, previous_rating,
+                            rated_at, global_mean=global_mean)
+
+
+def apply_rating_stats(writes, rated_at):
+    """
+    Apply committed rating writes to the model's in-memory movie stats.
+    """
+    mirror = _movie_stats_mirror()
+    if mirror is None:
+        return
+    rated_at = rated_at.replace(tzinfo=timezone.utc).timestamp()
+    for movie_id, rating, previous_rating in writes:
+        mirror.apply(movie_id, rating, previous_rating, rated_at)
+
+
 @api_v1.route('/rate', methods=['POST'])
 @require_api_key
 def rate_movie():
@@ -373,33 +750,104 @@ def rate_movie():
     movie_id = data['movieId']
     rating = data['rating']
 
-    movie = Movie.query.filter_by(movie_id=movie_id).first()
-    if not movie:
+    model_instance = current_app.config.get('MODEL_INSTANCE')
+    if movie_id not in (getattr(model_instance, 'movie_index', None) or ()) and \
+            not Movie.query.filter_by(movie_id=movie_id).first():
         return jsonify({"error": "Movie not found"}), 404
 
+    # The write is one log append; the ingestion thread applies it.
+    if rating_ingestor.enabled:
+        rating_ingestor.submit([(user_id, movie_id, rating, time.time())])
+        return jsonify({"message": "Rating accepted"}), 202
+
     existing_rating = Rating.query.filter_by(
         user_id=user_id, movie_id=movie_id).first()
+    rated_at = datetime.utcnow()
+    previous_rating = None
     if existing_rating:
+        previous_rating = existing_rating.rating
         existing_rating.rating = rating
-        existing_rating.timestamp = datetime.utcnow()
+        existing_rating.timestamp = rated_at
     else:
         new_rating = Rating(user_id=user_id, movie_id=movie_id, rating=rating)
         db.session.add(new_rating)
 
+    writes = [(movie_id, rating, previous_rating)]
+    record_rating_stats(writes, rated_at)
     db.session.commit()
+    apply_rating_stats(writes, rated_at)
     return jsonify({"message": "Rating updated/added successfully"}), 200
 
 
+@api_v1.route('/interactions', methods=['POST'])
+@require_api_key
+def record_interaction():
+    """
+    Count an implicit interaction (view, click, like or dislike) of a user
+    with a movie. The implicit-feedback model (IMPLICIT_FEEDBACK) picks it
+    up when it is next built.
+    """
+    try:
+        data = InteractionSchema().load(request.json)
+    except ValidationError as err:
+        return jsonify(err.messages), 400
+
+    user_id, movie_id, kind = data['userId'], data['movieId'], data['kind']
+    model_instance = current_app.config.get('MODEL_INSTANCE')
+    if movie_id not in (getattr(model_instance, 'movie_index', None) or ()) and \
+            not Movie.query.filter_by(movie_id=movie_id).first():
+        return jsonify({"error": "Movie not found"}), 404
+
+    interaction = Interaction.query.filter_by(
+        user_id=user_id, movie_id=movie_id, kind=kind).first()
+    if interaction:
+        interaction.count += 1
+        interaction.last_interacted_at = datetime.utcnow()
+    else:
+        db.session.add(Interaction(
+            user_id=user_id, movie_id=movie_id, kind=kind, count=1))
+    db.session.commit()
+    return jsonify({"message": "Interaction recorded"}), 200
+
+
+async def get_content_engine():
+    """
+    The content-based engine, built on first use and updated with tags
+    added since, at most every CONTENT_REFRESH_INTERVAL seconds.
+    """
+    if content_engines.engine is None:
+        movies = await async_db.run(queries.get_movie_catalog)
+        tags = await async_db.run(queries.get_tags_after)
+        return await scoring_executor.run(content_engines.build, movies, tags)
+    if content_engines.due():
+        tags = await async_db.run(
+            queries.get_tags_after, content_engines.last_tag_id)
+        return await scoring_executor.run(content_engines.add, tags)
+    return content_engines.engine
+
+
 @api_v1.route('/similar/<int:movie_id>', methods=['GET'])
 @require_api_key
-def get_similar_movies(movie_id):
+async def get_similar_movies(movie_id):
+    """
+    Movies similar in content (genres and tags) to a movie, including
+    movies nobody has rated yet.
+    """
+    n = request.args.get('n', 10, type=int)
     try:
-        ratings_matrix = get_ratings_matrix()
-        model = app.config['MODEL']
-        similar_items = model.get_similar_items(movie_id - 1)
+        engine = await get_content_engine()
+        similar_items = engine.get_similar_items(movie_id, n)
         if not similar_items:
             return jsonify({"error": "No similar movies found"}), 400
-        return jsonify(similar_items)
+        return jsonify([
+            {
+                "movieId": similar_id,
+                "title": engine.rows[similar_id][1],
+                "genres": engine.rows[similar_id][2],
+                "similarity": similarity
+            }
+            for similar_id, similarity in similar_items
+        ])
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -429,27 +877,18 @@ def get_genres():
     return jsonify(genre_list)  # Return the list of genre dictionaries
 
 
+async def fetch_popular_movies(count):
+    popular_movies = await async_db.run(queries.get_popular_movies, count)
+    return [{'movieId': movie.movie_id, 'title': movie.title}
+            for movie in popular_movies]
+
+
 @api_v1.route('/popular_movies')
 @require_api_key
-def get_popular_movies():
+async def get_popular_movies():
     try:
         count = request.args.get('count', 5, type=int)
-        popular_movies = (
-            db.session.query(
-                Movie,
-                db.func.avg(
-                    Rating.rating).label('avg_rating'),
-                db.func.count(
-                    Rating.rating).label('num_ratings')) .join(
-                Rating,
-                Movie.movie_id == Rating.movie_id) .group_by(
-                        Movie.movie_id,
-                        Movie.id) .order_by(
-                            db.desc('avg_rating'),
-                db.desc('num_ratings')) .limit(count) .all())
-        response = [{'movieId': movie.movie_id, 'title': movie.title}
-                    for movie, _, _ in popular_movies]
-        return jsonify(response)
+        return jsonify(await fetch_popular_movies(count))
     except Exception as e:
         app.logger.error(f"Error getting popular movies: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500
@@ -468,6 +907,8 @@ def get_authorization_url():
 
 
 async def exchange_code_for_token(code):
+    import aiohttp
+
     token_url = f"{os.getenv('OKTA_ORG_URL')}/oauth2/v1/token"
     data = {
         "grant_type": "authorization_code",
@@ -624,9 +1065,6 @@ def check_email_confirmation():
 
 @api_v1.route('/onboarding', methods=['GET', 'POST'])
 def save_preferences():
-    model_instance = current_app.config['MODEL_INSTANCE']
-    known_user_ids = current_app.config['KNOWN_USER_IDS']
-
     if request.method == 'GET':
         return render_template("onboarding.html")
 
@@ -658,25 +1096,37 @@ def save_preferences():
             return jsonify(
                 {"error": "No valid movie IDs found in the ratings."}), 400
 
-        for user_id, movie_id, rating_value in valid_ratings:
-            rating = Rating(
-                user_id=user_id,
-                movie_id=movie_id,
-                rating=rating_value)
-            db.session.add(rating)
-
-        db.session.commit()
-
-        # Update the recommendation model with new user data
-        if user_id not in known_user_ids:
+        if rating_ingestor.enabled:
+            db.session.commit()
+            rated_at = time.time()
+            sequence = rating_ingestor.submit(
+                [(user_id, movie_id, rating_value, rated_at)
+                 for user_id, movie_id, rating_value in valid_ratings])
+            # Recommendations right after onboarding read these ratings.
+            rating_ingestor.wait(sequence, timeout=5.0)
+        else:
+            for user_id, movie_id, rating_value in valid_ratings:
+                rating = Rating(
+                    user_id=user_id,
+                    movie_id=movie_id,
+                    rating=rating_value)
+                db.session.add(rating)
+
+            rated_at = datetime.utcnow()
+            writes = [(movie_id, rating_value, None)
+                      for _, movie_id, rating_value in valid_ratings]
+            record_rating_stats(writes, rated_at)
+            db.session.commit()
+            apply_rating_stats(writes, rated_at)
+
+        # The model is not refitted: /recommendations serves new users
+        # from these ratings through the cold-start recommender. While the
+        # model is still loading (or failed to load) there are no known
+        # user IDs to register with.
+        known_user_ids = current_app.config.get('KNOWN_USER_IDS')
+        if known_user_ids is not None and user_id not in known_user_ids:
             known_user_ids.add(user_id)
-            new_ratings = {
-                movie_id: rating_value for _,
-                movie_id,
-                rating_value in valid_ratings}
-            model_instance.update_rating_matrix(user_id, new_ratings)
-            model_instance.update_user_similarity()
-            logging.info(f"Model updated for new user: {user_id}")
+            logging.info(f"Registered new user: {user_id}")
 
         return jsonify({"message": "Preferences saved successfully"}), 200
 
@@ -694,67 +1144,49 @@ def save_preferences():
 
 @api_v1.route("/dashboard", methods=["GET"])
 @login_required
-def dashboard_data():
+async def dashboard_data():
     """
     Endpoint for getting data for the user dashboard.
+
+    Recommendations, trending movies and the user's rated movies are
+    fetched concurrently and in-process rather than through HTTP calls to
+    this same server.
     """
     try:
         user_id = current_user.id
 
-        # 1. Get Personalized Recommendations
-        try:
-            data = {"userId": user_id,
-                    "num_recommendations": 10}
-            app.logger.debug(f"Request data for recommendations: {data}")
-            recommendations_response = requests.post(
-                f"{request.url_root}api/v1/recommendations",
-                json=data,
-                headers={"X-API-Key": API_KEY}
-            )
-            recommendations_response.raise_for_status()
-            recommendations_data = recommendations_response.json()
-            print(
-                "Recommendation data sent to the front end",
-                recommendations_data)
-        except requests.RequestException as e:
-            app.logger.error(f"Error fetching recommendations: {e}")
-            recommendations_data = {"recommendations": []}
-
-        # 2. Get Trending Movies
-        try:
-            trending_movies_response = requests.get(
-                f"{request.url_root}api/v1/popular_movies?count=10",
-                headers={"X-API-Key": API_KEY}
-            )
-            trending_movies_response.raise_for_status()
-            trending_movies_data = trending_movies_response.json()
-        except requests.RequestException as e:
-            app.logger.error(f"Error fetching trending movies: {e}")
-            trending_movies_data = []
-
-        # 3. Get the User's Rated Movies
-        try:
-            rated_movies = Rating.query.filter_by(user_id=user_id).all()
-            rated_movie_ids = [rating.movie_id for rating in rated_movies]
-
-            rated_movies_data = []
-            movies = Movie.query.filter(
-                Movie.movie_id.in_(rated_movie_ids)).all()
-            for movie in movies:
-                user_rating = next(
-                    (rating.rating for rating in rated_movies if rating.movie_id == movie.movie_id),
-                    None)
-                rated_movies_data.append({
-                    "movieId": movie.movie_id,
-                    "title": movie.title,
-                    "genres": movie.genres,
-                    "userRating": user_rating
-                })
-        except Exception as e:
-            app.logger.error(f"Error fetching rated movies: {e}")
-            rated_movies_data = []
-
-        # 4. Get User Information
+        async def recommendations():
+            try:
+                body, status = await build_recommendations(user_id, 10)
+                return body.get("recommendations", [])
+            except Exception as e:
+                app.logger.error(f"Error fetching recommendations: {e}")
+                return []
+
+        async def trending_movies():
+            try:
+                return await fetch_popular_movies(10)
+            except Exception as e:
+                app.logger.error(f"Error fetching trending movies: {e}")
+                return []
+
+        async def rated_movies():
+            try:
+                rows = await async_db.run(queries.get_rated_movies, user_id)
+                return [{
+                    "movieId": row.movie_id,
+                    "title": row.title,
+                    "genres": row.genres,
+                    "userRating": row.rating
+                } for row in rows]
+            except Exception as e:
+                app.logger.error(f"Error fetching rated movies: {e}")
+                return []
+
+        recommendations_data, trending_movies_data, rated_movies_data = \
+            await asyncio.gather(
+                recommendations(), trending_movies(), rated_movies())
+
         user_info = {
             "id": user_id,
             "firstName": current_user.first_name,
@@ -766,7 +1198,7 @@ def dashboard_data():
         return render_template(
             "dashboard.html",
             user_info=user_info,
-            recommendations=recommendations_data["recommendations"],
+            recommendations=recommendations_data,
             trending_movies=trending_movies_data,
             rated_movies=rated_movies_data)
 
@@ -0,0 +1,62 @@
+"""
+Latency of MMR diversity reranking.
+
+Reranks a number of candidates down to the top n with genre vectors
+(compared densely) and with sparse TF-IDF-like content vectors.
+
+Usage:
+    python -m benchmarks.diversity --candidates 1000 10000 --n 20
+"""
+
+import argparse
+import time
+
+import numpy as np
+from scipy.sparse import random as sparse_random
+
+from recommendation_engine.diversity import genre_vectors, mmr, normalize_rows
+
+GENRES = ["Action", "Adventure", "Animation", "Children", "Comedy", "Crime",
+          "Documentary", "Drama", "Fantasy", "Horror", "Musical", "Mystery",
+          "Romance", "Sci-Fi", "Thriller", "War", "Western"]
+
+
+def median_ms(function, repeat):
+    function()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings)) * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--candidates', type=int, nargs='+',
+                        default=[1000, 10000])
+    parser.add_argument('--n', type=int, default=20)
+    parser.add_argument('--diversity', type=float, default=0.3)
+    parser.add_argument('--vocabulary', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args(argv)
+    rng = np.random.default_rng(0)
+
+    print(f"{'candidates':>10} {'genres ms':>10} {'content ms':>11}")
+    for n in args.candidates:
+        scores = rng.uniform(1, 5, n)
+        genres = genre_vectors([
+            "|".join(rng.choice(GENRES, rng.integers(1, 4), replace=False))
+            for _ in range(n)])
+        content = normalize_rows(sparse_random(
+            n, args.vocabulary, density=20 / args.vocabulary,
+            random_state=0, format='csr'))
+        dense = median_ms(
+            lambda: mmr(scores, genres, args.n, args.diversity), args.repeat)
+        sparse = median_ms(
+            lambda: mmr(scores, content, args.n, args.diversity), args.repeat)
+        print(f"{n:>10} {dense:>10.3f} {sparse:>11.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Throughput and memory of the evaluation metrics: per-user functions vs the
+batch form vs streaming accumulators.
+
+Builds random top-k predictions and a CSR relevance matrix and computes
+precision and recall with the per-user functions (on a sample of users,
+extrapolated), all metrics with evaluate_rankings in one batch, and all
+metrics chunk by chunk with MetricsAccumulator, in this process and in a
+pool of worker processes whose accumulators are merged. Peak traced
+memory (tracemalloc) is printed for the batch and the streaming run.
+
+Usage:
+    python -m benchmarks.evaluation_metrics --users 1000000 --chunk 50000 --workers 4
+"""
+
+import argparse
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+
+from evaluation.metrics import (
+    MetricsAccumulator, evaluate_rankings, precision_at_k, recall_at_k)
+
+
+def make_chunk(start, stop, items, k, per_user):
+    """Predictions and relevance of users start..stop, seeded by start."""
+    rng = np.random.default_rng(start)
+    users = stop - start
+    count = users * per_user
+    relevant = csr_matrix(
+        (np.ones(count), (rng.integers(0, users, count),
+                          rng.integers(0, items, count))),
+        shape=(users, items))
+    relevant.data[:] = 1.0
+    predicted = (rng.integers(0, items, (users, 1))
+                 + np.arange(k) * 7919) % items
+    return predicted, relevant
+
+
+def stream(start, stop, items, k, per_user, chunk):
+    accumulator = MetricsAccumulator(items, k)
+    for begin in range(start, stop, chunk):
+        accumulator.update(*make_chunk(
+            begin, min(begin + chunk, stop), items, k, per_user))
+    return accumulator
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=500000)
+    parser.add_argument('--items', type=int, default=20000)
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--per-user', type=int, default=20)
+    parser.add_argument('--chunk', type=int, default=50000)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--sample', type=int, default=20000)
+    args = parser.parse_args(argv)
+    shape = (args.items, args.k, args.per_user)
+
+    predicted, relevant = make_chunk(0, args.sample, *shape)
+    started = time.perf_counter()
+    for user in range(args.sample):
+        truth = relevant.indices[relevant.indptr[user]:relevant.indptr[user + 1]]
+        precision_at_k(truth, predicted[user], args.k)
+        recall_at_k(truth, predicted[user], args.k)
+    per_user = (time.perf_counter() - started) / args.sample
+    print(f"{'per-user functions':>22}: {per_user * args.users:7.2f} s "
+          f"(extrapolated from {args.sample} users)")
+
+    # The same chunks in every mode; the batch holds all of them at once.
+    tracemalloc.start()
+    chunks = [make_chunk(start, min(start + args.chunk, args.users), *shape)
+              for start in range(0, args.users, args.chunk)]
+    predicted = np.vstack([chunk[0] for chunk in chunks])
+    relevant = vstack([chunk[1] for chunk in chunks], format='csr')
+    del chunks
+    started = time.perf_counter()
+    _, result = evaluate_rankings(predicted, relevant)
+    seconds = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del predicted, relevant
+    print(f"{'batch':>22}: {seconds:7.2f} s, peak {peak / 2 ** 20:6.0f} MB")
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    streamed = stream(0, args.users, *shape, args.chunk).result()
+    seconds = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{'streaming':>22}: {seconds:7.2f} s, peak {peak / 2 ** 20:6.0f} MB "
+          f"(chunks of {args.chunk}, including generation)")
+
+    bounds = np.linspace(0, args.users, args.workers + 1).astype(int)
+    # Worker ranges start on chunk boundaries so the chunks match.
+    bounds = (bounds // args.chunk) * args.chunk
+    bounds[-1] = args.users
+    started = time.perf_counter()
+    with ProcessPoolExecutor(args.workers) as pool:
+        futures = [pool.submit(stream, start, stop, *shape, args.chunk)
+                   for start, stop in zip(bounds[:-1], bounds[1:])]
+        merged = MetricsAccumulator(args.items, args.k)
+        for future in futures:
+            merged.merge(future.result())
+    seconds = time.perf_counter() - started
+    merged = merged.result()
+    print(f"{f'{args.workers} worker processes':>22}: {seconds:7.2f} s "
+          f"(including generation)")
+
+    for name in ('precision', 'recall', 'ndcg', 'mrr', 'coverage'):
+        print(f"{name:>10}: batch {result[name]:.5f}, "
+              f"streaming {streamed[name]:.5f}, merged {merged[name]:.5f}")
+
+
+if __name__ == '__main__':
+    main()
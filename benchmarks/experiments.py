@@ -0,0 +1,109 @@
+"""
+Serving latency with and without a shadow variant.
+
+Fits UserBasedCF on a synthetic ratings matrix and ranks a stream of
+requests (predict_many over a user's candidate movies) three ways: alone,
+handing each request to the shadow variant of an ExperimentRouter (a
+refit with another k, scored on the shadow pool), and scoring the shadow
+inline as a synchronous comparison would. Prints the median and p99
+serving latency of each, the cost of a shadow hand-off and how many
+shadow jobs were scored or dropped. On few cores the shadow threads still
+compete with serving for CPU; the hand-off itself never waits for them.
+
+Usage:
+    python -m benchmarks.experiments --users 5000 --requests 2000 --shadow-k 60
+"""
+
+import argparse
+import time
+
+import numpy as np
+from scipy.sparse import random as sparse_random
+
+from api.experiments import ExperimentRouter
+from recommendation_engine.collaborative_filtering import UserBasedCF
+from recommendation_engine.instrumentation import REGISTRY
+
+
+def rank(model, user_id, movie_ids, n):
+    predictions = np.asarray(model.predict_many(user_id, movie_ids))
+    valid = np.flatnonzero(~np.isnan(predictions))
+    order = valid[np.argsort(-predictions[valid], kind='stable')]
+    return [movie_ids[i] for i in order[:n]]
+
+
+def percentiles(timings):
+    timings = np.asarray(timings) * 1000
+    return np.percentile(timings, 50), np.percentile(timings, 99)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=3000)
+    parser.add_argument('--movies', type=int, default=2000)
+    parser.add_argument('--density', type=float, default=0.02)
+    parser.add_argument('--candidates', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--k', type=int, default=30)
+    parser.add_argument('--shadow-k', type=int, default=60)
+    parser.add_argument('--shadow-workers', type=int, default=1)
+    parser.add_argument('--shadow-queue', type=int, default=16)
+    args = parser.parse_args(argv)
+
+    matrix = sparse_random(args.users, args.movies, density=args.density,
+                           random_state=0, format='csr')
+    matrix.data = np.ceil(matrix.data * 5)
+    model = UserBasedCF(matrix, {u: u for u in range(args.users)},
+                        {m: m for m in range(args.movies)}, k=args.k)
+    model.fit()
+
+    router = ExperimentRouter(shadow_workers=args.shadow_workers,
+                              shadow_queue=args.shadow_queue)
+    router.configure({'name': 'bench', 'variants': [{'name': 'control'}],
+                      'shadow': {'name': 'shadow',
+                                 'model': {'k': args.shadow_k}}})
+    shadow = router.experiment.shadow
+    router.model_for(shadow, model)
+    while router.model_for(shadow, model) is None:
+        time.sleep(0.05)
+    shadow_model = router.model_for(shadow, model)
+
+    rng = np.random.default_rng(0)
+    requests = [(int(user_id), rng.choice(
+        args.movies, args.candidates, replace=False).tolist())
+        for user_id in rng.integers(0, args.users, args.requests)]
+
+    modes = {'no shadow': [], 'shadow pool': [], 'inline shadow': []}
+    handoffs = []
+    for user_id, movie_ids in requests:
+        for mode, timings in modes.items():
+            started = time.perf_counter()
+            served = rank(model, user_id, movie_ids, 10)
+            if mode == 'shadow pool':
+                handoff = time.perf_counter()
+                router.shadow(user_id, served, lambda ids=movie_ids: ids,
+                              model)
+                handoffs.append(time.perf_counter() - handoff)
+            elif mode == 'inline shadow':
+                rank(shadow_model, user_id, movie_ids, 10)
+            timings.append(time.perf_counter() - started)
+    router.shutdown()
+
+    for mode, timings in modes.items():
+        p50, p99 = percentiles(timings)
+        print(f'{mode:>13}: p50 {p50:.3f} ms, p99 {p99:.3f} ms')
+    labels = {'experiment': 'bench', 'variant': 'shadow'}
+    scored = REGISTRY.histogram('experiment_shadow_latency', **labels).count
+    dropped = REGISTRY.counter(
+        'experiment_shadow_dropped_total', **labels).value
+    overlap = REGISTRY.counter(
+        'experiment_overlap_items_total', **labels).value
+    compared = REGISTRY.counter(
+        'experiment_compared_items_total', **labels).value
+    print(f'shadow hand-off: {np.median(handoffs) * 1e6:.1f} us median; '
+          f'{scored} scored, {dropped:.0f} dropped, '
+          f'overlap {overlap / max(compared, 1):.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Latency of hybrid score blending and of computing the rerank features.
+
+"blend" times HybridScorer.score over aligned vectors of every feature;
+"features" times RecommendationPipeline.features (with the per-user
+features cached) for the same number of candidates of a fitted model.
+
+Usage:
+    python -m benchmarks.hybrid --candidates 1000 10000 100000
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.pipeline import make_catalogue
+from recommendation_engine.hybrid import FEATURES, HybridScorer
+
+
+def median_ms(function, repeat):
+    function()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings)) * 1000
+
+
+def main(argv=None):
+    from recommendation_engine.pipeline import RecommendationPipeline
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--candidates', type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--movies', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    weights = {name: 1.0 for name in FEATURES if name != "content"}
+    scorer = HybridScorer(weights)
+    model, catalogue = make_catalogue(args.users, args.movies, 60)
+    pipeline = RecommendationPipeline(model, catalogue, scorer=scorer)
+    rng = np.random.default_rng(0)
+
+    print(f"{'candidates':>10} {'blend ms':>9} {'features ms':>12}")
+    for n in args.candidates:
+        features = {name: rng.random(n) for name in weights}
+        columns = rng.integers(0, len(pipeline.column_ids), n)
+        predictions = rng.uniform(1, 5, n)
+        blend = median_ms(lambda: scorer.score(features), args.repeat)
+        compute = median_ms(
+            lambda: pipeline.features(1, columns, predictions, ["Drama"]),
+            args.repeat)
+        print(f"{n:>10} {blend:>9.4f} {compute:>12.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Fit time, top-N quality and scoring latency of ImplicitALS by density.
+
+For each density the script samples implicit interactions from a planted
+low-rank model (users pick movies with probability growing with the
+affinity of their latent vectors plus a popularity term, Gumbel top-k;
+--signal scales the personal part), holds out 20% of every
+user's interactions, fits ImplicitALS on the rest and reports the fit
+time, precision@10 and recall@10 on the held-out interactions (from
+evaluation.metrics) next to a most-popular baseline, and the median time
+of one user's recommend() (one matrix-vector product plus top-N).
+
+Usage:
+    python -m benchmarks.implicit_als --users 20000 --movies 5000 --densities 0.005 0.02 0.05
+"""
+
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+from evaluation.metrics import precision_at_k, recall_at_k
+from recommendation_engine.implicit import ImplicitALS, interaction_matrix
+
+
+def sample_interactions(users, movies, density, signal=2.0, rank=16, seed=0):
+    rng = np.random.default_rng(seed)
+    user_vectors = rng.standard_normal((users, rank)).astype(np.float32)
+    movie_vectors = rng.standard_normal((movies, rank)).astype(np.float32)
+    popularity = rng.standard_normal(movies).astype(np.float32)
+    per_user = max(int(density * movies), 5)
+    rows, columns = [], []
+    for start in range(0, users, 1000):
+        affinity = signal * user_vectors[start:start + 1000] \
+            @ movie_vectors.T / np.sqrt(rank) + popularity
+        affinity += rng.gumbel(size=affinity.shape).astype(np.float32)
+        picked = np.argpartition(-affinity, per_user, axis=1)[:, :per_user]
+        rows.append(np.repeat(np.arange(start, start + len(picked)),
+                              per_user))
+        columns.append(picked.ravel())
+    return np.concatenate(rows), np.concatenate(columns), per_user
+
+
+def evaluate(recommend, held_out, k):
+    precision, recall = [], []
+    for user, relevant in held_out.items():
+        recommended = recommend(user)
+        precision.append(precision_at_k(relevant, recommended, k))
+        recall.append(recall_at_k(relevant, recommended, k))
+    return statistics.mean(precision), statistics.mean(recall)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--movies', type=int, default=3000)
+    parser.add_argument('--densities', type=float, nargs='+',
+                        default=[0.005, 0.02, 0.05])
+    parser.add_argument('--signal', type=float, default=2.0)
+    parser.add_argument('--factors', type=int, default=32)
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--eval-users', type=int, default=1000)
+    parser.add_argument('-k', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    user_index = {u: u for u in range(args.users)}
+    movie_index = {m: m for m in range(args.movies)}
+    print(f"{args.users} users, {args.movies} movies, "
+          f"{args.factors} factors, {args.iterations} iterations")
+    print(f"{'density':>8} {'nnz':>10} {'fit s':>7} {'P@k':>6} {'R@k':>6} "
+          f"{'pop P@k':>8} {'pop R@k':>8} {'recommend ms':>13}")
+    rng = np.random.default_rng(1)
+    for density in args.densities:
+        rows, columns, per_user = sample_interactions(
+            args.users, args.movies, density, args.signal)
+        test = rng.random(len(rows)) < 0.2
+        train = interaction_matrix(rows[~test], columns[~test],
+                                   np.ones((~test).sum()),
+                                   (args.users, args.movies))
+        held_out = {}
+        for user, movie in zip(rows[test], columns[test]):
+            if user < args.eval_users:
+                held_out.setdefault(int(user), []).append(int(movie))
+
+        model = ImplicitALS(train, user_index, movie_index,
+                            factors=args.factors, iterations=args.iterations)
+        started = time.perf_counter()
+        model.fit()
+        fit_seconds = time.perf_counter() - started
+
+        timings = []
+
+        def recommend(user):
+            started = time.perf_counter()
+            movies = [m for m, _ in model.recommend(user, args.k)]
+            timings.append(time.perf_counter() - started)
+            return movies
+
+        precision, recall = evaluate(recommend, held_out, args.k)
+
+        counts = np.asarray(train.sum(axis=0)).ravel()
+        ranked = np.argsort(-counts, kind='stable')
+
+        def most_popular(user):
+            seen = set(train.indices[train.indptr[user]:train.indptr[user + 1]])
+            return [m for m in ranked[:args.k + len(seen)]
+                    if m not in seen][:args.k]
+
+        pop_precision, pop_recall = evaluate(most_popular, held_out, args.k)
+        print(f"{density:8.3f} {train.nnz:10d} {fit_seconds:7.2f} "
+              f"{precision:6.3f} {recall:6.3f} {pop_precision:8.3f} "
+              f"{pop_recall:8.3f} {statistics.median(timings) * 1000:13.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Throughput of the write-ahead rating ingestion against its batch size.
+
+The script times WriteAheadLog appends (what /rate waits for) and a group
+fsync, then applies the same stream of rating events with upsert_ratings in
+batches of each given size, one transaction and one checkpoint per batch,
+against a seeded stand-in database (a temporary SQLite file by default, or
+an empty Postgres database given with --url).
+
+Usage:
+    python -m benchmarks.ingestion --events 5000 --batch-sizes 1 10 100 1000
+    python -m benchmarks.ingestion --url postgresql://localhost/bench
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from sqlalchemy.orm import Session
+
+from api.ingestion import WriteAheadLog, upsert_ratings
+from benchmarks.query_plans import make_engine, seed
+from models.models import MovieStats
+
+
+def make_events(count, users, movies, seed_value=0):
+    rng = random.Random(seed_value)
+    now = time.time()
+    return [(rng.randint(1, users), rng.randint(1, movies),
+             rng.randint(1, 10) / 2, now + i) for i in range(count)]
+
+
+def measure_append(directory, events):
+    log = WriteAheadLog(directory, name="append")
+    timings = []
+    for event in events:
+        start = time.perf_counter()
+        log.append([event])
+        timings.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    log.sync()
+    sync_ms = (time.perf_counter() - start) * 1000
+    log.close()
+    return statistics.median(timings) * 1e6, sync_ms
+
+
+def measure_apply(engine, directory, events, batch_size):
+    log = WriteAheadLog(directory, name=f"batch{batch_size}")
+    log.append(events)
+    log.sync()
+    offset = log.checkpoint
+    start = time.perf_counter()
+    with Session(engine) as session:
+        while True:
+            batch, end = log.read(offset, batch_size)
+            if not batch:
+                break
+            upsert_ratings(session, batch, global_mean=3.0)
+            session.commit()
+            log.save_checkpoint(end)
+            offset = end
+    elapsed = time.perf_counter() - start
+    log.close()
+    return len(events) / elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--url', help='Database URL (default: temp SQLite)')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--movies', type=int, default=2000)
+    parser.add_argument('--per-user', type=int, default=20)
+    parser.add_argument('--events', type=int, default=5000)
+    parser.add_argument('--batch-sizes', type=int, nargs='+',
+                        default=[1, 10, 100, 1000])
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    url = args.url or f"sqlite:///{os.path.join(directory, 'ingestion.db')}"
+    engine = make_engine(url)
+    events = make_events(args.events, args.users, args.movies)
+
+    append_us, sync_ms = measure_append(directory, events)
+    print(f'append: {append_us:.1f} us median per event, '
+          f'fsync of {len(events)} events: {sync_ms:.2f} ms')
+
+    for batch_size in args.batch_sizes:
+        seed(engine, args.users, args.movies, args.per_user)
+        MovieStats.__table__.drop(engine, checkfirst=True)
+        MovieStats.__table__.create(engine)
+        rate = measure_apply(engine, directory, events, batch_size)
+        print(f'batch size {batch_size:>5}: {rate:,.0f} events/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""
+Load test for the read-heavy endpoints, comparing the sync and async paths.
+
+The ``compare`` command starts the app twice, once with ASYNC_DATABASE off
+(every query runs on the Flask-SQLAlchemy session) and once with it on,
+fires the same load at both and prints throughput and latency percentiles.
+The database configured in the environment (DATABASE_URL) must already
+contain users, movies and ratings.
+
+Usage:
+    python -m benchmarks.load_test compare --concurrency 200 --requests 2000
+    python -m benchmarks.load_test run --url http://127.0.0.1:5000 \\
+        --path /api/v1/recommendations
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+MODES = {"sync": "False", "async": "True"}
+
+
+async def _fire(session, url, method, api_key, payload_for, latencies,
+                statuses):
+    payload = payload_for()
+    start = time.perf_counter()
+    async with session.request(method, url, json=payload,
+                               headers={"X-API-KEY": api_key}) as response:
+        await response.read()
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+    latencies.append(time.perf_counter() - start)
+
+
+async def run_load(url, method="POST", api_key="", concurrency=100,
+                   requests=1000, user_ids=(1, 100)):
+    """
+    Send ``requests`` requests with at most ``concurrency`` in flight.
+
+    Returns:
+        dict: Throughput, latency percentiles (ms) and status counts.
+    """
+    import aiohttp
+
+    def payload_for():
+        if method != "POST":
+            return None
+        return {"userId": random.randint(*user_ids),
+                "num_recommendations": 10}
+
+    latencies, statuses = [], {}
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def bounded():
+            async with semaphore:
+                await _fire(session, url, method, api_key, payload_for,
+                            latencies, statuses)
+
+        start = time.perf_counter()
+        outcomes = await asyncio.gather(
+            *(bounded() for _ in range(requests)), return_exceptions=True)
+        elapsed = time.perf_counter() - start
+
+    errors = [outcome for outcome in outcomes
+              if isinstance(outcome, Exception)]
+    if errors:
+        statuses["error"] = len(errors)
+        print(f"{len(errors)} requests failed, first error: {errors[0]!r}",
+              file=sys.stderr)
+
+    latency_ms = np.array(latencies) * 1000
+    return {
+        "throughput": len(latencies) / elapsed,
+        "p50": float(np.percentile(latency_ms, 50)) if len(latency_ms) else None,
+        "p95": float(np.percentile(latency_ms, 95)) if len(latency_ms) else None,
+        "p99": float(np.percentile(latency_ms, 99)) if len(latency_ms) else None,
+        "statuses": statuses,
+    }
+
+
+def serve(args):
+    """
+    Serve the app with a threaded WSGI server in the given mode.
+    """
+    from werkzeug.serving import make_server
+
+    os.environ["ASYNC_DATABASE"] = MODES[args.mode]
+    from api.app import create_app
+
+    app = create_app()
+    make_server("127.0.0.1", args.port, app, threaded=True).serve_forever()
+
+
+def _wait_ready(base_url, timeout=300):
+    import urllib.request
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"{base_url}/ready") as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{base_url} did not become ready")
+
+
+def compare(args):
+    results = {}
+    for offset, mode in enumerate(MODES):
+        port = args.port + offset
+        server = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.load_test", "serve",
+             "--mode", mode, "--port", str(port)])
+        try:
+            base_url = f"http://127.0.0.1:{port}"
+            _wait_ready(base_url)
+            results[mode] = asyncio.run(run_load(
+                base_url + args.path, args.method, args.api_key,
+                args.concurrency, args.requests, tuple(args.user_ids)))
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f"{args.method} {args.path}, concurrency={args.concurrency}, "
+          f"requests={args.requests}")
+    print(f"{'mode':<6} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'p99 ms':>9}  statuses")
+    for mode, result in results.items():
+        print(f"{mode:<6} {result['throughput']:>9.1f} {result['p50']:>9.1f} "
+              f"{result['p95']:>9.1f} {result['p99']:>9.1f}  "
+              f"{result['statuses']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_load_arguments(subparser):
+        subparser.add_argument("--path", default="/api/v1/recommendations")
+        subparser.add_argument("--method", default="POST")
+        subparser.add_argument("--api-key", default=os.getenv("API_KEY", ""))
+        subparser.add_argument("--concurrency", type=int, default=100)
+        subparser.add_argument("--requests", type=int, default=1000)
+        subparser.add_argument("--user-ids", type=int, nargs=2,
+                               default=[1, 100])
+
+    run_parser = subparsers.add_parser("run", help="Load a running server.")
+    run_parser.add_argument("--url", default="http://127.0.0.1:5000")
+    add_load_arguments(run_parser)
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="Start the app in sync and async mode and load both.")
+    compare_parser.add_argument("--port", type=int, default=5100)
+    add_load_arguments(compare_parser)
+
+    serve_parser = subparsers.add_parser("serve")
+    serve_parser.add_argument("--mode", choices=MODES, required=True)
+    serve_parser.add_argument("--port", type=int, required=True)
+
+    args = parser.parse_args(argv)
+    if args.command == "serve":
+        serve(args)
+    elif args.command == "compare":
+        compare(args)
+    else:
+        result = asyncio.run(run_load(
+            args.url + args.path, args.method, args.api_key,
+            args.concurrency, args.requests, tuple(args.user_ids)))
+        print(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Throughput and latency of single-pair predictions with and without the
+micro-batcher.
+
+Each thread sends one (user, movie) prediction at a time, as concurrent
+/predict requests do. "direct" calls UserBasedCF.predict from every thread;
+"batched" goes through a MicroBatcher, which scores the pairs that arrive
+together in one predict_pairs pass.
+
+Usage:
+    python -m benchmarks.micro_batching --concurrency 1 8 32 64
+"""
+
+import argparse
+import threading
+import time
+
+import numpy as np
+
+from benchmarks.model_server import make_model
+from recommendation_engine.batching import MicroBatcher
+
+
+def run_load(predict, threads, requests, users, movies):
+    """
+    Send ``requests`` predictions from ``threads`` threads.
+
+    Returns:
+        dict: Throughput and latency percentiles (ms).
+    """
+    latencies = []
+    per_thread = max(requests // threads, 1)
+    start_line = threading.Barrier(threads + 1)
+
+    def worker(seed):
+        rng = np.random.default_rng(seed)
+        start_line.wait()
+        for _ in range(per_thread):
+            user_id = int(rng.integers(1, users + 1))
+            movie_id = int(rng.integers(1, movies + 1))
+            start = time.perf_counter()
+            predict(user_id, movie_id)
+            latencies.append(time.perf_counter() - start)
+
+    pool = [threading.Thread(target=worker, args=(seed,))
+            for seed in range(threads)]
+    for thread in pool:
+        thread.start()
+    start_line.wait()
+    started = time.perf_counter()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    return {"throughput": len(latencies) / elapsed, "p50": p50, "p99": p99}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--movies', type=int, default=2000)
+    parser.add_argument('--density', type=float, default=0.02)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, nargs='+',
+                        default=[1, 8, 32, 64])
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=2.0)
+    args = parser.parse_args(argv)
+
+    model = make_model(args.users, args.movies, args.density)
+    batcher = MicroBatcher(args.max_batch_size, args.max_wait_ms / 1000)
+
+    def batched(user_id, movie_id):
+        return batcher.predict(model, user_id, movie_id)
+
+    print(f"{'threads':>7} {'mode':<8} {'req/s':>9} {'p50 ms':>8} "
+          f"{'p99 ms':>8}")
+    for threads in args.concurrency:
+        for name, predict in (("direct", model.predict),
+                              ("batched", batched)):
+            result = run_load(predict, threads, args.requests, args.users,
+                              args.movies)
+            print(f"{threads:>7} {name:<8} {result['throughput']:>9.1f} "
+                  f"{result['p50']:>8.2f} {result['p99']:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
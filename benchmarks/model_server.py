@@ -0,0 +1,142 @@
+"""
+Scoring throughput of the model server compared with in-process scoring.
+
+Fires concurrent predict_many requests (one user and a few hundred
+candidate movies each) from a pool of threads, as the API's scoring
+executor does, against a model fitted on a synthetic ratings matrix:
+
+- in-process: the threads call UserBasedCF.predict_many directly and
+  contend for the GIL;
+- server: the threads call a ModelServer running in a separate process
+  through ModelClient, and concurrent requests are batched;
+- server, unbatched: the same with max_batch_size=1.
+
+Usage:
+    python -m benchmarks.model_server --users 5000 --movies 2000 --threads 16
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+from scipy.sparse import random as sparse_random
+
+
+def make_model(users, movies, density, seed=0):
+    from recommendation_engine.collaborative_filtering import UserBasedCF
+    from recommendation_engine.movie_stats import MovieStatistics
+
+    matrix = sparse_random(users, movies, density=density,
+                           random_state=seed, format='csr')
+    matrix.data = np.ceil(matrix.data * 5)
+    model = UserBasedCF(matrix, {u + 1: u for u in range(users)},
+                        {m + 1: m for m in range(movies)})
+    model.fit()
+    # As in initialize_model, so fallback ratings are cheap lookups.
+    coo = matrix.tocoo()
+    model.movie_stats = MovieStatistics.from_ratings(coo.col + 1, coo.data)
+    return model
+
+
+def _serve(path, model_args, max_batch_size, max_wait, ready):
+    from recommendation_engine.model_server import ModelServer
+
+    server = ModelServer(path, make_model(*model_args),
+                         max_batch_size=max_batch_size, max_wait=max_wait)
+    asyncio.run(server.serve(ready))
+
+
+def run_load(predict_many, threads, requests, users, movies, candidates):
+    """
+    Send ``requests`` predict_many calls from ``threads`` threads.
+
+    Returns:
+        dict: Throughput and latency percentiles (ms).
+    """
+    latencies = []
+    per_thread = requests // threads
+    start_line = threading.Barrier(threads + 1)
+
+    def worker(seed):
+        rng = np.random.default_rng(seed)
+        start_line.wait()
+        for _ in range(per_thread):
+            user_id = int(rng.integers(1, users + 1))
+            movie_ids = rng.choice(movies, candidates, replace=False) + 1
+            start = time.perf_counter()
+            predict_many(user_id, movie_ids)
+            latencies.append(time.perf_counter() - start)
+
+    pool = [threading.Thread(target=worker, args=(seed,))
+            for seed in range(threads)]
+    for thread in pool:
+        thread.start()
+    start_line.wait()
+    started = time.perf_counter()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {"throughput": len(latencies) / elapsed, "p50": p50, "p95": p95,
+            "p99": p99}
+
+
+def measure_server(args, max_batch_size):
+    from recommendation_engine.model_server import ModelClient
+
+    path = os.path.join(tempfile.mkdtemp(), "model.sock")
+    context = multiprocessing.get_context('spawn')
+    ready = context.Event()
+    process = context.Process(target=_serve, args=(
+        path, (args.users, args.movies, args.density), max_batch_size,
+        args.max_wait_ms / 1000, ready), daemon=True)
+    process.start()
+    try:
+        if not ready.wait(600):
+            raise RuntimeError("The model server did not start")
+        client = ModelClient(path)
+        return run_load(client.predict_many, args.threads, args.requests,
+                        args.users, args.movies, args.candidates)
+    finally:
+        process.terminate()
+        process.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--movies', type=int, default=2000)
+    parser.add_argument('--density', type=float, default=0.02)
+    parser.add_argument('--candidates', type=int, default=300)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=2.0)
+    args = parser.parse_args(argv)
+
+    model = make_model(args.users, args.movies, args.density)
+    results = [
+        ("in-process", run_load(model.predict_many, args.threads,
+                                args.requests, args.users, args.movies,
+                                args.candidates)),
+        ("server", measure_server(args, args.max_batch_size)),
+        ("server, unbatched", measure_server(args, 1)),
+    ]
+
+    print(f"{args.threads} threads, {args.requests} requests of "
+          f"{args.candidates} movies")
+    print(f"{'mode':<18} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8}")
+    for name, result in results:
+        print(f"{name:<18} {result['throughput']:>8.1f} {result['p50']:>8.2f} "
+              f"{result['p95']:>8.2f} {result['p99']:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
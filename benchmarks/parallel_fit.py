@@ -0,0 +1,82 @@
+"""
+Fit time of the block-mode neighbour table by number of threads.
+
+Fits UserBasedCF on a synthetic ratings matrix in block mode
+(similarity.neighbor_table) with 1 to N threads under a memory ceiling,
+and prints the fit time, the speedup over one thread and the peak memory
+NumPy and SciPy allocated during the fit (tracemalloc) next to the
+ceiling. The single-threaded top-k table of the NEIGHBOR_TABLE_METRICS
+fit (similarity_matrix) is timed for reference; scikit-learn's fit is
+not, as it only indexes the matrix and searches neighbours per query.
+
+Usage:
+    python -m benchmarks.parallel_fit --users 50000 --jobs 1 2 4 8 --memory-mb 512
+"""
+
+import argparse
+import os
+import time
+import tracemalloc
+
+import numpy as np
+from scipy.sparse import random as sparse_random
+
+from recommendation_engine.collaborative_filtering import UserBasedCF
+from recommendation_engine.similarity import similarity_matrix
+
+
+def fit(matrix, user_index, movie_index, **kwargs):
+    model = UserBasedCF(matrix, user_index, movie_index, **kwargs)
+    started = time.perf_counter()
+    model.fit()
+    return time.perf_counter() - started
+
+
+def peak_memory(matrix, user_index, movie_index, **kwargs):
+    model = UserBasedCF(matrix, user_index, movie_index, **kwargs)
+    tracemalloc.start()
+    try:
+        model.fit()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--movies', type=int, default=5000)
+    parser.add_argument('--density', type=float, default=0.005)
+    parser.add_argument('--jobs', type=int, nargs='+',
+                        default=[1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument('--memory-mb', type=float, default=256)
+    parser.add_argument('--skip-reference', action='store_true')
+    args = parser.parse_args(argv)
+
+    matrix = sparse_random(args.users, args.movies, density=args.density,
+                           random_state=0, format='csr')
+    matrix.data = np.ceil(matrix.data * 5)
+    user_index = {u + 1: u for u in range(args.users)}
+    movie_index = {m + 1: m for m in range(args.movies)}
+    limit = int(args.memory_mb * 1024 * 1024)
+
+    print(f"{os.cpu_count()} CPUs, {args.users} users, "
+          f"{matrix.nnz} ratings, ceiling {args.memory_mb:.0f} MB")
+    print(f"{'mode':>12} {'fit s':>8} {'speedup':>8} {'peak MB':>8}")
+    if not args.skip_reference:
+        started = time.perf_counter()
+        similarity_matrix(matrix, top_k=30)
+        seconds = time.perf_counter() - started
+        print(f"{'reference':>12} {seconds:8.2f}")
+    baseline = None
+    for jobs in sorted(set(args.jobs)):
+        options = {'n_jobs': jobs, 'fit_memory_limit': limit}
+        seconds = fit(matrix, user_index, movie_index, **options)
+        baseline = baseline or seconds
+        peak = peak_memory(matrix, user_index, movie_index, **options)
+        print(f"{f'{jobs} threads':>12} {seconds:8.2f} "
+              f"{baseline / seconds:7.2f}x {peak / 2 ** 20:8.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""
+Recall and latency of the retrieve-then-rerank pipeline compared with
+exhaustive ranking.
+
+Ratings are drawn from a genre-clustered latent-factor model: every movie
+belongs to one or two genres, users prefer a few genres, and a user rates a
+movie more often, and higher, the closer their tastes are. For a sample of
+users both rankings use the same rerank (kNN prediction plus the recency
+boost); "exhaustive" scores every unrated movie, "pipeline" only the
+retrieved candidates.
+
+kNN predictions are averages of a few neighbours' ratings, so many movies
+tie at the top (often at 5 stars) and the exhaustive top n is one of many
+equally good lists. Recall@n therefore counts the pipeline's picks whose
+adjusted score reaches the exhaustive n-th best score.
+
+Usage:
+    python -m benchmarks.pipeline --users 5000 --movies 5000 \\
+        --max-candidates 100 300 1000
+"""
+
+import argparse
+import time
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+GENRES = ["Action", "Adventure", "Animation", "Comedy", "Crime", "Drama",
+          "Fantasy", "Horror", "Romance", "Sci-Fi", "Thriller", "War"]
+
+
+def make_catalogue(users, movies, ratings_per_user, factors=16, seed=0):
+    """
+    A fitted UserBasedCF model and its (movie_id, title, genres) rows.
+    """
+    from recommendation_engine.collaborative_filtering import UserBasedCF
+    from recommendation_engine.movie_stats import MovieStatistics
+
+    rng = np.random.default_rng(seed)
+    n_genres = len(GENRES)
+    genre_factors = rng.normal(size=(n_genres, factors))
+
+    primary = rng.integers(0, n_genres, movies)
+    secondary = rng.integers(0, n_genres, movies)
+    movie_factors = (genre_factors[primary] + 0.5 * genre_factors[secondary]
+                     + 0.5 * rng.normal(size=(movies, factors)))
+    liked = rng.integers(0, n_genres, (users, 2))
+    user_factors = (genre_factors[liked].sum(axis=1)
+                    + 0.5 * rng.normal(size=(users, factors)))
+    movie_popularity = rng.pareto(1.5, movies) + 1
+
+    rows, cols, values = [], [], []
+    for user in range(users):
+        affinity = movie_factors @ user_factors[user] / np.sqrt(factors)
+        weights = np.exp(affinity) * movie_popularity
+        rated = rng.choice(movies, ratings_per_user, replace=False,
+                           p=weights / weights.sum())
+        stars = np.clip(np.round(3 + affinity[rated] / 2
+                                 + rng.normal(0, 0.5, len(rated))), 1, 5)
+        rows.append(np.full(len(rated), user))
+        cols.append(rated)
+        values.append(stars)
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    values = np.concatenate(values)
+
+    matrix = csr_matrix((values, (rows, cols)), shape=(users, movies))
+    model = UserBasedCF(matrix, {u + 1: u for u in range(users)},
+                        {m + 1: m for m in range(movies)})
+    model.fit()
+    model.movie_stats = MovieStatistics.from_ratings(cols + 1, values)
+    # Movies nobody rated are left out, as they have no statistics.
+    years = rng.integers(1970, 2025, movies)
+    catalogue = [
+        (m + 1, f"Movie {m + 1} ({years[m]})",
+         "|".join(dict.fromkeys((GENRES[primary[m]], GENRES[secondary[m]]))))
+        for m in np.unique(cols).tolist()]
+    return model, catalogue
+
+
+def adjusted_scores(pipeline, movie_ids, predictions):
+    columns = [pipeline.model.movie_index[movie_id]
+               for movie_id in movie_ids.tolist()]
+    return predictions + pipeline.recency_weight * pipeline.recency[columns]
+
+
+def evaluate(pipeline, user_ids, n):
+    """
+    Recall@n against exhaustive ranking and latency of both.
+
+    Returns:
+        dict: Mean recall and median latencies (ms).
+    """
+    recalls, exhaustive_ms, pipeline_ms = [], [], []
+    for user_id in user_ids:
+        start = time.perf_counter()
+        expected = pipeline.recommend(user_id, n, exhaustive=True)
+        exhaustive_ms.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        found = pipeline.recommend(user_id, n)
+        pipeline_ms.append(time.perf_counter() - start)
+        if not len(expected[0]):
+            continue
+        threshold = adjusted_scores(pipeline, *expected).min()
+        hits = adjusted_scores(pipeline, *found) >= threshold - 1e-9
+        recalls.append(hits.sum() / len(expected[0]))
+    return {"recall": float(np.mean(recalls)),
+            "exhaustive": float(np.median(exhaustive_ms)) * 1000,
+            "pipeline": float(np.median(pipeline_ms)) * 1000}
+
+
+def main(argv=None):
+    from recommendation_engine.pipeline import RecommendationPipeline
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--movies', type=int, default=5000)
+    parser.add_argument('--ratings-per-user', type=int, default=60)
+    parser.add_argument('--sample', type=int, default=100)
+    parser.add_argument('-n', type=int, default=10)
+    parser.add_argument('--max-candidates', type=int, nargs='+',
+                        default=[100, 300, 1000])
+    args = parser.parse_args(argv)
+
+    model, catalogue = make_catalogue(args.users, args.movies,
+                                      args.ratings_per_user)
+    rng = np.random.default_rng(1)
+    user_ids = rng.choice(np.arange(1, args.users + 1), args.sample,
+                          replace=False).tolist()
+
+    print(f"{'candidates':>10} {'recall@' + str(args.n):>10} "
+          f"{'exhaustive ms':>14} {'pipeline ms':>12} {'speedup':>8}")
+    for max_candidates in args.max_candidates:
+        pipeline = RecommendationPipeline(model, catalogue,
+                                          max_candidates=max_candidates)
+        result = evaluate(pipeline, user_ids, args.n)
+        print(f"{max_candidates:>10} {result['recall']:>10.3f} "
+              f"{result['exhaustive']:>14.2f} {result['pipeline']:>12.2f} "
+              f"{result['exhaustive'] / result['pipeline']:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""
+Query plans and latencies of the hot ratings queries, before and after the
+composite indexes on ratings.
+
+The script seeds a stand-in database (a temporary SQLite file by default, or
+an empty Postgres database given with --url), runs the queries from
+api.queries plus the /rate lookup without the composite indexes, creates
+them and runs everything again. For each query it prints the plan and the
+median latency.
+
+Usage:
+    python -m benchmarks.query_plans --users 2000 --movies 2000
+    python -m benchmarks.query_plans --url postgresql://localhost/bench
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import create_engine, event, insert, select, text
+from sqlalchemy.orm import Session
+
+from api import queries
+from models.models import Movie, Rating, User
+
+COMPOSITE_INDEXES = ('ix_ratings_user_id_movie_id', 'ix_ratings_movie_id_rating')
+
+
+def rate_lookup(session, user_id, movie_id):
+    """The existing-rating lookup done by the /rate endpoint."""
+    return session.execute(select(Rating.id).where(
+        Rating.user_id == user_id, Rating.movie_id == movie_id)).first()
+
+
+QUERIES = {
+    'rate_lookup': (rate_lookup, lambda rng, a: (
+        rng.randint(1, a.users), rng.randint(1, a.movies))),
+    'rated_movie_ids': (queries.get_rated_movie_ids, lambda rng, a: (
+        rng.randint(1, a.users),)),
+    'movie_details': (queries.get_movie_details, lambda rng, a: (
+        rng.randint(1, a.movies),)),
+    'candidate_movies': (queries.get_candidate_movies, lambda rng, a: (
+        rng.randint(1, a.users),)),
+    'popular_movies': (queries.get_popular_movies, lambda rng, a: (10,)),
+}
+
+
+def make_engine(url):
+    engine = create_engine(url)
+    if engine.dialect.name == 'sqlite':
+        # SQLite has no schemas; map the models' 'public' schema away.
+        engine = engine.execution_options(schema_translate_map={'public': None})
+    return engine
+
+
+def seed(engine, users, movies, per_user, seed_value=0):
+    rng = random.Random(seed_value)
+    metadata = Rating.metadata
+    tables = [Movie.__table__, User.__table__, Rating.__table__]
+    metadata.drop_all(engine, tables=tables)
+    metadata.create_all(engine, tables=tables)
+    with engine.begin() as conn:
+        conn.execute(insert(Movie), [
+            {'movie_id': m, 'title': f'Movie {m}', 'genres': 'Drama'}
+            for m in range(1, movies + 1)])
+        conn.execute(insert(User), [
+            {'id': u, 'email': f'user{u}@example.com', 'password': 'x'}
+            for u in range(1, users + 1)])
+        conn.execute(insert(Rating), [
+            {'user_id': u, 'movie_id': m, 'rating': rng.randint(1, 10) / 2}
+            for u in range(1, users + 1)
+            for m in rng.sample(range(1, movies + 1), per_user)])
+
+
+def set_composite_indexes(engine, present):
+    for index in Rating.__table__.indexes:
+        if index.name in COMPOSITE_INDEXES:
+            if present:
+                index.create(engine, checkfirst=True)
+            else:
+                index.drop(engine, checkfirst=True)
+    with engine.begin() as conn:
+        conn.execute(text('ANALYZE'))
+
+
+def capture_statements(engine, function, args):
+    """Run the query function once and return the SQL it executed."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        with Session(engine) as session:
+            function(session, *args)
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    return statements
+
+
+def explain(engine, statement, parameters):
+    prefix = ('EXPLAIN QUERY PLAN ' if engine.dialect.name == 'sqlite'
+              else 'EXPLAIN ')
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql(prefix + statement, parameters).all()
+    if engine.dialect.name == 'sqlite':
+        return [row[-1] for row in rows]
+    return [row[0] for row in rows]
+
+
+def measure(engine, args):
+    results = {}
+    for name, (function, make_args) in QUERIES.items():
+        rng = random.Random(1)
+        plans = []
+        for statement, parameters in capture_statements(
+                engine, function, make_args(rng, args)):
+            plans.extend(explain(engine, statement, parameters))
+        timings = []
+        with Session(engine) as session:
+            for _ in range(args.repeat):
+                query_args = make_args(rng, args)
+                start = time.perf_counter()
+                function(session, *query_args)
+                timings.append(time.perf_counter() - start)
+        results[name] = (plans, statistics.median(timings) * 1000)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--url', help='Database URL (default: temp SQLite)')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--movies', type=int, default=2000)
+    parser.add_argument('--per-user', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args(argv)
+
+    url = args.url
+    if url is None:
+        path = os.path.join(tempfile.mkdtemp(), 'query_plans.db')
+        url = f'sqlite:///{path}'
+    engine = make_engine(url)
+
+    print(f'Seeding {args.users * args.per_user} ratings into '
+          f'{engine.dialect.name}...')
+    seed(engine, args.users, args.movies, args.per_user)
+
+    set_composite_indexes(engine, present=False)
+    before = measure(engine, args)
+    set_composite_indexes(engine, present=True)
+    after = measure(engine, args)
+
+    for name in QUERIES:
+        (plan_before, ms_before), (plan_after, ms_after) = (
+            before[name], after[name])
+        print(f'\n== {name}: {ms_before:.3f} ms -> {ms_after:.3f} ms '
+              f'(median of {args.repeat})')
+        print('  before:')
+        for line in plan_before:
+            print(f'    {line}')
+        print('  after:')
+        for line in plan_after:
+            print(f'    {line}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Per-response serialization cost of a recommendations response.
+
+Compares the previous path (a dict per movie encoded with Flask's jsonify),
+the same dicts encoded with api.serialization.dumps (orjson when
+installed), and pre-encoded movie fragments joined with the scores
+(encode_recommendations). Also reports gzip and brotli compression time
+and size for the largest response.
+
+Usage:
+    python -m benchmarks.serialization --sizes 10 100 1000
+"""
+
+import argparse
+import gzip
+import random
+import timeit
+from collections import namedtuple
+
+from flask import Flask, jsonify
+
+from api.serialization import (
+    MovieFragments, brotli, dumps, encode_recommendations, orjson)
+
+MovieRow = namedtuple('MovieRow', ['movie_id', 'title', 'genres'])
+GENRES = ["Action", "Adventure", "Comedy", "Drama", "Horror", "Romance",
+          "Sci-Fi", "Thriller"]
+
+
+def make_ranked(size, rng):
+    return [(MovieRow(movie_id, f"Movie {movie_id} ({1950 + movie_id % 70})",
+                      "|".join(rng.sample(GENRES, 3))),
+             rng.uniform(1, 5))
+            for movie_id in rng.sample(range(1, 100000), size)]
+
+
+def as_dicts(ranked):
+    return {'recommendations': [
+        {"movieId": movie.movie_id, "title": movie.title,
+         "genres": movie.genres, "predictedRating": float(score)}
+        for movie, score in ranked]}
+
+
+def best_of(function, repeat, number):
+    return min(timeit.repeat(function, repeat=repeat, number=number)) / number
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--number', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(0)
+    app = Flask(__name__)
+    print(f"encoder: {'orjson' if orjson else 'stdlib json'}")
+    print(f"{'size':>6} {'jsonify us':>12} {'dumps us':>10} "
+          f"{'fragments us':>13} {'speedup':>8}")
+
+    ranked = []
+    for size in args.sizes:
+        ranked = make_ranked(size, rng)
+        fragments = MovieFragments()
+        fragments.warm(movie for movie, _ in ranked)
+
+        with app.test_request_context():
+            baseline = best_of(lambda: jsonify(as_dicts(ranked)).get_data(),
+                               args.repeat, args.number)
+        direct = best_of(lambda: dumps(as_dicts(ranked)),
+                         args.repeat, args.number)
+        movies, scores = map(list, zip(*ranked))
+        fast = best_of(
+            lambda: encode_recommendations(fragments, movies, scores),
+            args.repeat, args.number)
+        print(f"{size:>6} {baseline * 1e6:>12.1f} {direct * 1e6:>10.1f} "
+              f"{fast * 1e6:>13.1f} {baseline / fast:>7.1f}x")
+
+    body = encode_recommendations(fragments, movies, scores)
+    print(f"\ncompression of a {len(body)} byte body:")
+    codecs = [('gzip', lambda: gzip.compress(body, compresslevel=5))]
+    if brotli is not None:
+        codecs.append(('br', lambda: brotli.compress(body, quality=4)))
+    for name, compress in codecs:
+        elapsed = best_of(compress, args.repeat, max(args.number // 10, 1))
+        print(f"  {name:<5} {len(compress()):>8} bytes {elapsed * 1e6:>10.1f} us")
+
+
+if __name__ == '__main__':
+    main()
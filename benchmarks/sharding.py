@@ -0,0 +1,83 @@
+"""
+Scoring throughput of the sharded model by number of shards.
+
+Scores batches of users (a few hundred candidate movies each) with
+ShardedUserCF.predict_batch against shards running in worker processes,
+and with an unsharded UserBasedCF for reference. Each shard computes
+similarities for 1/M of the users, so with a core per shard the
+similarity step shrinks with M. Every batch also pays for three IPC round
+trips, one copy of the query rows per shard and the coordinator's merge
+and gather steps (see recommendation_engine.sharding), which do not
+shrink. Throughput only grows with M while free cores remain.
+
+With fewer cores than shards the shards time-share, and only the
+overhead shows. On one CPU with 40000 users, 4 shards score about a third
+fewer users/s than the unsharded model.
+
+Usage:
+    python -m benchmarks.sharding --users 100000 --shards 1 2 4 8
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+from scipy.sparse import random as sparse_random
+
+from recommendation_engine.collaborative_filtering import UserBasedCF
+from recommendation_engine.sharding import ShardedUserCF
+
+
+def run(model, batches):
+    model.predict_batch(*batches[0])
+    started = time.perf_counter()
+    for user_ids, movie_lists in batches:
+        model.predict_batch(user_ids, movie_lists)
+    elapsed = time.perf_counter() - started
+    return len(batches) * len(batches[0][0]) / elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--movies', type=int, default=5000)
+    parser.add_argument('--density', type=float, default=0.005)
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--batches', type=int, default=10)
+    parser.add_argument('--candidates', type=int, default=300)
+    args = parser.parse_args(argv)
+
+    matrix = sparse_random(args.users, args.movies, density=args.density,
+                           random_state=0, format='csr')
+    matrix.data = np.ceil(matrix.data * 5)
+    user_index = {u + 1: u for u in range(args.users)}
+    movie_index = {m + 1: m for m in range(args.movies)}
+    rng = np.random.default_rng(0)
+    batches = [(rng.integers(1, args.users + 1, args.batch_size).tolist(),
+                [rng.integers(1, args.movies + 1, args.candidates)
+                 for _ in range(args.batch_size)])
+               for _ in range(args.batches)]
+
+    print(f"{os.cpu_count()} CPUs, {args.users} users, "
+          f"{matrix.nnz} ratings")
+    print(f"{'model':>12} {'users/s':>9}")
+    model = UserBasedCF(matrix, user_index, movie_index)
+    model.fit()
+    model.get_fallback_rating = lambda movie_id: 3.0
+    print(f"{'unsharded':>12} {run(model, batches):>9.0f}")
+    del model
+
+    for shards in args.shards:
+        model = ShardedUserCF(matrix, user_index, movie_index, shards=shards)
+        model.fit()
+        try:
+            throughput = run(model, batches)
+        finally:
+            model.close()
+        print(f"{f'{shards} shards':>12} {throughput:>9.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,17 @@
 import argparse
-from recommendation_engine.collaborative_filtering import UserBasedCF
-from data.loader import load_data
-from data.preprocessing import normalize_ratings
+import os
+import sys
 import numpy as np
-from api.app import app
 
+COMMANDS = ("recommend", "profile-report", "rebuild-movie-stats",
+            "publish-model", "serve-model")
+
+
+def recommend(args):
+    from recommendation_engine.collaborative_filtering import UserBasedCF
+    from data.loader import load_data
+    from data.preprocessing import normalize_ratings
 
-def main():
-    parser = argparse.ArgumentParser(description="CortexEng Recomemender")
-    parser.add_argument("userId", type=int,
-                        help="The user ID to generate recommendations for.")
-    parser.add_argument("--num_recommendations", "-n", type=int, default=10,
-                        help="Number of recommendations to return "
-                        "(default: 10)")
-    args = parser.parse_args()
     user_id = args.userId
     num_recommendations = args.num_recommendations
 
@@ -51,6 +49,182 @@ def main():
             f"- Movie ID: {recommendation['movieId']}, Predicted Rating: {recommendation['predictedRating']}")
 
 
+def profile_report(args):
+    from recommendation_engine.profiling import hotspot_report
+
+    report = hotspot_report(args.directory, top_n=args.top,
+                            sort_key=args.sort, name=args.name)
+    if not report:
+        print(f"No profiles found in {args.directory}")
+        return 1
+    print(report)
+    return 0
+
+
+def rebuild_stats(args):
+    from models.models import rebuild_movie_stats
+
+    stats = rebuild_movie_stats()
+    print(f"Rebuilt movie_stats for {len(stats)} movies "
+          f"(global mean {stats.global_mean:.3f})")
+    return 0
+
+
+def publish_model(args):
+    import time
+    from api.database import db
+    from models.models import initialize_model
+    from recommendation_engine.shared_model import SharedModelStore
+
+    store = SharedModelStore(args.directory, keep=args.keep)
+    while True:
+        model, known_user_ids = initialize_model()
+        db.session.remove()
+        if model is None:
+            print("Model initialization failed; nothing published.")
+        else:
+            generation = store.publish(model, known_user_ids)
+            print(f"Published generation {generation} to {args.directory}")
+        if args.interval <= 0:
+            return 0 if model is not None else 1
+        time.sleep(args.interval)
+
+
+def serve_model(args):
+    from recommendation_engine.model_server import ModelServer
+
+    if args.share_dir:
+        from recommendation_engine.shared_model import (
+            SharedModelReader, SharedModelStore)
+
+        reader = SharedModelReader(SharedModelStore(args.share_dir))
+        if not reader.refresh(force=True):
+            print(f"No model has been published to {args.share_dir}")
+            return 1
+        server = ModelServer(args.socket, reader=reader,
+                             max_batch_size=args.max_batch_size,
+                             max_wait=args.max_wait_ms / 1000)
+    else:
+        from models.models import initialize_model
+
+        model, known_user_ids = initialize_model()
+        if model is None:
+            print("Model initialization failed.")
+            return 1
+        server = ModelServer(args.socket, model, known_user_ids,
+                             max_batch_size=args.max_batch_size,
+                             max_wait=args.max_wait_ms / 1000)
+
+    print(f"Serving the model on {args.socket}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="CortexEng Recomemender")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    recommend_parser = subparsers.add_parser(
+        "recommend", help="Print recommendations for a user.")
+    recommend_parser.add_argument(
+        "userId", type=int,
+        help="The user ID to generate recommendations for.")
+    recommend_parser.add_argument(
+        "--num_recommendations", "-n", type=int, default=10,
+        help="Number of recommendations to return (default: 10)")
+
+    report_parser = subparsers.add_parser(
+        "profile-report",
+        help="Merge captured profiles into a top-N hotspot report.")
+    report_parser.add_argument(
+        "--directory", "-d", default="profiles",
+        help="Directory holding the .pstats files (default: profiles)")
+    report_parser.add_argument(
+        "--top", "-n", type=int, default=25,
+        help="Number of functions to list (default: 25)")
+    report_parser.add_argument(
+        "--sort", default="cumulative",
+        help="pstats sort key, e.g. cumulative or tottime "
+        "(default: cumulative)")
+    report_parser.add_argument(
+        "--name", default=None,
+        help="Only merge profiles whose label contains this text, "
+        "e.g. api_v1.get_recommendations or fit")
+
+    subparsers.add_parser(
+        "rebuild-movie-stats",
+        help="Recompute the movie_stats table from the ratings table.")
+
+    publish_parser = subparsers.add_parser(
+        "publish-model",
+        help="Fit the model and publish it for workers sharing it through "
+        "MODEL_SHARE_DIR.")
+    publish_parser.add_argument(
+        "--directory", "-d", default=os.getenv("MODEL_SHARE_DIR"),
+        required=not os.getenv("MODEL_SHARE_DIR"),
+        help="Model store directory (default: $MODEL_SHARE_DIR)")
+    publish_parser.add_argument(
+        "--interval", type=float, default=0,
+        help="Refit and publish every this many seconds; 0 publishes once "
+        "(default: 0)")
+    publish_parser.add_argument(
+        "--keep", type=int, default=2,
+        help="Number of generations kept on disk (default: 2)")
+
+    serve_parser = subparsers.add_parser(
+        "serve-model",
+        help="Serve predictions on a Unix socket for API processes started "
+        "with MODEL_SERVER_SOCKET.")
+    serve_parser.add_argument(
+        "--socket", "-s", default=os.getenv("MODEL_SERVER_SOCKET"),
+        required=not os.getenv("MODEL_SERVER_SOCKET"),
+        help="Socket path (default: $MODEL_SERVER_SOCKET)")
+    serve_parser.add_argument(
+        "--share-dir", default=os.getenv("MODEL_SHARE_DIR"),
+        help="Serve the model published to this store instead of fitting "
+        "one (default: $MODEL_SHARE_DIR)")
+    serve_parser.add_argument(
+        "--max-batch-size", type=int, default=64,
+        help="Maximum number of requests scored together (default: 64)")
+    serve_parser.add_argument(
+        "--max-wait-ms", type=float, default=2.0,
+        help="Milliseconds to wait for more requests to batch (default: 2)")
+    return parser
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    # Keep `main.py <userId>` working from before subcommands existed.
+    if argv and argv[0] not in COMMANDS and not argv[0].startswith("-"):
+        argv.insert(0, "recommend")
+    args = build_parser().parse_args(argv)
+
+    if args.command == "profile-report":
+        return profile_report(args)
+
+    from api.app import create_app
+
+    if args.command == "rebuild-movie-stats":
+        with create_app(lazy_startup=True, load_model=False,
+                        ingest_ratings=False).app_context():
+            return rebuild_stats(args)
+
+    if args.command == "publish-model":
+        with create_app(lazy_startup=True, load_model=False,
+                        ingest_ratings=False).app_context():
+            return publish_model(args)
+
+    if args.command == "serve-model":
+        with create_app(lazy_startup=True, load_model=False,
+                        ingest_ratings=False).app_context():
+            return serve_model(args)
+
+    with create_app(ingest_ratings=False).app_context():
+        return recommend(args)
+
+
 if __name__ == "__main__":
-    with app.app_context():
-        main()
+    sys.exit(main())
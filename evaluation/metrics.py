@@ -1,4 +1,5 @@
 import numpy as np
+from scipy.sparse import csr_matrix
 
 def mean_absolute_error(y_true, y_pred):
     """
@@ -30,9 +31,7 @@ def precision_at_k(y_true, y_pred, k):
     :param k: Number of top recommendations to consider
     :return: Precision at K value
     """
-    y_true = np.array(y_true)
-    y_pred = np.array(y_pred)[:k]
-    return len(set(y_true) & set(y_pred)) / float(k)
+    return len(set(y_true) & set(list(y_pred)[:k])) / float(k)
 
 def recall_at_k(y_true, y_pred, k):
     """
@@ -40,55 +39,158 @@ def recall_at_k(y_true, y_pred, k):
     :param y_true: Array of true item IDs
     :param y_pred: Array of predicted item IDs
     :param k: Number of top recommendations to consider
-    :return: Recall at K value
+    :return: Recall at K value, 0 when there are no true items
     """
-    y_true = np.array(y_true)
-    y_pred = np.array(y_pred)[:k]
-    return len(set(y_true) & set(y_pred)) / float(len(y_true))
-import numpy as np
+    relevant = set(y_true)
+    if not relevant:
+        return 0.0
+    return len(relevant & set(list(y_pred)[:k])) / float(len(relevant))
 
-def mean_absolute_error(y_true, y_pred):
-    """
-    Calculate Mean Absolute Error (MAE)
-    :param y_true: Array of true ratings
-    :param y_pred: Array of predicted ratings
-    :return: MAE value
-    """
-    y_true = np.array(y_true)
-    y_pred = np.array(y_pred)
-    return np.mean(np.abs(y_true - y_pred))
+# Batch metrics. Predictions are a (n_users, k) matrix of item column IDs,
+# best first, padded with -1; relevance is a CSR matrix with one row per
+# user and one column per item. Users without relevant items are left out
+# of the averages.
 
-def root_mean_squared_error(y_true, y_pred):
-    """
-    Calculate Root Mean Squared Error (RMSE)
-    :param y_true: Array of true ratings
-    :param y_pred: Array of predicted ratings
-    :return: RMSE value
-    """
-    y_true = np.array(y_true)
-    y_pred = np.array(y_pred)
-    return np.sqrt(np.mean((y_true - y_pred) ** 2))
+def top_k_hits(predicted, relevant):
+    """
+    Mark which predictions are relevant, for all users at once
+    :param predicted: (n_users, k) array of predicted item IDs
+    :param relevant: (n_users, n_items) relevance matrix, CSR
+    :return: (n_users, k) boolean array
+    """
+    predicted = np.asarray(predicted, dtype=np.int64)
+    relevant = csr_matrix(relevant)
+    relevant.sum_duplicates()
+    n_users, n_items = relevant.shape
+    if predicted.shape[0] != n_users:
+        raise ValueError(
+            f"Expected {n_users} rows of predictions, got {predicted.shape[0]}.")
+    # (user, item) pairs as sorted keys user * n_items + item.
+    relevant_keys = np.repeat(
+        np.arange(n_users, dtype=np.int64) * n_items,
+        np.diff(relevant.indptr)) + relevant.indices
+    if not len(relevant_keys):
+        return np.zeros(predicted.shape, dtype=bool)
+    valid = (predicted >= 0) & (predicted < n_items)
+    keys = np.arange(n_users, dtype=np.int64)[:, None] * n_items + predicted
+    positions = np.searchsorted(relevant_keys, keys)
+    positions[positions == len(relevant_keys)] = 0
+    return valid & (relevant_keys[positions] == keys)
 
-def precision_at_k(y_true, y_pred, k):
-    """
-    Calculate Precision at K
-    :param y_true: Array of true item IDs
-    :param y_pred: Array of predicted item IDs
-    :param k: Number of top recommendations to consider
-    :return: Precision at K value
-    """
-    y_true = np.array(y_true)
-    y_pred = np.array(y_pred)[:k]
-    return len(set(y_true) & set(y_pred)) / float(k)
+def ranking_metrics(predicted, relevant, k=None):
+    """
+    Calculate per-user ranking metrics in one vectorized pass
+    :param predicted: (n_users, k) array of predicted item IDs
+    :param relevant: (n_users, n_items) relevance matrix, CSR
+    :param k: Number of top recommendations to consider (default: all columns)
+    :return: Dict of per-user arrays: precision, recall, ndcg,
+        reciprocal_rank, and evaluated (users with relevant items)
+    """
+    predicted = np.asarray(predicted, dtype=np.int64)
+    if k is not None:
+        predicted = predicted[:, :k]
+    k = predicted.shape[1]
+    hits = top_k_hits(predicted, relevant)
+    n_relevant = np.diff(csr_matrix(relevant).indptr)
+    evaluated = n_relevant > 0
+    hit_counts = hits.sum(axis=1)
 
-def recall_at_k(y_true, y_pred, k):
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    dcg = hits @ discounts
+    ideal = np.concatenate(([0.0], np.cumsum(discounts)))[
+        np.minimum(n_relevant, k)]
+    first_hit = hits.argmax(axis=1)
+    return {
+        'precision': hit_counts / float(k) if k else np.zeros(len(hits)),
+        'recall': np.divide(hit_counts, n_relevant,
+                            out=np.zeros(len(hits)), where=evaluated),
+        'ndcg': np.divide(dcg, ideal, out=np.zeros(len(hits)),
+                          where=ideal > 0),
+        'reciprocal_rank': np.where(hits.any(axis=1),
+                                    1.0 / (first_hit + 1), 0.0),
+        'evaluated': evaluated,
+    }
+
+class MetricsAccumulator:
     """
-    Calculate Recall at K
-    :param y_true: Array of true item IDs
-    :param y_pred: Array of predicted item IDs
+    Streaming ranking metrics: feed predictions chunk by chunk with update()
+    and read the averages with result(). Memory is constant in the number of
+    users (sums plus a bitmap of recommended items); accumulators of
+    different chunks or worker processes combine with merge().
+    :param n_items: Number of items (columns of the relevance matrices)
     :param k: Number of top recommendations to consider
-    :return: Recall at K value
     """
-    y_true = np.array(y_true)
-    y_pred = np.array(y_pred)[:k]
-    return len(set(y_true) & set(y_pred)) / float(len(y_true))
\ No newline at end of file
+
+    METRICS = ('precision', 'recall', 'ndcg', 'reciprocal_rank')
+
+    def __init__(self, n_items, k):
+        self.n_items = n_items
+        self.k = k
+        self.users = 0
+        self.sums = dict.fromkeys(self.METRICS, 0.0)
+        self.recommended = np.zeros(n_items, dtype=bool)
+
+    def update(self, predicted, relevant):
+        """
+        Add a chunk of users
+        :param predicted: (n_users, k) array of predicted item IDs
+        :param relevant: (n_users, n_items) relevance matrix, CSR
+        :return: The chunk's per-user metrics (see ranking_metrics)
+        """
+        predicted = np.asarray(predicted, dtype=np.int64)[:, :self.k]
+        metrics = ranking_metrics(predicted, relevant)
+        evaluated = metrics['evaluated']
+        self.users += int(evaluated.sum())
+        for name in self.METRICS:
+            self.sums[name] += float(metrics[name][evaluated].sum())
+        items = predicted.ravel()
+        self.recommended[items[(items >= 0) & (items < self.n_items)]] = True
+        return metrics
+
+    def merge(self, other):
+        """
+        Add the users of another accumulator
+        :param other: MetricsAccumulator over the same items and k
+        :return: self
+        """
+        if (other.n_items, other.k) != (self.n_items, self.k):
+            raise ValueError("Cannot merge accumulators of different shapes.")
+        self.users += other.users
+        for name in self.METRICS:
+            self.sums[name] += other.sums[name]
+        self.recommended |= other.recommended
+        return self
+
+    def result(self):
+        """
+        Calculate the aggregate metrics
+        :return: Dict with the mean precision, recall, ndcg and MRR over the
+            evaluated users, the share of items recommended to any user
+            (coverage) and the number of evaluated users
+        """
+        means = {name: self.sums[name] / self.users if self.users else 0.0
+                 for name in self.METRICS}
+        return {
+            'precision': means['precision'],
+            'recall': means['recall'],
+            'ndcg': means['ndcg'],
+            'mrr': means['reciprocal_rank'],
+            'coverage': float(self.recommended.sum()) / self.n_items
+            if self.n_items else 0.0,
+            'users': self.users,
+        }
+
+def evaluate_rankings(predicted, relevant, k=None):
+    """
+    Calculate per-user and aggregate ranking metrics for a batch of users
+    :param predicted: (n_users, k) array of predicted item IDs
+    :param relevant: (n_users, n_items) relevance matrix, CSR
+    :param k: Number of top recommendations to consider (default: all columns)
+    :return: Tuple of the per-user metrics (see ranking_metrics) and the
+        aggregate metrics (see MetricsAccumulator.result)
+    """
+    predicted = np.asarray(predicted, dtype=np.int64)
+    accumulator = MetricsAccumulator(
+        csr_matrix(relevant).shape[1], k or predicted.shape[1])
+    per_user = accumulator.update(predicted, relevant)
+    return per_user, accumulator.result()
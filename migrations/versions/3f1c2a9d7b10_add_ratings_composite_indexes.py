@@ -0,0 +1,41 @@
+"""Add composite indexes on ratings
+
+(user_id, movie_id) serves the /rate upsert lookup and per-user rating
+queries; (movie_id, rating) covers per-movie averages and counts.
+
+On Postgres the indexes are built CONCURRENTLY so the ratings table stays
+writable while they are created.
+
+Revision ID: 3f1c2a9d7b10
+Revises:
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d7b10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+INDEXES = (
+    ('ix_ratings_user_id_movie_id', ['user_id', 'movie_id']),
+    ('ix_ratings_movie_id_rating', ['movie_id', 'rating']),
+)
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for name, columns in INDEXES:
+            op.create_index(name, 'ratings', columns, unique=False,
+                            schema='public', postgresql_concurrently=True,
+                            if_not_exists=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, _ in INDEXES:
+            op.drop_index(name, table_name='ratings', schema='public',
+                          postgresql_concurrently=True, if_exists=True)
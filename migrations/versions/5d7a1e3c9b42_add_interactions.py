@@ -0,0 +1,40 @@
+"""Add interactions table
+
+Implicit feedback (views, clicks, likes, dislikes) counted per user, movie
+and kind, for the implicit-feedback model (IMPLICIT_FEEDBACK).
+
+Revision ID: 5d7a1e3c9b42
+Revises: 8b4e6d2f9a31
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d7a1e3c9b42'
+down_revision = '8b4e6d2f9a31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'interactions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('movie_id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=16), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('last_interacted_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['movie_id'], ['public.movies.movie_id']),
+        sa.ForeignKeyConstraint(['user_id'], ['public.users.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'movie_id', 'kind',
+                            name='uq_interactions_user_movie_kind'),
+        schema='public')
+
+
+def downgrade():
+    op.drop_table('interactions', schema='public')
@@ -0,0 +1,57 @@
+"""Add movie_stats table
+
+Per-movie rating count, sum, sum of squares, mean, Bayesian mean and
+last-rated time. The table is filled from the ratings table here and
+can be recomputed with ``python -m cli.main rebuild-movie-stats``; model
+loads only read it.
+
+Revision ID: 8b4e6d2f9a31
+Revises: 3f1c2a9d7b10
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b4e6d2f9a31'
+down_revision = '3f1c2a9d7b10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'movie_stats',
+        sa.Column('movie_id', sa.Integer(), nullable=False),
+        sa.Column('rating_count', sa.Integer(), nullable=False),
+        sa.Column('rating_sum', sa.Float(), nullable=False),
+        sa.Column('rating_sum_squares', sa.Float(), nullable=False),
+        sa.Column('mean_rating', sa.Float(), nullable=True),
+        sa.Column('bayesian_mean', sa.Float(), nullable=True),
+        sa.Column('last_rated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['movie_id'], ['public.movies.movie_id']),
+        sa.PrimaryKeyConstraint('movie_id'),
+        schema='public')
+    op.create_index('ix_public_movie_stats_bayesian_mean', 'movie_stats',
+                    ['bayesian_mean'], unique=False, schema='public')
+    # 10 is recommendation_engine.movie_stats.DEFAULT_PRIOR_WEIGHT.
+    op.execute("""
+        INSERT INTO public.movie_stats
+            (movie_id, rating_count, rating_sum, rating_sum_squares,
+             mean_rating, bayesian_mean, last_rated_at)
+        SELECT r.movie_id, count(*), sum(r.rating), sum(r.rating * r.rating),
+               avg(r.rating),
+               (10 * g.mean + sum(r.rating)) / (10 + count(*)),
+               max(r.timestamp)
+        FROM public.ratings r
+        CROSS JOIN (SELECT avg(rating) AS mean FROM public.ratings) g
+        GROUP BY r.movie_id, g.mean
+    """)
+
+
+def downgrade():
+    op.drop_index('ix_public_movie_stats_bayesian_mean',
+                  table_name='movie_stats', schema='public')
+    op.drop_table('movie_stats', schema='public')
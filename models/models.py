@@ -1,25 +1,85 @@
 import logging
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, func
+import os
+from datetime import datetime, timezone
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, bindparam, func, select, update
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import relationship
 from api.database import db
 from flask_login import UserMixin
-import numpy as np
-from recommendation_engine.collaborative_filtering import UserBasedCF
-import scipy.sparse as sparse
+from recommendation_engine.profiling import PROFILER
+
+
+@PROFILER.profiled("initialize_model")
+def initialize_model(compact=None, time_decay=None, shards=None,
+                     implicit=None):
+    """
+    Build and fit the recommendation model from the ratings table.
+
+    The unsharded model fits in block mode on MODEL_FIT_JOBS threads (-1:
+    one per CPU) and within MODEL_FIT_MEMORY_MB megabytes when either
+    environment variable is set.
+
+    Args:
+        compact (bool, optional): Store the ratings as float32 with int32
+        indices and keep the ID maps as sorted arrays (IdIndex) instead of
+        dicts and sets. Defaults to the COMPACT_MODEL environment variable.
+        time_decay (bool, optional): Weight ratings by their age, with a
+        half-life of RATING_DECAY_HALF_LIFE_DAYS days (default: 365),
+        re-aged every RATING_DECAY_REFRESH_INTERVAL seconds (default: 3600).
+        Defaults to the RATING_TIME_DECAY environment variable.
+        shards (int, optional): Partition the users across this many worker
+        processes (ShardedUserCF) when greater than 1; each query then pays
+        for IPC to every shard, so this needs a free core per shard to be
+        faster. Defaults to the MODEL_SHARDS environment variable, or 1.
+        implicit (bool, optional): Build the implicit-feedback model instead
+        (see initialize_implicit_model). Defaults to the IMPLICIT_FEEDBACK
+        environment variable.
+
+    Returns:
+        tuple: The fitted UserBasedCF (or None) and the IDs of users that
+        have ratings.
+    """
+    # The numeric stack is only needed when a model is built, so it is not
+    # imported with the ORM models.
+    import numpy as np
+    from recommendation_engine.collaborative_filtering import UserBasedCF
+    from recommendation_engine.compact import IdIndex, build_ratings_matrix
+    from recommendation_engine.movie_stats import MovieStatistics
+    from recommendation_engine.sharding import ShardedUserCF
+    from recommendation_engine.time_decay import DAY, TimeDecay
+
+    if compact is None:
+        compact = os.getenv("COMPACT_MODEL") == 'True'
+    if implicit is None:
+        implicit = os.getenv("IMPLICIT_FEEDBACK") == 'True'
+    if implicit:
+        return initialize_implicit_model(compact)
+    if time_decay is None:
+        time_decay = os.getenv("RATING_TIME_DECAY") == 'True'
+    if shards is None:
+        shards = int(os.getenv("MODEL_SHARDS", "1"))
+    if shards > (os.cpu_count() or 1):
+        logging.warning(
+            f"{shards} model shards on {os.cpu_count()} CPUs: the shards "
+            f"share cores and score slower than fewer shards would.")
+    if shards > 1 and time_decay:
+        logging.warning(
+            "Time decay is not supported by the sharded model; ignoring it.")
+        time_decay = False
 
-
-def initialize_model():
     logging.basicConfig(level=logging.DEBUG)
     model = None
     known_user_ids = set()
 
     try:
         # Fetch all registered users from the database
-        all_users = db.session.query(User).all()
-        all_user_ids = [user.id for user in all_users]
+        all_user_ids = [row[0] for row in db.session.query(User.id).all()]
 
-        # Fetch all ratings from the database
-        ratings = db.session.query(Rating).all()
+        # Fetch all ratings as plain tuples rather than ORM objects
+        columns = [Rating.user_id, Rating.movie_id, Rating.rating]
+        if time_decay:
+            columns.append(Rating.timestamp)
+        ratings = db.session.query(*columns).order_by(Rating.id).all()
         logging.debug(f"Fetched {len(ratings)} ratings from the database.")
 
         if not ratings:
@@ -27,47 +87,74 @@ def initialize_model():
                 "Warning: No ratings found. The model will not be able to make predictions.")
             return None, None
 
-        user_ids = [rating.user_id for rating in ratings]
-        movie_ids = [rating.movie_id for rating in ratings]
-
-        known_user_ids.update(user_ids)
+        user_ids = np.fromiter((r[0] for r in ratings), dtype=np.int64,
+                               count=len(ratings))
+        movie_ids = np.fromiter((r[1] for r in ratings), dtype=np.int64,
+                                count=len(ratings))
+        values = np.fromiter((r[2] for r in ratings), dtype=np.float64,
+                             count=len(ratings))
 
-        unique_user_ids = list(set(all_user_ids))
-        unique_movie_ids = list(set(movie_ids))
+        # Sorted ID arrays; a user's row is the rank of their ID
+        user_lookup = IdIndex(all_user_ids)
+        movie_lookup = IdIndex(movie_ids)
 
         logging.debug(
-            f"Unique user IDs: {len(unique_user_ids)}, Unique movie IDs: {len(unique_movie_ids)}")
-
-        # Create mappings for user IDs and movie IDs
-        user_index = {
-            user_id: idx for idx,
-            user_id in enumerate(unique_user_ids)}
-        movie_index = {movie_id: idx for idx,
-                       movie_id in enumerate(unique_movie_ids)}
-
-        # Create a sparse matrix for ratings
-        rating_matrix = sparse.lil_matrix(
-            (len(unique_user_ids), len(unique_movie_ids)))
-        logging.debug(f"Rating matrix shape: {rating_matrix.shape}")
-
-        for rating in ratings:
-            user_idx = user_index.get(rating.user_id)
-            movie_idx = movie_index.get(rating.movie_id)
+            f"Unique user IDs: {len(user_lookup)}, Unique movie IDs: {len(movie_lookup)}")
 
-            if user_idx is None or movie_idx is None:
-                logging.warning(
-                    f"Invalid user_id {rating.user_id} or movie_id {rating.movie_id} found in ratings. Skipping this entry.")
-                continue
-
-            rating_matrix[user_idx, movie_idx] = rating.rating
+        rows = user_lookup.positions(user_ids)
+        cols = movie_lookup.positions(movie_ids)
+        valid = rows >= 0
+        if not valid.all():
+            logging.warning(
+                f"Skipping {int((~valid).sum())} ratings with unknown user IDs.")
 
-        logging.debug("Rating matrix populated")
-        # Convert the space matrix to a CSR (Compressed Sparse Row) matrix for
-        # efficient storage and computation
-        rating_matrix = rating_matrix.tocsr()
+        rating_matrix = build_ratings_matrix(
+            rows[valid], cols[valid], values[valid],
+            shape=(len(user_lookup), len(movie_lookup)),
+            dtype=np.float32 if compact else np.float64)
+        logging.debug(f"Rating matrix shape: {rating_matrix.shape}")
 
-        model = UserBasedCF(rating_matrix, user_index, movie_index)
-        logging.debug(f"UserBasedCF model instance created: {model}")
+        if compact:
+            user_index, movie_index = user_lookup, movie_lookup
+            known_user_ids = IdIndex(user_ids[valid])
+        else:
+            user_index = dict(user_lookup.items())
+            movie_index = dict(movie_lookup.items())
+            known_user_ids = set(user_ids[valid].tolist())
+
+        if shards > 1:
+            model = ShardedUserCF(rating_matrix, user_index, movie_index,
+                                  shards=shards)
+        else:
+            fit_jobs = os.getenv("MODEL_FIT_JOBS")
+            fit_memory = os.getenv("MODEL_FIT_MEMORY_MB")
+            model = UserBasedCF(
+                rating_matrix, user_index, movie_index,
+                n_jobs=int(fit_jobs) if fit_jobs else None,
+                fit_memory_limit=int(float(fit_memory) * 1024 * 1024)
+                if fit_memory else None)
+        logging.debug(f"{type(model).__name__} model instance created: {model}")
+
+        if time_decay:
+            timestamps = np.array([r[3] for r in ratings],
+                                  dtype='datetime64[us]')
+            seconds = np.where(np.isnat(timestamps), np.nan,
+                               timestamps.astype(np.int64) / 1e6)
+            # Same positions as the ratings, so the CSR data arrays align.
+            seconds = build_ratings_matrix(
+                rows[valid], cols[valid], seconds[valid],
+                shape=rating_matrix.shape).data
+            model.time_decay = TimeDecay(
+                rating_matrix, seconds,
+                half_life=DAY * float(
+                    os.getenv("RATING_DECAY_HALF_LIFE_DAYS", "365")),
+                refresh_interval=float(
+                    os.getenv("RATING_DECAY_REFRESH_INTERVAL", "3600")))
+
+        model.movie_stats = load_movie_stats_or_none()
+        if model.movie_stats is None:
+            model.movie_stats = MovieStatistics.from_ratings(
+                movie_ids[valid], values[valid])
 
         logging.debug("Starting to fit the UserBasedCF model")
         model.fit()
@@ -82,6 +169,313 @@ def initialize_model():
     return model, known_user_ids
 
 
+@PROFILER.profiled("initialize_implicit_model")
+def initialize_implicit_model(compact=False):
+    """
+    Build and fit the implicit-feedback model (ImplicitALS) from the
+    interactions and ratings tables.
+
+    Each interaction counts INTERACTION_WEIGHTS[kind] times its count and
+    each rating its distance from NEUTRAL_RATING, so dislikes and low
+    ratings are negative feedback. The factorization is configured with
+    the IMPLICIT_FACTORS (default: 64), IMPLICIT_ALPHA (default: 10) and
+    IMPLICIT_ITERATIONS (default: 15) environment variables.
+
+    Args:
+        compact (bool, optional): Keep the ID maps as sorted arrays
+        (IdIndex) instead of dicts and sets.
+
+    Returns:
+        tuple: The fitted ImplicitALS (or None) and the IDs of users that
+        have interactions or ratings.
+    """
+    import numpy as np
+    from recommendation_engine.compact import IdIndex
+    from recommendation_engine.implicit import (
+        ImplicitALS, interaction_matrix, rating_strengths)
+    from recommendation_engine.movie_stats import MovieStatistics
+
+    model = None
+    known_user_ids = set()
+    try:
+        all_user_ids = [row[0] for row in db.session.query(User.id).all()]
+        ratings = db.session.query(
+            Rating.user_id, Rating.movie_id, Rating.rating).all()
+        interactions = [
+            (user_id, movie_id, INTERACTION_WEIGHTS[kind] * count)
+            for user_id, movie_id, kind, count in db.session.query(
+                Interaction.user_id, Interaction.movie_id, Interaction.kind,
+                Interaction.count)
+            if kind in INTERACTION_WEIGHTS]
+        logging.debug(f"Fetched {len(ratings)} ratings and "
+                      f"{len(interactions)} interactions from the database.")
+        if not ratings and not interactions:
+            logging.warning(
+                "Warning: No ratings or interactions found. The model will not be able to make predictions.")
+            return None, None
+
+        events = np.array(
+            [(user_id, movie_id) for user_id, movie_id, _ in ratings]
+            + [(user_id, movie_id) for user_id, movie_id, _ in interactions],
+            dtype=np.int64).reshape(-1, 2)
+        strengths = np.concatenate((
+            rating_strengths([rating for _, _, rating in ratings]),
+            np.array([strength for _, _, strength in interactions],
+                     dtype=np.float32)))
+
+        user_lookup = IdIndex(all_user_ids)
+        movie_lookup = IdIndex(events[:, 1])
+        rows = user_lookup.positions(events[:, 0])
+        cols = movie_lookup.positions(events[:, 1])
+        valid = rows >= 0
+        matrix = interaction_matrix(
+            rows[valid], cols[valid], strengths[valid],
+            shape=(len(user_lookup), len(movie_lookup)))
+
+        if compact:
+            user_index, movie_index = user_lookup, movie_lookup
+            known_user_ids = IdIndex(events[valid, 0])
+        else:
+            user_index = dict(user_lookup.items())
+            movie_index = dict(movie_lookup.items())
+            known_user_ids = set(events[valid, 0].tolist())
+
+        model = ImplicitALS(
+            matrix, user_index, movie_index,
+            factors=int(os.getenv("IMPLICIT_FACTORS", "64")),
+            alpha=float(os.getenv("IMPLICIT_ALPHA", "10")),
+            iterations=int(os.getenv("IMPLICIT_ITERATIONS", "15")))
+        model.movie_stats = load_movie_stats_or_none()
+        if model.movie_stats is None:
+            model.movie_stats = MovieStatistics.from_ratings(
+                [movie_id for _, movie_id, _ in ratings],
+                [rating for _, _, rating in ratings])
+
+        model.fit()
+        logging.info("Implicit-feedback model initialized successfully.")
+    except Exception as e:
+        logging.error(
+            f"Exception type: {type(e).__name__}, Error message: {str(e)}")
+        model = None
+
+    return model, known_user_ids
+
+
+def _to_epoch(value):
+    # Timestamps are stored as naive UTC datetimes.
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _from_epoch(value):
+    if value is None:
+        return None
+    return datetime.fromtimestamp(value, tz=timezone.utc).replace(tzinfo=None)
+
+
+def load_movie_stats():
+    """
+    Load the movie_stats table into an in-memory MovieStatistics mirror.
+
+    Returns:
+        MovieStatistics: The statistics, or None if the table is empty.
+    """
+    import numpy as np
+    from recommendation_engine.movie_stats import MovieStatistics
+
+    rows = db.session.query(
+        MovieStats.movie_id, MovieStats.rating_count, MovieStats.rating_sum,
+        MovieStats.rating_sum_squares, MovieStats.last_rated_at).all()
+    if not rows:
+        return None
+    movie_ids, counts, sums, sum_squares, last_rated = zip(*rows)
+    return MovieStatistics(
+        movie_ids, counts, sums, sum_squares,
+        np.array([np.nan if t is None else _to_epoch(t) for t in last_rated]))
+
+
+def load_movie_stats_or_none():
+    """
+    load_movie_stats for a model load, which never writes the table: None
+    when the table is empty or unavailable, and the caller computes the
+    statistics from the ratings it fetched. Concurrent workers would race
+    on a rebuild; the table is filled by the rebuild-movie-stats command.
+    """
+    try:
+        stats = load_movie_stats()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logging.warning(
+            f"movie_stats table unavailable ({e}); computing movie statistics from the fetched ratings.")
+        return None
+    if stats is None:
+        logging.warning(
+            "movie_stats table is empty; computing movie statistics from the fetched ratings. Run `python -m cli.main rebuild-movie-stats` to fill it.")
+    return stats
+
+
+def rebuild_movie_stats():
+    """
+    Recompute the movie_stats table from the ratings table.
+
+    The aggregates are computed in one vectorized pass over the ratings and
+    the table is replaced in a single transaction.
+
+    Returns:
+        MovieStatistics: The in-memory mirror of the rebuilt table.
+    """
+    import numpy as np
+    from recommendation_engine.movie_stats import MovieStatistics
+
+    ratings = db.session.query(
+        Rating.movie_id, Rating.rating, Rating.timestamp).all()
+    movie_ids = np.fromiter((r[0] for r in ratings), dtype=np.int64,
+                            count=len(ratings))
+    values = np.fromiter((r[1] for r in ratings), dtype=np.float64,
+                         count=len(ratings))
+    timestamps = np.array([r[2] for r in ratings], dtype='datetime64[us]')
+    seconds = np.where(np.isnat(timestamps), np.nan,
+                       timestamps.astype(np.int64) / 1e6)
+    stats = MovieStatistics.from_ratings(movie_ids, values, seconds)
+
+    records = stats.records()
+    for record in records:
+        record['last_rated_at'] = _from_epoch(record['last_rated_at'])
+    db.session.query(MovieStats).delete()
+    if records:
+        db.session.bulk_insert_mappings(MovieStats, records)
+    db.session.commit()
+    logging.info(f"Rebuilt movie_stats for {len(records)} movies.")
+    return stats
+
+
+def record_movie_rating(session, movie_id, rating, previous_rating=None,
+                        rated_at=None, global_mean=None,
+                        prior_weight=None):
+    """
+    Apply one rating write to the movie_stats table.
+
+    The row is updated with relative increments, so concurrent writers do
+    not overwrite each other. The caller commits. The Bayesian mean uses
+    the given global mean (normally the in-memory mirror's); between
+    rebuilds it is exact for the updated movie only.
+
+    Args:
+        session (sqlalchemy.orm.Session): Session to write with.
+        movie_id (int): The rated movie.
+        rating (float): The new rating.
+        previous_rating (float, optional): The rating this write replaces.
+        rated_at (datetime, optional): Time of the rating (naive UTC).
+        global_mean (float, optional): Mean of all ratings; read from the
+        table when not given.
+        prior_weight (float, optional): Pseudo-count of the Bayesian mean.
+    """
+    from recommendation_engine.movie_stats import DEFAULT_PRIOR_WEIGHT
+
+    if prior_weight is None:
+        prior_weight = DEFAULT_PRIOR_WEIGHT
+    if global_mean is None:
+        totals = session.query(func.sum(MovieStats.rating_sum),
+                               func.sum(MovieStats.rating_count)).one()
+        global_mean = totals[0] / totals[1] if totals[1] else rating
+    rated_at = rated_at or datetime.utcnow()
+
+    added = 0 if previous_rating is not None else 1
+    delta = rating - (previous_rating or 0.0)
+    delta_squares = rating * rating - (previous_rating or 0.0) ** 2
+    new_sum = MovieStats.rating_sum + delta
+    new_count = MovieStats.rating_count + added
+
+    result = session.execute(
+        update(MovieStats)
+        .where(MovieStats.movie_id == movie_id)
+        .values(rating_count=new_count,
+                rating_sum=new_sum,
+                rating_sum_squares=MovieStats.rating_sum_squares + delta_squares,
+                mean_rating=new_sum / new_count,
+                bayesian_mean=(prior_weight * global_mean + new_sum)
+                / (prior_weight + new_count),
+                last_rated_at=rated_at))
+    if result.rowcount == 0:
+        session.add(MovieStats(
+            movie_id=movie_id, rating_count=1, rating_sum=rating,
+            rating_sum_squares=rating * rating, mean_rating=rating,
+            bayesian_mean=(prior_weight * global_mean + rating)
+            / (prior_weight + 1),
+            last_rated_at=rated_at))
+
+
+def record_movie_ratings(session, writes, global_mean=None, prior_weight=None):
+    """
+    Apply a batch of rating writes to the movie_stats table.
+
+    The writes are folded into one increment per movie and applied with a
+    single executemany UPDATE plus one bulk INSERT for movies without a
+    row, instead of a statement per write as record_movie_rating does. The
+    caller commits.
+
+    Args:
+        session (sqlalchemy.orm.Session): Session to write with.
+        writes (list): (movie_id, rating, previous_rating, rated_at) tuples,
+        with previous_rating None for new ratings and rated_at a naive UTC
+        datetime.
+        global_mean (float, optional): See record_movie_rating.
+        prior_weight (float, optional): See record_movie_rating.
+    """
+    from recommendation_engine.movie_stats import DEFAULT_PRIOR_WEIGHT
+
+    if not writes:
+        return
+    if prior_weight is None:
+        prior_weight = DEFAULT_PRIOR_WEIGHT
+    if global_mean is None:
+        totals = session.query(func.sum(MovieStats.rating_sum),
+                               func.sum(MovieStats.rating_count)).one()
+        global_mean = totals[0] / totals[1] if totals[1] else writes[0][1]
+
+    increments = {}
+    for movie_id, rating, previous_rating, rated_at in writes:
+        added, delta, delta_squares, last = increments.get(
+            movie_id, (0, 0.0, 0.0, rated_at))
+        increments[movie_id] = (
+            added + (previous_rating is None),
+            delta + rating - (previous_rating or 0.0),
+            delta_squares + rating * rating - (previous_rating or 0.0) ** 2,
+            max(last, rated_at))
+    existing = set(session.scalars(select(MovieStats.movie_id).where(
+        MovieStats.movie_id.in_(increments))))
+
+    table = MovieStats.__table__
+    new_sum = table.c.rating_sum + bindparam('delta')
+    new_count = table.c.rating_count + bindparam('added')
+    updates = [{'b_movie_id': movie_id, 'added': added, 'delta': delta,
+                'delta_squares': delta_squares, 'rated_at': rated_at}
+               for movie_id, (added, delta, delta_squares, rated_at)
+               in increments.items() if movie_id in existing]
+    if updates:
+        session.execute(
+            update(table)
+            .where(table.c.movie_id == bindparam('b_movie_id'))
+            .values(rating_count=new_count,
+                    rating_sum=new_sum,
+                    rating_sum_squares=table.c.rating_sum_squares
+                    + bindparam('delta_squares'),
+                    mean_rating=new_sum / new_count,
+                    bayesian_mean=(prior_weight * global_mean + new_sum)
+                    / (prior_weight + new_count),
+                    last_rated_at=bindparam('rated_at')),
+            updates)
+    inserts = [{'movie_id': movie_id, 'rating_count': added,
+                'rating_sum': delta, 'rating_sum_squares': delta_squares,
+                'mean_rating': delta / added if added else None,
+                'bayesian_mean': (prior_weight * global_mean + delta)
+                / (prior_weight + added),
+                'last_rated_at': rated_at}
+               for movie_id, (added, delta, delta_squares, rated_at)
+               in increments.items() if movie_id not in existing]
+    if inserts:
+        session.execute(table.insert(), inserts)
+
+
 class Movie(db.Model):
     __tablename__ = 'movies'
     __table_args__ = {'schema': 'public'}
@@ -125,7 +519,13 @@ class Tag(db.Model):
 
 class Rating(db.Model):
     __tablename__ = 'ratings'
-    __table_args__ = {'schema': 'public'}
+    __table_args__ = (
+        # Per-user lookups (the /rate upsert, a user's rated movies) and
+        # per-movie aggregates over ratings.
+        db.Index('ix_ratings_user_id_movie_id', 'user_id', 'movie_id'),
+        db.Index('ix_ratings_movie_id_rating', 'movie_id', 'rating'),
+        {'schema': 'public'}
+    )
 
     id = db.Column(Integer, primary_key=True)
     user_id = db.Column(Integer, ForeignKey('public.users.id'), nullable=False)
@@ -142,6 +542,55 @@ class Rating(db.Model):
     user = relationship('User', back_populates='ratings')
 
 
+# Signed strength of one implicit interaction of each kind; negative kinds
+# are negative feedback.
+INTERACTION_WEIGHTS = {'view': 1.0, 'click': 2.0, 'like': 4.0,
+                       'dislike': -4.0}
+
+
+class Interaction(db.Model):
+    """
+    Implicit feedback: how often a user interacted with a movie in a given
+    way (see INTERACTION_WEIGHTS).
+    """
+    __tablename__ = 'interactions'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'movie_id', 'kind',
+                            name='uq_interactions_user_movie_kind'),
+        {'schema': 'public'}
+    )
+
+    id = db.Column(Integer, primary_key=True)
+    user_id = db.Column(Integer, ForeignKey('public.users.id'), nullable=False)
+    movie_id = db.Column(
+        Integer,
+        ForeignKey('public.movies.movie_id'),
+        nullable=False)
+    kind = db.Column(String(16), nullable=False)
+    count = db.Column(Integer, nullable=False, default=1)
+    last_interacted_at = db.Column(DateTime, default=func.now())
+
+
+class MovieStats(db.Model):
+    """
+    Precomputed rating aggregates per movie, maintained incrementally on
+    every rating write and rebuilt by rebuild_movie_stats().
+    """
+    __tablename__ = 'movie_stats'
+    __table_args__ = {'schema': 'public'}
+
+    movie_id = db.Column(
+        Integer,
+        ForeignKey('public.movies.movie_id'),
+        primary_key=True)
+    rating_count = db.Column(Integer, nullable=False, default=0)
+    rating_sum = db.Column(Float, nullable=False, default=0.0)
+    rating_sum_squares = db.Column(Float, nullable=False, default=0.0)
+    mean_rating = db.Column(Float, nullable=True)
+    bayesian_mean = db.Column(Float, nullable=True, index=True)
+    last_rated_at = db.Column(DateTime, nullable=True)
+
+
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
     __table_args__ = (
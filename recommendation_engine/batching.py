@@ -0,0 +1,124 @@
+"""
+This module batches concurrent single-pair predictions in front of a
+UserBasedCF model.
+
+Each caller submits one (user, movie) pair and gets a future. A worker
+thread collects the pairs that arrive within ``max_wait`` seconds of the
+first one, up to ``max_batch_size``, scores them with one
+``UserBasedCF.predict_pairs`` call (one neighbour query over the stacked
+user rows and one vectorized scoring pass) and resolves the futures. A
+lone request therefore waits at most ``max_wait`` longer than it would
+unbatched, while concurrent requests share the cost of a single pass.
+
+Example:
+    >>> batcher = MicroBatcher(max_batch_size=64, max_wait=0.002)
+    >>> batcher.predict(model, user_id, movie_id)
+    >>> future = batcher.submit(model, user_id, movie_id)
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from recommendation_engine.instrumentation import count, timer
+
+
+class MicroBatcher:
+    """
+    Collects single-pair predictions from many threads and scores them
+    together.
+
+    Attributes:
+        max_batch_size (int): Maximum number of pairs scored together.
+        max_wait (float): Seconds to wait for more pairs once the first
+        pair of a batch has arrived.
+    """
+
+    def __init__(self, max_batch_size=64, max_wait=0.002):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_batch_size = app.config.get(
+            'PREDICT_BATCH_MAX_SIZE') or self.max_batch_size
+        max_wait_ms = app.config.get('PREDICT_BATCH_MAX_WAIT_MS')
+        if max_wait_ms is not None:
+            self.max_wait = max_wait_ms / 1000
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="predict-batcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, model, user_id, movie_id):
+        """
+        Queue a prediction.
+
+        Args:
+            model (UserBasedCF): The model to score with. Pairs for
+            different models are scored separately.
+            user_id (int): ID of the user.
+            movie_id (int): ID of the movie.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the predicted rating (a
+            float, NaN if prediction is not possible).
+        """
+        if self._thread is None:
+            self._start()
+        future = Future()
+        self._queue.put((model, user_id, movie_id, future))
+        return future
+
+    def predict(self, model, user_id, movie_id, timeout=None):
+        """
+        Queue a prediction and wait for it.
+        """
+        return self.submit(model, user_id, movie_id).result(timeout)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            count("predict_batches_total")
+            count("predict_batched_requests_total", len(batch))
+            by_model = {}
+            for item in batch:
+                by_model.setdefault(id(item[0]), []).append(item)
+            for items in by_model.values():
+                self._score(items)
+
+    def _score(self, items):
+        model = items[0][0]
+        try:
+            with timer("predict_batch"):
+                predictions = model.predict_pairs(
+                    [user_id for _, user_id, _, _ in items],
+                    [movie_id for _, _, movie_id, _ in items])
+        except Exception as e:
+            logging.error(f"Batched prediction of {len(items)} pairs failed: {e}")
+            for *_, future in items:
+                future.set_exception(e)
+            return
+        for (*_, future), prediction in zip(items, predictions.tolist()):
+            future.set_result(prediction)
@@ -0,0 +1,130 @@
+"""
+This module recommends movies to users the kNN model cannot serve yet:
+users who joined after the model was fitted and users with only a few
+ratings.
+
+Instead of refitting the model, a new user's seed ratings (from
+onboarding) are folded in through the item-neighbour table of a
+RecommendationPipeline. Each seed spreads its rating's deviation from the
+global mean to its most similar movies. A candidate's estimate is its
+popularity (Bayesian mean rating) plus the similarity-weighted average
+deviation of the seeds that reach it, damped by ``prior_weight`` so one
+weak neighbour moves it little. Movies of the user's onboarding genres
+get a bonus, and the genres' precomputed popular lists are the backstop
+when there are no seeds.
+
+The work depends on the number of seeds and the table sizes, not on the
+number of users or movies, and the model is never modified.
+
+Example:
+    >>> cold_start = ColdStartRecommender(pipeline)
+    >>> movie_ids, estimates = cold_start.recommend(
+    ...     {1: 5.0, 32: 4.0}, ["Comedy", "Drama"], 10)
+"""
+
+import numpy as np
+
+from recommendation_engine.instrumentation import timer
+
+DEFAULT_MIN_RATINGS = 5
+
+
+def needs_cold_start(model, user_id, min_ratings=DEFAULT_MIN_RATINGS):
+    """
+    Whether a user has fewer than ``min_ratings`` ratings in the model.
+
+    Models without a ratings matrix (sharded, implicit-feedback, model
+    server client) report the ratings per user they were fitted on as
+    ``rating_counts``; without it only unknown users need a cold start.
+    """
+    user_idx = model.user_index.get(user_id)
+    if user_idx is None:
+        return True
+    ratings = getattr(model, 'ratings_matrix', None)
+    if ratings is None:
+        counts = getattr(model, 'rating_counts', None)
+        return counts is not None and counts[user_idx] < min_ratings
+    indptr = ratings.indptr
+    return indptr[user_idx + 1] - indptr[user_idx] < min_ratings
+
+
+class ColdStartRecommender:
+    """
+    Recommendations from seed ratings and genres, without refitting.
+
+    Args:
+        pipeline (RecommendationPipeline): Provides the item-neighbour
+        table, popularity and per-genre popular lists.
+        prior_weight (float): Similarity mass the seeds' evidence is
+        damped by.
+        genre_bonus (float): Score added to movies of the user's genres.
+        popular (int): Number of overall popular movies used when the user
+        has neither seeds nor genres.
+    """
+
+    def __init__(self, pipeline, prior_weight=1.0, genre_bonus=0.25,
+                 popular=100):
+        self.pipeline = pipeline
+        self.prior_weight = prior_weight
+        self.genre_bonus = genre_bonus
+        self.popular = popular
+
+    def recommend(self, ratings, genres, n):
+        """
+        Top n movies for a user.
+
+        Args:
+            ratings (dict): The user's ratings by movie ID.
+            genres (list): The user's preferred genres.
+            n (int): Number of recommendations.
+
+        Returns:
+            tuple: Movie IDs and estimated ratings (numpy arrays), best
+            first.
+        """
+        pipeline = self.pipeline
+        movie_index = pipeline.model.movie_index
+        with timer("cold_start"):
+            seeds, seed_ratings = [], []
+            for movie_id, rating in ratings.items():
+                column = movie_index.get(movie_id)
+                if column is not None:
+                    seeds.append(column)
+                    seed_ratings.append(rating)
+            seeds = np.array(seeds, dtype=np.int64)
+            deviations = np.array(seed_ratings, dtype=np.float64) \
+                - pipeline.global_mean
+
+            neighbors = pipeline.item_neighbors[seeds]
+            similarities = np.maximum(neighbors.data, 0.0)
+            weighted = similarities * np.repeat(
+                deviations, np.diff(neighbors.indptr))
+
+            genres = [genre for genre in genres
+                      if genre in pipeline.genre_popular]
+            backstop = [pipeline.genre_popular[genre] for genre in genres]
+            if not backstop:
+                backstop = [pipeline.by_popularity[:self.popular]]
+
+            columns, inverse = np.unique(
+                np.concatenate([neighbors.indices] + backstop),
+                return_inverse=True)
+            evidence = np.bincount(inverse[:len(weighted)], weights=weighted,
+                                   minlength=len(columns))
+            mass = np.bincount(inverse[:len(weighted)], weights=similarities,
+                               minlength=len(columns))
+            estimates = np.clip(pipeline.popularity[columns]
+                                + evidence / (mass + self.prior_weight), 1, 5)
+
+            scores = estimates + pipeline.recency_weight * \
+                pipeline.recency[columns]
+            if genres:
+                preferred = [pipeline.genres[genre] for genre in genres]
+                in_genres = np.asarray(pipeline.column_genres[columns][
+                    :, preferred].sum(axis=1)).ravel() > 0
+                scores = scores + self.genre_bonus * in_genres
+
+            keep = pipeline.in_catalogue[columns] & ~np.isin(columns, seeds)
+            columns, estimates = columns[keep], estimates[keep]
+            order = np.lexsort((columns, -scores[keep]))[:n]
+            return pipeline.column_ids[columns[order]], estimates[order]
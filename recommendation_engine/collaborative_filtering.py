@@ -18,10 +18,61 @@ Example:
 import logging
 import numpy as np
 from scipy.sparse import csr_matrix
-from sklearn.metrics.pairwise import cosine_similarity, pairwise_distances
-from sklearn.neighbors import NearestNeighbors
 import random
 from datetime import datetime
+from recommendation_engine.hybrid import (
+    HybridScorer, parse_year, recency_boosts)
+from recommendation_engine.instrumentation import count, timer, trace
+from recommendation_engine.profiling import PROFILER
+from recommendation_engine.similarity import (
+    SIMILARITY_METRICS, neighbor_table, similarity_matrix)
+
+# Metrics that scikit-learn cannot compute on sparse input without
+# densifying; for these fit() builds a top-k neighbour table instead.
+NEIGHBOR_TABLE_METRICS = tuple(
+    metric for metric in SIMILARITY_METRICS if metric != 'cosine')
+
+
+def neighbor_scores(similarity_scores, neighbor_ratings, own_ratings, k,
+                    sim_threshold, rating_weights=None):
+    """
+    Similarity-weighted mean of the neighbours' ratings of each movie.
+
+    Each movie is scored from its k most similar neighbours that rated it
+    and are more similar than sim_threshold; movies the user rated keep
+    their rating.
+
+    Args:
+        similarity_scores (numpy.ndarray): Similarity of each neighbour,
+        in decreasing order.
+        neighbor_ratings (numpy.ndarray): Neighbours x movies ratings, 0
+        where unrated.
+        own_ratings (numpy.ndarray): The user's ratings of the movies.
+        k (int): Maximum number of neighbours per movie.
+        sim_threshold (float): Minimum similarity of a valid neighbour.
+        rating_weights (numpy.ndarray, optional): Neighbours x movies
+        weights multiplying the similarities, e.g. time decay.
+
+    Returns:
+        tuple: Predicted ratings (NaN without valid neighbours) and, per
+        movie, whether it was rated by the user or a valid neighbour.
+    """
+    valid = (neighbor_ratings > 0) & (similarity_scores > sim_threshold)[:, None]
+    # Neighbours are sorted by similarity, so the k most similar valid
+    # raters of each movie are the first k valid rows of its column.
+    valid &= np.cumsum(valid, axis=0) <= k
+
+    weights = similarity_scores[:, None]
+    if rating_weights is not None:
+        weights = weights * rating_weights
+    weights = np.where(valid, weights, 0.0)
+    weight_sums = weights.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scored = np.clip(
+            (weights * neighbor_ratings).sum(axis=0) / weight_sums, 1, 5)
+    scored[weight_sums == 0] = np.nan
+    scored = np.where(own_ratings > 0, own_ratings, scored)
+    return scored, valid.any(axis=0) | (own_ratings > 0)
 
 
 class UserBasedCF:
@@ -42,6 +93,17 @@ class UserBasedCF:
         valid neighbors (default: 0.2).
         nearest_neighbors (sklearn.neighbors.NearestNeighbors): Fitted
         nearest neighbors model.
+        neighbor_table (scipy.sparse.csr_matrix): Top-k similarities per
+        user, used instead of nearest_neighbors for the metrics in
+        NEIGHBOR_TABLE_METRICS and in block fit mode.
+        n_jobs (int): Threads of the block fit mode, None to fit with
+        scikit-learn (or similarity_matrix for NEIGHBOR_TABLE_METRICS).
+        fit_memory_limit (int): Memory ceiling in bytes of the block fit
+        mode; setting it also selects the mode.
+        time_decay (TimeDecay): Age weights of the ratings, or None to
+        weight all ratings equally. With weights, similarities are computed
+        on the decayed ratings and each neighbour's rating counts with its
+        similarity times its weight; set it before fit().
     """
 
     def __init__(
@@ -51,7 +113,9 @@ class UserBasedCF:
             movie_index,
             similarity_metric='cosine',
             k=30,
-            sim_threshold=0.2):
+            sim_threshold=0.2,
+            n_jobs=None,
+            fit_memory_limit=None):
         """
         Initialize the UserBasedCF object.
 
@@ -65,12 +129,18 @@ class UserBasedCF:
             ratings matrix.
             similarity_metric (str, optional): Metric to use for computing
             user
-            similarity (default: 'cosine').
+            similarity (default: 'cosine'). Either a scikit-learn metric or
+            one of 'pearson', 'adjusted_cosine', 'jaccard' and
+            'shrunk_cosine' from recommendation_engine.similarity.
             k (int, optional): Number of nearest neighbors to consider
             (default: 30).
             sim_threshold (float, optional): Minimum similarity score threshold
             for
             valid neighbors (default: 0.2).
+            n_jobs (int, optional): Fit in block mode (neighbor_table) on
+            this many threads; -1 for one per CPU.
+            fit_memory_limit (int, optional): Memory ceiling in bytes for the
+            block mode fit.
         """
         if ratings_matrix is None:
             raise ValueError("Rating matrix cannot be None.")
@@ -81,7 +151,14 @@ class UserBasedCF:
         self.similarity_metric = similarity_metric
         self.k = k
         self.sim_threshold = sim_threshold
+        self.n_jobs = n_jobs
+        self.fit_memory_limit = fit_memory_limit
         self.nearest_neighbors = None
+        self.neighbor_table = None
+        # Per-movie rating statistics (MovieStatistics), attached by
+        # initialize_model; used for fallback ratings when available.
+        self.movie_stats = None
+        self.time_decay = None
 
     def fit(self):
         """
@@ -90,11 +167,43 @@ class UserBasedCF:
         This method converts the ratings matrix to a sparse matrix and
         computes
         the nearest neighbors for each user based on the specified similarity metric.
+        With n_jobs or fit_memory_limit set, it builds the neighbour table
+        block by block instead (see similarity.neighbor_table); a
+        MemoryError means the limit is too low for the table.
         """
         if self.ratings_matrix is None:
             logging.error("Ratings matrix is None. Cannot proceed with fit.")
             return
 
+        if self.n_jobs is not None or self.fit_memory_limit is not None:
+            self.ratings_matrix = csr_matrix(self.ratings_matrix)
+            metric = self.similarity_metric \
+                if self.similarity_metric in SIMILARITY_METRICS else 'cosine'
+            logging.debug(
+                f"Computing the top {self.k} {metric} neighbors for users "
+                f"in blocks on {self.n_jobs or 1} threads.")
+            with timer("model_fit"), PROFILER.profile("fit"):
+                self.neighbor_table = neighbor_table(
+                    self._similarity_ratings(), metric, top_k=self.k,
+                    n_jobs=self.n_jobs or 1,
+                    max_memory=self.fit_memory_limit)
+            self.nearest_neighbors = None
+            return
+
+        if self.similarity_metric in NEIGHBOR_TABLE_METRICS:
+            self.ratings_matrix = csr_matrix(self.ratings_matrix)
+            logging.debug(
+                f"Computing the top {self.k} {self.similarity_metric} neighbors for users.")
+            with timer("model_fit"), PROFILER.profile("fit"):
+                self.neighbor_table = similarity_matrix(
+                    self._similarity_ratings(), self.similarity_metric,
+                    top_k=self.k)
+            self.nearest_neighbors = None
+            return
+
+        # scikit-learn is imported on first fit to keep module import cheap.
+        from sklearn.neighbors import NearestNeighbors
+
         try:
             logging.debug(
                 "Converting the rating matrix to a sparse matrix for efficiency.")
@@ -103,7 +212,8 @@ class UserBasedCF:
             logging.debug("Computing the nearest neighbors for users.")
             self.nearest_neighbors = NearestNeighbors(
                 metric=self.similarity_metric, algorithm='auto', n_neighbors=self.k + 1)
-            self.nearest_neighbors.fit(self.ratings_matrix)
+            with timer("model_fit"), PROFILER.profile("fit"):
+                self.nearest_neighbors.fit(self._similarity_ratings())
             logging.debug("Nearest neighbors model fitted successfully.")
         except Exception as e:
             logging.error(f"Error in fit method: {e}")
@@ -130,7 +240,7 @@ class UserBasedCF:
             user_idx = self.user_index[user_id]
             movie_idx = self.movie_index[movie_id]
 
-            if self.nearest_neighbors is None:
+            if self.nearest_neighbors is None and self.neighbor_table is None:
                 logging.error(
                     "Nearest neighbors model is None. Cannot make predictions.")
                 return np.nan
@@ -139,46 +249,36 @@ class UserBasedCF:
             if user_ratings[movie_idx] > 0:
                 return user_ratings[movie_idx]
 
-            distances, indices = self.nearest_neighbors.kneighbors(
-                self.ratings_matrix[user_idx], n_neighbors=self.k + 1)
-            similarity_scores = 1 - distances.flatten()
-            indices = indices.flatten()
-
-            logging.debug(
-                f"Similarity scores for user {user_id}: {similarity_scores}")
-            logging.debug(
-                f"Indices of neighbors for user {user_id}: {indices}")
-
-            rated_users_mask = self.ratings_matrix[indices, movie_idx].toarray(
-            ).flatten() > 0
-            rated_users = indices[rated_users_mask]
+            similarity_scores, indices = self._neighbors(user_idx)
 
-            logging.debug(f"Rated users for movie {movie_id}: {rated_users}")
+            trace("predict user=%s movie=%s neighbours=%s similarities=%s",
+                  user_id, movie_id, indices, similarity_scores)
 
-            valid_users_mask = similarity_scores[rated_users_mask] > self.sim_threshold
-            valid_rated_users = rated_users[valid_users_mask]
+            neighbor_ratings = self.ratings_matrix[indices, movie_idx].toarray(
+            ).flatten()
+            valid_mask = (neighbor_ratings > 0) & (
+                similarity_scores > self.sim_threshold)
 
-            logging.debug(
-                f"Valid rated users for movie {movie_id}: {valid_rated_users}")
-
-            if len(valid_rated_users) == 0:
-                logging.debug(
-                    f"No valid rated users found for movie {movie_id} and user {user_id}")
+            if not valid_mask.any():
+                trace("predict user=%s movie=%s has no valid rated neighbours",
+                      user_id, movie_id)
                 return self.get_fallback_rating(movie_id)
 
-            top_k_users = valid_rated_users[np.argsort(
-                -similarity_scores[rated_users_mask][valid_users_mask])[:self.k]]
-            ratings = self.ratings_matrix[top_k_users,
-                                          movie_idx].toarray().flatten()
-            sim_scores = similarity_scores[top_k_users]
+            order = np.argsort(-similarity_scores[valid_mask])[:self.k]
+            top_k_users = indices[valid_mask][order]
+            ratings = neighbor_ratings[valid_mask][order]
+            sim_scores = similarity_scores[valid_mask][order]
+            rating_weights = self._rating_weights(indices, [movie_idx])
+            if rating_weights is not None:
+                sim_scores = sim_scores * rating_weights.ravel()[
+                    valid_mask][order]
 
-            logging.debug(f"Top K users: {top_k_users}")
-            logging.debug(f"Ratings from top K users: {ratings}")
-            logging.debug(f"Similarity scores of top K users: {sim_scores}")
+            trace("predict user=%s movie=%s top_k=%s ratings=%s similarities=%s",
+                  user_id, movie_id, top_k_users, ratings, sim_scores)
 
             if sim_scores.sum() == 0:
-                logging.debug(
-                    f"Sum of similarity scores is zero for user {user_id} and movie {movie_id}")
+                trace("predict user=%s movie=%s similarity sum is zero",
+                      user_id, movie_id)
                 return np.nan
 
             prediction = np.dot(sim_scores, ratings) / sim_scores.sum()
@@ -188,6 +288,243 @@ class UserBasedCF:
                 f"Error predicting rating for user {user_id} and movie {movie_id}: {e}")
             return self.get_fallback_rating(movie_id)
 
+    def predict_many(self, user_id, movie_ids) -> np.ndarray:
+        """
+        Predict the ratings of one user for many movies in a single pass.
+
+        The user's neighbours are looked up once and the neighbours' ratings
+        for all movies are scored together, which gives the same results as
+        calling predict() for every movie.
+
+        Args:
+            user_id (int): ID of the user.
+            movie_ids (list): IDs of the movies.
+
+        Returns:
+            numpy.ndarray: Predicted ratings, NaN where prediction is not
+            possible.
+        """
+        return self.predict_batch([user_id], [movie_ids])[0]
+
+    def predict_batch(self, user_ids, movie_id_lists) -> list:
+        """
+        Predict ratings for several users at once.
+
+        The neighbours of all users are looked up together, with a single
+        kneighbors call over the stacked user rows when the model uses a
+        scikit-learn index, and each user's movies are then scored as in
+        predict_many().
+
+        Args:
+            user_ids (list): IDs of the users.
+            movie_id_lists (list): For each user, the IDs of the movies to
+            score.
+
+        Returns:
+            list: One numpy.ndarray of predicted ratings per user.
+        """
+        results = [None] * len(user_ids)
+        pending = []
+        for position, (user_id, movie_ids) in enumerate(
+                zip(user_ids, movie_id_lists)):
+            movie_ids = np.asarray(movie_ids)
+            if len(movie_ids) == 0:
+                results[position] = np.full(0, np.nan)
+            elif user_id not in self.user_index:
+                results[position] = np.array(
+                    [self.get_fallback_rating(movie_id)
+                     for movie_id in movie_ids])
+            elif self.nearest_neighbors is None and self.neighbor_table is None:
+                logging.error(
+                    "Nearest neighbors model is None. Cannot make predictions.")
+                results[position] = np.full(len(movie_ids), np.nan)
+            else:
+                pending.append((position, self.user_index[user_id], movie_ids))
+
+        if pending:
+            neighbors = self._neighbors_batch(
+                [user_idx for _, user_idx, _ in pending])
+            for (position, user_idx, movie_ids), (similarity_scores, indices) \
+                    in zip(pending, neighbors):
+                results[position] = self._score(
+                    user_idx, movie_ids, similarity_scores, indices)
+        return results
+
+    def predict_pairs(self, user_ids, movie_ids) -> np.ndarray:
+        """
+        Predict the ratings of many (user, movie) pairs in one pass.
+
+        Gives the same results as calling predict() for every pair, but the
+        neighbours of all distinct users are looked up in one query and all
+        pairs are scored together with array operations.
+
+        Args:
+            user_ids (list): ID of the user of each pair.
+            movie_ids (list): ID of the movie of each pair.
+
+        Returns:
+            numpy.ndarray: Predicted ratings, NaN where prediction is not
+            possible.
+        """
+        predictions = np.full(len(user_ids), np.nan)
+        needs_fallback = np.array(
+            [user_id not in self.user_index or movie_id not in self.movie_index
+             for user_id, movie_id in zip(user_ids, movie_ids)], dtype=bool)
+        pairs = np.flatnonzero(~needs_fallback)
+        if len(pairs) and self.nearest_neighbors is None \
+                and self.neighbor_table is None:
+            logging.error(
+                "Nearest neighbors model is None. Cannot make predictions.")
+            pairs = pairs[:0]
+
+        if len(pairs):
+            rows = np.array([self.user_index[user_ids[p]] for p in pairs],
+                            dtype=np.int64)
+            columns = np.array([self.movie_index[movie_ids[p]] for p in pairs],
+                               dtype=np.int64)
+
+            # Pairs the user has rated already keep their rating.
+            own_ratings = np.asarray(self.ratings_matrix[rows, columns]).ravel()
+            rated = own_ratings > 0
+            predictions[pairs[rated]] = own_ratings[rated]
+            pairs, rows, columns = pairs[~rated], rows[~rated], columns[~rated]
+
+        if len(pairs):
+            scored, has_neighbors = self._score_pairs(rows, columns)
+            predictions[pairs] = scored
+            needs_fallback[pairs] = ~has_neighbors
+
+        for position in np.flatnonzero(needs_fallback):
+            predictions[position] = self.get_fallback_rating(
+                movie_ids[position])
+        return predictions
+
+    def _score_pairs(self, rows, columns):
+        """
+        Score (user row, movie column) pairs from the users' neighbours.
+
+        Returns:
+            tuple: The predicted ratings and, per pair, whether any valid
+            neighbour rated the movie.
+        """
+        unique_rows, inverse = np.unique(rows, return_inverse=True)
+        neighbors = self._neighbors_batch(unique_rows.tolist())
+
+        # One entry per (pair, neighbour of the pair's user).
+        lengths = np.array([len(indices) for _, indices in neighbors],
+                           dtype=np.int64)[inverse]
+        entry_pair = np.repeat(np.arange(len(rows)), lengths)
+        entry_sims = np.concatenate([neighbors[u][0] for u in inverse])
+        entry_users = np.concatenate([neighbors[u][1] for u in inverse])
+        entry_columns = np.repeat(columns, lengths)
+        entry_ratings = np.asarray(self.ratings_matrix[
+            entry_users, entry_columns]).ravel()
+
+        valid = (entry_ratings > 0) & (entry_sims > self.sim_threshold)
+        entry_pair, entry_sims = entry_pair[valid], entry_sims[valid]
+        entry_ratings = entry_ratings[valid]
+        entry_weights = np.ones(len(entry_pair)) if self.time_decay is None \
+            else np.asarray(self.time_decay.weights[
+                entry_users[valid], entry_columns[valid]]).ravel()
+
+        # Keep the k most similar valid neighbours of each pair.
+        order = np.lexsort((-entry_sims, entry_pair))
+        entry_pair, entry_sims = entry_pair[order], entry_sims[order]
+        entry_ratings = entry_ratings[order]
+        entry_weights = entry_weights[order]
+        rank = np.arange(len(entry_pair)) - np.searchsorted(
+            entry_pair, entry_pair)
+        top_k = rank < self.k
+        entry_pair, entry_ratings = entry_pair[top_k], entry_ratings[top_k]
+        entry_sims = entry_sims[top_k] * entry_weights[top_k]
+
+        weight_sums = np.bincount(entry_pair, weights=entry_sims,
+                                  minlength=len(rows))
+        weighted = np.bincount(entry_pair, weights=entry_sims * entry_ratings,
+                               minlength=len(rows))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            scored = np.clip(weighted / weight_sums, 1, 5)
+        scored[weight_sums == 0] = np.nan
+        has_neighbors = np.bincount(entry_pair, minlength=len(rows)) > 0
+        return scored, has_neighbors
+
+    def _score(self, user_idx, movie_ids, similarity_scores, indices):
+        """
+        Score movies for a user from the user's neighbours.
+        """
+        predictions = np.full(len(movie_ids), np.nan)
+        known = np.array([movie_id in self.movie_index
+                          for movie_id in movie_ids], dtype=bool)
+        columns = np.array([self.movie_index[movie_id] for movie_id
+                            in movie_ids[known]], dtype=np.int64)
+
+        order = np.argsort(-similarity_scores)
+        similarity_scores, indices = similarity_scores[order], indices[order]
+
+        own_ratings = self.ratings_matrix[user_idx].toarray()[0][columns]
+        # Neighbours x candidate movies
+        neighbor_ratings = self.ratings_matrix[indices][:, columns].toarray()
+        scored, rated = neighbor_scores(
+            similarity_scores, neighbor_ratings, own_ratings, self.k,
+            self.sim_threshold, self._rating_weights(indices, columns))
+
+        predictions[known] = scored
+        has_neighbors = np.zeros(len(movie_ids), dtype=bool)
+        has_neighbors[known] = rated
+        for position in np.flatnonzero(~has_neighbors):
+            predictions[position] = self.get_fallback_rating(
+                movie_ids[position])
+        return predictions
+
+    def _similarity_ratings(self):
+        """
+        The ratings similarities are computed on: decayed by age when the
+        model has time decay weights.
+        """
+        if self.time_decay is None:
+            return self.ratings_matrix
+        return self.time_decay.weighted
+
+    def _rating_weights(self, rows, columns):
+        """
+        Time decay weights of the ratings at rows x columns (dense), None
+        without time decay.
+        """
+        if self.time_decay is None:
+            return None
+        return self.time_decay.weights[rows][:, columns].toarray()
+
+    def _neighbors(self, user_idx):
+        """
+        Look up the nearest neighbours of a user.
+
+        Args:
+            user_idx (int): Row index of the user in the ratings matrix.
+
+        Returns:
+            tuple: Similarity scores and row indices of the neighbours.
+        """
+        return self._neighbors_batch([user_idx])[0]
+
+    def _neighbors_batch(self, user_idxs):
+        """
+        Look up the nearest neighbours of several users in one query.
+
+        Args:
+            user_idxs (list): Row indices of the users in the ratings matrix.
+
+        Returns:
+            list: A (similarity scores, row indices) tuple per user.
+        """
+        with timer("knn_query"):
+            if self.neighbor_table is not None:
+                rows = [self.neighbor_table[user_idx] for user_idx in user_idxs]
+                return [(row.data.astype(np.float64), row.indices)
+                        for row in rows]
+            distances, indices = self.nearest_neighbors.kneighbors(
+                self._similarity_ratings()[user_idxs], n_neighbors=self.k + 1)
+        return list(zip(1 - distances, indices))
+
     def get_fallback_rating(self, movie_id) -> float:
         """
         Get a fallback rating for a movie when no valid neighbors are found.
@@ -196,30 +533,20 @@ class UserBasedCF:
             movie_id (int): ID of the movie.
 
         Returns:
-            float: Fallback rating for the movie, based on the movie's average rating
-            or genre-based average rating.
+            float: Fallback rating for the movie, based on the movie's
+            precomputed Bayesian mean, its average rating or a genre-based
+            average rating.
         """
+        count("fallback_ratings_total")
         try:
-            # First, try to use the average rating for the movie
-            movie_ratings = self.ratings_matrix[:,
-                                                self.movie_index[movie_id]].data
-            if len(movie_ratings) > 0:
-                base_rating = float(np.mean(movie_ratings))
+            stats = (self.movie_stats.get(movie_id)
+                     if self.movie_stats is not None else None)
+            if stats is not None:
+                # Precomputed mean, damped towards the global mean so movies
+                # with a handful of ratings do not dominate
+                base_rating = stats['bayesian_mean']
             else:
-                # If no ratings available, use genre-based average
-                movie = Movie.query.get(movie_id)
-                if movie and movie.genres:
-                    genre_ratings = Rating.query.join(Movie).filter(
-                        Movie.genres.contains(
-                            movie.genres)).with_entities(
-                        Rating.rating).all()
-                    if genre_ratings:
-                        base_rating = float(
-                            np.mean([r.rating for r in genre_ratings]))
-                    else:
-                        base_rating = 3.0  # Neutral rating if no genre data available
-                else:
-                    base_rating = 3.0  # Neutral rating if no movie or genre data
+                base_rating = self._average_or_genre_rating(movie_id)
 
             # Add some randomness, but keep the rating between 1 and 5
             return max(1.0, min(5.0, base_rating + random.uniform(-0.5, 0.5)))
@@ -229,72 +556,149 @@ class UserBasedCF:
                 f"Error in get_fallback_rating for movie {movie_id}: {str(e)}")
             return 3.0  # Return neutral rating in case of any error
 
+    def _average_or_genre_rating(self, movie_id) -> float:
+        # First, try to use the average rating for the movie
+        movie_ratings = self.ratings_matrix[:,
+                                            self.movie_index[movie_id]].data
+        if len(movie_ratings) > 0:
+            return float(np.mean(movie_ratings))
+
+        # If no ratings available, use genre-based average
+        movie = Movie.query.get(movie_id)
+        if movie and movie.genres:
+            genre_ratings = Rating.query.join(Movie).filter(
+                Movie.genres.contains(
+                    movie.genres)).with_entities(
+                Rating.rating).all()
+            if genre_ratings:
+                return float(np.mean([r.rating for r in genre_ratings]))
+            return 3.0  # Neutral rating if no genre data available
+        return 3.0  # Neutral rating if no movie or genre data
+
     def rank_recommendations(self, recommendations) -> list:
         """
         Rank a list of movie recommendations based on predicted rating and recency.
 
         Args:
-            recommendations (list): List of dictionaries containing 'movieId' and
-            'predictedRating' keys.
+            recommendations (list): List of dictionaries containing 'movieId',
+            'title' and 'predictedRating' keys. The release year is read from
+            the title, e.g. "Heat (1995)".
 
         Returns:
             list: Sorted list of recommendations, with an additional 'score' key that combines
                 the predicted rating and a recency boost for newer movies.
         """
-        current_year = datetime.now().year
-        for rec in recommendations:
-            movie = Movie.query.get(rec['movieId'])
-            if movie and movie.year:
-                years_old = current_year - movie.year
-                # Boost for movies less than 10 years old
-                recency_boost = max(0, 1 - (years_old / 10))
-                rec['score'] = rec['predictedRating'] + recency_boost
-            else:
-                rec['score'] = rec['predictedRating']
+        if not recommendations:
+            return []
+        years = [parse_year(rec.get('title')) for rec in recommendations]
+        features = {
+            "cf": np.array([rec['predictedRating']
+                            for rec in recommendations], dtype=np.float64),
+            "recency": recency_boosts(
+                np.array([np.nan if year is None else year for year in years]),
+                datetime.now().year),
+        }
+        scores = HybridScorer({"cf": 1.0, "recency": 1.0}).score(features)
+        for rec, score in zip(recommendations, scores.tolist()):
+            rec['score'] = score
+        return [recommendations[i]
+                for i in np.argsort(-scores, kind='stable')]
+
+    def set_ratings(self, user_ids, movie_ids, ratings, rated_at=None):
+        """
+        Overwrite ratings the matrix already holds, in place.
 
-        return sorted(recommendations, key=lambda x: x['score'], reverse=True)
+        Pairs without a stored rating are skipped: adding them would change
+        the matrix's structure, so they wait for the next fit (new users are
+        served by the cold-start recommender meanwhile).
+
+        Args:
+            user_ids (list): ID of the user of each rating.
+            movie_ids (list): ID of the movie of each rating.
+            ratings (list): The new ratings.
+            rated_at (list, optional): Time of each rating in seconds since
+            the epoch, for the time decay weights.
+
+        Returns:
+            int: Number of ratings overwritten.
+        """
+        matrix = self.ratings_matrix
+        updated = 0
+        for position, (user_id, movie_id, rating) in enumerate(
+                zip(user_ids, movie_ids, ratings)):
+            if user_id not in self.user_index or \
+                    movie_id not in self.movie_index:
+                continue
+            row, column = self.user_index[user_id], self.movie_index[movie_id]
+            start, end = matrix.indptr[row], matrix.indptr[row + 1]
+            slot = start + np.searchsorted(matrix.indices[start:end], column)
+            if slot == end or matrix.indices[slot] != column:
+                continue
+            matrix.data[slot] = rating
+            if self.time_decay is not None:
+                decay = self.time_decay
+                weight = 1.0 if rated_at is None else np.exp(
+                    -decay.rate * max(decay.reference_time
+                                      - rated_at[position], 0.0))
+                decay.weights.data[slot] = weight
+                decay.weighted.data[slot] = rating * weight
+            updated += 1
+        return updated
 
     def update_rating_matrix(self, user_id, movie_ids, ratings):
         """
-            Update the ratings matrix with new user-movie ratings.
+        Set a user's ratings and refit the model.
+
+        Unlike set_ratings, this can add ratings the matrix does not hold
+        yet: users and movies missing from the ID maps get the next free
+        row or column. That needs dict ID maps; with the sorted IdIndex
+        maps of a compact model, unknown IDs raise ValueError. Time decay
+        weights are carried over, with these ratings dated now.
 
         Args:
             user_id (int): ID of the user.
             movie_ids (list): List of movie IDs.
             ratings (list): List of corresponding ratings for the movies.
-
-        This method resizes the ratings matrix if necessary to accommodate new users or movies,
-        updates the specified ratings, and refits the nearest neighbors model.
         """
-        self.ratings_matrix = self.ratings_matrix.tolil()
-
-        # Check if the user ID is out of range
-        if user_id >= self.ratings_matrix.shape[0]:
-            # Resize the matrix to accommodate the new user
-            new_rows = user_id - self.ratings_matrix.shape[0] + 1
-            self.ratings_matrix = scipy.sparse.vstack(
-                [self.ratings_matrix, scipy.sparse.lil_matrix((new_rows, self.ratings_matrix.shape[1]))])
-
-        # Check if any movie IDs are out of range
-        max_movie_id = max(movie_ids)
-        if max_movie_id >= self.ratings_matrix.shape[1]:
-            # Resize the matrix to accommodate the new movie
-            new_cols = max_movie_id - self.ratings_matrix.shape[1] + 1
-            self.ratings_matrix = scipy.sparse.hstack(
-                [self.ratings_matrix, scipy.sparse.lil_matrix((self.ratings_matrix.shape[0], new_cols))])
-
-        # Update the ratings for the specified user and movies
-        for movie_id, rating in zip(movie_ids, ratings):
-            self.ratings_matrix[user_id, movie_id] = rating
-
-        self.ratings_matrix = self.ratings_matrix.tocsr()
+        movie_ids = list(movie_ids)
+        rows, columns = self.ratings_matrix.shape
+        for index, ids in ((self.user_index, [user_id]),
+                           (self.movie_index, movie_ids)):
+            unknown = [id_ for id_ in dict.fromkeys(ids) if id_ not in index]
+            if unknown and not isinstance(index, dict):
+                raise ValueError(
+                    f"Cannot add IDs {unknown} to a compact ID index; "
+                    "refit the model instead.")
+            for id_ in unknown:
+                if index is self.user_index:
+                    index[id_] = rows
+                    rows += 1
+                else:
+                    index[id_] = columns
+                    columns += 1
+
+        row = self.user_index[user_id]
+        positions = [self.movie_index[movie_id] for movie_id in movie_ids]
+        matrix = self.ratings_matrix.tolil()
+        matrix.resize((rows, columns))
+        for column, rating in zip(positions, ratings):
+            matrix[row, column] = rating
+        self.ratings_matrix = matrix.tocsr()
+        if self.time_decay is not None:
+            self.time_decay = self.time_decay.reindex(
+                self.ratings_matrix, [row] * len(positions), positions)
         self.fit()
 
     def update_user_similarity(self):
         """
         Update the user similarity matrix based on the current ratings matrix.
 
-        This method computes the cosine similarity between all pairs of users
-        and stores the result in the `similarity_matrix` attribute.
+        This method computes the similarity between all pairs of users with
+        the model's metric (cosine for metrics the similarity module does not
+        implement) and stores the result, as a sparse matrix, in the
+        `similarity_matrix` attribute.
         """
-        self.similarity_matrix = cosine_similarity(self.ratings_matrix)
+        metric = self.similarity_metric \
+            if self.similarity_metric in SIMILARITY_METRICS else 'cosine'
+        self.similarity_matrix = similarity_matrix(
+            self._similarity_ratings(), metric, include_self=True)
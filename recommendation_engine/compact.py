@@ -0,0 +1,246 @@
+"""
+This module provides a compact in-memory representation for the ratings
+model: CSR matrices with int32 index arrays and float32 values, and ID maps
+stored as sorted NumPy arrays instead of Python dicts and sets.
+
+Ratings are half stars between 0.5 and 5, so they can also be stored as
+uint8 codes (rating * 2) when the matrix is written to disk or shared
+between processes.
+
+Example:
+    >>> users = IdIndex([42, 7, 19])
+    >>> users[19]
+    1
+    >>> matrix = build_ratings_matrix(rows, cols, values, shape,
+    ...                               dtype=np.float32)
+"""
+
+import sys
+import numpy as np
+from scipy.sparse import csr_matrix
+
+INDEX_DTYPE = np.int32
+HALF_STAR_SCALE = 2
+
+
+class IdIndex:
+    """
+    Read-only mapping of external IDs to dense positions, backed by a sorted
+    NumPy array and looked up with ``np.searchsorted``.
+
+    It supports the parts of the dict and set interfaces the model uses
+    (``in``, ``[]``, ``get``, ``len``, iteration, ``keys``/``values``/
+    ``items``), so it can replace ``user_index``, ``movie_index`` and
+    ``known_user_ids``.
+
+    Attributes:
+        ids (numpy.ndarray): Sorted, unique IDs. The position of an ID in
+        this array is the value it maps to.
+    """
+
+    def __init__(self, ids, dtype=np.int64):
+        self.ids = np.unique(np.asarray(ids, dtype=dtype))
+
+    @classmethod
+    def from_sorted(cls, ids):
+        """
+        Wrap an array that is already sorted and unique, without copying
+        it (e.g. a memory-mapped array).
+        """
+        index = cls.__new__(cls)
+        index.ids = ids
+        return index
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids.tolist())
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        position = self.get(key)
+        if position is None:
+            raise KeyError(key)
+        return position
+
+    def get(self, key, default=None):
+        try:
+            key = int(key)
+        except (TypeError, ValueError):
+            return default
+        position = int(np.searchsorted(self.ids, key))
+        if position < len(self.ids) and self.ids[position] == key:
+            return position
+        return default
+
+    def keys(self):
+        return self.ids.tolist()
+
+    def values(self):
+        return range(len(self.ids))
+
+    def items(self):
+        return zip(self.ids.tolist(), range(len(self.ids)))
+
+    def positions(self, keys):
+        """
+        Vectorized lookup of many IDs.
+
+        Args:
+            keys (array-like): IDs to look up.
+
+        Returns:
+            numpy.ndarray: Positions of the IDs, with -1 for unknown IDs.
+        """
+        keys = np.asarray(keys, dtype=self.ids.dtype)
+        positions = np.searchsorted(self.ids, keys)
+        clipped = np.minimum(positions, max(len(self.ids) - 1, 0))
+        found = (positions < len(self.ids)) & (self.ids[clipped] == keys)
+        return np.where(found, positions, -1)
+
+    def add(self, key):
+        """
+        Add an ID, as for a set.
+
+        Inserting shifts the positions of all larger IDs, so this is only
+        meant for indexes used as sets, such as ``known_user_ids``.
+        """
+        if key not in self:
+            position = int(np.searchsorted(self.ids, int(key)))
+            self.ids = np.insert(self.ids, position, int(key))
+
+    @property
+    def nbytes(self):
+        return self.ids.nbytes
+
+
+def index_ids(index):
+    """
+    The IDs of a dict or IdIndex ID map, ordered by position.
+
+    Args:
+        index (dict or IdIndex): Mapping of IDs to dense positions.
+
+    Returns:
+        numpy.ndarray: int64 array whose i-th element maps to position i.
+    """
+    if isinstance(index, IdIndex):
+        return index.ids
+    ids = np.empty(len(index), dtype=np.int64)
+    for key, position in index.items():
+        ids[position] = key
+    return ids
+
+
+def index_from_ids(ids):
+    """
+    The inverse of index_ids: an ID map from IDs ordered by position.
+
+    Sorted IDs are wrapped in an IdIndex without copying; otherwise a dict
+    is built.
+
+    Args:
+        ids (numpy.ndarray): IDs ordered by position.
+
+    Returns:
+        IdIndex or dict: Mapping of IDs to positions.
+    """
+    if np.all(ids[1:] > ids[:-1]):
+        return IdIndex.from_sorted(ids)
+    return {int(key): position for position, key in enumerate(ids.tolist())}
+
+
+def build_ratings_matrix(rows, cols, values, shape, dtype=np.float64):
+    """
+    Build a CSR ratings matrix from coordinate arrays in one vectorized pass.
+
+    If a (row, column) pair occurs more than once, the last value wins,
+    matching assignment into a LIL matrix.
+
+    Args:
+        rows (array-like): Row positions.
+        cols (array-like): Column positions.
+        values (array-like): Ratings.
+        shape (tuple): Shape of the matrix.
+        dtype (numpy.dtype, optional): Value dtype (default: float64).
+
+    Returns:
+        scipy.sparse.csr_matrix: Matrix with sorted, duplicate-free indices
+        and int32 index arrays when the shape allows it.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    values = np.asarray(values, dtype=dtype)
+
+    keys = rows * shape[1] + cols
+    # np.unique keeps the first occurrence, so search the reversed keys to
+    # keep the last one.
+    _, last = np.unique(keys[::-1], return_index=True)
+    keep = len(keys) - 1 - last
+
+    rows, cols, values = rows[keep], cols[keep], values[keep]
+    index_dtype = INDEX_DTYPE if max(shape[0] + 1, shape[1], len(keep)) \
+        < np.iinfo(INDEX_DTYPE).max else np.int64
+
+    indptr = np.zeros(shape[0] + 1, dtype=index_dtype)
+    np.cumsum(np.bincount(rows, minlength=shape[0]), out=indptr[1:])
+    # np.unique returned the keys sorted, so rows and columns are in CSR order.
+    return csr_matrix((values, cols.astype(index_dtype), indptr), shape=shape)
+
+
+def compact_csr(matrix, dtype=np.float32):
+    """
+    Convert a ratings matrix to int32 index arrays and compact values.
+
+    Args:
+        matrix (scipy.sparse matrix or numpy.ndarray): Ratings matrix.
+        dtype (numpy.dtype, optional): Value dtype (default: float32).
+
+    Returns:
+        scipy.sparse.csr_matrix: The compact matrix.
+    """
+    matrix = csr_matrix(matrix)
+    return csr_matrix(
+        (matrix.data.astype(dtype),
+         matrix.indices.astype(INDEX_DTYPE),
+         matrix.indptr.astype(INDEX_DTYPE)),
+        shape=matrix.shape)
+
+
+def encode_half_stars(values):
+    """
+    Encode half-star ratings (0.5 to 5) as uint8 codes.
+    """
+    return np.rint(np.asarray(values) * HALF_STAR_SCALE).astype(np.uint8)
+
+
+def decode_half_stars(codes, dtype=np.float32):
+    """
+    Decode uint8 half-star codes back to ratings.
+    """
+    return np.asarray(codes).astype(dtype) / HALF_STAR_SCALE
+
+
+def model_nbytes(model):
+    """
+    Estimate the resident size of a model's ratings matrix and ID maps.
+
+    Args:
+        model (UserBasedCF): The model.
+
+    Returns:
+        int: Approximate size in bytes.
+    """
+    matrix = model.ratings_matrix
+    total = matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+    for index in (model.user_index, model.movie_index):
+        if isinstance(index, IdIndex):
+            total += index.nbytes
+        elif index is not None:
+            total += sys.getsizeof(index) + sum(
+                sys.getsizeof(key) + sys.getsizeof(value)
+                for key, value in index.items())
+    return total
@@ -0,0 +1,314 @@
+"""
+This module implements a recommender for implicit and negative feedback:
+alternating least squares on a confidence-weighted interaction matrix
+(Hu, Koren and Volinsky, "Collaborative Filtering for Implicit Feedback
+Datasets").
+
+The interaction matrix holds a signed strength per (user, movie): views,
+clicks and likes add to it, dislikes and low ratings subtract. A positive
+strength r means the user prefers the movie (p = 1), a negative one that
+they do not (p = 0); either way with confidence c = 1 + alpha * |r|.
+Movies without interactions count as p = 0 with confidence 1.
+
+Each half step solves, for every user u (and then every movie),
+
+    (Y^T Y + Y^T (C_u - I) Y + regularization * I) x_u = Y^T C_u p_u
+
+with a few conjugate-gradient steps warm-started from the previous
+factors. The solves are vectorized over a block of users at a time: the
+matrix-vector product only touches Y^T Y and the user's stored
+interactions, so the cost grows with the number of interactions, not
+with users x movies. Factors are float32.
+
+Scoring a user is one matrix-vector product of the movie factors with the
+user's factors.
+
+Example:
+    >>> interactions = interaction_matrix(rows, columns, strengths, shape)
+    >>> model = ImplicitALS(interactions, user_index, movie_index)
+    >>> model.fit()
+    >>> model.recommend(user_id, n=10)
+"""
+
+import logging
+
+import numpy as np
+from scipy.sparse import coo_matrix, csr_matrix
+
+from recommendation_engine.instrumentation import timer
+from recommendation_engine.profiling import PROFILER
+
+# Interactions per block of a vectorized solve; bounds the gathered
+# factors to DEFAULT_BLOCK_NNZ x factors floats.
+DEFAULT_BLOCK_NNZ = 1 << 18
+# Ratings at this value carry no preference; above it they count as
+# positive feedback, below it as negative.
+NEUTRAL_RATING = 3.0
+
+
+def interaction_matrix(rows, columns, strengths, shape):
+    """
+    Build the float32 CSR interaction matrix, summing repeated
+    (row, column) entries and dropping those that cancel out.
+
+    Args:
+        rows (array-like): User row of each interaction.
+        columns (array-like): Movie column of each interaction.
+        strengths (array-like): Signed strength of each interaction.
+        shape (tuple): (users, movies).
+
+    Returns:
+        scipy.sparse.csr_matrix: Summed strengths.
+    """
+    matrix = coo_matrix(
+        (np.asarray(strengths, dtype=np.float32),
+         (np.asarray(rows), np.asarray(columns))), shape=shape).tocsr()
+    matrix.sum_duplicates()
+    matrix.eliminate_zeros()
+    return matrix
+
+
+def rating_strengths(ratings):
+    """
+    Signed interaction strengths of explicit ratings, relative to
+    NEUTRAL_RATING.
+    """
+    return np.asarray(ratings, dtype=np.float32) - NEUTRAL_RATING
+
+
+def _blocks(indptr, block_nnz):
+    """
+    Row ranges holding about block_nnz interactions each.
+    """
+    n_rows = len(indptr) - 1
+    start = 0
+    while start < n_rows:
+        stop = int(np.searchsorted(indptr, indptr[start] + block_nnz,
+                                   side='right')) - 1
+        stop = min(max(stop, start + 1), n_rows)
+        yield start, stop
+        start = stop
+
+
+def conjugate_gradient(interactions, factors, fixed, regularization, alpha,
+                       steps, block_nnz=DEFAULT_BLOCK_NNZ):
+    """
+    Update ``factors`` in place for the rows of ``interactions`` with the
+    other side's factors held fixed.
+
+    Args:
+        interactions (scipy.sparse.csr_matrix): Signed strengths, one row
+        per factor row.
+        factors (numpy.ndarray): Factors to update, warm start.
+        fixed (numpy.ndarray): Factors of the columns.
+        regularization (float): L2 regularization.
+        alpha (float): Confidence per unit of strength.
+        steps (int): Conjugate-gradient steps per row.
+        block_nnz (int): Interactions per vectorized block.
+    """
+    gram = fixed.T @ fixed
+    gram[np.diag_indices_from(gram)] += regularization
+    tiny = np.finfo(factors.dtype).tiny
+    for start, stop in _blocks(interactions.indptr, block_nnz):
+        begin, end = interactions.indptr[start], interactions.indptr[stop]
+        indptr = interactions.indptr[start:stop + 1] - begin
+        columns = interactions.indices[begin:end]
+        strengths = interactions.data[begin:end]
+        extra = (alpha * np.abs(strengths)).astype(factors.dtype)
+        rows = np.repeat(np.arange(stop - start), np.diff(indptr))
+        gathered = fixed[columns]
+
+        def product(x):
+            # (Y^T Y + reg I) x + Y^T (C - I) Y x, row by row.
+            weights = extra * np.einsum('ij,ij->i', gathered, x[rows])
+            return x @ gram + csr_matrix(
+                (weights, columns, indptr),
+                shape=(stop - start, len(fixed))) @ fixed
+
+        # Y^T C p: only positive interactions have p = 1.
+        positive = np.where(strengths > 0, 1 + extra, 0).astype(factors.dtype)
+        target = csr_matrix((positive, columns, indptr),
+                            shape=(stop - start, len(fixed))) @ fixed
+        x = factors[start:stop]
+        residual = target - product(x)
+        direction = residual.copy()
+        norms = np.einsum('ij,ij->i', residual, residual)
+        for _ in range(steps):
+            if norms.max(initial=0) <= tiny:
+                break
+            product_direction = product(direction)
+            curvature = np.einsum('ij,ij->i', direction, product_direction)
+            step = np.divide(norms, curvature, out=np.zeros_like(norms),
+                             where=curvature > tiny)
+            x += step[:, None] * direction
+            residual -= step[:, None] * product_direction
+            new_norms = np.einsum('ij,ij->i', residual, residual)
+            ratio = np.divide(new_norms, norms, out=np.zeros_like(norms),
+                              where=norms > tiny)
+            direction = residual + ratio[:, None] * direction
+            norms = new_norms
+        factors[start:stop] = x
+
+
+class ImplicitALS:
+    """
+    Confidence-weighted matrix factorization of implicit feedback.
+
+    Scores are predicted preferences, around 0 (not interested) to 1
+    (interested), not ratings.
+
+    Attributes:
+        interactions (scipy.sparse.csr_matrix): Signed interaction strengths,
+        users x movies.
+        user_index (dict): Mapping of user IDs to rows.
+        movie_index (dict): Mapping of movie IDs to columns.
+        user_factors (numpy.ndarray): float32 factors per user.
+        item_factors (numpy.ndarray): float32 factors per movie.
+        movie_ids (numpy.ndarray): Movie ID of each column.
+        rating_counts (numpy.ndarray): Number of movies each user rated or
+        interacted with.
+        movie_stats (MovieStatistics): Per-movie rating statistics, attached
+        by initialize_model.
+    """
+
+    # The API returns the scores as "score" rather than as a predicted
+    # rating (see api.v1.endpoints.predicts_ratings).
+    predicts_ratings = False
+
+    def __init__(self, interactions, user_index, movie_index, factors=64,
+                 regularization=0.1, alpha=10.0, iterations=15, cg_steps=3,
+                 block_nnz=DEFAULT_BLOCK_NNZ, random_state=0):
+        """
+        Initialize the ImplicitALS object.
+
+        Args:
+            interactions (scipy.sparse matrix): Signed interaction strengths,
+            users x movies (see interaction_matrix).
+            user_index (dict): Mapping of user IDs to rows.
+            movie_index (dict): Mapping of movie IDs to columns.
+            factors (int, optional): Latent factors (default: 64).
+            regularization (float, optional): L2 regularization
+            (default: 0.1).
+            alpha (float, optional): Confidence per unit of strength
+            (default: 10).
+            iterations (int, optional): Alternating passes (default: 15).
+            cg_steps (int, optional): Conjugate-gradient steps per solve
+            (default: 3).
+            block_nnz (int, optional): Interactions per vectorized block.
+            random_state (int, optional): Seed of the initial factors.
+        """
+        if interactions is None:
+            raise ValueError("Interaction matrix cannot be None.")
+        self.interactions = csr_matrix(interactions, dtype=np.float32)
+        self.user_index = user_index
+        self.movie_index = movie_index
+        self.factors = factors
+        self.regularization = regularization
+        self.alpha = alpha
+        self.iterations = iterations
+        self.cg_steps = cg_steps
+        self.block_nnz = block_nnz
+        self.random_state = random_state
+        self.user_factors = None
+        self.item_factors = None
+        self.movie_ids = np.zeros(self.interactions.shape[1], dtype=np.int64)
+        for movie_id, column in movie_index.items():
+            self.movie_ids[column] = movie_id
+        self.rating_counts = np.diff(self.interactions.indptr)
+        self.movie_stats = None
+
+    def fit(self):
+        """
+        Fit the user and movie factors.
+        """
+        n_users, n_movies = self.interactions.shape
+        rng = np.random.default_rng(self.random_state)
+        self.user_factors = (rng.standard_normal(
+            (n_users, self.factors)) * 0.01).astype(np.float32)
+        self.item_factors = (rng.standard_normal(
+            (n_movies, self.factors)) * 0.01).astype(np.float32)
+        by_movie = self.interactions.T.tocsr()
+        logging.debug(
+            f"Fitting {self.factors} implicit factors on "
+            f"{self.interactions.nnz} interactions.")
+        with timer("model_fit"), PROFILER.profile("fit"):
+            for _ in range(self.iterations):
+                conjugate_gradient(
+                    self.interactions, self.user_factors, self.item_factors,
+                    self.regularization, self.alpha, self.cg_steps,
+                    self.block_nnz)
+                conjugate_gradient(
+                    by_movie, self.item_factors, self.user_factors,
+                    self.regularization, self.alpha, self.cg_steps,
+                    self.block_nnz)
+
+    def scores(self, user_id):
+        """
+        Predicted preference of the user for every movie (one matrix-vector
+        product), or None for unknown users.
+        """
+        row = self.user_index.get(user_id)
+        if row is None:
+            return None
+        return self.item_factors @ self.user_factors[row]
+
+    def predict(self, user_id, movie_id) -> float:
+        """
+        Predicted preference of a user for a movie, NaN if either is
+        unknown.
+        """
+        return float(self.predict_many(user_id, [movie_id])[0])
+
+    def predict_many(self, user_id, movie_ids) -> np.ndarray:
+        """
+        Predicted preferences of one user for several movies, NaN for
+        unknown users and movies.
+        """
+        movie_ids = list(movie_ids)
+        predictions = np.full(len(movie_ids), np.nan)
+        row = self.user_index.get(user_id)
+        if row is None or not movie_ids:
+            return predictions
+        known = np.array([movie_id in self.movie_index
+                          for movie_id in movie_ids], dtype=bool)
+        columns = [self.movie_index[movie_id]
+                   for movie_id, ok in zip(movie_ids, known) if ok]
+        predictions[known] = self.item_factors[columns] \
+            @ self.user_factors[row]
+        return predictions
+
+    def predict_batch(self, user_ids, movie_id_lists) -> list:
+        """
+        predict_many for several users.
+        """
+        return [self.predict_many(user_id, movie_ids)
+                for user_id, movie_ids in zip(user_ids, movie_id_lists)]
+
+    def recommend(self, user_id, n=10, exclude_seen=True):
+        """
+        The user's top movies.
+
+        Args:
+            user_id (int): ID of the user.
+            n (int, optional): Number of movies (default: 10).
+            exclude_seen (bool, optional): Leave out movies the user
+            interacted with, positively or not (default: True).
+
+        Returns:
+            list: (movie ID, score) tuples, best first; empty for unknown
+            users.
+        """
+        scores = self.scores(user_id)
+        if scores is None:
+            return []
+        if exclude_seen:
+            row = self.user_index[user_id]
+            seen = self.interactions.indices[
+                self.interactions.indptr[row]:self.interactions.indptr[row + 1]]
+            scores[seen] = -np.inf
+        n = min(n, len(scores))
+        top = np.argpartition(-scores, n - 1)[:n] if n < len(scores) \
+            else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        top = top[np.isfinite(scores[top])]
+        return list(zip(self.movie_ids[top].tolist(), scores[top].tolist()))
@@ -0,0 +1,268 @@
+"""
+This module provides lightweight timers, counters and sampled trace events
+for the recommendation hot path.
+
+Metrics are kept in process memory and rendered in the Prometheus text
+exposition format. Timers can additionally record into a per-request list
+that the API turns into a Server-Timing header.
+
+Example:
+    >>> with timer("knn_query"):
+    ...     model.nearest_neighbors.kneighbors(row)
+    >>> count("fallback_ratings_total")
+    >>> print(REGISTRY.render())
+"""
+
+import bisect
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+METRIC_PREFIX = "cortexeng_"
+
+# Latency buckets in seconds, from 100µs up to 10s.
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Fraction of trace events that are actually formatted and logged.
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+
+trace_logger = logging.getLogger("cortexeng.trace")
+
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{value}"' for key, value in labels)
+    return "{" + pairs + "}"
+
+
+class Counter:
+    """
+    Monotonically increasing counter.
+
+    Attributes:
+        value (float): Current value of the counter.
+    """
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Histogram:
+    """
+    Latency histogram with fixed bucket boundaries.
+
+    Attributes:
+        buckets (tuple): Upper bounds of the buckets.
+        counts (list): Number of observations per bucket (non-cumulative),
+        with a final overflow bucket.
+        total (float): Sum of all observed values.
+        count (int): Number of observations.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[position] += 1
+            self.total += value
+            self.count += 1
+
+
+class MetricsRegistry:
+    """
+    Registry of named, optionally labelled counters and histograms.
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def counter(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._counters.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._counters.setdefault(key, Counter())
+        return metric
+
+    def histogram(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._histograms.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._histograms.setdefault(key, Histogram())
+        return metric
+
+    def register_collector(self, collector):
+        """
+        Register a callable returning ``(name, labels, value)`` counter
+        samples that are read at scrape time only.
+        """
+        self._collectors.append(collector)
+
+    def track_lru_cache(self, name, cached_function):
+        """
+        Export hit and miss counts of a ``functools.lru_cache`` function.
+
+        Args:
+            name (str): Value of the ``cache`` label.
+            cached_function (callable): Function wrapped by ``lru_cache``.
+        """
+        def collect():
+            info = cached_function.cache_info()
+            return [("cache_hits_total", {"cache": name}, info.hits),
+                    ("cache_misses_total", {"cache": name}, info.misses)]
+        self.register_collector(collect)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self):
+        """
+        Render all metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics page.
+        """
+        samples = {}
+        for (name, labels), metric in list(self._counters.items()):
+            samples.setdefault(name, []).append((labels, metric.value))
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                samples.setdefault(name, []).append(
+                    (tuple(sorted(labels.items())), value))
+
+        lines = []
+        for name in sorted(samples):
+            lines.append(f"# TYPE {METRIC_PREFIX}{name} counter")
+            for labels, value in samples[name]:
+                lines.append(
+                    f"{METRIC_PREFIX}{name}{_format_labels(labels)} {value:g}")
+
+        histograms = {}
+        for (name, labels), metric in list(self._histograms.items()):
+            histograms.setdefault(name, []).append((labels, metric))
+        for name in sorted(histograms):
+            metric_name = f"{METRIC_PREFIX}{name}_seconds"
+            lines.append(f"# TYPE {metric_name} histogram")
+            for labels, metric in histograms[name]:
+                cumulative = 0
+                for bound, bucket_count in zip(
+                        metric.buckets + (float("inf"),), metric.counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    bucket_labels = _format_labels(labels + (("le", le),))
+                    lines.append(
+                        f"{metric_name}_bucket{bucket_labels} {cumulative}")
+                label_text = _format_labels(labels)
+                lines.append(f"{metric_name}_sum{label_text} {metric.total:g}")
+                lines.append(f"{metric_name}_count{label_text} {metric.count}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+@contextmanager
+def timer(name, **labels):
+    """
+    Time a block and record it in the ``<name>_seconds`` histogram and, if
+    a request is being timed, in its Server-Timing entries.
+
+    Args:
+        name (str): Stage name, e.g. ``"knn_query"``.
+        **labels: Optional Prometheus labels.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def observe(name, elapsed, **labels):
+    """
+    Record a duration measured elsewhere, e.g. by a database event hook.
+
+    Args:
+        name (str): Stage name.
+        elapsed (float): Duration in seconds.
+        **labels: Optional Prometheus labels.
+    """
+    REGISTRY.histogram(name, **labels).observe(elapsed)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, elapsed))
+
+
+def count(name, amount=1, **labels):
+    """
+    Increment the counter ``name`` by ``amount``.
+    """
+    REGISTRY.counter(name, **labels).inc(amount)
+
+
+def trace(message, *args):
+    """
+    Emit a sampled debug trace event.
+
+    The message is formatted lazily by the logging module, and only for the
+    sampled fraction of calls, so large arguments such as neighbour arrays
+    cost nothing when the event is dropped.
+
+    Args:
+        message (str): %-style format string.
+        *args: Arguments for the format string.
+    """
+    if TRACE_SAMPLE_RATE <= 0 or not trace_logger.isEnabledFor(logging.DEBUG):
+        return
+    if TRACE_SAMPLE_RATE < 1 and random.random() >= TRACE_SAMPLE_RATE:
+        return
+    trace_logger.debug(message, *args)
+
+
+def start_request_timing():
+    """
+    Start collecting timer entries for the current request.
+    """
+    _request_timings.set([])
+
+
+def server_timing_header():
+    """
+    Build a Server-Timing header value from the current request's timers.
+
+    Returns:
+        str or None: Header value, or None if nothing was recorded.
+    """
+    timings = _request_timings.get()
+    if not timings:
+        return None
+    totals = {}
+    for name, elapsed in timings:
+        totals[name] = totals.get(name, 0.0) + elapsed
+    return ", ".join(f"{name};dur={elapsed * 1000:.3f}"
+                     for name, elapsed in totals.items())
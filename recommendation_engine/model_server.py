@@ -0,0 +1,554 @@
+"""
+This module serves the recommendation model from a separate process over a
+Unix domain socket, so CPU-heavy kNN scoring does not compete with the web
+server's request handling for the GIL.
+
+Every message is a frame: a 4-byte little-endian payload length followed by
+the payload. Requests are a fixed header (operation, user ID, count) plus
+the movie IDs as a raw int64 array. Responses are a status byte and either
+raw NumPy arrays, each prefixed with its type code and length, or a UTF-8
+error message. Nothing is encoded as JSON.
+
+Operations:
+    predict_many: A user ID and n movie IDs; returns n predicted ratings.
+    recommend: A user ID and n; returns the IDs and predicted ratings of the
+    user's top n unrated movies, best first.
+    info: Returns the user IDs, movie IDs and known user IDs of the model,
+    the number of ratings of each user, and each movie's rating count, sum
+    and sum of squares.
+
+The server merges requests that arrive within ``max_wait`` seconds of each
+other, up to ``max_batch_size``, into one ``UserBasedCF.predict_batch``
+call, which looks up the neighbours of all their users in one query.
+Requests that arrive while a batch is being scored form the next batch.
+
+Example:
+    $ python -m cli.main serve-model --socket /tmp/cortexeng-model.sock
+
+    >>> client = ModelClient("/tmp/cortexeng-model.sock")
+    >>> client.info()
+    >>> client.predict_many(user_id, movie_ids)
+    >>> movie_ids, ratings = client.recommend(user_id, 10)
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from recommendation_engine.compact import index_from_ids, index_ids
+from recommendation_engine.instrumentation import count, timer
+from recommendation_engine.movie_stats import MovieStatistics
+
+FRAME = struct.Struct('<I')
+REQUEST = struct.Struct('<BqI')
+RESPONSE = struct.Struct('<BB')
+ARRAY = struct.Struct('<cI')
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+OP_PREDICT_MANY = 1
+OP_RECOMMEND = 2
+OP_INFO = 3
+OPERATIONS = (OP_PREDICT_MANY, OP_RECOMMEND, OP_INFO)
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+# Wire type codes of the arrays a response can carry.
+DTYPES = {b'd': np.dtype('<f8'), b'q': np.dtype('<i8')}
+
+
+class ModelServerError(Exception):
+    """
+    Raised by ModelClient when the server answers a request with an error.
+    """
+
+
+def encode_request(op, user_id=0, n=0, movie_ids=None):
+    """
+    Encode a request frame.
+
+    Args:
+        op (int): One of OP_PREDICT_MANY, OP_RECOMMEND and OP_INFO.
+        user_id (int): ID of the user.
+        n (int): Number of recommendations, for OP_RECOMMEND.
+        movie_ids (array-like, optional): Movies to score, for
+        OP_PREDICT_MANY.
+
+    Returns:
+        bytes: The length-prefixed frame.
+    """
+    ids = b''
+    if movie_ids is not None:
+        ids = np.ascontiguousarray(movie_ids, dtype=DTYPES[b'q']).tobytes()
+        n = len(ids) // 8
+    payload = REQUEST.pack(op, user_id, n) + ids
+    return FRAME.pack(len(payload)) + payload
+
+
+def decode_request(payload):
+    """
+    Decode a request payload (a frame without its length prefix).
+
+    Returns:
+        tuple: The operation, user ID, count and movie IDs (int64 array).
+
+    Raises:
+        ValueError: If the payload is malformed.
+    """
+    if len(payload) < REQUEST.size:
+        raise ValueError("Truncated request header")
+    op, user_id, n = REQUEST.unpack_from(payload)
+    if op not in OPERATIONS:
+        raise ValueError(f"Unknown operation {op}")
+    body = memoryview(payload)[REQUEST.size:]
+    if len(body) % 8:
+        raise ValueError("Movie IDs are not a whole number of int64 values")
+    movie_ids = np.frombuffer(body, dtype=DTYPES[b'q'])
+    if op == OP_PREDICT_MANY and len(movie_ids) != n:
+        raise ValueError(f"Expected {n} movie IDs, got {len(movie_ids)}")
+    return op, user_id, n, movie_ids
+
+
+def encode_response(*arrays):
+    """
+    Encode a successful response carrying float64 and int64 arrays.
+
+    Returns:
+        bytes: The length-prefixed frame.
+    """
+    parts = [RESPONSE.pack(STATUS_OK, len(arrays))]
+    for array in arrays:
+        array = np.asarray(array)
+        code = b'd' if array.dtype.kind == 'f' else b'q'
+        parts.append(ARRAY.pack(code, len(array)))
+        parts.append(np.ascontiguousarray(array, dtype=DTYPES[code]).tobytes())
+    payload = b''.join(parts)
+    return FRAME.pack(len(payload)) + payload
+
+
+def encode_error(message):
+    """
+    Encode an error response.
+
+    Returns:
+        bytes: The length-prefixed frame.
+    """
+    payload = RESPONSE.pack(STATUS_ERROR, 0) + str(message).encode('utf-8')
+    return FRAME.pack(len(payload)) + payload
+
+
+def decode_response(payload):
+    """
+    Decode a response payload (a frame without its length prefix).
+
+    Returns:
+        list: The arrays of the response, as views of the payload.
+
+    Raises:
+        ModelServerError: If the server answered with an error.
+    """
+    status, n_arrays = RESPONSE.unpack_from(payload)
+    if status != STATUS_OK:
+        raise ModelServerError(
+            bytes(payload[RESPONSE.size:]).decode('utf-8', 'replace'))
+    arrays, offset = [], RESPONSE.size
+    for _ in range(n_arrays):
+        code, length = ARRAY.unpack_from(payload, offset)
+        offset += ARRAY.size
+        arrays.append(np.frombuffer(payload, dtype=DTYPES[code],
+                                    count=length, offset=offset))
+        offset += length * 8
+    return arrays
+
+
+def top_ratings(movie_ids, predictions, n):
+    """
+    The n best predicted movies, skipping NaN predictions.
+
+    Ties keep the order of movie_ids, as the API's ranking does.
+
+    Returns:
+        tuple: Movie IDs and predicted ratings, best first.
+    """
+    valid = np.flatnonzero(~np.isnan(predictions))
+    order = valid[np.argsort(-predictions[valid], kind='stable')][:n]
+    return movie_ids[order], predictions[order]
+
+
+class ModelServer:
+    """
+    Serves a model's predictions over a Unix domain socket.
+
+    Scoring runs on one worker thread, off the event loop, so the server
+    keeps reading and queueing requests while a batch is scored.
+
+    Args:
+        path (str): Socket path. An existing file at the path is replaced.
+        model (UserBasedCF, optional): The fitted model to serve.
+        known_user_ids (set or IdIndex, optional): Reported by info; the
+        model's users by default.
+        reader (SharedModelReader, optional): Serve the reader's model
+        instead of ``model``, switching to newly published generations.
+        max_batch_size (int): Maximum number of requests scored together.
+        max_wait (float): Seconds to wait for more requests once the first
+        request of a batch has arrived.
+    """
+
+    def __init__(self, path, model=None, known_user_ids=None, reader=None,
+                 max_batch_size=64, max_wait=0.002):
+        if model is None and reader is None:
+            raise ValueError("A model or a SharedModelReader is required.")
+        self.path = path
+        self._model = model
+        self._known_user_ids = known_user_ids
+        self.reader = reader
+        self.max_batch_size = max(max_batch_size, 1)
+        self.max_wait = max_wait
+        self._executor = None
+        self._movie_ids = (None, None)
+        self._loop = None
+        self._stopping = None
+        self._thread = None
+
+    @property
+    def model(self):
+        return self.reader.model if self.reader is not None else self._model
+
+    @property
+    def known_user_ids(self):
+        if self.reader is not None:
+            return self.reader.known_user_ids
+        return self._known_user_ids
+
+    def _movie_id_array(self, model):
+        # Cached per model, so a reader switching generations refreshes it.
+        cached_model, ids = self._movie_ids
+        if cached_model is not model:
+            ids = index_ids(model.movie_index)
+            self._movie_ids = (model, ids)
+        return ids
+
+    def _run_batch(self, requests):
+        """
+        Score a batch of decoded requests and encode their responses.
+        """
+        if self.reader is not None:
+            self.reader.refresh()
+        model = self.model
+        responses = [None] * len(requests)
+        scored, user_ids, movie_id_lists = [], [], []
+        try:
+            for position, (op, user_id, n, movie_ids) in enumerate(requests):
+                if op == OP_INFO:
+                    responses[position] = self._info(model)
+                elif op == OP_PREDICT_MANY:
+                    scored.append(position)
+                    user_ids.append(user_id)
+                    movie_id_lists.append(movie_ids)
+                elif user_id not in model.user_index:
+                    responses[position] = encode_error(
+                        f"User ID {user_id} is not in the model")
+                else:
+                    scored.append(position)
+                    user_ids.append(user_id)
+                    movie_id_lists.append(self._unrated(model, user_id))
+
+            count("model_server_requests_total", len(requests))
+            predictions = []
+            if scored:
+                count("model_server_batches_total")
+                with timer("model_server_batch"):
+                    predictions = model.predict_batch(user_ids, movie_id_lists)
+            for position, movie_ids, predicted in zip(
+                    scored, movie_id_lists, predictions):
+                op, _, n, _ = requests[position]
+                if op == OP_PREDICT_MANY:
+                    responses[position] = encode_response(predicted)
+                else:
+                    responses[position] = encode_response(
+                        *top_ratings(movie_ids, predicted, n))
+        except Exception as e:
+            logging.error(f"Model server batch failed: {e}")
+            error = encode_error(f"Scoring failed: {e}")
+            responses = [response or error for response in responses]
+        return responses
+
+    def _unrated(self, model, user_id):
+        row = model.ratings_matrix[model.user_index[user_id]]
+        unrated = np.ones(model.ratings_matrix.shape[1], dtype=bool)
+        unrated[row.indices[row.data > 0]] = False
+        return self._movie_id_array(model)[unrated]
+
+    def _info(self, model):
+        known = self.known_user_ids
+        if known is None:
+            known = index_ids(model.user_index)
+        elif not isinstance(known, np.ndarray):
+            known = np.fromiter(known, dtype=np.int64, count=len(known))
+        ratings = model.ratings_matrix
+        n_movies = ratings.shape[1]
+        return encode_response(
+            index_ids(model.user_index), self._movie_id_array(model),
+            np.sort(known), np.diff(ratings.indptr),
+            np.bincount(ratings.indices, minlength=n_movies),
+            np.bincount(ratings.indices, weights=ratings.data,
+                        minlength=n_movies),
+            np.bincount(ratings.indices, weights=np.square(ratings.data),
+                        minlength=n_movies))
+
+    async def _batch_loop(self, queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                if not queue.empty():
+                    batch.append(queue.get_nowait())
+                    continue
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            responses = await loop.run_in_executor(
+                self._executor, self._run_batch,
+                [request for request, _ in batch])
+            for (_, future), response in zip(batch, responses):
+                if not future.done():
+                    future.set_result(response)
+
+    async def _handle(self, queue, connections, reader, writer):
+        connections.add(writer)
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                (length,) = FRAME.unpack(await reader.readexactly(FRAME.size))
+                if length > MAX_FRAME_SIZE:
+                    logging.warning(
+                        f"Closing model server connection: {length} byte frame")
+                    break
+                payload = await reader.readexactly(length)
+                try:
+                    request = decode_request(payload)
+                except ValueError as e:
+                    response = encode_error(e)
+                else:
+                    future = loop.create_future()
+                    queue.put_nowait((request, future))
+                    response = await future
+                writer.write(response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            connections.discard(writer)
+            writer.close()
+
+    async def serve(self, ready=None):
+        """
+        Serve until stop() is called.
+
+        Args:
+            ready (threading.Event, optional): Set once the socket accepts
+            connections.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="model-server")
+        queue, connections = asyncio.Queue(), set()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = await asyncio.start_unix_server(
+            lambda reader, writer: self._handle(
+                queue, connections, reader, writer),
+            path=self.path)
+        batcher = asyncio.create_task(self._batch_loop(queue))
+        logging.info(f"Model server listening on {self.path}")
+        if ready is not None:
+            ready.set()
+        try:
+            await self._stopping.wait()
+        finally:
+            server.close()
+            for writer in list(connections):
+                writer.close()
+            batcher.cancel()
+            await asyncio.gather(batcher, return_exceptions=True)
+            self._executor.shutdown(wait=True)
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def serve_forever(self):
+        """
+        Serve from the calling thread until interrupted.
+        """
+        asyncio.run(self.serve())
+
+    def start(self, timeout=10):
+        """
+        Serve from a background thread and return once the socket is
+        listening.
+        """
+        ready = threading.Event()
+        self._thread = threading.Thread(
+            target=lambda: asyncio.run(self.serve(ready)),
+            name="model-server", daemon=True)
+        self._thread.start()
+        if not ready.wait(timeout):
+            raise TimeoutError(f"Model server did not start on {self.path}")
+
+    def stop(self):
+        """
+        Stop a server started with start() or serve().
+        """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def _recv_exactly(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            raise ConnectionError("Model server closed the connection")
+        received += n
+    return buffer
+
+
+class ModelClient:
+    """
+    Client of a ModelServer that stands in for the model in the API.
+
+    It has the model's ``predict`` and ``predict_many`` methods and, after
+    info(), its ``user_index`` and ``movie_index``, so it can be stored as
+    MODEL_INSTANCE and used by the endpoints unchanged. Each thread uses
+    its own connection, so requests from concurrent scoring threads reach
+    the server together and are batched.
+
+    Args:
+        path (str): Socket path of the server.
+        timeout (float): Socket timeout in seconds.
+
+    Attributes:
+        user_index (IdIndex or dict): The served model's users.
+        movie_index (IdIndex or dict): The served model's movies.
+        known_user_ids (IdIndex): Users with ratings.
+        rating_counts (numpy.ndarray): Number of ratings of each user.
+        movie_stats (MovieStatistics): Rating statistics of the served
+        model's movies, as of info(), for cold-start popularity.
+    """
+
+    def __init__(self, path, timeout=30.0):
+        self.path = path
+        self.timeout = timeout
+        self.user_index = None
+        self.movie_index = None
+        self.known_user_ids = None
+        self.rating_counts = None
+        self.movie_stats = None
+        self._local = threading.local()
+
+    def _connection(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.path)
+            except OSError:
+                sock.close()
+                raise
+            self._local.sock = sock
+        return sock
+
+    def _call(self, frame):
+        sock = self._connection()
+        try:
+            sock.sendall(frame)
+            (length,) = FRAME.unpack(_recv_exactly(sock, FRAME.size))
+            payload = _recv_exactly(sock, length)
+        except OSError:
+            # The stream may be out of step now; reconnect next time.
+            self.close()
+            raise
+        return decode_response(payload)
+
+    def close(self):
+        """
+        Close the calling thread's connection.
+        """
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+    def info(self):
+        """
+        Fetch the served model's ID maps and rating counts.
+        """
+        (user_ids, movie_ids, known, rating_counts, counts, sums,
+         sum_squares) = self._call(encode_request(OP_INFO))
+        self.user_index = index_from_ids(user_ids)
+        self.movie_index = index_from_ids(movie_ids)
+        self.known_user_ids = index_from_ids(known)
+        self.rating_counts = rating_counts
+        self.movie_stats = MovieStatistics(movie_ids, counts, sums,
+                                           sum_squares)
+        return self
+
+    def wait_until_ready(self, timeout):
+        """
+        Call info() until the server answers or timeout seconds have passed.
+
+        Returns:
+            bool: True if the server answered.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self.info()
+                return True
+            except OSError:
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(0.1)
+
+    def predict_many(self, user_id, movie_ids):
+        """
+        Predicted ratings of one user for many movies (see
+        UserBasedCF.predict_many).
+        """
+        (predictions,) = self._call(encode_request(
+            OP_PREDICT_MANY, user_id, movie_ids=movie_ids))
+        return predictions
+
+    def predict(self, user_id, movie_id):
+        return float(self.predict_many(user_id, [movie_id])[0])
+
+    def recommend(self, user_id, n):
+        """
+        The user's top n unrated movies.
+
+        Returns:
+            tuple: Movie IDs and predicted ratings (numpy arrays), best
+            first.
+        """
+        movie_ids, ratings = self._call(
+            encode_request(OP_RECOMMEND, user_id, n))
+        return movie_ids, ratings
@@ -0,0 +1,239 @@
+"""
+This module keeps per-movie rating statistics in NumPy arrays.
+
+``MovieStatistics`` mirrors the movie_stats table: rating count, sum, sum of
+squares and last-rated time per movie, from which the mean, variance and a
+Bayesian (damped) mean are derived. It can be rebuilt from the raw ratings
+in one vectorized pass and is updated in place as ratings are written, so
+fallback predictions and popularity ranking never aggregate the ratings
+table per request.
+
+The Bayesian mean shrinks a movie's mean towards the global mean::
+
+    (prior_weight * global_mean + rating_sum) / (prior_weight + rating_count)
+
+Example:
+    >>> stats = MovieStatistics.from_ratings(movie_ids, ratings)
+    >>> stats.apply(42, 4.5)
+    >>> stats.top(10)
+"""
+
+import threading
+
+import numpy as np
+
+from recommendation_engine.compact import IdIndex
+
+DEFAULT_PRIOR_WEIGHT = 10.0
+
+
+def bayesian_mean(rating_sum, rating_count, global_mean,
+                  prior_weight=DEFAULT_PRIOR_WEIGHT):
+    """
+    Mean rating damped towards the global mean.
+
+    Works on scalars and NumPy arrays alike.
+    """
+    return ((prior_weight * global_mean + rating_sum)
+            / (prior_weight + rating_count))
+
+
+class MovieStatistics:
+    """
+    Per-movie rating aggregates, one array slot per movie.
+
+    Attributes:
+        movie_ids (IdIndex): Sorted movie IDs; a movie's slot is its rank.
+        counts (np.ndarray): Number of ratings (int64).
+        sums (np.ndarray): Sum of ratings (float64).
+        sum_squares (np.ndarray): Sum of squared ratings (float64).
+        last_rated (np.ndarray): Time of the latest rating in seconds since
+        the epoch, NaN if unknown.
+        prior_weight (float): Pseudo-count used by the Bayesian mean.
+    """
+
+    def __init__(self, movie_ids, counts, sums, sum_squares, last_rated=None,
+                 prior_weight=DEFAULT_PRIOR_WEIGHT):
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        if last_rated is None:
+            last_rated = np.full(len(movie_ids), np.nan)
+        if np.all(movie_ids[1:] > movie_ids[:-1]):
+            # Already sorted: keep the arrays as they are, which avoids
+            # copying memory-mapped statistics.
+            order = slice(None)
+            self.movie_ids = IdIndex.from_sorted(movie_ids)
+        else:
+            order = np.argsort(movie_ids, kind='stable')
+            self.movie_ids = IdIndex(movie_ids)
+        self.counts = np.asarray(counts, dtype=np.int64)[order]
+        self.sums = np.asarray(sums, dtype=np.float64)[order]
+        self.sum_squares = np.asarray(sum_squares, dtype=np.float64)[order]
+        self.last_rated = np.asarray(last_rated, dtype=np.float64)[order]
+        self.prior_weight = prior_weight
+        self._total_count = int(self.counts.sum())
+        self._total_sum = float(self.sums.sum())
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_ratings(cls, movie_ids, ratings, timestamps=None,
+                     prior_weight=DEFAULT_PRIOR_WEIGHT):
+        """
+        Aggregate raw ratings in one vectorized pass.
+
+        Args:
+            movie_ids (array-like): Movie ID of each rating.
+            ratings (array-like): Rating values.
+            timestamps (array-like, optional): Rating times in seconds since
+            the epoch.
+            prior_weight (float): Pseudo-count for the Bayesian mean.
+
+        Returns:
+            MovieStatistics: The aggregated statistics.
+        """
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        ratings = np.asarray(ratings, dtype=np.float64)
+        unique_ids, slots = np.unique(movie_ids, return_inverse=True)
+        size = len(unique_ids)
+
+        counts = np.bincount(slots, minlength=size)
+        sums = np.bincount(slots, weights=ratings, minlength=size)
+        sum_squares = np.bincount(slots, weights=ratings * ratings,
+                                  minlength=size)
+        last_rated = np.full(size, np.nan)
+        if timestamps is not None:
+            timestamps = np.asarray(timestamps, dtype=np.float64)
+            known = ~np.isnan(timestamps)
+            np.fmax.at(last_rated, slots[known], timestamps[known])
+        return cls(unique_ids, counts, sums, sum_squares, last_rated,
+                   prior_weight=prior_weight)
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    def __contains__(self, movie_id):
+        return movie_id in self.movie_ids
+
+    @property
+    def global_mean(self):
+        if self._total_count == 0:
+            return 0.0
+        return self._total_sum / self._total_count
+
+    def means(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.counts > 0, self.sums / self.counts, np.nan)
+
+    def variances(self):
+        means = self.means()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.maximum(self.sum_squares / self.counts - means * means, 0)
+
+    def bayesian_means(self):
+        return bayesian_mean(self.sums, self.counts, self.global_mean,
+                             self.prior_weight)
+
+    def get(self, movie_id):
+        """
+        Statistics for one movie.
+
+        Returns:
+            dict: count, sum, sum_squares, mean, bayesian_mean and
+            last_rated, or None if the movie has no ratings.
+        """
+        slot = self.movie_ids.get(movie_id)
+        if slot is None or self.counts[slot] == 0:
+            return None
+        count = int(self.counts[slot])
+        total = float(self.sums[slot])
+        last_rated = float(self.last_rated[slot])
+        return {
+            'count': count,
+            'sum': total,
+            'sum_squares': float(self.sum_squares[slot]),
+            'mean': total / count,
+            'bayesian_mean': float(bayesian_mean(
+                total, count, self.global_mean, self.prior_weight)),
+            'last_rated': None if np.isnan(last_rated) else last_rated,
+        }
+
+    def apply(self, movie_id, rating, previous_rating=None, rated_at=None):
+        """
+        Update the statistics for a single rating write.
+
+        Args:
+            movie_id (int): The rated movie.
+            rating (float): The new rating value.
+            previous_rating (float, optional): The value this rating
+            replaces, if the user had already rated the movie.
+            rated_at (float, optional): Time of the rating in seconds since
+            the epoch.
+        """
+        with self._lock:
+            slot = self.movie_ids.get(movie_id)
+            if slot is None:
+                slot = self._insert(movie_id)
+
+            if previous_rating is None:
+                self.counts[slot] += 1
+                self._total_count += 1
+                delta = rating
+                delta_squares = rating * rating
+            else:
+                delta = rating - previous_rating
+                delta_squares = rating * rating - previous_rating ** 2
+            self.sums[slot] += delta
+            self.sum_squares[slot] += delta_squares
+            self._total_sum += delta
+            if rated_at is not None:
+                self.last_rated[slot] = np.fmax(self.last_rated[slot],
+                                                rated_at)
+
+    def _insert(self, movie_id):
+        self.movie_ids.add(movie_id)
+        slot = self.movie_ids[movie_id]
+        self.counts = np.insert(self.counts, slot, 0)
+        self.sums = np.insert(self.sums, slot, 0.0)
+        self.sum_squares = np.insert(self.sum_squares, slot, 0.0)
+        self.last_rated = np.insert(self.last_rated, slot, np.nan)
+        return slot
+
+    def top(self, n, min_count=1):
+        """
+        Movie IDs with the highest Bayesian mean.
+
+        Ties are broken by rating count.
+
+        Args:
+            n (int): Number of movies to return.
+            min_count (int): Ignore movies with fewer ratings.
+
+        Returns:
+            np.ndarray: Up to n movie IDs, best first.
+        """
+        eligible = np.flatnonzero(self.counts >= min_count)
+        if len(eligible) == 0:
+            return np.empty(0, dtype=np.int64)
+        scores = self.bayesian_means()[eligible]
+        order = np.lexsort((-self.counts[eligible], -scores))[:n]
+        return self.movie_ids.ids[eligible[order]]
+
+    def records(self):
+        """
+        Rows for the movie_stats table, one dict per movie with ratings.
+        """
+        means = self.means()
+        bayesian = self.bayesian_means()
+        return [
+            {
+                'movie_id': int(movie_id),
+                'rating_count': int(self.counts[slot]),
+                'rating_sum': float(self.sums[slot]),
+                'rating_sum_squares': float(self.sum_squares[slot]),
+                'mean_rating': float(means[slot]),
+                'bayesian_mean': float(bayesian[slot]),
+                'last_rated_at': (None if np.isnan(self.last_rated[slot])
+                                  else float(self.last_rated[slot])),
+            }
+            for slot, movie_id in enumerate(self.movie_ids.ids.tolist())
+            if self.counts[slot] > 0
+        ]
@@ -0,0 +1,450 @@
+"""
+This module recommends movies in two stages: cheap candidate retrieval,
+then an exact rerank of the candidates only.
+
+Scoring every unrated movie with the kNN predictor costs time proportional
+to the catalogue. The pipeline instead retrieves a few hundred candidates
+from cheap sources:
+
+- user-neighbour expansion: the movies the user's nearest neighbours rated
+  highest, the only movies the kNN predictor scores from neighbours
+  rather than falling back;
+- item-neighbour expansion: the most similar movies (top-k item-item
+  cosine similarity) of the movies the user rated highest;
+- genre-popular: the best rated movies of the user's preferred genres, or
+  of the genres of their top-rated movies;
+- trending: well-liked movies that were rated recently.
+
+The sources are merged round-robin, so each contributes its best movies
+first, and the merged list is capped at ``max_candidates``. The rerank
+stage predicts the candidates' ratings as the model's predict_many does,
+blends them with other signals through a HybridScorer (by default the
+recency boost of UserBasedCF.rank_recommendations) and can pick the top
+movies by maximal marginal relevance, trading score for dissimilarity
+(content vectors, or genres without a content engine) to the movies
+already picked. Both stages share one nearest-neighbour lookup.
+
+Example:
+    >>> pipeline = RecommendationPipeline(model, movie_rows)
+    >>> movie_ids, predicted = pipeline.recommend(user_id, 10, ["Drama"])
+"""
+
+from datetime import datetime
+
+import numpy as np
+from scipy.sparse import csr_matrix, diags
+
+from recommendation_engine.compact import index_ids
+from recommendation_engine.diversity import mmr, normalize_rows
+from recommendation_engine.hybrid import (
+    HybridScorer, UserFeatureCache, parse_year, recency_boosts)
+from recommendation_engine.instrumentation import timer
+from recommendation_engine.movie_stats import DEFAULT_PRIOR_WEIGHT, bayesian_mean
+from recommendation_engine.similarity import similarity_matrix
+
+DAY = 24 * 60 * 60
+# Ratings a genre needs before the user's affinity to it is trusted.
+GENRE_SHRINKAGE = 3.0
+# Affinity added for the genres the user picked during onboarding.
+PREFERRED_GENRE_BONUS = 1.0
+
+
+def interleave(sources):
+    """
+    Merge ranked lists round-robin, keeping the first occurrence of each
+    item: the first item of every list, then the second, and so on.
+
+    Args:
+        sources (list): Integer arrays, each ordered best first.
+
+    Returns:
+        numpy.ndarray: The merged items.
+    """
+    sources = [np.asarray(source, dtype=np.int64) for source in sources]
+    items = np.concatenate(sources + [np.zeros(0, dtype=np.int64)])
+    ranks = np.concatenate([np.arange(len(source)) for source in sources]
+                           + [np.zeros(0, dtype=np.int64)])
+    origin = np.repeat(np.arange(len(sources)),
+                       [len(source) for source in sources])
+    merged = items[np.lexsort((origin, ranks))]
+    _, first = np.unique(merged, return_index=True)
+    return merged[np.sort(first)]
+
+
+class RecommendationPipeline:
+    """
+    Candidate retrieval followed by an exact rerank.
+
+    Models without a ratings matrix (sharded, implicit-feedback, model
+    server client) get popularity from their movie statistics and no
+    item-neighbour table. Only the cold-start recommender uses such a
+    pipeline; retrieval and rerank need the ratings.
+
+    Args:
+        model (UserBasedCF): The fitted model.
+        movies (iterable): (movie_id, title, genres) rows of the catalogue.
+        max_candidates (int): Cap on the number of candidates reranked.
+        seed_items (int): Number of the user's top-rated movies expanded.
+        item_neighbors (int): Similar movies kept per movie.
+        per_genre (int): Popular movies kept per genre.
+        trending (int): Number of trending movies kept.
+        trending_window (float): Seconds before the newest rating in which
+        a movie must have been rated to count as trending.
+        recency_weight (float): Weight of the recency boost in the rerank.
+        diversity (float): Default MMR diversity of the rerank, 0 (rank by
+        score) to 1.
+        current_year (int, optional): Year the recency boost is relative to.
+        scorer (HybridScorer, optional): Blends the rerank features;
+        defaults to the prediction plus ``recency_weight`` times the
+        recency boost. Its recency weight replaces ``recency_weight``.
+        content (ContentBasedEngine, optional): Source of the "content"
+        feature and of the item vectors used for diversity.
+        feature_cache (UserFeatureCache, optional): Cache of per-user
+        features.
+
+    Attributes:
+        rows (dict): Catalogue rows by movie ID.
+        column_ids (numpy.ndarray): Movie ID of each ratings matrix column.
+        in_catalogue (numpy.ndarray): Whether each column has a catalogue
+        row; columns without one are never recommended.
+        item_neighbors (scipy.sparse.csr_matrix): Top-k item-item cosine
+        similarities between columns.
+        popularity (numpy.ndarray): Bayesian mean rating of each column.
+        global_mean (float): Mean of all ratings.
+        genre_popular (dict): Columns of each genre, most popular first.
+    """
+
+    def __init__(self, model, movies, max_candidates=300, seed_items=10,
+                 item_neighbors=20, per_genre=50, trending=50,
+                 trending_window=30 * DAY, recency_weight=1.0,
+                 diversity=0.0, current_year=None, scorer=None,
+                 content=None, feature_cache=None):
+        self.model = model
+        self.max_candidates = max_candidates
+        self.seed_items = seed_items
+        self.scorer = scorer or HybridScorer(
+            {"cf": 1.0, "recency": recency_weight})
+        self.recency_weight = self.scorer.weights.get("recency", 0.0)
+        self.diversity = diversity
+        self.content = content
+        self.user_features = feature_cache or UserFeatureCache()
+        self.rows = {row[0]: row for row in movies}
+
+        self.column_ids = index_ids(model.movie_index)
+        n_columns = len(self.column_ids)
+        self.in_catalogue = np.array(
+            [movie_id in self.rows for movie_id in self.column_ids.tolist()],
+            dtype=bool)
+
+        with timer("pipeline_build"):
+            if getattr(model, 'ratings_matrix', None) is not None:
+                ratings = csr_matrix(model.ratings_matrix)
+                self.item_neighbors = similarity_matrix(
+                    ratings.T.tocsr(), 'cosine', top_k=item_neighbors)
+                counts = np.bincount(ratings.indices, minlength=n_columns)
+                sums = np.bincount(ratings.indices, weights=ratings.data,
+                                   minlength=n_columns)
+            else:
+                self.item_neighbors = csr_matrix((n_columns, n_columns))
+                counts, sums = self._movie_totals(model.movie_stats)
+            self.global_mean = sums.sum() / max(counts.sum(), 1)
+            self.popularity = bayesian_mean(sums, counts, self.global_mean,
+                                            DEFAULT_PRIOR_WEIGHT)
+            by_popularity = np.argsort(-self.popularity, kind='stable')
+            self.by_popularity = by_popularity[
+                self.in_catalogue[by_popularity]]
+
+            years = np.full(n_columns, np.nan)
+            genre_names = []
+            self.genres = {}
+            genre_rows, genre_cols = [], []
+            for column, movie_id in enumerate(self.column_ids.tolist()):
+                row = self.rows.get(movie_id)
+                if row is None:
+                    continue
+                year = parse_year(row[1])
+                if year is not None:
+                    years[column] = year
+                for genre in (row[2] or "").split("|"):
+                    if genre and genre != "(no genres listed)":
+                        if genre not in self.genres:
+                            self.genres[genre] = len(genre_names)
+                            genre_names.append(genre)
+                        genre_rows.append(column)
+                        genre_cols.append(self.genres[genre])
+            self.column_genres = csr_matrix(
+                (np.ones(len(genre_rows)), (genre_rows, genre_cols)),
+                shape=(n_columns, len(genre_names)))
+            self.genre_vectors = normalize_rows(self.column_genres)
+            genre_counts = np.asarray(self.column_genres.sum(axis=1)).ravel()
+            self.genre_share = csr_matrix(
+                self.column_genres.multiply(
+                    1 / np.maximum(genre_counts, 1)[:, None]))
+            self.recency = recency_boosts(
+                years, current_year or datetime.now().year)
+
+            # Popular movies of each genre, best first.
+            by_genre = self.column_genres.T.tocsr()
+            self.genre_popular = {}
+            for genre, position in self.genres.items():
+                members = np.zeros(n_columns, dtype=bool)
+                members[by_genre[position].indices] = True
+                self.genre_popular[genre] = self.by_popularity[
+                    members[self.by_popularity]][:per_genre]
+
+            self.trending = self._trending(self.by_popularity, trending,
+                                           trending_window)
+
+    def _movie_totals(self, stats):
+        counts = np.zeros(len(self.column_ids), dtype=np.int64)
+        sums = np.zeros(len(self.column_ids))
+        if stats is not None:
+            slots = stats.movie_ids.positions(self.column_ids)
+            found = slots >= 0
+            counts[found] = stats.counts[slots[found]]
+            sums[found] = stats.sums[slots[found]]
+        return counts, sums
+
+    def _trending(self, by_popularity, size, window):
+        stats = self.model.movie_stats
+        if stats is None:
+            return by_popularity[:size]
+        slots = stats.movie_ids.positions(self.column_ids)
+        last_rated = np.where(slots >= 0, stats.last_rated[slots], np.nan)
+        if np.all(np.isnan(last_rated)):
+            return by_popularity[:size]
+        recent = last_rated >= np.nanmax(last_rated) - window
+        return by_popularity[recent[by_popularity]][:size]
+
+    def _neighbors(self, user_id):
+        return self.model._neighbors(self.model.user_index[user_id])
+
+    def candidates(self, user_id, preferred_genres=(), neighbors=None):
+        """
+        Retrieve candidate movies for a user.
+
+        Args:
+            user_id (int): ID of the user; must be in the model.
+            preferred_genres (list): Genres whose popular movies are
+            retrieved. Defaults to the genres of the user's top-rated
+            movies.
+            neighbors (tuple, optional): The user's (similarity scores,
+            row indices) neighbours, looked up if not given.
+
+        Returns:
+            numpy.ndarray: Column positions of at most max_candidates
+            unrated movies.
+        """
+        if neighbors is None:
+            neighbors = self._neighbors(user_id)
+        with timer("pipeline_candidates"):
+            row = self.model.ratings_matrix[self.model.user_index[user_id]]
+            rated = row.indices[row.data > 0]
+            rated_values = row.data[row.data > 0]
+            best = np.argsort(-rated_values, kind='stable')[:self.seed_items]
+            seeds, seed_ratings = rated[best], rated_values[best]
+
+            # Movies rated by similar users, by similarity-weighted rating
+            # plus the rerank's recency boost.
+            similarity_scores, indices = neighbors
+            similar = similarity_scores > self.model.sim_threshold
+            rows = self.model.ratings_matrix[indices[similar]]
+            weights = np.repeat(similarity_scores[similar], np.diff(rows.indptr))
+            rated_by_neighbors, inverse = np.unique(rows.indices,
+                                                    return_inverse=True)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                means = (np.bincount(inverse, weights=weights * rows.data)
+                         / np.bincount(inverse, weights=weights))
+            means = np.nan_to_num(means) + self.recency_weight * \
+                self.recency[rated_by_neighbors]
+            rated_by_neighbors = rated_by_neighbors[
+                np.argsort(-means, kind='stable')]
+
+            # Similar movies of the seeds, weighted by the user's ratings.
+            similar_movies = self.item_neighbors[seeds]
+            weights = similar_movies.data * np.repeat(
+                seed_ratings, np.diff(similar_movies.indptr))
+            expanded, inverse = np.unique(similar_movies.indices,
+                                          return_inverse=True)
+            expanded = expanded[np.argsort(
+                -np.bincount(inverse, weights=weights), kind='stable')]
+
+            genres = [genre for genre in preferred_genres
+                      if genre in self.genre_popular]
+            if not genres and len(seeds):
+                seed_genres = np.asarray(
+                    self.column_genres[seeds].sum(axis=0)).ravel()
+                names = list(self.genres)
+                genres = [names[position] for position in
+                          np.argsort(-seed_genres, kind='stable')[:3]
+                          if seed_genres[position] > 0]
+            popular = interleave([self.genre_popular[genre]
+                                  for genre in genres])
+
+            merged = interleave([rated_by_neighbors, expanded, popular,
+                                 self.trending])
+            keep = self.in_catalogue[merged] & ~np.isin(merged, rated)
+            return merged[keep][:self.max_candidates]
+
+    def user_profile(self, user_id, preferred_genres=()):
+        """
+        Features of a user that do not depend on the candidates, cached
+        between requests.
+
+        Returns:
+            dict: "ratings" (the user's ratings by movie ID), "seeds" and
+            "seed_ratings" (columns and ratings of their top-rated movies)
+            and "genre_affinity" (shrunk mean deviation of their ratings
+            from the global mean per genre, plus a bonus for preferred
+            genres).
+        """
+        return self.user_features.get(
+            (user_id, tuple(preferred_genres)),
+            lambda: self._user_profile(user_id, preferred_genres))
+
+    def _user_profile(self, user_id, preferred_genres):
+        row = self.model.ratings_matrix[self.model.user_index[user_id]]
+        rated = row.indices[row.data > 0]
+        values = row.data[row.data > 0].astype(np.float64)
+        best = np.argsort(-values, kind='stable')[:self.seed_items]
+
+        genres = self.column_genres[rated]
+        totals = np.asarray(genres.T @ (values - self.global_mean)).ravel()
+        counts = np.asarray(genres.sum(axis=0)).ravel()
+        affinity = totals / (counts + GENRE_SHRINKAGE)
+        for genre in preferred_genres:
+            if genre in self.genres:
+                affinity[self.genres[genre]] += PREFERRED_GENRE_BONUS
+        return {
+            "ratings": dict(zip(self.column_ids[rated].tolist(),
+                                values.tolist())),
+            "seeds": rated[best],
+            "seed_ratings": values[best],
+            "genre_affinity": affinity,
+        }
+
+    def features(self, user_id, columns, predictions, preferred_genres=()):
+        """
+        The feature vectors the scorer uses, aligned with ``columns``.
+
+        Args:
+            user_id (int): ID of the user; must be in the model.
+            columns (numpy.ndarray): Column positions of the candidates.
+            predictions (numpy.ndarray): The candidates' predicted ratings.
+            preferred_genres (list): The user's preferred genres.
+
+        Returns:
+            dict: Feature vectors by name (see recommendation_engine.hybrid).
+        """
+        names = self.scorer.features
+        features = {}
+        if "cf" in names:
+            features["cf"] = predictions
+        if "popularity" in names:
+            features["popularity"] = self.popularity[columns]
+        if "recency" in names:
+            features["recency"] = self.recency[columns]
+        if not {"item_similarity", "genre_affinity", "content"} & set(names):
+            return features
+
+        profile = self.user_profile(user_id, preferred_genres)
+        if "genre_affinity" in names:
+            features["genre_affinity"] = \
+                self.genre_share[columns] @ profile["genre_affinity"]
+        if "item_similarity" in names:
+            similar = self.item_neighbors[profile["seeds"]]
+            weights = similar.data * np.repeat(
+                profile["seed_ratings"] / 5, np.diff(similar.indptr))
+            totals = np.bincount(similar.indices, weights=weights,
+                                 minlength=len(self.column_ids))
+            features["item_similarity"] = \
+                totals[columns] / max(len(profile["seeds"]), 1)
+        if "content" in names:
+            features["content"] = (
+                self.content.user_scores(profile["ratings"],
+                                         self.column_ids[columns])
+                if self.content is not None else np.zeros(len(columns)))
+        return features
+
+    def item_vectors(self, columns):
+        """
+        L2-normalized item vectors of columns, for diversity: content
+        vectors with a content engine, genre indicators otherwise.
+        """
+        if self.content is None:
+            return self.genre_vectors[columns]
+        rows = np.array([self.content.movie_index.get(movie_id, -1)
+                         for movie_id in self.column_ids[columns].tolist()],
+                        dtype=np.int64)
+        known = diags((rows >= 0).astype(np.float64))
+        return (known @ self.content.vectors[np.maximum(rows, 0)]).tocsr()
+
+    def rerank(self, user_id, columns, n, neighbors=None,
+               preferred_genres=(), diversity=None):
+        """
+        Score candidates exactly and pick the top n.
+
+        Args:
+            user_id (int): ID of the user; must be in the model.
+            columns (numpy.ndarray): Column positions of the candidates.
+            n (int): Number of movies to pick.
+            neighbors (tuple, optional): See candidates().
+            preferred_genres (list): The user's preferred genres.
+            diversity (float, optional): MMR diversity, 0 to 1; defaults to
+            the pipeline's.
+
+        Returns:
+            tuple: Movie IDs and predicted ratings (numpy arrays), in
+            selection order.
+        """
+        if neighbors is None:
+            neighbors = self._neighbors(user_id)
+        with timer("pipeline_rerank"):
+            movie_ids = self.column_ids[columns]
+            # As predict_many, without looking the neighbours up again.
+            predictions = self.model._score(
+                self.model.user_index[user_id], movie_ids, *neighbors)
+            valid = ~np.isnan(predictions)
+            columns, movie_ids = columns[valid], movie_ids[valid]
+            predictions = predictions[valid]
+            scores = self.scorer.score(self.features(
+                user_id, columns, predictions, preferred_genres))
+            # Ties go to the lower column, whatever order candidates came in.
+            order = np.lexsort((columns, -scores))
+            diversity = self.diversity if diversity is None else diversity
+            if diversity > 0:
+                order = order[mmr(scores[order],
+                                  self.item_vectors(columns[order]), n,
+                                  diversity)]
+            order = order[:n]
+            return movie_ids[order], predictions[order]
+
+    def recommend(self, user_id, n, preferred_genres=(), exhaustive=False,
+                  diversity=None):
+        """
+        Top n recommendations for a user.
+
+        Args:
+            user_id (int): ID of the user.
+            n (int): Number of recommendations.
+            preferred_genres (list): See candidates().
+            exhaustive (bool): Rerank every unrated movie instead of the
+            retrieved candidates, e.g. to measure the pipeline's recall.
+            diversity (float, optional): See rerank().
+
+        Returns:
+            tuple: Movie IDs and predicted ratings (numpy arrays), best
+            first. Both are empty for users the model does not know.
+        """
+        if user_id not in self.model.user_index:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        neighbors = self._neighbors(user_id)
+        if exhaustive:
+            row = self.model.ratings_matrix[self.model.user_index[user_id]]
+            unrated = self.in_catalogue.copy()
+            unrated[row.indices[row.data > 0]] = False
+            columns = np.flatnonzero(unrated)
+        else:
+            columns = self.candidates(user_id, preferred_genres, neighbors)
+        return self.rerank(user_id, columns, n, neighbors, preferred_genres,
+                           diversity)
@@ -0,0 +1,230 @@
+"""
+This module provides opt-in cProfile hooks for the recommendation pipeline.
+
+Profiles are written as ``.pstats`` files into a bounded ring directory:
+once more than ``max_profiles`` files exist the oldest ones are removed.
+Profiling is disabled unless the PROFILE_DIR environment variable is set.
+
+Only one profile runs per process at a time; blocks that start while
+another is running are not profiled. Before Python 3.12 cProfile only
+sees the thread it is enabled on, so work handed to another thread in a
+copy of the caller's context (contextvars.copy_context) joins the
+caller's profile with ``profile_worker``. From 3.12 cProfile runs on
+sys.monitoring, which allows a single profiler per process and shows it
+every thread, so ``profile_worker`` has nothing to add.
+
+Example:
+    >>> with PROFILER.profile("fit"):
+    ...     model.fit()
+    >>> with PROFILER.profile_worker():  # on a pool thread
+    ...     model.predict_many(user_id, movie_ids)
+    >>> print(hotspot_report("profiles", top_n=20))
+"""
+
+import cProfile
+import contextvars
+import glob
+import io
+import logging
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+PROFILE_SUFFIX = ".pstats"
+
+# cProfile on sys.monitoring: enabling a second profiler raises ValueError
+# and the running one records every thread.
+PROCESS_WIDE_PROFILER = sys.version_info >= (3, 12)
+
+# Held while a profile runs anywhere in the process.
+_running = threading.Lock()
+
+# Profiles of worker threads to merge into the profile running in this
+# context, None when no profile is running.
+_worker_profiles = contextvars.ContextVar("worker_profiles", default=None)
+
+
+class ProfileRecorder:
+    """
+    Capture cProfile profiles into a bounded directory.
+
+    Attributes:
+        directory (str or None): Directory the profiles are written to, or
+        None to disable profiling.
+        max_profiles (int): Maximum number of profiles kept on disk.
+        sample_rate (float): Fraction of requests that are profiled.
+    """
+
+    def __init__(self, directory=None, max_profiles=50, sample_rate=0.0):
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self.sample_rate = sample_rate
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            directory=os.getenv("PROFILE_DIR") or None,
+            max_profiles=int(os.getenv("PROFILE_MAX_FILES", "50")),
+            sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0")))
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def should_profile(self, forced=False):
+        """
+        Decide whether the current request should be profiled.
+
+        Args:
+            forced (bool): True if the client explicitly asked for a profile.
+
+        Returns:
+            bool: True if the request should be profiled.
+        """
+        if not self.enabled:
+            return False
+        return forced or random.random() < self.sample_rate
+
+    @contextmanager
+    def profile(self, name):
+        """
+        Profile the enclosed block and save it as ``<name>.pstats``.
+
+        Nested calls in the same thread are folded into the outer profile;
+        while another thread's profile runs the block is not profiled.
+
+        Args:
+            name (str): Label used in the profile file name.
+        """
+        if not self.enabled or getattr(self._local, "active", False) \
+                or not _running.acquire(blocking=False):
+            yield
+            return
+
+        profiler = _enable_profiler()
+        if profiler is None:
+            _running.release()
+            yield
+            return
+        workers = []
+        self._local.active = True
+        token = _worker_profiles.set(workers)
+        try:
+            yield
+        finally:
+            profiler.disable()
+            _worker_profiles.reset(token)
+            self._local.active = False
+            _running.release()
+            self._save(profiler, name, workers)
+
+    @contextmanager
+    def profile_worker(self):
+        """
+        Profile the enclosed block into the profile running in the current
+        context, for work a profiled block hands to another thread. A no-op
+        when no profile is running.
+        """
+        workers = _worker_profiles.get()
+        if workers is None or PROCESS_WIDE_PROFILER \
+                or getattr(self._local, "active", False):
+            yield
+            return
+
+        profiler = _enable_profiler()
+        if profiler is None:
+            yield
+            return
+        self._local.active = True
+        try:
+            yield
+        finally:
+            profiler.disable()
+            self._local.active = False
+            workers.append(profiler)
+
+    def profiled(self, name):
+        """
+        Decorator form of ``profile``.
+        """
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.profile(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _save(self, profiler, name, workers=()):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            file_name = (f"{time.time_ns()}-{os.getpid()}-"
+                         f"{name.replace('/', '_')}{PROFILE_SUFFIX}")
+            stats = pstats.Stats(profiler)
+            for worker in list(workers):
+                stats.add(worker)
+            stats.dump_stats(os.path.join(self.directory, file_name))
+            self._trim()
+        except OSError as e:
+            logging.error(f"Could not save profile {name}: {e}")
+
+    def _trim(self):
+        with self._lock:
+            files = sorted(glob.glob(
+                os.path.join(self.directory, f"*{PROFILE_SUFFIX}")))
+            for stale in files[:max(0, len(files) - self.max_profiles)]:
+                try:
+                    os.remove(stale)
+                except FileNotFoundError:
+                    pass
+
+
+def _enable_profiler():
+    """
+    Start a cProfile profiler, or return None if another profiling tool
+    holds the process.
+    """
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        logging.debug(f"Not profiling: {e}")
+        return None
+    return profiler
+
+
+PROFILER = ProfileRecorder.from_env()
+
+
+def hotspot_report(directory, top_n=25, sort_key="cumulative", name=None):
+    """
+    Merge the captured profiles into a top-N hotspot report.
+
+    Args:
+        directory (str): Directory containing ``.pstats`` files.
+        top_n (int, optional): Number of functions to list (default: 25).
+        sort_key (str, optional): pstats sort key (default: 'cumulative').
+        name (str, optional): Only merge profiles whose label contains this.
+
+    Returns:
+        str: The formatted report, or an empty string if there are no
+        profiles.
+    """
+    files = sorted(glob.glob(os.path.join(directory, f"*{PROFILE_SUFFIX}")))
+    if name is not None:
+        files = [f for f in files if name in os.path.basename(f)]
+    if not files:
+        return ""
+
+    output = io.StringIO()
+    stats = pstats.Stats(*files, stream=output)
+    output.write(f"Merged {len(files)} profiles from {directory}\n")
+    stats.strip_dirs().sort_stats(sort_key).print_stats(top_n)
+    return output.getvalue()
@@ -0,0 +1,445 @@
+"""
+This module partitions the user-based model across worker processes.
+
+Users are split into contiguous row ranges, one per shard. A shard holds
+its users' rows of the ratings matrix and answers two queries:
+
+- neighbours: the cosine top-n of its users for a batch of query rating
+  vectors, by a sparse product with its L2-normalized rows;
+- ratings: dense blocks of its users' ratings for given movies.
+
+``ShardedUserCF`` is the coordinator. To score a batch of users it fetches
+their rating rows from the shards that own them, sends the rows to every
+shard, and merges each user's per-shard neighbour lists (each already
+sorted) with a heap into the global top k + 1, the same neighbours a
+brute-force cosine index over all users finds. It then gathers the
+neighbours' ratings of the candidate movies from their shards and scores
+them like ``UserBasedCF``. Requests are sent to every shard before any
+reply is read, so the shards work in parallel.
+
+Shards run in processes started with the 'spawn' method, or in the
+calling process with ``local=True`` (for tests and debugging); both
+behave the same.
+
+Sharding splits only the similarity product; the rest of a batch costs
+more than in ``UserBasedCF``, whatever the number of shards M:
+
+- three IPC round trips (query rows from their owners, neighbours from
+  all M shards, neighbour ratings from their owners), each pickling its
+  arguments and replies through a pipe;
+- the query rows are pickled once per shard, so the bytes sent grow
+  with M;
+- the coordinator merges M sorted lists per user and assembles the dense
+  rating blocks;
+- batches go through the shards one at a time (one pipe per shard), so
+  concurrent scoring threads queue behind each other.
+
+A single shard is therefore no faster than the unsharded model, and M
+shards only pay off with a free core per shard and enough users that the
+similarity product dominates. On one core the shards time-share it and
+throughput falls as M grows (see benchmarks/sharding.py). MODEL_SHARDS
+is for models too large for one process, or hosts with idle cores.
+
+Example:
+    >>> model = ShardedUserCF(ratings_matrix, user_index, movie_index,
+    ...                       shards=4)
+    >>> model.fit()
+    >>> model.predict_many(user_id, movie_ids)
+    >>> model.close()
+"""
+
+import heapq
+import itertools
+import logging
+import multiprocessing
+import threading
+
+import numpy as np
+from scipy.sparse import csr_matrix, diags, vstack
+
+from recommendation_engine.collaborative_filtering import neighbor_scores
+from recommendation_engine.instrumentation import count, timer
+
+# Query rows multiplied against a shard at once; bounds the dense
+# similarity block to QUERY_BLOCK x shard users.
+QUERY_BLOCK = 64
+
+
+def shard_bounds(n_rows, shards):
+    """
+    Row offsets splitting n_rows into ``shards`` contiguous ranges of
+    (nearly) equal size.
+    """
+    return np.linspace(0, n_rows, shards + 1).round().astype(np.int64)
+
+
+class UserShard:
+    """
+    One shard's users: a row range of the ratings matrix.
+
+    Args:
+        ratings (scipy.sparse.csr_matrix): The shard's rows.
+        offset (int): Row of the shard's first user in the full matrix.
+    """
+
+    def __init__(self, ratings, offset):
+        self.ratings = csr_matrix(ratings)
+        self.offset = offset
+        norms = np.sqrt(np.asarray(
+            self.ratings.multiply(self.ratings).sum(axis=1))).ravel()
+        inverse = np.zeros_like(norms)
+        np.divide(1.0, norms, out=inverse, where=norms > 0)
+        # Transposed once, so queries are one sparse product.
+        self.normalized_t = (diags(inverse) @ self.ratings).T.tocsr()
+
+    def neighbors(self, queries, n):
+        """
+        The n users of the shard most cosine-similar to each query.
+
+        Args:
+            queries (scipy.sparse.csr_matrix): Query rating rows.
+            n (int): Neighbours per query.
+
+        Returns:
+            tuple: Similarities and global rows (queries x min(n, users)
+            arrays), each row in decreasing similarity.
+        """
+        n = min(n, self.ratings.shape[0])
+        norms = np.sqrt(np.asarray(queries.multiply(queries).sum(axis=1)))
+        inverse = np.zeros_like(norms)
+        np.divide(1.0, norms, out=inverse, where=norms > 0)
+        similarities = np.empty((queries.shape[0], n))
+        rows = np.empty((queries.shape[0], n), dtype=np.int64)
+        for start in range(0, queries.shape[0], QUERY_BLOCK):
+            stop = min(start + QUERY_BLOCK, queries.shape[0])
+            block = (queries[start:stop] @ self.normalized_t).toarray()
+            block *= inverse[start:stop]
+            top = np.argpartition(-block, n - 1, axis=1)[:, :n] \
+                if n < block.shape[1] else np.tile(
+                    np.arange(block.shape[1]), (stop - start, 1))
+            values = np.take_along_axis(block, top, axis=1)
+            order = np.argsort(-values, axis=1, kind='stable')
+            similarities[start:stop] = np.take_along_axis(values, order, 1)
+            rows[start:stop] = np.take_along_axis(top, order, 1) + self.offset
+        return similarities, rows
+
+    def ratings_of(self, requests):
+        """
+        Dense rating blocks.
+
+        Args:
+            requests (list): (global rows, columns) pairs.
+
+        Returns:
+            list: A rows x columns numpy.ndarray per request.
+        """
+        return [self.ratings[rows - self.offset][:, columns].toarray()
+                for rows, columns in requests]
+
+    def rows(self, rows):
+        """
+        The rating rows of global rows, as a CSR matrix.
+        """
+        return self.ratings[np.asarray(rows) - self.offset]
+
+
+def _serve_shard(connection, ratings, offset):
+    """
+    Worker process loop: answer (method, args) messages until None.
+    """
+    shard = UserShard(ratings, offset)
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        method, args = message
+        try:
+            connection.send((True, getattr(shard, method)(*args)))
+        except Exception as e:
+            connection.send((False, f"{type(e).__name__}: {e}"))
+    connection.close()
+
+
+class ShardError(Exception):
+    """
+    Raised by the coordinator when a shard fails to answer a query.
+    """
+
+
+class LocalShard:
+    """
+    A shard in the calling process, with ShardProcess's interface.
+    """
+
+    def __init__(self, ratings, offset):
+        self.shard = UserShard(ratings, offset)
+        self._result = None
+
+    def submit(self, method, *args):
+        self._result = getattr(self.shard, method)(*args)
+
+    def result(self):
+        result, self._result = self._result, None
+        return result
+
+    def close(self):
+        pass
+
+
+class ShardProcess:
+    """
+    A shard served by a worker process over a pipe.
+
+    submit() sends a query without waiting, so queries to several shards
+    run concurrently; result() waits for the reply.
+    """
+
+    def __init__(self, ratings, offset, context=None):
+        context = context or multiprocessing.get_context('spawn')
+        self._connection, child = context.Pipe()
+        self.process = context.Process(
+            target=_serve_shard, args=(child, ratings, offset),
+            name=f"user-shard-{offset}", daemon=True)
+        self.process.start()
+        child.close()
+
+    def submit(self, method, *args):
+        self._connection.send((method, args))
+
+    def result(self):
+        ok, result = self._connection.recv()
+        if not ok:
+            raise ShardError(result)
+        return result
+
+    def close(self):
+        if self.process.is_alive():
+            try:
+                self._connection.send(None)
+            except OSError:
+                pass
+            self.process.join(5)
+            if self.process.is_alive():
+                self.process.terminate()
+        self._connection.close()
+
+
+class ShardedUserCF:
+    """
+    User-based collaborative filtering over users partitioned into shards.
+
+    Predictions match UserBasedCF with the cosine metric. Only the
+    prediction methods of UserBasedCF are provided, so the API uses the
+    exhaustive (non-pipeline) ranking with this model.
+
+    Args:
+        ratings_matrix (scipy.sparse matrix): Sparse matrix of user-movie
+        ratings, partitioned by row and handed to the shards on fit().
+        user_index (dict or IdIndex): Mapping of user IDs to rows.
+        movie_index (dict or IdIndex): Mapping of movie IDs to columns.
+        shards (int): Number of shards.
+        k (int): Number of nearest neighbours to consider.
+        sim_threshold (float): Minimum similarity of a valid neighbour.
+        local (bool): Run the shards in this process instead of worker
+        processes.
+
+    Attributes:
+        bounds (numpy.ndarray): First row of each shard, then the number of
+        rows.
+        rating_counts (numpy.ndarray): Number of ratings of each user.
+        movie_stats (MovieStatistics): Fallback ratings, when attached.
+    """
+
+    def __init__(self, ratings_matrix, user_index, movie_index, shards=2,
+                 k=30, sim_threshold=0.2, local=False):
+        self._ratings = csr_matrix(ratings_matrix)
+        self.user_index = user_index
+        self.movie_index = movie_index
+        self.k = k
+        self.sim_threshold = sim_threshold
+        self.local = local
+        self.bounds = shard_bounds(self._ratings.shape[0],
+                                   min(shards, max(self._ratings.shape[0], 1)))
+        # Kept after fit() hands the ratings to the shards, for cold start.
+        self.rating_counts = np.diff(self._ratings.indptr)
+        self.shards = []
+        self.movie_stats = None
+        # One query at a time per pipe; scoring threads take turns.
+        self._lock = threading.Lock()
+
+    def fit(self):
+        """
+        Start the shards, handing each its rows of the ratings matrix.
+        """
+        self.close()
+        with timer("model_fit"):
+            for start, stop in zip(self.bounds[:-1], self.bounds[1:]):
+                rows = self._ratings[start:stop]
+                self.shards.append(LocalShard(rows, start) if self.local
+                                   else ShardProcess(rows, start))
+        logging.debug(f"Started {len(self.shards)} user shards.")
+        # The coordinator keeps only the shards from here on.
+        self._ratings = None
+
+    def close(self):
+        """
+        Stop the shards' worker processes.
+        """
+        for shard in self.shards:
+            shard.close()
+        self.shards = []
+
+    def _fan_out(self, calls):
+        """
+        Run {shard number: (method, args)} on the shards concurrently.
+
+        Returns:
+            dict: The result of each shard's call.
+        """
+        with self._lock:
+            for number, (method, args) in calls.items():
+                self.shards[number].submit(method, *args)
+            return {number: self.shards[number].result()
+                    for number in calls}
+
+    def _shard_of(self, rows):
+        return np.searchsorted(self.bounds, rows, side='right') - 1
+
+    def _gather_rows(self, rows):
+        """
+        The rating rows of global rows, fetched from their shards.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        owners = self._shard_of(rows)
+        results = self._fan_out({
+            int(number): ("rows", (rows[owners == number],))
+            for number in np.unique(owners)})
+        parts = [results[int(number)] for number in np.unique(owners)]
+        # vstack follows the shard order; put the rows back in query order.
+        order = np.argsort(owners, kind='stable')
+        stacked = vstack(parts).tocsr()
+        return stacked[np.argsort(order)]
+
+    def _neighbors_batch(self, user_idxs):
+        """
+        Look up the k + 1 nearest neighbours (the user included, as in
+        UserBasedCF) of several users across all shards.
+
+        Returns:
+            list: A (similarity scores, row indices) tuple per user.
+        """
+        with timer("knn_query"):
+            queries = self._gather_rows(user_idxs)
+            results = self._fan_out({
+                number: ("neighbors", (queries, self.k + 1))
+                for number in range(len(self.shards))})
+            count("shard_queries_total", len(self.shards))
+
+            neighbors = []
+            for position in range(len(user_idxs)):
+                # Merge the shards' sorted lists, most similar first.
+                merged = heapq.merge(*[
+                    zip((-results[number][0][position]).tolist(),
+                        results[number][1][position].tolist())
+                    for number in range(len(self.shards))])
+                top = list(itertools.islice(merged, self.k + 1))
+                neighbors.append((-np.array([sim for sim, _ in top]),
+                                  np.array([row for _, row in top],
+                                           dtype=np.int64)))
+        return neighbors
+
+    def _gather_ratings(self, requests):
+        """
+        Dense (rows x columns) rating blocks, assembled from the shards.
+
+        Args:
+            requests (list): (global rows, columns) pairs.
+        """
+        per_shard = {}
+        for position, (rows, columns) in enumerate(requests):
+            owners = self._shard_of(rows)
+            for number in np.unique(owners).tolist():
+                picked = np.flatnonzero(owners == number)
+                per_shard.setdefault(number, []).append(
+                    (position, picked, rows[picked], columns))
+        results = self._fan_out({
+            number: ("ratings_of", ([(rows, columns) for _, _, rows, columns
+                                     in parts],))
+            for number, parts in per_shard.items()})
+
+        blocks = [np.zeros((len(rows), len(columns)))
+                  for rows, columns in requests]
+        for number, parts in per_shard.items():
+            for (position, picked, _, _), block in zip(parts, results[number]):
+                blocks[position][picked] = block
+        return blocks
+
+    def predict_batch(self, user_ids, movie_id_lists):
+        """
+        Predict ratings for several users at once (see
+        UserBasedCF.predict_batch).
+
+        Returns:
+            list: One numpy.ndarray of predicted ratings per user.
+        """
+        results = [None] * len(user_ids)
+        pending = []
+        for position, (user_id, movie_ids) in enumerate(
+                zip(user_ids, movie_id_lists)):
+            movie_ids = np.asarray(movie_ids)
+            if len(movie_ids) == 0:
+                results[position] = np.full(0, np.nan)
+            elif user_id not in self.user_index or not self.shards:
+                results[position] = np.array(
+                    [self.get_fallback_rating(movie_id)
+                     for movie_id in movie_ids])
+            else:
+                pending.append((position, self.user_index[user_id], movie_ids))
+        if not pending:
+            return results
+
+        neighbors = self._neighbors_batch(
+            [user_idx for _, user_idx, _ in pending])
+        requests, columns_of = [], []
+        for (_, user_idx, movie_ids), (_, indices) in zip(pending, neighbors):
+            known = np.array([movie_id in self.movie_index
+                              for movie_id in movie_ids], dtype=bool)
+            columns = np.array([self.movie_index[movie_id] for movie_id
+                                in movie_ids[known]], dtype=np.int64)
+            columns_of.append((known, columns))
+            # The user's own row first, then the neighbours'.
+            requests.append((np.concatenate(([user_idx], indices)), columns))
+        blocks = self._gather_ratings(requests)
+
+        for (position, _, movie_ids), (similarities, _), (known, _), block \
+                in zip(pending, neighbors, columns_of, blocks):
+            scored, rated = neighbor_scores(
+                similarities, block[1:], block[0], self.k, self.sim_threshold)
+            predictions = np.full(len(movie_ids), np.nan)
+            predictions[known] = scored
+            has_neighbors = np.zeros(len(movie_ids), dtype=bool)
+            has_neighbors[known] = rated
+            for missing in np.flatnonzero(~has_neighbors):
+                predictions[missing] = self.get_fallback_rating(
+                    movie_ids[missing])
+            results[position] = predictions
+        return results
+
+    def predict_many(self, user_id, movie_ids):
+        """
+        Predicted ratings of one user for many movies.
+        """
+        return self.predict_batch([user_id], [movie_ids])[0]
+
+    def predict(self, user_id, movie_id):
+        return float(self.predict_many(user_id, [movie_id])[0])
+
+    def get_fallback_rating(self, movie_id):
+        """
+        The movie's Bayesian mean rating, or a neutral 3.0 without
+        statistics.
+        """
+        count("fallback_ratings_total")
+        stats = (self.movie_stats.get(movie_id)
+                 if self.movie_stats is not None else None)
+        return stats['bayesian_mean'] if stats is not None else 3.0
@@ -0,0 +1,271 @@
+"""
+This module shares one fitted model between many server processes through
+memory-mapped files.
+
+A single loader process fits the model and publishes its arrays (the CSR
+ratings matrix, a top-k neighbour table, the ID maps and the movie
+statistics) as ``.npy`` files in a new generation directory, then points
+the ``CURRENT`` file at it. Worker processes map those files read-only, so
+the operating system keeps one copy of the pages no matter how many
+workers attach, and switch to a newer generation when ``CURRENT`` changes,
+without restarting.
+
+Putting the store on a tmpfs such as /dev/shm keeps the files in memory::
+
+    MODEL_SHARE_DIR=/dev/shm/cortexeng python -m cli.main publish-model \\
+        --interval 600 &
+    MODEL_SHARE_DIR=/dev/shm/cortexeng gunicorn -w 8 "api.app:create_app()"
+
+Example:
+    >>> store = SharedModelStore("/dev/shm/cortexeng")
+    >>> store.publish(model, known_user_ids)
+    >>> reader = SharedModelReader(store)
+    >>> reader.refresh()
+    >>> reader.model.predict_many(user_id, movie_ids)
+"""
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from recommendation_engine.compact import (
+    IdIndex, index_from_ids, index_ids)
+from recommendation_engine.movie_stats import MovieStatistics
+
+CURRENT_FILE = "CURRENT"
+GENERATION_PREFIX = "gen-"
+FORMAT_VERSION = 1
+
+
+class SharedModelStore:
+    """
+    Directory of published model generations.
+
+    Args:
+        directory (str): Where generations are written. It is created if
+        missing.
+        keep (int): Number of generations kept on disk. Workers that still
+        map an older, deleted generation keep working until they refresh.
+    """
+
+    def __init__(self, directory, keep=2):
+        self.directory = directory
+        self.keep = max(keep, 1)
+        os.makedirs(directory, exist_ok=True)
+
+    def current_generation(self):
+        """
+        Returns:
+            int: The latest published generation, or None.
+        """
+        try:
+            with open(os.path.join(self.directory, CURRENT_FILE)) as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _path(self, generation):
+        return os.path.join(self.directory,
+                            f"{GENERATION_PREFIX}{generation:08d}")
+
+    def publish(self, model, known_user_ids=None):
+        """
+        Write a fitted model as a new generation and make it current.
+
+        Models fitted with a scikit-learn NearestNeighbors index are
+        published with an equivalent top-k neighbour table, since workers
+        cannot share the scikit-learn object.
+
+        Args:
+            model (UserBasedCF): The fitted model.
+            known_user_ids (set or IdIndex, optional): IDs of users with
+            ratings.
+
+        Returns:
+            int: The new generation number.
+        """
+        from recommendation_engine.similarity import similarity_matrix
+
+        ratings = csr_matrix(model.ratings_matrix)
+        neighbors = model.neighbor_table
+        if neighbors is None:
+            neighbors = similarity_matrix(
+                ratings, model.similarity_metric, top_k=model.k)
+
+        arrays = {
+            'ratings_data': ratings.data,
+            'ratings_indices': ratings.indices,
+            'ratings_indptr': ratings.indptr,
+            'neighbors_data': neighbors.data,
+            'neighbors_indices': neighbors.indices,
+            'neighbors_indptr': neighbors.indptr,
+            'user_ids': index_ids(model.user_index),
+            'movie_ids': index_ids(model.movie_index),
+        }
+        if known_user_ids is not None:
+            arrays['known_user_ids'] = (
+                known_user_ids.ids if isinstance(known_user_ids, IdIndex)
+                else np.array(sorted(known_user_ids), dtype=np.int64))
+        stats = model.movie_stats
+        if stats is not None:
+            arrays.update(stats_movie_ids=stats.movie_ids.ids,
+                          stats_counts=stats.counts, stats_sums=stats.sums,
+                          stats_sum_squares=stats.sum_squares,
+                          stats_last_rated=stats.last_rated)
+
+        generation = (self.current_generation() or 0) + 1
+        staging = tempfile.mkdtemp(prefix=".staging-", dir=self.directory)
+        try:
+            for name, array in arrays.items():
+                np.save(os.path.join(staging, f"{name}.npy"),
+                        np.ascontiguousarray(array))
+            with open(os.path.join(staging, "meta.json"), "w") as f:
+                json.dump({
+                    'format': FORMAT_VERSION,
+                    'generation': generation,
+                    'shape': list(ratings.shape),
+                    'similarity_metric': model.similarity_metric,
+                    'k': model.k,
+                    'sim_threshold': model.sim_threshold,
+                    'prior_weight': stats.prior_weight if stats else None,
+                    'published_at': time.time(),
+                }, f)
+            os.rename(staging, self._path(generation))
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        # Readers only look at CURRENT, so the switch is a single rename.
+        pointer = os.path.join(self.directory, f".{CURRENT_FILE}.{os.getpid()}")
+        with open(pointer, "w") as f:
+            f.write(str(generation))
+        os.replace(pointer, os.path.join(self.directory, CURRENT_FILE))
+        self._remove_old(generation)
+        logging.info(
+            f"Published model generation {generation} to {self.directory}")
+        return generation
+
+    def _remove_old(self, current):
+        for name in os.listdir(self.directory):
+            if not name.startswith(GENERATION_PREFIX):
+                continue
+            generation = int(name[len(GENERATION_PREFIX):])
+            if generation <= current - self.keep:
+                shutil.rmtree(os.path.join(self.directory, name),
+                              ignore_errors=True)
+
+    def attach(self, generation=None):
+        """
+        Map a generation into this process.
+
+        The ratings matrix, neighbour table and ID maps are read-only views
+        of the files. The movie statistics are mapped copy-on-write so this
+        process can still apply its own rating writes to them.
+
+        Args:
+            generation (int, optional): Defaults to the current generation.
+
+        Returns:
+            tuple: The model (UserBasedCF), the known user IDs (IdIndex or
+            None) and the generation number.
+        """
+        from recommendation_engine.collaborative_filtering import UserBasedCF
+
+        if generation is None:
+            generation = self.current_generation()
+        if generation is None:
+            raise FileNotFoundError(
+                f"No model has been published to {self.directory}")
+        path = self._path(generation)
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+
+        def load(name, mode='r'):
+            file_path = os.path.join(path, f"{name}.npy")
+            if not os.path.exists(file_path):
+                return None
+            return np.load(file_path, mmap_mode=mode)
+
+        shape = tuple(meta['shape'])
+        ratings = csr_matrix((load('ratings_data'), load('ratings_indices'),
+                              load('ratings_indptr')), shape=shape)
+        model = UserBasedCF(
+            ratings, index_from_ids(load('user_ids')),
+            index_from_ids(load('movie_ids')),
+            similarity_metric=meta['similarity_metric'], k=meta['k'],
+            sim_threshold=meta['sim_threshold'])
+        model.neighbor_table = csr_matrix(
+            (load('neighbors_data'), load('neighbors_indices'),
+             load('neighbors_indptr')), shape=(shape[0], shape[0]))
+
+        stats_ids = load('stats_movie_ids', mode='c')
+        if stats_ids is not None:
+            model.movie_stats = MovieStatistics(
+                stats_ids, load('stats_counts', mode='c'),
+                load('stats_sums', mode='c'),
+                load('stats_sum_squares', mode='c'),
+                load('stats_last_rated', mode='c'),
+                prior_weight=meta['prior_weight'])
+
+        known = load('known_user_ids')
+        known_user_ids = IdIndex.from_sorted(known) if known is not None else None
+        return model, known_user_ids, generation
+
+
+class SharedModelReader:
+    """
+    Keeps a process attached to the current generation of a store.
+
+    Args:
+        store (SharedModelStore): The store to read from.
+        poll_interval (float): Minimum number of seconds between checks of
+        the CURRENT file.
+
+    Attributes:
+        model (UserBasedCF): The attached model, or None.
+        known_user_ids (IdIndex): Known user IDs of the attached model.
+        generation (int): The attached generation, or None.
+    """
+
+    def __init__(self, store, poll_interval=1.0):
+        self.store = store
+        self.poll_interval = poll_interval
+        self.model = None
+        self.known_user_ids = None
+        self.generation = None
+        self._checked_at = float('-inf')
+
+    def refresh(self, force=False):
+        """
+        Attach the current generation if it is newer than the attached one.
+
+        Args:
+            force (bool): Check CURRENT even if poll_interval has not passed.
+
+        Returns:
+            bool: True if a new generation was attached.
+        """
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.poll_interval:
+            return False
+        self._checked_at = now
+
+        generation = self.store.current_generation()
+        if generation is None or generation == self.generation:
+            return False
+        try:
+            model, known_user_ids, generation = self.store.attach(generation)
+        except FileNotFoundError:
+            # Removed by a newer publish between reading CURRENT and
+            # attaching; the next check picks up the newer generation.
+            return False
+        self.model, self.known_user_ids = model, known_user_ids
+        self.generation = generation
+        logging.info(f"Attached shared model generation {generation}")
+        return True
@@ -0,0 +1,401 @@
+"""
+This module computes user-user similarities on sparse CSR rating matrices.
+
+Similarities are computed one block of rows at a time with sparse matrix
+products and ``indptr`` arithmetic only, so the full user x user matrix is
+never densified. Each block can optionally be truncated to the top-k
+neighbours per row.
+
+Supported metrics:
+    cosine: Cosine similarity of the raw rating vectors.
+    adjusted_cosine: Cosine similarity after subtracting each item's mean
+    rating.
+    pearson: Pearson correlation over the items both users rated, with
+    each user's ratings centred on their own mean.
+    jaccard: Size of the intersection over the union of the rated items.
+    shrunk_cosine: Cosine similarity multiplied by n / (n + shrinkage),
+    where n is the number of co-rated items.
+
+neighbor_table() computes the top-k table on a thread pool, one row block
+per task (SciPy's sparse products and NumPy's selection release the GIL),
+with the block size derived from a memory ceiling.
+
+Example:
+    >>> neighbours = similarity_matrix(ratings_matrix, metric='pearson',
+    ...                                top_k=30)
+    >>> neighbours[user_idx].indices  # nearest users of user_idx
+    >>> neighbours = neighbor_table(ratings_matrix, top_k=30, n_jobs=8,
+    ...                             max_memory=2 * 1024 ** 3)
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+
+SIMILARITY_METRICS = ('cosine', 'adjusted_cosine', 'pearson', 'jaccard',
+                      'shrunk_cosine')
+
+DEFAULT_BLOCK_SIZE = 1024
+DEFAULT_SHRINKAGE = 10.0
+
+# Sparse similarity products each metric builds per block (see
+# _BlockComputer.block), used to bound a block's memory.
+_BLOCK_PRODUCTS = {'cosine': 1, 'adjusted_cosine': 1, 'shrunk_cosine': 3,
+                   'pearson': 5, 'jaccard': 1}
+# Worst-case bytes per block cell: float64 value and int32 column per
+# sparse product, plus the dense float64 copy and the int64 row ids and
+# positions of the top-k selection.
+_SPARSE_CELL_BYTES = 12
+_SELECTION_CELL_BYTES = 24
+
+
+def _as_csr(matrix):
+    matrix = csr_matrix(matrix, dtype=np.float64)
+    matrix.sum_duplicates()
+    return matrix
+
+
+def _row_ids(matrix):
+    """
+    Row number of every stored entry, derived from ``indptr``.
+    """
+    return np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+
+
+def _with_data(matrix, data):
+    return csr_matrix((data, matrix.indices, matrix.indptr),
+                      shape=matrix.shape)
+
+
+def _binary(matrix):
+    return _with_data(matrix, np.ones_like(matrix.data))
+
+
+def row_means(matrix):
+    """
+    Mean of the stored (rated) entries of each row.
+
+    Args:
+        matrix (scipy.sparse.csr_matrix): Ratings matrix.
+
+    Returns:
+        numpy.ndarray: Row means, 0 for empty rows.
+    """
+    counts = np.diff(matrix.indptr)
+    sums = np.bincount(_row_ids(matrix), weights=matrix.data,
+                       minlength=matrix.shape[0])
+    return sums / np.maximum(counts, 1)
+
+
+def column_means(matrix):
+    """
+    Mean of the stored (rated) entries of each column.
+    """
+    counts = np.bincount(matrix.indices, minlength=matrix.shape[1])
+    sums = np.bincount(matrix.indices, weights=matrix.data,
+                       minlength=matrix.shape[1])
+    return sums / np.maximum(counts, 1)
+
+
+def _row_norms(matrix):
+    return np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+
+
+def _inverse(values):
+    inverse = np.zeros_like(values, dtype=np.float64)
+    np.divide(1.0, values, out=inverse, where=values > 0)
+    return inverse
+
+
+def _scale(block, row_factors, column_factors):
+    """
+    Multiply ``block[i, j]`` by ``row_factors[i] * column_factors[j]`` in
+    place, using the CSR structure directly.
+    """
+    block.data *= np.repeat(row_factors, np.diff(block.indptr))
+    block.data *= column_factors[block.indices]
+    return block
+
+
+class _BlockComputer:
+    """
+    Precomputed operands for one metric, evaluated one row block at a time.
+    """
+
+    def __init__(self, matrix, metric, shrinkage):
+        if metric not in SIMILARITY_METRICS:
+            raise ValueError(
+                f"Unknown similarity metric {metric!r}; expected one of "
+                f"{', '.join(SIMILARITY_METRICS)}.")
+        self.metric = metric
+        self.shrinkage = shrinkage
+        self.matrix = matrix
+
+        if metric == 'adjusted_cosine':
+            centred = matrix.copy()
+            centred.data -= column_means(matrix)[matrix.indices]
+            self.vectors = centred
+        else:
+            self.vectors = matrix
+
+        if metric in ('cosine', 'adjusted_cosine', 'shrunk_cosine'):
+            self.inverse_norms = _inverse(_row_norms(self.vectors))
+            self.transposed = self.vectors.T.tocsr()
+
+        if metric in ('pearson', 'jaccard', 'shrunk_cosine'):
+            self.binary = _binary(matrix)
+            self.binary_transposed = self.binary.T.tocsr()
+
+        if metric == 'pearson':
+            centred = matrix.copy()
+            centred.data -= np.repeat(row_means(matrix),
+                                      np.diff(matrix.indptr))
+            self.centred = centred
+            self.centred_transposed = centred.T.tocsr()
+            self.squared = centred.multiply(centred).tocsr()
+            self.squared_transposed = self.squared.T.tocsr()
+
+        if metric == 'jaccard':
+            self.counts = np.diff(matrix.indptr).astype(np.float64)
+
+    def block(self, start, stop):
+        rows = slice(start, stop)
+        if self.metric in ('cosine', 'adjusted_cosine', 'shrunk_cosine'):
+            block = (self.vectors[rows] @ self.transposed).tocsr()
+            _scale(block, self.inverse_norms[rows], self.inverse_norms)
+            if self.metric == 'shrunk_cosine':
+                overlap = (self.binary[rows] @ self.binary_transposed).tocsr()
+                overlap.data = overlap.data / (overlap.data + self.shrinkage)
+                block = block.multiply(overlap).tocsr()
+            return block
+
+        if self.metric == 'pearson':
+            numerator = (self.centred[rows] @ self.centred_transposed).tocsr()
+            # Sums of squared deviations restricted to co-rated items.
+            own = (self.squared[rows] @ self.binary_transposed).tocsr()
+            other = (self.binary[rows] @ self.squared_transposed).tocsr()
+            denominator = own.multiply(other).tocsr()
+            denominator.data = 1.0 / np.sqrt(denominator.data)
+            return numerator.multiply(denominator).tocsr()
+
+        # jaccard
+        intersection = (self.binary[rows] @ self.binary_transposed).tocsr()
+        block_rows = np.repeat(np.arange(start, stop),
+                               np.diff(intersection.indptr))
+        union = (self.counts[block_rows] + self.counts[intersection.indices]
+                 - intersection.data)
+        intersection.data = intersection.data / union
+        return intersection
+
+
+def top_k_per_row(block, k, min_similarity=None):
+    """
+    Keep only the k largest entries of every row of a CSR block.
+
+    Selection is vectorized over the whole block: entries are sorted by
+    (row, -value) and ranked within their row via ``indptr``.
+
+    Args:
+        block (scipy.sparse.csr_matrix): Similarity block.
+        k (int): Number of entries to keep per row.
+        min_similarity (float, optional): Drop entries at or below this
+        value before ranking.
+
+    Returns:
+        scipy.sparse.csr_matrix: Truncated block with rows sorted by
+        decreasing similarity.
+    """
+    block = block.tocsr()
+    block.eliminate_zeros()
+    rows = _row_ids(block)
+    data, indices = block.data, block.indices
+    if min_similarity is not None:
+        keep = data > min_similarity
+        rows, data, indices = rows[keep], data[keep], indices[keep]
+
+    order = np.lexsort((-data, rows))
+    rows, data, indices = rows[order], data[order], indices[order]
+    counts = np.bincount(rows, minlength=block.shape[0])
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    rank = np.arange(len(rows)) - np.repeat(starts, counts)
+    keep = rank < k
+
+    kept_counts = np.minimum(counts, k)
+    indptr = np.concatenate(([0], np.cumsum(kept_counts)))
+    return csr_matrix((data[keep], indices[keep], indptr), shape=block.shape)
+
+
+def _drop_diagonal(block, start):
+    rows = _row_ids(block) + start
+    block.data[rows == block.indices] = 0.0
+    block.eliminate_zeros()
+    return block
+
+
+def similarity_blocks(matrix, metric='cosine', block_size=DEFAULT_BLOCK_SIZE,
+                      top_k=None, min_similarity=None,
+                      shrinkage=DEFAULT_SHRINKAGE, include_self=False):
+    """
+    Compute user-user similarities one row block at a time.
+
+    Args:
+        matrix (scipy.sparse matrix): Users x items ratings matrix.
+        metric (str, optional): One of SIMILARITY_METRICS (default: 'cosine').
+        block_size (int, optional): Rows per block (default: 1024).
+        top_k (int, optional): Keep only the k most similar users per row.
+        min_similarity (float, optional): Drop similarities at or below
+        this value when truncating to top_k.
+        shrinkage (float, optional): Shrinkage for 'shrunk_cosine'.
+        include_self (bool, optional): Keep each user's similarity to
+        themselves (default: False).
+
+    Yields:
+        tuple: (start, stop, block) with block a CSR matrix of shape
+        (stop - start, n_users).
+    """
+    matrix = _as_csr(matrix)
+    computer = _BlockComputer(matrix, metric, shrinkage)
+    n_rows = matrix.shape[0]
+    for start in range(0, n_rows, block_size):
+        stop = min(start + block_size, n_rows)
+        block = computer.block(start, stop)
+        if not include_self:
+            block = _drop_diagonal(block, start)
+        if top_k is not None:
+            block = top_k_per_row(block, top_k, min_similarity)
+        yield start, stop, block
+
+
+def similarity_matrix(matrix, metric='cosine', block_size=DEFAULT_BLOCK_SIZE,
+                      top_k=None, min_similarity=None,
+                      shrinkage=DEFAULT_SHRINKAGE, include_self=False):
+    """
+    Compute the sparse user x user similarity matrix.
+
+    Takes the same arguments as ``similarity_blocks``.
+
+    Returns:
+        scipy.sparse.csr_matrix: Similarities; with ``top_k`` each row
+        holds at most k entries sorted by decreasing similarity.
+    """
+    blocks = [block for _, _, block in similarity_blocks(
+        matrix, metric, block_size, top_k, min_similarity, shrinkage,
+        include_self)]
+    if not blocks:
+        n_rows = matrix.shape[0]
+        return csr_matrix((n_rows, n_rows))
+    return vstack(blocks, format='csr')
+
+
+def _top_k_dense(block, start, k, min_similarity=None):
+    """
+    Top-k entries per row of a block, selected on its dense form with
+    ``np.argpartition``. The user's own column (row + start) is dropped.
+    """
+    n_rows, n_columns = block.shape
+    rows, columns, values = _row_ids(block), block.indices, block.data
+    keep = values != 0.0 if min_similarity is None \
+        else values > min_similarity
+    # Negated, with +inf for missing entries: argpartition selects the
+    # smallest values.
+    dense = np.full(block.shape, np.inf)
+    dense[rows[keep], columns[keep]] = -values[keep]
+    dense[np.arange(n_rows), np.arange(start, start + n_rows)] = np.inf
+    k = min(k, n_columns)
+    if k < n_columns:
+        columns = np.argpartition(dense, k - 1, axis=1)[:, :k]
+    else:
+        columns = np.broadcast_to(np.arange(n_columns), dense.shape)
+    values = np.take_along_axis(dense, columns, axis=1)
+    order = np.argsort(values, axis=1, kind='stable')
+    columns = np.take_along_axis(columns, order, axis=1)
+    values = -np.take_along_axis(values, order, axis=1)
+    # Dropped entries are -inf and sorted last in their row.
+    keep = np.isfinite(values)
+    indptr = np.concatenate(([0], np.cumsum(keep.sum(axis=1))))
+    return csr_matrix((values[keep], columns[keep].astype(np.int32), indptr),
+                      shape=block.shape)
+
+
+def neighbor_block_size(n_rows, n_columns, metric='cosine', top_k=30,
+                        n_jobs=1, max_memory=None, operand_bytes=0):
+    """
+    Rows per block so that the neighbour table, the operands and n_jobs
+    blocks in flight stay within max_memory bytes.
+
+    A block is budgeted at its worst case, every similarity stored.
+
+    Raises:
+        MemoryError: If not even one row per job fits.
+    """
+    if max_memory is None:
+        return DEFAULT_BLOCK_SIZE
+    table_bytes = n_rows * min(top_k, n_columns) * _SPARSE_CELL_BYTES
+    row_bytes = n_columns * (
+        _BLOCK_PRODUCTS[metric] * _SPARSE_CELL_BYTES + _SELECTION_CELL_BYTES)
+    budget = max_memory - table_bytes - operand_bytes
+    rows = budget // (n_jobs * row_bytes)
+    if rows < 1:
+        raise MemoryError(
+            f"max_memory={max_memory} bytes is below the "
+            f"{table_bytes + operand_bytes + n_jobs * row_bytes} bytes needed "
+            f"for a {n_rows}-user neighbour table with {n_jobs} jobs.")
+    return int(min(rows, DEFAULT_BLOCK_SIZE))
+
+
+def neighbor_table(matrix, metric='cosine', top_k=30, min_similarity=None,
+                   n_jobs=1, max_memory=None, shrinkage=DEFAULT_SHRINKAGE):
+    """
+    Compute the top-k similarity table on a pool of threads.
+
+    The users are split into row blocks; each task computes a block's
+    similarities, keeps the top-k of every row with ``np.argpartition`` and
+    returns only those, so at most n_jobs full blocks exist at a time.
+
+    Args:
+        matrix (scipy.sparse matrix): Users x items ratings matrix.
+        metric (str, optional): One of SIMILARITY_METRICS (default: 'cosine').
+        top_k (int, optional): Neighbours kept per user (default: 30).
+        min_similarity (float, optional): Drop similarities at or below
+        this value.
+        n_jobs (int, optional): Threads computing blocks; -1 for one per
+        CPU (default: 1).
+        max_memory (int, optional): Ceiling in bytes for the table, the
+        metric's operands and the blocks in flight; sets the block size.
+        shrinkage (float, optional): Shrinkage for 'shrunk_cosine'.
+
+    Returns:
+        scipy.sparse.csr_matrix: Similarities, each row holding at most
+        top_k entries sorted by decreasing similarity, without the user.
+
+    Raises:
+        MemoryError: If max_memory cannot hold the table and one block per
+        job.
+    """
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = os.cpu_count() or 1
+    matrix = _as_csr(matrix)
+    n_rows = matrix.shape[0]
+    if n_rows == 0:
+        return csr_matrix((0, 0))
+    computer = _BlockComputer(matrix, metric, shrinkage)
+    operand_bytes = sum(
+        operand.data.nbytes + operand.indices.nbytes + operand.indptr.nbytes
+        for operand in vars(computer).values() if hasattr(operand, 'indptr'))
+    block_size = neighbor_block_size(
+        n_rows, n_rows, metric, top_k, n_jobs, max_memory, operand_bytes)
+
+    def compute(start):
+        stop = min(start + block_size, n_rows)
+        return _top_k_dense(computer.block(start, stop), start, top_k,
+                            min_similarity)
+
+    starts = range(0, n_rows, block_size)
+    if n_jobs == 1 or len(starts) == 1:
+        blocks = [compute(start) for start in starts]
+    else:
+        with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+            blocks = list(pool.map(compute, starts))
+    return vstack(blocks, format='csr')
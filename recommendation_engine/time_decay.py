@@ -0,0 +1,149 @@
+"""
+This module weights ratings by their age.
+
+A rating of age ``t`` gets the weight ``2 ** (-t / half_life)``. The
+weights are kept in a CSR matrix with the ratings matrix's sparsity
+structure, computed in one vectorized pass from a timestamp array aligned
+with the ratings' ``data`` array, next to the matching decayed ratings
+(rating times weight). UserBasedCF computes user similarities on the
+decayed ratings and multiplies its neighbours' similarities by the weights
+when predicting.
+
+Ageing every rating by the same interval multiplies every weight by the
+same factor, so refresh() rescales the ``data`` arrays in place instead of
+rebuilding anything. Cosine similarity and the similarity-weighted mean
+are scale invariant, so neighbours and predictions do not change; what
+does is the weight of old ratings relative to ratings added later.
+
+Example:
+    >>> decay = TimeDecay(model.ratings_matrix, timestamps, half_life=DAY * 365)
+    >>> model.time_decay = decay
+    >>> decay.refresh()
+"""
+
+import threading
+import time
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+DAY = 24 * 60 * 60
+DEFAULT_HALF_LIFE = 365 * DAY
+
+
+class TimeDecay:
+    """
+    Exponentially decayed rating weights.
+
+    Args:
+        ratings_matrix (scipy.sparse.csr_matrix): The ratings, with sorted
+        indices.
+        timestamps (array-like): Time of each rating in seconds since the
+        epoch, aligned with ``ratings_matrix.data``. Missing (NaN) and
+        future times count as ``now``.
+        half_life (float): Seconds after which a rating's weight halves.
+        now (float, optional): Time the weights are computed for; defaults
+        to the current time.
+        refresh_interval (float): Seconds between refreshes in
+        maybe_refresh().
+
+    Attributes:
+        weights (scipy.sparse.csr_matrix): Weight of each rating.
+        weighted (scipy.sparse.csr_matrix): Ratings times their weights.
+        reference_time (float): Time the weights are currently computed for.
+    """
+
+    def __init__(self, ratings_matrix, timestamps, half_life=DEFAULT_HALF_LIFE,
+                 now=None, refresh_interval=3600.0):
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        if len(timestamps) != ratings_matrix.nnz:
+            raise ValueError(
+                f"Expected {ratings_matrix.nnz} timestamps, got {len(timestamps)}.")
+        if half_life <= 0:
+            raise ValueError("half_life must be positive.")
+        self.half_life = float(half_life)
+        self.refresh_interval = refresh_interval
+        self.reference_time = time.time() if now is None else float(now)
+        self._refreshed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+        ages = np.nan_to_num(self.reference_time - timestamps, nan=0.0)
+        factors = np.exp(-self.rate * np.maximum(ages, 0.0))
+        # float32 for compact (float32) ratings, float64 otherwise
+        dtype = np.result_type(ratings_matrix.dtype, np.float32)
+        self.weights = csr_matrix(
+            (factors.astype(dtype), ratings_matrix.indices,
+             ratings_matrix.indptr), shape=ratings_matrix.shape)
+        self.weighted = csr_matrix(
+            (ratings_matrix.data * self.weights.data, ratings_matrix.indices,
+             ratings_matrix.indptr), shape=ratings_matrix.shape)
+
+    @property
+    def rate(self):
+        """
+        Decay rate per second.
+        """
+        return np.log(2) / self.half_life
+
+    def refresh(self, now=None):
+        """
+        Age the weights to ``now`` (default: the current time) in place.
+        """
+        now = time.time() if now is None else float(now)
+        with self._lock:
+            factor = np.exp(-self.rate * (now - self.reference_time))
+            self.weights.data *= factor
+            self.weighted.data *= factor
+            self.reference_time = now
+            self._refreshed_at = time.monotonic()
+
+    def maybe_refresh(self):
+        """
+        refresh() if refresh_interval seconds passed since the last one.
+
+        Returns:
+            bool: True if the weights were refreshed.
+        """
+        if time.monotonic() - self._refreshed_at < self.refresh_interval:
+            return False
+        self.refresh()
+        return True
+
+    def timestamps(self):
+        """
+        Rating times implied by the current weights, aligned with
+        ``weights.data``.
+        """
+        return self.reference_time + np.log(
+            self.weights.data.astype(np.float64)) / self.rate
+
+    def reindex(self, ratings_matrix, rows=(), columns=()):
+        """
+        Weights for an updated ratings matrix.
+
+        Ratings the old matrix had keep their time; ratings it did not have
+        and those at the given (rows, columns) positions are dated now.
+
+        Returns:
+            TimeDecay: The new weights.
+        """
+        width = max(self.weights.shape[1], ratings_matrix.shape[1])
+
+        def keys(matrix):
+            matrix = matrix.tocoo()
+            return matrix.row.astype(np.int64) * width + matrix.col
+
+        old_keys, new_keys = keys(self.weights), keys(ratings_matrix)
+        # COO of a canonical CSR matrix is sorted by (row, column).
+        positions = np.minimum(np.searchsorted(old_keys, new_keys),
+                               max(len(old_keys) - 1, 0))
+        known = (old_keys[positions] == new_keys) if len(old_keys) \
+            else np.zeros(len(new_keys), dtype=bool)
+        touched = np.isin(new_keys, np.asarray(rows, dtype=np.int64) * width
+                          + np.asarray(columns, dtype=np.int64))
+        now = time.time()
+        timestamps = np.full(len(new_keys), now)
+        keep = known & ~touched
+        timestamps[keep] = self.timestamps()[positions[keep]]
+        return TimeDecay(ratings_matrix, timestamps, self.half_life, now,
+                         self.refresh_interval)
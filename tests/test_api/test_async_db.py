@@ -0,0 +1,147 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+import numpy as np
+from flask import Flask
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from api.async_db import AsyncDatabase, async_database_uri, async_db
+from api.database import db, init_database
+from models.models import Movie, Rating, User, rebuild_movie_stats
+from recommendation_engine.collaborative_filtering import UserBasedCF
+
+
+def query_thread(session, value):
+    return (session.execute(text("SELECT :value"), {'value': value}).scalar(),
+            threading.current_thread().name)
+
+
+class TestAsyncDatabase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = \
+            f"sqlite:///{os.path.join(self.directory, 'test.db')}"
+        init_database(self.app)
+
+    def test_async_database_uri(self):
+        self.assertEqual(async_database_uri('postgresql://u:p@h/db'),
+                         'postgresql+asyncpg://u:p@h/db')
+        self.assertEqual(async_database_uri('sqlite:///x.db'),
+                         'sqlite+aiosqlite:///x.db')
+        with self.assertRaises(ValueError):
+            async_database_uri('mysql://h/db')
+
+    def test_runs_on_the_event_loop_thread(self):
+        self.app.config['ASYNC_DATABASE'] = True
+        database = AsyncDatabase()
+        database.init_app(self.app)
+        self.addCleanup(database.close)
+        self.assertEqual(database.engine.url.drivername, 'sqlite+aiosqlite')
+
+        async def queries():
+            return await asyncio.gather(
+                *(database.run(query_thread, value) for value in range(5)))
+
+        # Each request has its own event loop; the engine's stays the same.
+        for _ in range(2):
+            self.assertEqual(asyncio.run(queries()),
+                             [(value, 'async-db') for value in range(5)])
+
+    def test_disabled_runs_on_the_session(self):
+        database = AsyncDatabase()
+        database.init_app(self.app)
+        self.assertFalse(database.enabled)
+        with self.app.app_context():
+            value, thread = asyncio.run(database.run(query_thread, 7))
+        self.assertEqual((value, thread), (7, threading.current_thread().name))
+
+
+class TestAsyncEndpoints(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        public = os.path.join(directory, 'public.db')
+        environ = mock.patch.dict(os.environ, {
+            'DATABASE_URL': f"sqlite:///{os.path.join(directory, 'app.db')}",
+            'OKTA_ORG_URL': 'https://okta.example.com', 'OKTA_CLIENT_ID': 'id',
+            'OKTA_CLIENT_SECRET': 'secret', 'MAIL_PORT': '25',
+            'SECRET_KEY': 'x', 'API_KEY': 'key',
+            'SECURITY_PASSWORD_SALT': 's', 'ASYNC_DATABASE': 'True',
+            'LAZY_STARTUP': 'True'})
+        environ.start()
+        self.addCleanup(environ.stop)
+
+        # SQLite has no schemas: attach a database as the models' 'public'
+        # schema on every connection, sync and async.
+        def attach(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f"ATTACH DATABASE '{public}' AS public")
+            cursor.close()
+
+        event.listen(Engine, 'connect', attach)
+        self.addCleanup(event.remove, Engine, 'connect', attach)
+
+        from api.app import create_app
+
+        self.app = create_app(load_model=False, ingest_ratings=False)
+        self.addCleanup(async_db.close)
+        self.assertTrue(async_db.enabled)
+
+        ratings = [(1, 10, 5.0), (1, 11, 3.0), (1, 12, 4.0), (2, 10, 4.0),
+                   (2, 13, 5.0), (3, 11, 2.0), (3, 13, 4.0), (3, 14, 5.0)]
+        with self.app.app_context():
+            db.create_all(bind_key=None)
+            # No preferred genres: the genre filter is PostgreSQL's SIMILAR TO.
+            db.session.add_all([User(id=u, email=f"{u}@x", password="p")
+                                for u in (1, 2, 3)])
+            db.session.add_all([Movie(movie_id=m, title=f"Movie {m} (2001)",
+                                      genres="Drama") for m in range(10, 15)])
+            db.session.add_all([Rating(user_id=u, movie_id=m, rating=r)
+                                for u, m, r in ratings])
+            db.session.commit()
+            rebuild_movie_stats()
+
+        matrix = np.zeros((3, 5))
+        for user_id, movie_id, rating in ratings:
+            matrix[user_id - 1, movie_id - 10] = rating
+        model = UserBasedCF(matrix, {u: u - 1 for u in (1, 2, 3)},
+                            {m: m - 10 for m in range(10, 15)}, k=2,
+                            sim_threshold=0.0)
+        model.fit()
+        self.app.config.update(MODEL_INSTANCE=model,
+                               KNOWN_USER_IDS={1, 2, 3}, COLD_START=False)
+        self.client = self.app.test_client()
+
+    def served_async(self):
+        return mock.patch.object(async_db, '_run_sync',
+                                 wraps=async_db._run_sync)
+
+    def test_movie_details(self):
+        with self.served_async() as run_sync:
+            response = self.client.get('/api/v1/movies/10',
+                                       headers={'X-API-KEY': 'key'})
+        self.assertEqual(run_sync.call_count, 1)
+        self.assertEqual(response.status_code, 200)
+        body = response.get_json()
+        self.assertEqual(body['title'], 'Movie 10 (2001)')
+        self.assertAlmostEqual(body['average_rating'], 4.5)
+
+    def test_recommendations(self):
+        with self.served_async() as run_sync:
+            response = self.client.post(
+                '/api/v1/recommendations', headers={'X-API-KEY': 'key'},
+                data=json.dumps({'userId': 2, 'num_recommendations': 3}),
+                content_type='application/json')
+        self.assertGreaterEqual(run_sync.call_count, 2)
+        self.assertEqual(response.status_code, 200)
+        movie_ids = [movie['movieId']
+                     for movie in response.get_json()['recommendations']]
+        self.assertTrue(movie_ids)
+        self.assertFalse({10, 13} & set(movie_ids))
@@ -0,0 +1,43 @@
+import unittest
+from flask import Flask
+from api.database import (
+    READ_REPLICA_BIND, db, engine_options, init_database, read_session)
+
+
+class TestEngineOptions(unittest.TestCase):
+    def test_sqlite_keeps_default_pool(self):
+        self.assertEqual(engine_options('sqlite:///test.db', pool_size=5), {})
+
+    def test_postgres_pool_and_statement_timeout(self):
+        options = engine_options('postgresql://localhost/db', pool_size=5,
+                                 max_overflow=10, pool_recycle=1800,
+                                 statement_timeout_ms=2000)
+        self.assertEqual(options['pool_size'], 5)
+        self.assertEqual(options['max_overflow'], 10)
+        self.assertEqual(options['pool_recycle'], 1800)
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertNotIn('pool_timeout', options)
+        self.assertEqual(options['connect_args'],
+                         {'options': '-c statement_timeout=2000'})
+
+
+class TestReadSession(unittest.TestCase):
+    def make_app(self, replica_uri=None):
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        app.config['READ_REPLICA_URI'] = replica_uri
+        init_database(app)
+        return app
+
+    def test_defaults_to_primary_session(self):
+        app = self.make_app()
+        with app.app_context():
+            self.assertIs(read_session(), db.session)
+
+    def test_routes_to_replica(self):
+        app = self.make_app(replica_uri='sqlite://')
+        with app.app_context():
+            session = read_session()
+            self.assertIsNot(session, db.session)
+            self.assertIs(session.get_bind(), db.engines[READ_REPLICA_BIND])
+            self.assertIs(read_session(), session)
@@ -0,0 +1,163 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import numpy as np
+from api.experiments import Experiment, ExperimentRouter, bucket
+from recommendation_engine.collaborative_filtering import UserBasedCF
+from recommendation_engine.instrumentation import REGISTRY
+from recommendation_engine.sharding import ShardedUserCF
+
+CONFIG = {
+    'name': 'neighbours',
+    'salt': 'a',
+    'variants': [{'name': 'control', 'weight': 25},
+                 {'name': 'k1', 'weight': 75, 'model': {'k': 1}}],
+}
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out")
+        time.sleep(0.01)
+
+
+class TestAssignment(unittest.TestCase):
+    def test_bucketing_is_deterministic_and_weighted(self):
+        experiment = Experiment.from_config(CONFIG)
+        assigned = [experiment.assign(user_id).name
+                    for user_id in range(20000)]
+        self.assertEqual(assigned, [Experiment.from_config(CONFIG).assign(
+            user_id).name for user_id in range(20000)])
+        self.assertAlmostEqual(assigned.count('k1') / 20000, 0.75, delta=0.02)
+        # A new salt reshuffles the users.
+        self.assertNotEqual(bucket('a', 42), bucket('b', 42))
+
+    def test_invalid_configs(self):
+        for config in (
+                {'name': 'x', 'variants': []},
+                {'name': 'x', 'variants': [{'name': 'a', 'weight': 0}]},
+                {'name': 'x', 'variants': [{'name': 'a'}, {'name': 'a'}]},
+                {'name': 'x', 'variants': [
+                    {'name': 'a', 'model': {'engine': 'svd'}}]},
+                {'variants': [{'name': 'a'}]}):
+            with self.assertRaises(ValueError):
+                Experiment.from_config(config)
+
+    def test_hot_reload(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'experiment.json')
+        with open(path, 'w') as f:
+            json.dump(CONFIG, f)
+        router = ExperimentRouter(path, reload_interval=0)
+        router.maybe_reload(force=True)
+        self.assertEqual(router.experiment.name, 'neighbours')
+
+        def rewrite(content):
+            with open(path, 'w') as f:
+                f.write(content)
+            stat = os.stat(path)
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        rewrite(json.dumps({'name': 'all', 'variants': [{'name': 'only'}]}))
+        self.assertEqual(router.assign(7).name, 'only')
+        # An invalid file keeps the running experiment.
+        rewrite('{"name": ')
+        self.assertEqual(router.assign(7).name, 'only')
+        os.remove(path)
+        self.assertIsNone(router.assign(7))
+
+
+class TestVariantModels(unittest.TestCase):
+    def setUp(self):
+        REGISTRY.reset()
+        dense = np.array([[5, 3, 0, 1], [4, 0, 3, 1], [1, 1, 0, 5],
+                          [1, 0, 0, 4], [0, 1, 5, 4]], dtype=np.float64)
+        self.model = UserBasedCF(dense, {u: u for u in range(5)},
+                                 {m: m for m in range(4)}, k=3,
+                                 sim_threshold=0.0)
+        self.model.fit()
+        self.router = ExperimentRouter()
+        self.addCleanup(self.router.shutdown)
+
+    def test_variant_model_is_built_in_background(self):
+        self.router.configure(CONFIG)
+        control, variant = self.router.experiment.variants
+        self.assertIs(self.router.model_for(control, self.model), self.model)
+        self.assertIsNone(self.router.model_for(variant, self.model))
+        wait_for(lambda: self.router.model_for(variant, self.model))
+        built = self.router.model_for(variant, self.model)
+        self.assertEqual((built.k, self.model.k), (1, 3))
+        self.assertTrue(np.shares_memory(built.ratings_matrix.data,
+                                         self.model.ratings_matrix.data))
+        self.assertIsNot(built.nearest_neighbors,
+                         self.model.nearest_neighbors)
+        self.assertTrue(1 <= built.predict(0, 2) <= 5)
+        # A new serving model is built again.
+        self.assertIsNone(self.router.model_for(variant, UserBasedCF(
+            self.model.ratings_matrix, self.model.user_index,
+            self.model.movie_index)))
+
+    def test_unknown_option_falls_back(self):
+        self.router.configure({'name': 'x', 'variants': [
+            {'name': 'bad', 'model': {'neighbours': 5}}]})
+        variant = self.router.experiment.variants[0]
+        self.assertIsNone(self.router.model_for(variant, self.model))
+        time.sleep(0.2)
+        self.assertIsNone(self.router.model_for(variant, self.model))
+
+    def test_sharded_model_is_not_refitted(self):
+        sharded = ShardedUserCF(self.model.ratings_matrix,
+                                self.model.user_index, self.model.movie_index,
+                                shards=2, k=3, sim_threshold=0.0, local=False)
+        sharded.fit()
+        self.addCleanup(sharded.close)
+        expected = sharded.predict(0, 2)
+        shards = list(sharded.shards)
+
+        self.router.configure(CONFIG)
+        variant = self.router.experiment.variants[1]
+        with self.assertRaises(ValueError):
+            self.router.build_model(variant.model, sharded)
+        self.assertIsNone(self.router.model_for(variant, sharded))
+        time.sleep(0.2)
+        self.assertIsNone(self.router.model_for(variant, sharded))
+        # The serving model keeps its worker processes.
+        self.assertEqual(sharded.shards, shards)
+        self.assertEqual(sharded.predict(0, 2), expected)
+
+    def test_shadow_overlap_and_dropping(self):
+        self.router.shadow_queue = 1
+        self.router.configure(dict(CONFIG, shadow={'name': 'shadow'}))
+        release = threading.Event()
+
+        def candidates():
+            release.wait(10)
+            return [1, 2, 3]
+
+        first = self.router.shadow(0, [2, 1], candidates, self.model)
+        started = time.perf_counter()
+        self.assertIsNone(self.router.shadow(0, [2], candidates, self.model))
+        self.assertLess(time.perf_counter() - started, 0.1)
+        release.set()
+
+        shadow_ids = first.result(10)
+        expected = self.model.predict_many(0, [1, 2, 3])
+        self.assertEqual(shadow_ids,
+                         [[1, 2, 3][i] for i in np.argsort(-expected)[:2]])
+        labels = {'experiment': 'neighbours', 'variant': 'shadow'}
+        self.assertEqual(REGISTRY.counter(
+            'experiment_shadow_dropped_total', **labels).value, 1)
+        self.assertEqual(REGISTRY.counter(
+            'experiment_compared_items_total', **labels).value, 2)
+        self.assertEqual(REGISTRY.counter(
+            'experiment_overlap_items_total', **labels).value,
+            len({1, 2} & set(shadow_ids)))
+        self.assertEqual(REGISTRY.histogram(
+            'experiment_shadow_latency', **labels).count, 1)
@@ -0,0 +1,98 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from api.database import db
+from models.models import Movie, Rating, User
+from recommendation_engine.implicit import ImplicitALS, interaction_matrix
+
+RATINGS = [(1, 10, 5.0), (1, 11, 4.0), (2, 10, 4.5), (2, 12, 5.0),
+           (3, 11, 4.0), (3, 12, 2.0), (3, 13, 5.0)]
+
+
+class TestImplicitScores(unittest.TestCase):
+    """
+    The implicit-feedback model's preferences are returned as "score", not
+    as a predicted rating.
+    """
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        public = os.path.join(directory, 'public.db')
+        environ = mock.patch.dict(os.environ, {
+            'DATABASE_URL': f"sqlite:///{os.path.join(directory, 'app.db')}",
+            'OKTA_ORG_URL': 'https://okta.example.com', 'OKTA_CLIENT_ID': 'id',
+            'OKTA_CLIENT_SECRET': 'secret', 'MAIL_PORT': '25',
+            'SECRET_KEY': 'x', 'API_KEY': 'key',
+            'SECURITY_PASSWORD_SALT': 's', 'LAZY_STARTUP': 'True'})
+        environ.start()
+        self.addCleanup(environ.stop)
+
+        # SQLite has no schemas: attach a database as the models' 'public'
+        # schema on every connection.
+        def attach(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f"ATTACH DATABASE '{public}' AS public")
+            cursor.close()
+
+        event.listen(Engine, 'connect', attach)
+        self.addCleanup(event.remove, Engine, 'connect', attach)
+
+        from api.app import create_app
+
+        self.app = create_app(load_model=False, ingest_ratings=False)
+        with self.app.app_context():
+            db.create_all(bind_key=None)
+            # No preferred genres: the genre filter is PostgreSQL's SIMILAR TO.
+            db.session.add_all([User(id=u, email=f"{u}@x", password="p")
+                                for u in (1, 2, 3)])
+            db.session.add_all([Movie(movie_id=m, title=f"Movie {m} (2001)",
+                                      genres="Drama") for m in range(10, 15)])
+            db.session.add_all([Rating(user_id=u, movie_id=m, rating=r)
+                                for u, m, r in RATINGS])
+            db.session.commit()
+
+        users, movies, strengths = zip(*RATINGS)
+        model = ImplicitALS(
+            interaction_matrix(np.array(users) - 1, np.array(movies) - 10,
+                               np.array(strengths) - 3.0, (3, 5)),
+            {u: u - 1 for u in (1, 2, 3)}, {m: m - 10 for m in range(10, 15)},
+            factors=4, iterations=5)
+        model.fit()
+        self.app.config.update(MODEL_INSTANCE=model,
+                               KNOWN_USER_IDS={1, 2, 3}, COLD_START=False,
+                               RECOMMENDATION_PIPELINE=False,
+                               PREDICT_BATCHING=False)
+        self.model = model
+        self.client = self.app.test_client()
+
+    def post(self, path, body):
+        return self.client.post(path, headers={'X-API-KEY': 'key'},
+                                data=json.dumps(body),
+                                content_type='application/json')
+
+    def test_predict(self):
+        response = self.post('/api/v1/predict', {'userId': 1, 'movieId': 12})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(),
+                         {'score': self.model.predict(1, 12)})
+
+    def test_recommendations(self):
+        response = self.post('/api/v1/recommendations',
+                             {'userId': 1, 'num_recommendations': 3})
+        self.assertEqual(response.status_code, 200, response.get_data())
+        recommendations = response.get_json()['recommendations']
+        self.assertTrue(recommendations)
+        self.assertLessEqual({movie['movieId'] for movie in recommendations},
+                             {12, 13, 14})
+        for movie in recommendations:
+            self.assertNotIn('predictedRating', movie)
+            self.assertAlmostEqual(movie['score'],
+                                   self.model.predict(1, movie['movieId']),
+                                   places=5)
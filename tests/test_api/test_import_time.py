@@ -0,0 +1,66 @@
+import importlib.util
+import os
+import subprocess
+import sys
+import unittest
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+# Packages that must only be imported once a request or the model needs them.
+DEFERRED_MODULES = ("sklearn", "scipy", "okta", "aiohttp", "jose", "pandas")
+
+# Also deferred by the app factory's module, which only registers the
+# extensions: NumPy and the ORM models are loaded by create_app.
+APP_DEFERRED_MODULES = DEFERRED_MODULES + ("numpy", "models")
+
+# Generous ceiling for the cumulative import time of the web entry points.
+IMPORT_TIME_BUDGET_US = int(os.getenv("IMPORT_TIME_BUDGET_MS", "2000")) * 1000
+
+
+def import_profile(module):
+    """
+    Import a module in a fresh interpreter with ``-X importtime``.
+
+    Returns:
+        dict: Mapping of imported module names to cumulative microseconds.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT, capture_output=True, text=True, timeout=120)
+    if result.returncode != 0:
+        raise AssertionError(result.stderr)
+    profile = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line.split("|")
+        profile[name.strip()] = int(cumulative_us)
+    return profile
+
+
+@unittest.skipUnless(importlib.util.find_spec("flask_oidc"),
+                     "web dependencies are not installed")
+class TestImportTime(unittest.TestCase):
+    def test_app_import_defers_heavy_packages(self):
+        for entry_point, deferred in (("api.v1.endpoints", DEFERRED_MODULES),
+                                      ("api.app", APP_DEFERRED_MODULES)):
+            with self.subTest(entry_point):
+                profile = import_profile(entry_point)
+                loaded = {name.split(".")[0] for name in profile}
+                for module in deferred:
+                    self.assertNotIn(module, loaded)
+
+    def test_app_import_within_budget(self):
+        for entry_point in ("api.v1.endpoints", "api.app"):
+            with self.subTest(entry_point):
+                profile = import_profile(entry_point)
+                self.assertLess(profile[entry_point], IMPORT_TIME_BUDGET_US)
+
+    def test_app_import_does_not_write_env_file(self):
+        env_path = os.path.join(REPO_ROOT, ".env")
+        existed = os.path.exists(env_path)
+        mtime = os.path.getmtime(env_path) if existed else None
+        import_profile("api.app")
+        self.assertEqual(os.path.exists(env_path), existed)
+        if existed:
+            self.assertEqual(os.path.getmtime(env_path), mtime)
@@ -0,0 +1,242 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import datetime
+import numpy as np
+from flask import Flask
+from scipy.sparse import csr_matrix
+from api.database import db, init_database
+from api.ingestion import (
+    RECORD, RatingIngestor, WriteAheadLog, apply_to_model, decode_events,
+    encode_events, log_names, upsert_ratings)
+from models.models import (
+    Movie, MovieStats, Rating, User, record_movie_rating, record_movie_ratings)
+from recommendation_engine.collaborative_filtering import UserBasedCF
+
+EVENTS = [(1, 10, 4.0, 1_700_000_000.0), (2, 10, 3.5, 1_700_000_001.0),
+          (1, 11, 5.0, 1_700_000_002.0)]
+
+
+class TestWriteAheadLog(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_encode_decode(self):
+        data = encode_events(EVENTS)
+        self.assertEqual(len(data), 3 * RECORD.size)
+        self.assertEqual(decode_events(data), (EVENTS, len(data)))
+        # A torn last record and a corrupted one end the valid prefix.
+        self.assertEqual(decode_events(data[:-5]), (EVENTS[:2], 2 * RECORD.size))
+        corrupt = bytearray(data)
+        corrupt[RECORD.size + 3] ^= 0xFF
+        self.assertEqual(decode_events(bytes(corrupt)),
+                         (EVENTS[:1], RECORD.size))
+
+    def test_append_read_checkpoint(self):
+        log = WriteAheadLog(self.directory)
+        end = log.append(EVENTS[:2])
+        log.append(EVENTS[2:])
+        self.assertEqual(log.read(0, 10), ([], 0))
+        log.sync()
+        events, offset = log.read(0, 2)
+        self.assertEqual((events, offset), (EVENTS[:2], end))
+        log.save_checkpoint(offset)
+        log.close()
+
+        reopened = WriteAheadLog(self.directory)
+        self.assertEqual(reopened.checkpoint, end)
+        self.assertEqual(reopened.read(reopened.checkpoint, 10)[0], EVENTS[2:])
+        reopened.close()
+
+    def test_recovery_cuts_torn_tail(self):
+        log = WriteAheadLog(self.directory)
+        log.append(EVENTS)
+        log.close()
+        with open(log.path, 'ab') as f:
+            f.write(encode_events(EVENTS[:1])[:20])
+
+        recovered = WriteAheadLog(self.directory)
+        self.assertEqual(recovered.end, 3 * RECORD.size)
+        self.assertEqual(os.path.getsize(log.path), 3 * RECORD.size)
+        self.assertEqual(recovered.read(0, 10)[0], EVENTS)
+        recovered.close()
+
+    def test_truncate_applied(self):
+        log = WriteAheadLog(self.directory)
+        end = log.append(EVENTS)
+        log.sync()
+        self.assertFalse(log.truncate_applied(0))
+        log.save_checkpoint(end)
+        self.assertFalse(log.truncate_applied(end))
+        self.assertTrue(log.truncate_applied(0))
+        self.assertEqual((log.end, log.checkpoint), (0, 0))
+        self.assertEqual(os.path.getsize(log.path), 0)
+        log.close()
+
+    def test_log_is_locked(self):
+        log = WriteAheadLog(self.directory)
+        with self.assertRaises(BlockingIOError):
+            WriteAheadLog(self.directory)
+        log.remove()
+        self.assertEqual(log_names(self.directory), [])
+        # A removed log opens as a new, empty one.
+        reopened = WriteAheadLog(self.directory)
+        self.assertEqual((reopened.end, reopened.checkpoint), (0, 0))
+        reopened.close()
+
+
+class IngestionDatabaseTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = \
+            f"sqlite:///{os.path.join(self.directory, 'test.db')}"
+        # SQLite has no schemas; map the models' 'public' schema away.
+        self.app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            'execution_options': {'schema_translate_map': {'public': None}}}
+        init_database(self.app)
+        with self.app.app_context():
+            db.create_all(bind_key=None)
+            db.session.add_all([User(id=u, email=f"{u}@x", password="p")
+                                for u in (1, 2)])
+            db.session.add_all([Movie(movie_id=m, title=f"Movie {m}", genres="Drama")
+                                for m in (10, 11)])
+            db.session.commit()
+
+    def ratings(self):
+        return sorted(db.session.query(
+            Rating.user_id, Rating.movie_id, Rating.rating).all())
+
+    def stats(self):
+        return sorted(db.session.query(
+            MovieStats.movie_id, MovieStats.rating_count,
+            MovieStats.rating_sum).all())
+
+
+class TestUpsertRatings(IngestionDatabaseTestCase):
+    def test_upsert_is_idempotent(self):
+        with self.app.app_context():
+            batch = EVENTS + [(1, 10, 2.0, 1_700_000_003.0)]
+            writes = upsert_ratings(db.session, batch, global_mean=3.0)
+            db.session.commit()
+            self.assertEqual(len(writes), 3)
+            self.assertEqual(self.ratings(),
+                             [(1, 10, 2.0), (1, 11, 5.0), (2, 10, 3.5)])
+            self.assertEqual(self.stats(), [(10, 2, 5.5), (11, 1, 5.0)])
+
+            # Replayed after a crash before the checkpoint.
+            writes = upsert_ratings(db.session, batch, global_mean=3.0)
+            db.session.commit()
+            self.assertEqual([w[3] for w in writes], [2.0, 3.5, 5.0])
+            self.assertEqual(len(self.ratings()), 3)
+            self.assertEqual(self.stats(), [(10, 2, 5.5), (11, 1, 5.0)])
+
+    def test_batched_stats_match_single_writes(self):
+        writes = [(10, 4.0, None, datetime(2024, 1, 1)),
+                  (10, 2.0, 4.0, datetime(2024, 1, 3)),
+                  (11, 5.0, None, datetime(2024, 1, 4)),
+                  (10, 3.0, None, datetime(2024, 1, 5))]
+        columns = (MovieStats.movie_id, MovieStats.rating_count,
+                   MovieStats.rating_sum, MovieStats.rating_sum_squares,
+                   MovieStats.mean_rating, MovieStats.bayesian_mean,
+                   MovieStats.last_rated_at)
+        with self.app.app_context():
+            record_movie_rating(db.session, 11, 1.0, None,
+                                datetime(2023, 1, 1), global_mean=3.0)
+            db.session.commit()
+            for write in writes:
+                record_movie_rating(db.session, *write, global_mean=3.0)
+            expected = db.session.query(*columns).order_by(
+                MovieStats.movie_id).all()
+            db.session.rollback()
+
+            record_movie_ratings(db.session, writes, global_mean=3.0)
+            actual = db.session.query(*columns).order_by(
+                MovieStats.movie_id).all()
+            self.assertEqual(len(actual), 2)
+            for row, expected_row in zip(actual, expected):
+                self.assertEqual(row[:3], expected_row[:3])
+                self.assertAlmostEqual(row[5], expected_row[5])
+                self.assertEqual(row[6], expected_row[6])
+
+
+class TestRatingIngestor(IngestionDatabaseTestCase):
+    def start(self):
+        ingestor = RatingIngestor(batch_size=2, flush_interval=0.001)
+        ingestor.start(self.app, os.path.join(self.directory, "log"))
+        self.addCleanup(ingestor.stop)
+        return ingestor
+
+    def test_applies_batches(self):
+        ingestor = self.start()
+        sequence = ingestor.submit(EVENTS + [(2, 11, 1.0, time.time())])
+        self.assertTrue(ingestor.wait(sequence, timeout=10))
+        with self.app.app_context():
+            self.assertEqual(self.ratings(),
+                             [(1, 10, 4.0), (1, 11, 5.0), (2, 10, 3.5),
+                              (2, 11, 1.0)])
+        self.assertEqual(ingestor.log.checkpoint, ingestor.log.end)
+
+    def test_replays_logs_of_exited_processes(self):
+        directory = os.path.join(self.directory, "log")
+        exited = WriteAheadLog(directory, "ratings-1")
+        exited.append(EVENTS)
+        exited.close()
+        running = WriteAheadLog(directory, "ratings-2")
+        running.append([(2, 11, 1.0, 1_700_000_003.0)])
+        running.sync()
+        self.addCleanup(running.close)
+
+        ingestor = self.start()
+        self.assertNotIn(ingestor.log.name, ("ratings-1", "ratings-2"))
+        deadline = time.monotonic() + 10
+        while "ratings-1" in log_names(directory):
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        with self.app.app_context():
+            self.assertEqual(len(self.ratings()), 3)
+        # The log of a process that is still running is not touched.
+        self.assertEqual(log_names(directory),
+                         sorted(["ratings-2", ingestor.log.name]))
+        self.assertEqual(running.checkpoint, 0)
+
+    def test_processes_do_not_share_a_log(self):
+        first, second = self.start(), self.start()
+        self.assertNotEqual(first.log.path, second.log.path)
+        self.assertTrue(first.wait(first.submit(EVENTS[:2]), timeout=10))
+        self.assertTrue(second.wait(second.submit(EVENTS[2:]), timeout=10))
+        self.assertEqual(first.log.checkpoint, 2 * RECORD.size)
+        self.assertEqual(second.log.checkpoint, RECORD.size)
+
+    def test_model_errors_do_not_stop_the_consumer(self):
+        class BrokenModel:
+            movie_stats = None
+            ratings_matrix = csr_matrix(np.ones((1, 1)))
+
+            def set_ratings(self, *args):
+                raise RuntimeError("model is gone")
+
+        self.app.config['MODEL_INSTANCE'] = BrokenModel()
+        ingestor = self.start()
+        self.assertTrue(ingestor.wait(ingestor.submit(EVENTS[:1]), timeout=10))
+        self.assertTrue(ingestor.wait(ingestor.submit(EVENTS[1:]), timeout=10))
+        # The committed batches are checkpointed all the same.
+        self.assertEqual(ingestor.log.checkpoint, ingestor.log.end)
+        with self.app.app_context():
+            self.assertEqual(len(self.ratings()), 3)
+
+
+class TestApplyToModel(unittest.TestCase):
+    def test_read_only_ratings_are_left_alone(self):
+        model = UserBasedCF(np.array([[4.0, 0.0]]), {1: 0}, {10: 0, 11: 1})
+        writes = [(1, 10, 2.0, 4.0, 1_700_000_000.0)]
+        model.ratings_matrix.data.flags.writeable = False
+        apply_to_model(model, writes)
+        self.assertEqual(model.ratings_matrix[0, 0], 4.0)
+        model.ratings_matrix.data.flags.writeable = True
+        apply_to_model(model, writes)
+        self.assertEqual(model.ratings_matrix[0, 0], 2.0)
@@ -0,0 +1,121 @@
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from flask import Flask
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from api.database import db, init_database
+from models.models import Movie, Rating, User, initialize_model
+from recommendation_engine.model_server import ModelServer
+
+GENRES = ["Action", "Comedy", "Drama", "Horror"]
+NEW_USER = 100
+SEEDS = {3: 5.0, 7: 4.5}
+
+
+class TestOnboardThenRecommend(unittest.TestCase):
+    """
+    A user who joined after the model was fitted gets recommendations as
+    soon as onboarding has stored their genres and ratings, whichever model
+    serves the app.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        public = os.path.join(self.directory, 'public.db')
+        database_url = f"sqlite:///{os.path.join(self.directory, 'app.db')}"
+        environ = mock.patch.dict(os.environ, {
+            'DATABASE_URL': database_url,
+            'OKTA_ORG_URL': 'https://okta.example.com', 'OKTA_CLIENT_ID': 'id',
+            'OKTA_CLIENT_SECRET': 'secret', 'MAIL_PORT': '25',
+            'SECRET_KEY': 'x', 'API_KEY': 'key',
+            'SECURITY_PASSWORD_SALT': 's', 'COLD_START': 'True'})
+        environ.start()
+        self.addCleanup(environ.stop)
+
+        # SQLite has no schemas: attach a database as the models' 'public'
+        # schema on every connection.
+        def attach(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f"ATTACH DATABASE '{public}' AS public")
+            cursor.close()
+
+        event.listen(Engine, 'connect', attach)
+        self.addCleanup(event.remove, Engine, 'connect', attach)
+
+        self.seed_app = Flask(__name__)
+        self.seed_app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+        init_database(self.seed_app)
+        rng = random.Random(0)
+        with self.seed_app.app_context():
+            db.create_all(bind_key=None)
+            db.session.add_all([
+                Movie(movie_id=m, title=f"Movie {m} ({1990 + m % 30})",
+                      genres="|".join(rng.sample(GENRES, 2)))
+                for m in range(1, 41)])
+            db.session.add_all([User(id=u, email=f"{u}@x", password="p")
+                                for u in range(1, 31)])
+            db.session.flush()
+            db.session.add_all([
+                Rating(user_id=u, movie_id=m, rating=rng.randint(2, 10) / 2)
+                for u in range(1, 31) for m in rng.sample(range(1, 41), 8)])
+            db.session.commit()
+
+    def onboard_then_recommend(self, **environ):
+        from api.app import create_app
+
+        # The loader thread reads the model options from the environment.
+        with mock.patch.dict(os.environ, environ):
+            app = create_app(lazy_startup=True, ingest_ratings=False)
+            self.assertTrue(app.extensions['model_loader'].wait(120))
+        model = app.config['MODEL_INSTANCE']
+        self.assertIsNotNone(model)
+        self.addCleanup(getattr(model, 'close', lambda: None))
+        with app.app_context():
+            db.session.add(User(id=NEW_USER, email="new@x", password="p"))
+            db.session.commit()
+
+        client = app.test_client()
+        response = client.post('/api/v1/onboarding', json={
+            'id': NEW_USER, 'genres': ['Comedy'],
+            'ratings': {str(m): r for m, r in SEEDS.items()}})
+        self.assertEqual(response.status_code, 200)
+
+        response = client.post(
+            '/api/v1/recommendations', headers={'X-API-KEY': 'key'},
+            data=json.dumps({'userId': NEW_USER, 'num_recommendations': 5}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.get_data())
+        recommendations = response.get_json()['recommendations']
+        self.assertEqual(len(recommendations), 5)
+        self.assertFalse(set(SEEDS) & {movie['movieId']
+                                       for movie in recommendations})
+        return model
+
+    def test_user_based_cf(self):
+        model = self.onboard_then_recommend()
+        self.assertEqual(type(model).__name__, 'UserBasedCF')
+
+    def test_sharded(self):
+        model = self.onboard_then_recommend(MODEL_SHARDS='2')
+        self.assertEqual(type(model).__name__, 'ShardedUserCF')
+
+    def test_implicit(self):
+        model = self.onboard_then_recommend(IMPLICIT_FEEDBACK='True')
+        self.assertEqual(type(model).__name__, 'ImplicitALS')
+
+    def test_model_server(self):
+        with self.seed_app.app_context():
+            served, known_user_ids = initialize_model(
+                compact=False, time_decay=False, shards=1, implicit=False)
+        path = os.path.join(self.directory, 'model.sock')
+        server = ModelServer(path, served, known_user_ids)
+        server.start()
+        self.addCleanup(server.stop)
+        model = self.onboard_then_recommend(MODEL_SERVER_SOCKET=path)
+        self.assertEqual(type(model).__name__, 'ModelClient')
@@ -0,0 +1,31 @@
+import unittest
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+from api import queries
+from models.models import Movie
+
+
+class TestMovieQueries(unittest.TestCase):
+    def setUp(self):
+        # SQLite has no schemas; map the models' 'public' schema away.
+        self.engine = create_engine('sqlite://').execution_options(
+            schema_translate_map={'public': None})
+        Movie.__table__.create(self.engine)
+        with self.engine.begin() as conn:
+            conn.execute(insert(Movie), [
+                {'movie_id': m, 'title': f'Movie {m}', 'genres': 'Drama'}
+                for m in range(10, 0, -1)])
+
+    def test_keyset_pages(self):
+        with Session(self.engine) as session:
+            first = queries.get_movies_after(session, None, 4,
+                                             ('movie_id', 'title'))
+            second = queries.get_movies_after(session, first[-1].movie_id, 4,
+                                              ('movie_id',))
+        self.assertEqual([row.movie_id for row in first], [1, 2, 3, 4])
+        self.assertEqual(first[0].title, 'Movie 1')
+        self.assertEqual([row.movie_id for row in second], [5, 6, 7, 8])
+
+    def test_estimate_movie_count_falls_back_to_count(self):
+        with Session(self.engine) as session:
+            self.assertEqual(queries.estimate_movie_count(session), 10)
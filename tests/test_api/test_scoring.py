@@ -0,0 +1,48 @@
+import asyncio
+import threading
+import unittest
+from api.scoring import ScoringExecutor, ScoringOverloaded
+from recommendation_engine.instrumentation import (
+    server_timing_header, start_request_timing, timer)
+
+
+class TestScoringExecutor(unittest.TestCase):
+    def test_runs_function_on_pool(self):
+        executor = ScoringExecutor(max_workers=2)
+        result = asyncio.run(executor.run(lambda a, b: a + b, 2, 3))
+        self.assertEqual(result, 5)
+        executor.shutdown()
+
+    def test_rejects_when_saturated(self):
+        executor = ScoringExecutor(max_workers=1, max_pending=1)
+        release = threading.Event()
+
+        async def scenario():
+            blocked = asyncio.ensure_future(executor.run(release.wait))
+            await asyncio.sleep(0.05)
+            with self.assertRaises(ScoringOverloaded):
+                await executor.run(lambda: None)
+            release.set()
+            await blocked
+            # The slot is free again once the first job finishes.
+            self.assertIsNone(await executor.run(lambda: None))
+
+        asyncio.run(scenario())
+        executor.shutdown()
+
+    def test_job_timers_reach_the_request(self):
+        executor = ScoringExecutor(max_workers=1)
+
+        def job():
+            with timer("knn_query"):
+                return threading.current_thread().name
+
+        async def request():
+            start_request_timing()
+            thread_name = await executor.run(job)
+            return thread_name, server_timing_header()
+
+        thread_name, header = asyncio.run(request())
+        self.assertTrue(thread_name.startswith("scoring"))
+        self.assertIn("knn_query;dur=", header)
+        executor.shutdown()
@@ -0,0 +1,94 @@
+import gzip
+import json
+import unittest
+from collections import namedtuple
+from unittest import mock
+from flask import Flask
+from api import serialization
+from api.serialization import (
+    MovieFragments, compress_response, dumps, encode_recommendations,
+    json_response, rows_to_dicts)
+
+
+class TestSerialization(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+
+    def test_dumps_is_compact_json(self):
+        self.assertEqual(json.loads(dumps({'a': [1, None]})), {'a': [1, None]})
+        self.assertNotIn(b' ', dumps({'a': 1, 'b': 2}))
+
+    def test_rows_to_dicts(self):
+        rows = [(1, 'Heat'), (2, 'Alien')]
+        self.assertEqual(rows_to_dicts(rows, ('movie_id', 'title')),
+                         [{'movie_id': 1, 'title': 'Heat'},
+                          {'movie_id': 2, 'title': 'Alien'}])
+
+    def test_conditional_response(self):
+        with self.app.test_request_context('/'):
+            response = json_response({'movies': []}, conditional=True)
+            etag = response.get_etag()[0]
+            self.assertEqual(response.status_code, 200)
+        with self.app.test_request_context(
+                '/', headers={'If-None-Match': f'"{etag}"'}):
+            response = json_response({'movies': []}, conditional=True)
+            self.assertEqual(response.status_code, 304)
+
+
+class TestRecommendationEncoding(unittest.TestCase):
+    def setUp(self):
+        Movie = namedtuple('Movie', ['movie_id', 'title', 'genres'])
+        self.movies = [Movie(3, 'Heat "95"', 'Action|Crime'),
+                       Movie(1, 'Amélie', 'Comedy')]
+        self.scores = [4.25, 3.0]
+
+    def expected(self):
+        return {'recommendations': [
+            {'movieId': 3, 'title': 'Heat "95"', 'genres': 'Action|Crime',
+             'predictedRating': 4.25},
+            {'movieId': 1, 'title': 'Amélie', 'genres': 'Comedy',
+             'predictedRating': 3.0}]}
+
+    def test_matches_plain_encoding(self):
+        fragments = MovieFragments()
+        body = encode_recommendations(fragments, self.movies, self.scores)
+        self.assertEqual(json.loads(body), self.expected())
+        self.assertEqual(len(fragments), 2)
+        # Second call is served from the cache.
+        body = encode_recommendations(fragments, self.movies, self.scores)
+        self.assertEqual(json.loads(body), self.expected())
+
+    def test_stdlib_fallback(self):
+        with mock.patch.object(serialization, 'orjson', None):
+            body = encode_recommendations(
+                MovieFragments(), self.movies, self.scores)
+        self.assertEqual(json.loads(body), self.expected())
+
+    def test_empty(self):
+        self.assertEqual(
+            json.loads(encode_recommendations(MovieFragments(), [], [])),
+            {'recommendations': []})
+
+
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.payload = {'movies': [{'title': f'Movie {i}'} for i in range(200)]}
+
+    def test_gzip_when_accepted(self):
+        with self.app.test_request_context('/'):
+            response = json_response(self.payload, conditional=True)
+            compress_response(response, 'gzip, deflate', min_size=100)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.vary)
+        self.assertTrue(response.get_etag()[1])
+        self.assertEqual(json.loads(gzip.decompress(response.get_data())),
+                         self.payload)
+
+    def test_skips_small_or_unaccepted(self):
+        with self.app.test_request_context('/'):
+            small = compress_response(json_response({'a': 1}), 'gzip')
+            refused = compress_response(
+                json_response(self.payload), 'gzip;q=0', min_size=100)
+        self.assertNotIn('Content-Encoding', small.headers)
+        self.assertNotIn('Content-Encoding', refused.headers)
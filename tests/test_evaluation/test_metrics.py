@@ -0,0 +1,86 @@
+import pickle
+import unittest
+import numpy as np
+from scipy.sparse import csr_matrix
+from evaluation.metrics import (
+    MetricsAccumulator, evaluate_rankings, precision_at_k, ranking_metrics,
+    recall_at_k, top_k_hits)
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        # 4 users x 6 items; user 2 has no relevant items.
+        self.relevant = csr_matrix(np.array([
+            [1, 0, 1, 0, 0, 0],
+            [0, 0, 0, 0, 0, 1],
+            [0, 0, 0, 0, 0, 0],
+            [1, 1, 1, 1, 0, 0],
+        ]))
+        self.predicted = np.array([
+            [2, 1, 0],
+            [3, 4, -1],
+            [0, 1, 2],
+            [9, 3, 0],
+        ])
+
+    def test_recall_without_relevant_items(self):
+        self.assertEqual(recall_at_k([], [1, 2], 2), 0.0)
+
+    def test_hits_ignore_padding_and_unknown_items(self):
+        np.testing.assert_array_equal(
+            top_k_hits(self.predicted, self.relevant),
+            [[True, False, True], [False, False, False],
+             [False, False, False], [False, True, True]])
+
+    def test_batch_matches_single_user_metrics(self):
+        metrics = ranking_metrics(self.predicted, self.relevant, k=2)
+        for user in range(4):
+            relevant = self.relevant[user].indices
+            self.assertAlmostEqual(
+                metrics['precision'][user],
+                precision_at_k(relevant, self.predicted[user], 2))
+            self.assertAlmostEqual(
+                metrics['recall'][user],
+                recall_at_k(relevant, self.predicted[user], 2))
+        np.testing.assert_array_equal(metrics['evaluated'],
+                                      [True, True, False, True])
+
+    def test_ndcg_and_reciprocal_rank(self):
+        metrics = ranking_metrics(self.predicted, self.relevant)
+        discounts = 1 / np.log2([2, 3, 4])
+        np.testing.assert_allclose(metrics['ndcg'], [
+            (discounts[0] + discounts[2]) / discounts[:2].sum(), 0, 0,
+            (discounts[1] + discounts[2]) / discounts.sum()])
+        np.testing.assert_allclose(metrics['reciprocal_rank'],
+                                   [1, 0, 0, 0.5])
+
+    def test_aggregates_skip_users_without_relevant_items(self):
+        per_user, result = evaluate_rankings(self.predicted, self.relevant)
+        evaluated = per_user['evaluated']
+        self.assertEqual(result['users'], 3)
+        self.assertAlmostEqual(result['recall'],
+                               per_user['recall'][evaluated].mean())
+        self.assertAlmostEqual(result['mrr'], 0.5)
+        # Items 0-4 were recommended, item 5 was not.
+        self.assertAlmostEqual(result['coverage'], 5 / 6)
+
+    def test_streaming_chunks_merge_to_batch_result(self):
+        rng = np.random.default_rng(0)
+        relevant = csr_matrix((rng.random((500, 40)) < 0.1).astype(float))
+        predicted = np.argsort(rng.random((500, 40)), axis=1)[:, :5]
+        _, expected = evaluate_rankings(predicted, relevant)
+
+        workers = [MetricsAccumulator(40, 5) for _ in range(3)]
+        for chunk, start in enumerate(range(0, 500, 64)):
+            workers[chunk % 3].update(predicted[start:start + 64],
+                                      relevant[start:start + 64])
+        # Accumulators travel between processes pickled.
+        merged = MetricsAccumulator(40, 5)
+        for worker in workers:
+            merged.merge(pickle.loads(pickle.dumps(worker)))
+        result = merged.result()
+        self.assertEqual(result['users'], expected['users'])
+        for name in ('precision', 'recall', 'ndcg', 'mrr', 'coverage'):
+            self.assertAlmostEqual(result[name], expected[name])
+        with self.assertRaises(ValueError):
+            merged.merge(MetricsAccumulator(40, 10))
@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+import unittest
+from flask import Flask
+from api.database import db, init_database
+from models.models import (
+    Movie, MovieStats, Rating, User, initialize_model, rebuild_movie_stats)
+
+RATINGS = [(1, 10, 5.0), (1, 11, 3.0), (2, 10, 4.0), (2, 12, 2.0),
+           (3, 11, 4.0), (3, 12, 5.0)]
+
+
+class TestInitializeModel(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = \
+            f"sqlite:///{os.path.join(self.directory, 'test.db')}"
+        # SQLite has no schemas; map the models' 'public' schema away.
+        self.app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            'execution_options': {'schema_translate_map': {'public': None}}}
+        init_database(self.app)
+        with self.app.app_context():
+            db.create_all(bind_key=None)
+            db.session.add_all([User(id=u, email=f"{u}@x", password="p")
+                                for u in (1, 2, 3)])
+            db.session.add_all([Movie(movie_id=m, title=f"Movie {m}",
+                                      genres="Drama") for m in (10, 11, 12)])
+            db.session.add_all([Rating(user_id=u, movie_id=m, rating=r)
+                                for u, m, r in RATINGS])
+            db.session.commit()
+
+    def test_empty_movie_stats_table_is_not_written(self):
+        for implicit in (False, True):
+            with self.app.app_context():
+                model, _ = initialize_model(
+                    compact=False, time_decay=False, shards=1,
+                    implicit=implicit)
+                self.assertEqual(db.session.query(MovieStats).count(), 0)
+            stats = model.movie_stats.get(10)
+            self.assertEqual((stats['count'], stats['sum']), (2, 9.0))
+            self.assertEqual(len(model.movie_stats), 3)
+
+    def test_movie_stats_table_is_loaded(self):
+        with self.app.app_context():
+            rebuild_movie_stats()
+            db.session.query(MovieStats).filter_by(movie_id=12).delete()
+            db.session.commit()
+            model, _ = initialize_model(compact=False, time_decay=False,
+                                        shards=1, implicit=False)
+        self.assertEqual(len(model.movie_stats), 2)
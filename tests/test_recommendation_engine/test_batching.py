@@ -0,0 +1,109 @@
+import threading
+import time
+import unittest
+import numpy as np
+from scipy.sparse import random as sparse_random
+from recommendation_engine.batching import MicroBatcher
+from recommendation_engine.collaborative_filtering import UserBasedCF
+from recommendation_engine.instrumentation import REGISTRY
+
+
+def make_model(metric='cosine'):
+    matrix = sparse_random(120, 80, density=0.15, random_state=3,
+                           format='csr')
+    matrix.data = np.ceil(matrix.data * 5)
+    model = UserBasedCF(matrix, {u + 1: u for u in range(120)},
+                        {m + 1: m for m in range(80)},
+                        similarity_metric=metric, k=10)
+    model.fit()
+    # Fallback ratings are jittered; make them recognisable instead.
+    model.get_fallback_rating = lambda movie_id: -1.0
+    return model
+
+
+class TestPredictPairs(unittest.TestCase):
+    def test_matches_predict(self):
+        rng = np.random.default_rng(0)
+        # Includes unknown users and movies, which fall back.
+        user_ids = rng.integers(0, 125, 400).tolist()
+        movie_ids = rng.integers(0, 85, 400).tolist()
+        for metric in ('cosine', 'adjusted_cosine'):
+            model = make_model(metric)
+            expected = [model.predict(u, m) for u, m in zip(user_ids, movie_ids)]
+            np.testing.assert_allclose(
+                model.predict_pairs(user_ids, movie_ids), expected)
+
+    def test_empty_and_unfitted(self):
+        model = make_model()
+        self.assertEqual(len(model.predict_pairs([], [])), 0)
+        model.nearest_neighbors = None
+        predictions = model.predict_pairs([1, 999], [1, 1])
+        self.assertTrue(np.isnan(predictions[0]))
+        self.assertEqual(predictions[1], -1.0)
+
+
+class TestMicroBatcher(unittest.TestCase):
+    def setUp(self):
+        self.model = make_model()
+
+    def test_concurrent_requests_share_a_pass(self):
+        batcher = MicroBatcher(max_batch_size=64, max_wait=0.05)
+        batches = REGISTRY.counter("predict_batches_total")
+        before = batches.value
+        pairs = [(u, m) for u in range(1, 9) for m in (3, 17, 40, 90)]
+        futures = [batcher.submit(self.model, u, m) for u, m in pairs]
+        results = [future.result(timeout=5) for future in futures]
+
+        np.testing.assert_allclose(
+            results, [self.model.predict(u, m) for u, m in pairs])
+        self.assertEqual(batches.value - before, 1)
+
+    def test_batches_are_capped(self):
+        batcher = MicroBatcher(max_batch_size=4, max_wait=0.05)
+        batched = REGISTRY.counter("predict_batched_requests_total")
+        batches = REGISTRY.counter("predict_batches_total")
+        requests_before, batches_before = batched.value, batches.value
+        futures = [batcher.submit(self.model, 1, m) for m in range(1, 11)]
+        for future in futures:
+            future.result(timeout=5)
+        self.assertEqual(batched.value - requests_before, 10)
+        self.assertGreaterEqual(batches.value - batches_before, 3)
+
+    def test_lone_request_waits_at_most_max_wait(self):
+        batcher = MicroBatcher(max_batch_size=64, max_wait=0.02)
+        batcher.predict(self.model, 1, 1)
+        start = time.perf_counter()
+        batcher.predict(self.model, 2, 5, timeout=5)
+        self.assertLess(time.perf_counter() - start, 0.5)
+
+    def test_threads_get_their_own_results(self):
+        batcher = MicroBatcher(max_batch_size=16, max_wait=0.005)
+        results, errors = {}, []
+
+        def call(user_id):
+            try:
+                results[user_id] = batcher.predict(
+                    self.model, user_id, 7, timeout=5)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call, args=(user_id,))
+                   for user_id in range(1, 33)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        for user_id, prediction in results.items():
+            self.assertAlmostEqual(prediction, self.model.predict(user_id, 7))
+
+    def test_errors_reach_every_caller(self):
+        class Broken:
+            def predict_pairs(self, user_ids, movie_ids):
+                raise RuntimeError("model unavailable")
+
+        batcher = MicroBatcher(max_wait=0.01)
+        futures = [batcher.submit(Broken(), 1, m) for m in range(3)]
+        for future in futures:
+            with self.assertRaisesRegex(RuntimeError, "model unavailable"):
+                future.result(timeout=5)
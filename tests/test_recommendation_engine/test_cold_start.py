@@ -0,0 +1,91 @@
+import unittest
+import numpy as np
+from scipy.sparse import csr_matrix
+from recommendation_engine.cold_start import (
+    ColdStartRecommender, needs_cold_start)
+from recommendation_engine.collaborative_filtering import UserBasedCF
+from recommendation_engine.pipeline import RecommendationPipeline
+
+GENRES = ["Action", "Comedy", "Drama", "Horror"]
+
+
+def make_model():
+    # Two taste groups: users 1-40 rate movies 1-20 highly, users 41-80
+    # rate movies 21-40 highly; everyone rates a few movies of the other
+    # group low.
+    rng = np.random.default_rng(0)
+    rows, cols, values = [], [], []
+    for user in range(80):
+        liked = np.arange(20) if user < 40 else np.arange(20, 40)
+        other = np.arange(20, 40) if user < 40 else np.arange(20)
+        for column in rng.choice(liked, 12, replace=False):
+            rows.append(user)
+            cols.append(column)
+            values.append(rng.choice([4.0, 5.0]))
+        for column in rng.choice(other, 3, replace=False):
+            rows.append(user)
+            cols.append(column)
+            values.append(rng.choice([1.0, 2.0]))
+    # User 81 has only two ratings.
+    rows += [80, 80]
+    cols += [0, 1]
+    values += [5.0, 5.0]
+    matrix = csr_matrix((values, (rows, cols)), shape=(81, 40))
+    model = UserBasedCF(matrix, {u + 1: u for u in range(81)},
+                        {m + 1: m for m in range(40)}, k=10)
+    model.fit()
+    return model
+
+
+def make_movies():
+    # Movies 1-20 are Action, 21-40 Comedy; every fourth one is also Drama.
+    return [(m, f"Movie {m} (2000)",
+             ("Action" if m <= 20 else "Comedy")
+             + ("|Drama" if m % 4 == 0 else ""))
+            for m in range(1, 41)]
+
+
+class TestColdStart(unittest.TestCase):
+    def setUp(self):
+        self.model = make_model()
+        self.pipeline = RecommendationPipeline(
+            self.model, make_movies(), item_neighbors=10, current_year=2000,
+            recency_weight=0.0)
+        self.cold_start = ColdStartRecommender(self.pipeline)
+
+    def test_needs_cold_start(self):
+        self.assertTrue(needs_cold_start(self.model, 999))
+        self.assertTrue(needs_cold_start(self.model, 81, min_ratings=5))
+        self.assertFalse(needs_cold_start(self.model, 81, min_ratings=2))
+        self.assertFalse(needs_cold_start(self.model, 1, min_ratings=5))
+
+    def test_seed_ratings_pull_similar_movies(self):
+        ids, estimates = self.cold_start.recommend(
+            {1: 5.0, 2: 5.0, 3: 4.5}, [], 10)
+        self.assertEqual(len(ids), 10)
+        self.assertTrue(all(movie_id <= 20 for movie_id in ids.tolist()))
+        self.assertFalse({1, 2, 3} & set(ids.tolist()))
+        self.assertTrue(np.all(np.diff(estimates) <= 1e-9))
+
+        ids, _ = self.cold_start.recommend({25: 5.0, 30: 5.0}, [], 10)
+        self.assertTrue(all(movie_id > 20 for movie_id in ids.tolist()))
+
+    def test_genres_without_seeds(self):
+        ids, estimates = self.cold_start.recommend({}, ["Comedy"], 5)
+        self.assertEqual(len(ids), 5)
+        self.assertTrue(all(movie_id > 20 for movie_id in ids.tolist()))
+        np.testing.assert_allclose(
+            estimates,
+            self.pipeline.popularity[[movie_id - 1
+                                      for movie_id in ids.tolist()]])
+
+    def test_nothing_known_falls_back_to_popular(self):
+        ids, _ = self.cold_start.recommend({999: 4.0}, ["Western"], 5)
+        expected = self.pipeline.column_ids[self.pipeline.by_popularity[:5]]
+        self.assertEqual(ids.tolist(), expected.tolist())
+
+    def test_model_is_not_modified(self):
+        before = self.model.ratings_matrix.copy()
+        self.cold_start.recommend({1: 5.0}, ["Drama"], 10)
+        self.assertEqual((self.model.ratings_matrix != before).nnz, 0)
+        self.assertNotIn(999, self.model.user_index)
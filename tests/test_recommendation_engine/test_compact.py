@@ -0,0 +1,82 @@
+import random
+import unittest
+import numpy as np
+from recommendation_engine.collaborative_filtering import UserBasedCF
+from recommendation_engine.compact import (
+    IdIndex, build_ratings_matrix, compact_csr, decode_half_stars,
+    encode_half_stars, model_nbytes)
+
+
+class TestIdIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = IdIndex([40, 7, 19, 7])
+
+    def test_mapping_interface(self):
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(self.index[7], 0)
+        self.assertEqual(self.index[np.int64(40)], 2)
+        self.assertIn(19, self.index)
+        self.assertNotIn(20, self.index)
+        self.assertIsNone(self.index.get(1000))
+        self.assertEqual(dict(self.index.items()), {7: 0, 19: 1, 40: 2})
+        with self.assertRaises(KeyError):
+            self.index[8]
+
+    def test_vectorized_positions(self):
+        positions = self.index.positions([19, 5, 40, 41])
+        np.testing.assert_array_equal(positions, [1, -1, 2, -1])
+
+    def test_add_as_set(self):
+        self.index.add(10)
+        self.index.add(10)
+        self.assertEqual(self.index.keys(), [7, 10, 19, 40])
+
+
+class TestCompactMatrix(unittest.TestCase):
+    def setUp(self):
+        self.ratings = np.array([
+            [5, 3, 0, 1],
+            [4, 0, 3, 1],
+            [1, 1, 0, 5],
+            [1, 0, 0, 4],
+            [0, 1, 5, 4],
+        ], dtype=np.float64)
+        self.user_ids = [10, 20, 30, 40, 50]
+        self.movie_ids = [100, 200, 300, 400]
+
+    def test_build_keeps_last_duplicate(self):
+        matrix = build_ratings_matrix(
+            [0, 1, 0], [1, 0, 1], [2.0, 4.0, 3.5], shape=(2, 2))
+        self.assertEqual(matrix[0, 1], 3.5)
+        self.assertEqual(matrix.nnz, 2)
+        self.assertEqual(matrix.indices.dtype, np.int32)
+
+    def test_half_star_codes_round_trip(self):
+        values = np.array([0.5, 1.0, 3.5, 5.0])
+        codes = encode_half_stars(values)
+        self.assertEqual(codes.dtype, np.uint8)
+        np.testing.assert_array_equal(decode_half_stars(codes), values)
+
+    def test_compact_model_predicts_like_default(self):
+        dict_model = UserBasedCF(
+            self.ratings,
+            {user_id: idx for idx, user_id in enumerate(self.user_ids)},
+            {movie_id: idx for idx, movie_id in enumerate(self.movie_ids)},
+            k=3, sim_threshold=0.0)
+        compact_model = UserBasedCF(
+            compact_csr(self.ratings), IdIndex(self.user_ids),
+            IdIndex(self.movie_ids), k=3, sim_threshold=0.0)
+        dict_model.fit()
+        compact_model.fit()
+
+        self.assertEqual(compact_model.ratings_matrix.dtype, np.float32)
+        self.assertEqual(compact_model.ratings_matrix.indptr.dtype, np.int32)
+        for user_id in self.user_ids:
+            for movie_id in self.movie_ids:
+                # Fallback ratings are jittered, so draw the same jitter.
+                random.seed(user_id * movie_id)
+                expected = dict_model.predict(user_id, movie_id)
+                random.seed(user_id * movie_id)
+                actual = compact_model.predict(user_id, movie_id)
+                self.assertAlmostEqual(expected, actual, places=4)
+        self.assertLess(model_nbytes(compact_model), model_nbytes(dict_model))
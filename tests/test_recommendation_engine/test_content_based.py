@@ -0,0 +1,85 @@
+import unittest
+import numpy as np
+from recommendation_engine.content_based import (
+    ContentBasedEngine, blend_scores, tokenize)
+
+MOVIES = [
+    (1, "Toy Story (1995)", "Adventure|Animation|Children|Comedy"),
+    (2, "Jumanji (1995)", "Adventure|Children|Fantasy"),
+    (3, "Heat (1995)", "Action|Crime|Thriller"),
+    (4, "Casino (1995)", "Crime|Drama"),
+    (5, "Toy Story 2 (1999)", "Adventure|Animation|Children|Comedy"),
+    (6, "Unknown (2020)", "(no genres listed)"),
+    (7, "Se7en (1995)", "Mystery|Thriller"),
+]
+
+TAGS = [
+    (1, "pixar"), (1, "Pixar animation"), (5, "pixar"), (2, "board game"),
+    (3, "Al Pacino"), (4, "Robert De Niro"), (3, "Robert De Niro"),
+    (7, "serial killer"), (7, "dark"), (4, "Las Vegas"),
+]
+
+
+class TestContentBasedEngine(unittest.TestCase):
+    def setUp(self):
+        self.engine = ContentBasedEngine(MOVIES, TAGS, top_k=3)
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize("Sci-Fi classic"), ["sci", "fi", "classic"])
+        self.assertEqual(tokenize(""), [])
+
+    def test_vectors_are_normalized(self):
+        norms = np.sqrt(np.asarray(
+            self.engine.vectors.multiply(self.engine.vectors).sum(axis=1))
+        ).ravel()
+        # Movie 6 has neither genres nor tags.
+        np.testing.assert_allclose(norms, [1, 1, 1, 1, 1, 0, 1])
+        self.assertIn("tag:pixar", self.engine.vocabulary)
+        self.assertIn("genre:Crime", self.engine.vocabulary)
+        self.assertNotIn("genre:(no genres listed)", self.engine.vocabulary)
+
+    def test_get_similar_items(self):
+        similar = self.engine.get_similar_items(1, 2)
+        self.assertEqual(similar[0][0], 5)
+        self.assertGreater(similar[0][1], similar[1][1])
+        self.assertEqual(self.engine.get_similar_items(3, 1)[0][0], 4)
+        self.assertEqual(self.engine.get_similar_items(6), [])
+        self.assertEqual(self.engine.get_similar_items(999), [])
+        self.assertLessEqual(len(self.engine.get_similar_items(2, 10)), 3)
+
+    def test_matches_dense_cosine(self):
+        dense = self.engine.vectors.toarray()
+        similarities = dense @ dense.T
+        for movie_id, similarity in self.engine.get_similar_items(4, 3):
+            self.assertAlmostEqual(similarity, similarities[3, movie_id - 1])
+
+    def test_add_tags_matches_full_build(self):
+        new_tags = [(6, "Pixar"), (6, "animation"), (2, "Robin Williams")]
+        self.engine.add_tags(new_tags)
+        rebuilt = ContentBasedEngine(MOVIES, TAGS + new_tags, top_k=3)
+
+        def dense(engine):
+            order = [engine.vocabulary[name] for name in sorted(
+                rebuilt.vocabulary)]
+            return engine.vectors.toarray()[:, order]
+
+        np.testing.assert_allclose(dense(self.engine), dense(rebuilt))
+        self.assertEqual(self.engine.get_similar_items(6, 1)[0][0], 1)
+        for movie_id in (2, 6):
+            self.assertEqual(
+                [m for m, _ in self.engine.get_similar_items(movie_id)],
+                [m for m, _ in rebuilt.get_similar_items(movie_id)])
+        self.assertEqual(len(self.engine.add_tags([(999, "lost")])), 0)
+
+    def test_user_scores(self):
+        scores = self.engine.user_scores({1: 5.0, 3: 1.0}, [5, 4, 6, 999])
+        self.assertGreater(scores[0], 0.5)
+        self.assertLess(scores[1], 0)
+        self.assertEqual(scores[2], 0)
+        self.assertEqual(scores[3], 0)
+        np.testing.assert_array_equal(self.engine.user_scores({}, [1, 2]),
+                                      [0, 0])
+
+    def test_blend_scores(self):
+        blended = blend_scores([4.0, np.nan, 2.0], [1.0, 0.5, -0.2], 0.5)
+        np.testing.assert_allclose(blended, [4.5, 3.0, 1.5])
@@ -0,0 +1,68 @@
+import unittest
+import numpy as np
+from scipy.sparse import random as sparse_random
+from recommendation_engine.diversity import (
+    genre_vectors, mmr, normalize_rows)
+
+
+def brute_force_mmr(scores, vectors, n, diversity):
+    relevance = (scores - scores.min()) / (scores.max() - scores.min())
+    similarities = vectors @ vectors.T
+    picks = []
+    while len(picks) < n:
+        best, best_value = None, -np.inf
+        for i in range(len(scores)):
+            if i in picks:
+                continue
+            penalty = max((similarities[i, j] for j in picks), default=0.0)
+            value = (1 - diversity) * relevance[i] - diversity * penalty
+            if value > best_value:
+                best, best_value = i, value
+        picks.append(best)
+    return picks
+
+
+class TestDiversity(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.scores = rng.uniform(1, 5, 200)
+        self.vectors = normalize_rows(sparse_random(
+            200, 500, density=0.02, random_state=1, format='csr'))
+
+    def test_genre_vectors(self):
+        vectors = genre_vectors(["Action|Crime", "Crime", "", None])
+        self.assertEqual(vectors.shape, (4, 2))
+        np.testing.assert_allclose(
+            vectors.toarray(),
+            [[np.sqrt(0.5), np.sqrt(0.5)], [0, 1], [0, 0], [0, 0]])
+
+    def test_zero_diversity_ranks_by_score(self):
+        scores = np.array([1.0, 3.0, 2.0, 3.0])
+        picks = mmr(scores, genre_vectors(["A"] * 4), 3, 0.0)
+        self.assertEqual(picks.tolist(), [1, 3, 2])
+        self.assertEqual(mmr(scores, genre_vectors(["A"] * 4), 9, 0.5)[0], 1)
+
+    def test_matches_brute_force(self):
+        for diversity in (0.2, 0.7):
+            picks = mmr(self.scores, self.vectors, 15, diversity)
+            self.assertEqual(len(set(picks.tolist())), 15)
+            self.assertEqual(
+                picks.tolist(),
+                brute_force_mmr(self.scores, self.vectors.toarray(), 15,
+                                diversity))
+
+    def test_dense_and_sparse_agree(self):
+        vectors = genre_vectors(
+            ["|".join(f"g{g}" for g in range(i % 7, i % 7 + 3))
+             for i in range(200)])
+        self.assertLessEqual(vectors.shape[1], 64)
+        wide = normalize_rows(
+            np.hstack([vectors.toarray(), np.zeros((200, 100))]))
+        np.testing.assert_array_equal(mmr(self.scores, vectors, 20, 0.5),
+                                      mmr(self.scores, wide, 20, 0.5))
+
+    def test_diversity_spreads_genres(self):
+        # The best five movies are all dramas.
+        scores = np.array([5.0, 4.9, 4.8, 4.7, 4.6, 3.0, 2.9])
+        vectors = genre_vectors(["Drama"] * 5 + ["Comedy", "Horror"])
+        self.assertEqual(mmr(scores, vectors, 3, 0.5).tolist(), [0, 5, 6])
@@ -0,0 +1,160 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+import numpy as np
+from scipy.sparse import random as sparse_random
+from recommendation_engine.collaborative_filtering import UserBasedCF
+from recommendation_engine.hybrid import (
+    FEATURES, HybridScorer, UserFeatureCache, fit_linear_model)
+from recommendation_engine.instrumentation import REGISTRY
+from recommendation_engine.pipeline import RecommendationPipeline
+
+
+class TestHybridScorer(unittest.TestCase):
+    def test_score(self):
+        scorer = HybridScorer({"cf": 1.0, "recency": 0.5, "content": 0.0},
+                              bias=0.1)
+        self.assertEqual(scorer.features, ("cf", "recency"))
+        scores = scorer.score({"cf": np.array([4.0, 3.0]),
+                               "recency": np.array([1.0, 0.0]),
+                               "popularity": np.array([9.0, 9.0])})
+        np.testing.assert_allclose(scores, [4.6, 3.1])
+        np.testing.assert_allclose(
+            HybridScorer({}).score({"cf": np.zeros(3)}), [0, 0, 0])
+
+    def test_unknown_feature(self):
+        with self.assertRaisesRegex(ValueError, "Unknown hybrid features"):
+            HybridScorer({"cf": 1.0, "vibes": 2.0})
+
+    def test_from_config(self):
+        expected = {"weights": {"cf": 1.0, "popularity": 0.25}, "bias": 0.5}
+        self.assertEqual(HybridScorer.from_config(expected).to_dict(),
+                         expected)
+        self.assertEqual(
+            HybridScorer.from_config('{"cf": 2.0}').to_dict(),
+            {"weights": {"cf": 2.0}, "bias": 0.0})
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "weights.json")
+            HybridScorer.from_dict(expected).save(path)
+            self.assertEqual(HybridScorer.from_config(path).to_dict(),
+                             expected)
+            with open(path) as f:
+                self.assertEqual(json.load(f), expected)
+
+    def test_fit_linear_model(self):
+        rng = np.random.default_rng(0)
+        features = {"cf": rng.uniform(1, 5, 500),
+                    "popularity": rng.uniform(2, 4, 500),
+                    "recency": rng.uniform(0, 1, 500)}
+        targets = (0.8 * features["cf"] + 0.3 * features["popularity"]
+                   - 0.2 * features["recency"] + 0.1)
+        scorer = fit_linear_model(features, targets, l2=0.0)
+        self.assertAlmostEqual(scorer.weights["cf"], 0.8)
+        self.assertAlmostEqual(scorer.weights["popularity"], 0.3)
+        self.assertAlmostEqual(scorer.weights["recency"], -0.2)
+        self.assertAlmostEqual(scorer.bias, 0.1)
+        np.testing.assert_allclose(scorer.score(features), targets)
+
+    def test_blending_is_fast(self):
+        rng = np.random.default_rng(1)
+        features = {name: rng.random(10000) for name in FEATURES}
+        scorer = HybridScorer({name: 0.5 for name in FEATURES})
+        scorer.score(features)
+        start = time.perf_counter()
+        for _ in range(100):
+            scorer.score(features)
+        self.assertLess((time.perf_counter() - start) / 100, 0.001)
+
+
+class TestUserFeatureCache(unittest.TestCase):
+    def test_hits_expiry_and_eviction(self):
+        cache = UserFeatureCache(max_size=2, ttl=60)
+        calls = []
+
+        def compute(value):
+            calls.append(value)
+            return value
+
+        hits = REGISTRY.counter("user_features_cache_hits_total")
+        before = hits.value
+        self.assertEqual(cache.get(1, lambda: compute("a")), "a")
+        self.assertEqual(cache.get(1, lambda: compute("b")), "a")
+        self.assertEqual(hits.value - before, 1)
+
+        cache.get(2, lambda: compute("c"))
+        cache.get(3, lambda: compute("d"))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get(1, lambda: compute("e")), "e")
+
+        cache.invalidate(1)
+        self.assertEqual(cache.get(1, lambda: compute("f")), "f")
+        cache.ttl = 0
+        self.assertEqual(cache.get(1, lambda: compute("g")), "g")
+        self.assertEqual(calls, ["a", "c", "d", "e", "f", "g"])
+
+
+class TestPipelineFeatures(unittest.TestCase):
+    def setUp(self):
+        matrix = sparse_random(100, 60, density=0.15, random_state=2,
+                               format='csr')
+        matrix.data = np.ceil(matrix.data * 5)
+        self.model = UserBasedCF(matrix, {u + 1: u for u in range(100)},
+                                 {m + 1: m for m in range(60)}, k=10)
+        self.model.fit()
+        self.model.get_fallback_rating = lambda movie_id: 3.0
+        genres = ["Action", "Comedy", "Drama"]
+        self.movies = [(m, f"Movie {m} ({1980 + m % 45})", genres[m % 3])
+                       for m in range(1, 61)]
+
+    def test_features_are_aligned(self):
+        scorer = HybridScorer({name: 1.0 for name in FEATURES})
+        pipeline = RecommendationPipeline(self.model, self.movies,
+                                          scorer=scorer)
+        columns = np.array([0, 1, 10, 59])
+        predictions = np.array([4.0, 3.0, 2.0, 1.0])
+        features = pipeline.features(1, columns, predictions, ["Drama"])
+        self.assertEqual(set(features), set(FEATURES))
+        for values in features.values():
+            self.assertEqual(len(values), len(columns))
+        np.testing.assert_array_equal(features["cf"], predictions)
+        np.testing.assert_array_equal(features["content"], np.zeros(4))
+        # Movie 2 (column 1) is Drama, which the user prefers; movie 1 is
+        # Comedy.
+        drama = features["genre_affinity"][1] - features["genre_affinity"][0]
+        self.assertGreater(drama, 0.5)
+
+    def test_default_scorer_keeps_ranking(self):
+        pipeline = RecommendationPipeline(self.model, self.movies,
+                                          recency_weight=0.5)
+        self.assertEqual(pipeline.scorer.features, ("cf", "recency"))
+        self.assertEqual(pipeline.recency_weight, 0.5)
+        ids, predictions = pipeline.recommend(4, 10, exhaustive=True)
+        scores = predictions + 0.5 * pipeline.recency[ids - 1]
+        self.assertTrue(np.all(np.diff(scores) <= 1e-9))
+
+    def test_user_profile_is_cached(self):
+        scorer = HybridScorer({"cf": 1.0, "genre_affinity": 1.0})
+        pipeline = RecommendationPipeline(self.model, self.movies,
+                                          scorer=scorer)
+        misses = REGISTRY.counter("user_features_cache_misses_total")
+        before = misses.value
+        pipeline.recommend(7, 5)
+        pipeline.recommend(7, 5)
+        self.assertEqual(misses.value - before, 1)
+        profile = pipeline.user_profile(7)
+        rated = self.model.ratings_matrix[6].indices + 1
+        self.assertEqual(sorted(profile["ratings"]), sorted(rated.tolist()))
+
+    def test_rank_recommendations(self):
+        recommendations = [
+            {"movieId": 1, "title": "Old (1950)", "predictedRating": 4.0},
+            {"movieId": 2, "title": "No year", "predictedRating": 3.9},
+            {"movieId": 3, "title": f"New ({time.localtime().tm_year})",
+             "predictedRating": 3.5},
+        ]
+        ranked = self.model.rank_recommendations(recommendations)
+        self.assertEqual([rec["movieId"] for rec in ranked], [3, 1, 2])
+        self.assertAlmostEqual(ranked[0]["score"], 4.5)
+        self.assertEqual(self.model.rank_recommendations([]), [])
@@ -0,0 +1,97 @@
+import unittest
+import numpy as np
+from evaluation.metrics import recall_at_k
+from recommendation_engine.implicit import (
+    ImplicitALS, conjugate_gradient, interaction_matrix, rating_strengths)
+
+
+def planted_interactions(users=200, movies=100, per_user=15, seed=0):
+    """Even users interact with even movies, odd users with odd ones."""
+    rng = np.random.default_rng(seed)
+    rows, columns = [], []
+    for user in range(users):
+        candidates = np.arange(user % 2, movies, 2)
+        rows += [user] * per_user
+        columns += list(rng.choice(candidates, per_user, replace=False))
+    return rows, columns
+
+
+class TestImplicitALS(unittest.TestCase):
+    def test_interaction_matrix_sums_signed_strengths(self):
+        matrix = interaction_matrix([0, 0, 1, 1], [2, 2, 0, 0],
+                                    [1.0, 2.0, 4.0, -4.0], (2, 3))
+        self.assertEqual(matrix.dtype, np.float32)
+        self.assertEqual(matrix[0, 2], 3.0)
+        # Cancelled out: no longer stored.
+        self.assertEqual(matrix.nnz, 1)
+        np.testing.assert_allclose(rating_strengths([5, 3, 1]), [2, 0, -2])
+
+    def test_conjugate_gradient_matches_exact_solve(self):
+        rng = np.random.default_rng(1)
+        matrix = interaction_matrix(
+            rng.integers(0, 20, 120), rng.integers(0, 15, 120),
+            rng.integers(-3, 6, 120), (20, 15))
+        fixed = rng.standard_normal((15, 6)).astype(np.float32)
+        factors = np.zeros((20, 6), dtype=np.float32)
+        conjugate_gradient(matrix, factors, fixed, regularization=0.1,
+                           alpha=2.0, steps=20, block_nnz=16)
+        dense = matrix.toarray()
+        for user in range(20):
+            confidence = 1 + 2.0 * np.abs(dense[user])
+            preference = (dense[user] > 0).astype(np.float64)
+            expected = np.linalg.solve(
+                fixed.T @ (confidence[:, None] * fixed) + 0.1 * np.eye(6),
+                fixed.T @ (confidence * preference))
+            np.testing.assert_allclose(factors[user], expected, atol=1e-4)
+
+    def test_recommends_within_planted_groups(self):
+        rows, columns = planted_interactions()
+        # Hold out the last interaction of every user.
+        held_out = {}
+        for position in range(14, len(rows), 15):
+            held_out[rows[position]] = columns[position] + 1
+        train = [i for i in range(len(rows)) if (i + 1) % 15]
+        matrix = interaction_matrix(np.take(rows, train),
+                                    np.take(columns, train),
+                                    np.ones(len(train)), (200, 100))
+        model = ImplicitALS(matrix, {u: u for u in range(200)},
+                            {m + 1: m for m in range(100)}, factors=8,
+                            iterations=8)
+        model.fit()
+        self.assertEqual(model.user_factors.dtype, np.float32)
+
+        recommended = model.recommend(0, 10)
+        self.assertEqual(len(recommended), 10)
+        self.assertTrue(all(movie_id % 2 == 1 for movie_id, _ in recommended))
+        seen = set(matrix[0].indices + 1)
+        self.assertFalse(seen & {movie_id for movie_id, _ in recommended})
+        # The 36 unseen movies of the user's group include the held-out one.
+        recall = np.mean([
+            recall_at_k([held_out[user]],
+                        [m for m, _ in model.recommend(user, 36)], 36)
+            for user in range(200)])
+        self.assertGreater(recall, 0.8)
+
+    def test_negative_feedback_lowers_score(self):
+        rows, columns = planted_interactions()
+        strengths = np.ones(len(rows))
+        positive = interaction_matrix(rows, columns, strengths, (200, 100))
+        disliked = [i for i in range(len(rows)) if rows[i] == 0][:3]
+        strengths[disliked] = -4.0
+        negative = interaction_matrix(rows, columns, strengths, (200, 100))
+        index = ({u: u for u in range(200)}, {m + 1: m for m in range(100)})
+        scores = []
+        for matrix in (positive, negative):
+            model = ImplicitALS(matrix, *index, factors=8, iterations=8)
+            model.fit()
+            scores.append(model.predict_many(
+                0, [columns[i] + 1 for i in disliked]))
+        self.assertTrue((scores[1] < scores[0] - 0.3).all())
+
+    def test_unknown_ids(self):
+        matrix = interaction_matrix([0], [0], [1.0], (1, 1))
+        model = ImplicitALS(matrix, {7: 0}, {9: 0}, factors=2, iterations=1)
+        model.fit()
+        self.assertTrue(np.isnan(model.predict(8, 9)))
+        self.assertTrue(np.isnan(model.predict_many(7, [10])).all())
+        self.assertEqual(model.recommend(8), [])
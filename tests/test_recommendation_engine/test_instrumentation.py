@@ -0,0 +1,47 @@
+import unittest
+from recommendation_engine import instrumentation
+from recommendation_engine.instrumentation import (
+    REGISTRY, count, server_timing_header, start_request_timing, timer)
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        REGISTRY.reset()
+
+    def test_timer_records_histogram(self):
+        with timer("knn_query"):
+            pass
+        histogram = REGISTRY.histogram("knn_query")
+        self.assertEqual(histogram.count, 1)
+        self.assertEqual(sum(histogram.counts), 1)
+
+    def test_render_prometheus_text(self):
+        count("fallback_ratings_total", 2)
+        with timer("scoring", variant="a"):
+            pass
+        text = REGISTRY.render()
+        self.assertIn("cortexeng_fallback_ratings_total 2", text)
+        self.assertIn('cortexeng_scoring_seconds_bucket{variant="a",le="+Inf"} 1',
+                      text)
+        self.assertIn('cortexeng_scoring_seconds_count{variant="a"} 1', text)
+
+    def test_server_timing_header_aggregates_stages(self):
+        start_request_timing()
+        with timer("db_query"):
+            pass
+        with timer("db_query"):
+            pass
+        header = server_timing_header()
+        self.assertEqual(header.count("db_query;dur="), 1)
+
+    def test_trace_formats_lazily_when_not_sampled(self):
+        class Exploding:
+            def __str__(self):
+                raise AssertionError("formatted an unsampled trace event")
+
+        rate = instrumentation.TRACE_SAMPLE_RATE
+        instrumentation.TRACE_SAMPLE_RATE = 0
+        try:
+            instrumentation.trace("value %s", Exploding())
+        finally:
+            instrumentation.TRACE_SAMPLE_RATE = rate
@@ -0,0 +1,136 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import numpy as np
+from scipy.sparse import random as sparse_random
+from recommendation_engine.collaborative_filtering import UserBasedCF
+from recommendation_engine.instrumentation import REGISTRY
+from recommendation_engine.model_server import (
+    FRAME, OP_PREDICT_MANY, OP_RECOMMEND, ModelClient, ModelServer,
+    ModelServerError, decode_request, decode_response, encode_error,
+    encode_request, encode_response)
+
+
+def make_model(n_users=200, n_movies=150, seed=1):
+    matrix = sparse_random(n_users, n_movies, density=0.1,
+                           random_state=seed, format='csr')
+    matrix.data = np.ceil(matrix.data * 5)
+    model = UserBasedCF(matrix, {u + 1: u for u in range(n_users)},
+                        {m + 1: m for m in range(n_movies)}, k=10)
+    model.fit()
+    # Fallback ratings are jittered; fix them so results are comparable.
+    model.get_fallback_rating = lambda movie_id: 3.0
+    return model
+
+
+class TestProtocol(unittest.TestCase):
+    def test_request_round_trip(self):
+        frame = encode_request(OP_PREDICT_MANY, 7, movie_ids=[3, 1, 2])
+        (length,) = FRAME.unpack_from(frame)
+        self.assertEqual(length, len(frame) - FRAME.size)
+        op, user_id, n, movie_ids = decode_request(frame[FRAME.size:])
+        self.assertEqual((op, user_id, n), (OP_PREDICT_MANY, 7, 3))
+        self.assertEqual(movie_ids.tolist(), [3, 1, 2])
+
+        op, user_id, n, movie_ids = decode_request(
+            encode_request(OP_RECOMMEND, 7, 10)[FRAME.size:])
+        self.assertEqual((op, n, len(movie_ids)), (OP_RECOMMEND, 10, 0))
+
+    def test_malformed_requests_are_rejected(self):
+        payload = encode_request(OP_PREDICT_MANY, 1, movie_ids=[1, 2])
+        for bad in (payload[FRAME.size:FRAME.size + 3],
+                    payload[FRAME.size:-1],
+                    payload[FRAME.size:-8],
+                    b'\x09' + payload[FRAME.size + 1:]):
+            with self.assertRaises(ValueError):
+                decode_request(bad)
+
+    def test_response_round_trip(self):
+        frame = encode_response(np.array([1.5, np.nan]), np.array([4, 5]))
+        ratings, ids = decode_response(frame[FRAME.size:])
+        self.assertEqual(ratings.dtype, np.float64)
+        np.testing.assert_array_equal(ratings, [1.5, np.nan])
+        self.assertEqual(ids.tolist(), [4, 5])
+
+        with self.assertRaisesRegex(ModelServerError, "no such user"):
+            decode_response(encode_error("no such user")[FRAME.size:])
+
+
+class TestModelServer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.model = make_model()
+        cls.directory = tempfile.mkdtemp()
+        cls.path = os.path.join(cls.directory, "model.sock")
+        cls.server = ModelServer(cls.path, cls.model, known_user_ids={1, 2},
+                                 max_wait=0.005)
+        cls.server.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        shutil.rmtree(cls.directory, ignore_errors=True)
+
+    def setUp(self):
+        self.client = ModelClient(self.path).info()
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_info(self):
+        self.assertEqual(len(self.client.user_index), 200)
+        self.assertEqual(self.client.movie_index[150], 149)
+        self.assertEqual(list(self.client.known_user_ids), [1, 2])
+
+    def test_predictions_match_the_model(self):
+        movie_ids = list(range(1, 151))
+        for user_id in (1, 42, 200):
+            np.testing.assert_allclose(
+                self.client.predict_many(user_id, movie_ids),
+                self.model.predict_many(user_id, movie_ids))
+        self.assertEqual(self.client.predict(42, 7),
+                         self.model.predict_many(42, [7])[0])
+
+    def test_recommend_ranks_unrated_movies(self):
+        movie_ids, ratings = self.client.recommend(42, 5)
+        self.assertEqual(len(movie_ids), 5)
+        self.assertTrue(np.all(np.diff(ratings) <= 0))
+        rated = self.model.ratings_matrix[41].indices + 1
+        self.assertFalse(np.isin(movie_ids, rated).any())
+        np.testing.assert_allclose(
+            ratings, self.model.predict_many(42, movie_ids))
+
+        with self.assertRaisesRegex(ModelServerError, "not in the model"):
+            self.client.recommend(999, 5)
+
+    def test_concurrent_requests_are_batched(self):
+        requests = REGISTRY.counter("model_server_requests_total")
+        batches = REGISTRY.counter("model_server_batches_total")
+        requests_before, batches_before = requests.value, batches.value
+        movie_ids = list(range(1, 151))
+        expected = {user_id: self.model.predict_many(user_id, movie_ids)
+                    for user_id in range(1, 17)}
+        results, errors = {}, []
+        barrier = threading.Barrier(16)
+
+        def call(user_id):
+            try:
+                barrier.wait()
+                results[user_id] = self.client.predict_many(user_id, movie_ids)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call, args=(user_id,))
+                   for user_id in expected]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        for user_id, predictions in expected.items():
+            np.testing.assert_allclose(results[user_id], predictions)
+        self.assertEqual(requests.value - requests_before, 16)
+        self.assertLess(batches.value - batches_before, 16)
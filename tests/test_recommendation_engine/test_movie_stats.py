@@ -0,0 +1,54 @@
+import unittest
+import numpy as np
+from recommendation_engine.movie_stats import MovieStatistics, bayesian_mean
+
+
+class TestMovieStatistics(unittest.TestCase):
+    def setUp(self):
+        self.movie_ids = np.array([30, 10, 30, 20, 10, 30])
+        self.ratings = np.array([4.0, 2.0, 5.0, 3.0, 4.0, 3.0])
+        self.timestamps = np.array([100, 50, 300, np.nan, 80, 200])
+        self.stats = MovieStatistics.from_ratings(
+            self.movie_ids, self.ratings, self.timestamps, prior_weight=2)
+
+    def test_from_ratings(self):
+        stats = self.stats.get(30)
+        self.assertEqual(stats['count'], 3)
+        self.assertAlmostEqual(stats['mean'], 4.0)
+        self.assertAlmostEqual(stats['sum_squares'], 50.0)
+        self.assertEqual(stats['last_rated'], 300)
+        self.assertIsNone(self.stats.get(20)['last_rated'])
+        self.assertIsNone(self.stats.get(99))
+        self.assertAlmostEqual(self.stats.global_mean, 21 / 6)
+        self.assertAlmostEqual(
+            stats['bayesian_mean'], (2 * 21 / 6 + 12) / (2 + 3))
+        np.testing.assert_allclose(self.stats.variances(),
+                                   [1.0, 0.0, 2 / 3])
+
+    def test_apply_matches_rebuild(self):
+        self.stats.apply(20, 5.0, rated_at=400)
+        self.stats.apply(30, 1.0, previous_rating=5.0)
+        self.stats.apply(15, 2.5)
+        rebuilt = MovieStatistics.from_ratings(
+            [30, 10, 30, 20, 10, 30, 20, 15],
+            [4.0, 2.0, 1.0, 3.0, 4.0, 3.0, 5.0, 2.5], prior_weight=2)
+        self.assertEqual(self.stats.movie_ids.keys(), [10, 15, 20, 30])
+        for movie_id in (10, 15, 20, 30):
+            expected = rebuilt.get(movie_id)
+            actual = self.stats.get(movie_id)
+            for key in ('count', 'sum', 'sum_squares', 'bayesian_mean'):
+                self.assertAlmostEqual(actual[key], expected[key])
+        self.assertEqual(self.stats.get(20)['last_rated'], 400)
+
+    def test_top_by_bayesian_mean(self):
+        np.testing.assert_array_equal(self.stats.top(2), [30, 20])
+        np.testing.assert_array_equal(self.stats.top(5, min_count=3), [30])
+
+    def test_records(self):
+        records = {r['movie_id']: r for r in self.stats.records()}
+        self.assertEqual(set(records), {10, 20, 30})
+        self.assertEqual(records[10]['rating_count'], 2)
+        self.assertAlmostEqual(records[10]['mean_rating'], 3.0)
+        self.assertAlmostEqual(
+            records[10]['bayesian_mean'],
+            bayesian_mean(6.0, 2, 21 / 6, prior_weight=2))
@@ -0,0 +1,142 @@
+import unittest
+import numpy as np
+from scipy.sparse import random as sparse_random
+from recommendation_engine.collaborative_filtering import UserBasedCF
+from recommendation_engine.hybrid import parse_year, recency_boosts
+from recommendation_engine.instrumentation import REGISTRY
+from recommendation_engine.movie_stats import MovieStatistics
+from recommendation_engine.pipeline import RecommendationPipeline, interleave
+
+GENRES = ["Action", "Comedy", "Drama", "Horror"]
+
+
+def make_model():
+    matrix = sparse_random(150, 100, density=0.1, random_state=5,
+                           format='csr')
+    matrix.data = np.ceil(matrix.data * 5)
+    model = UserBasedCF(matrix, {u + 1: u for u in range(150)},
+                        {m + 1: m for m in range(100)}, k=10)
+    model.fit()
+    model.get_fallback_rating = lambda movie_id: 3.0
+    return model
+
+
+def make_movies():
+    return [(m, f"Movie {m} ({1990 + m % 35})",
+             f"{GENRES[m % 4]}|{GENRES[(m // 4) % 4]}")
+            for m in range(1, 101)]
+
+
+class TestHelpers(unittest.TestCase):
+    def test_parse_year(self):
+        self.assertEqual(parse_year("Heat (1995)"), 1995)
+        self.assertEqual(parse_year("Babylon 5 (1994) "), 1994)
+        self.assertIsNone(parse_year("Untitled"))
+        self.assertIsNone(parse_year(None))
+
+    def test_recency_boosts(self):
+        np.testing.assert_allclose(
+            recency_boosts([2024, 2019, 2000, np.nan], 2024),
+            [1.0, 0.5, 0.0, 0.0])
+
+    def test_interleave(self):
+        merged = interleave([[1, 2, 3], [4, 1, 5], [6]])
+        self.assertEqual(merged.tolist(), [1, 4, 6, 2, 3, 5])
+        self.assertEqual(interleave([]).tolist(), [])
+
+
+class TestRecommendationPipeline(unittest.TestCase):
+    def setUp(self):
+        self.model = make_model()
+        self.movies = make_movies()
+
+    def test_candidates_are_capped_and_unrated(self):
+        pipeline = RecommendationPipeline(
+            self.model, self.movies, max_candidates=25, item_neighbors=5)
+        for user_id in (1, 40, 150):
+            columns = pipeline.candidates(user_id)
+            rated = self.model.ratings_matrix[user_id - 1].indices
+            self.assertLessEqual(len(columns), 25)
+            self.assertEqual(len(set(columns.tolist())), len(columns))
+            self.assertFalse(np.isin(columns, rated).any())
+
+    def test_candidates_include_neighbours_of_top_rated(self):
+        pipeline = RecommendationPipeline(self.model, self.movies,
+                                          seed_items=1, item_neighbors=3)
+        row = self.model.ratings_matrix[0]
+        top = row.indices[np.argmax(row.data)]
+        neighbours = set(pipeline.item_neighbors[top].indices.tolist())
+        neighbours -= set(row.indices.tolist())
+        self.assertTrue(neighbours <= set(pipeline.candidates(1).tolist()))
+
+    def test_preferred_genres_are_retrieved(self):
+        pipeline = RecommendationPipeline(self.model, self.movies,
+                                          item_neighbors=1, per_genre=10)
+        columns = pipeline.candidates(3, ["Horror"])
+        horror = [column for column in columns.tolist()
+                  if "Horror" in self.movies[column][2]]
+        self.assertGreaterEqual(len(horror), 5)
+
+    def test_matches_exhaustive_when_uncapped(self):
+        pipeline = RecommendationPipeline(
+            self.model, self.movies, max_candidates=1000, item_neighbors=100,
+            per_genre=100, trending=100, current_year=2024)
+        for user_id in (2, 77):
+            ids, scores = pipeline.recommend(user_id, 10)
+            expected_ids, expected = pipeline.recommend(
+                user_id, 10, exhaustive=True)
+            self.assertEqual(ids.tolist(), expected_ids.tolist())
+            np.testing.assert_allclose(scores, expected)
+            np.testing.assert_allclose(
+                scores, self.model.predict_many(user_id, ids))
+
+    def test_recency_boost_reorders(self):
+        pipeline = RecommendationPipeline(
+            self.model, self.movies, recency_weight=100.0, current_year=2024)
+        ids, _ = pipeline.recommend(5, 5, exhaustive=True)
+        years = [parse_year(self.movies[movie_id - 1][1])
+                 for movie_id in ids.tolist()]
+        self.assertTrue(all(year >= 2020 for year in years))
+
+    def test_diversity_spreads_genres(self):
+        pipeline = RecommendationPipeline(self.model, self.movies,
+                                          recency_weight=0.0, diversity=0.1)
+
+        def genres_of(diversity):
+            ids, _ = pipeline.recommend(9, 4, exhaustive=True,
+                                        diversity=diversity)
+            return {genre for movie_id in ids.tolist()
+                    for genre in self.movies[movie_id - 1][2].split("|")}
+
+        self.assertEqual(len(genres_of(0.9)), len(GENRES))
+        self.assertLessEqual(len(genres_of(0.0)), len(genres_of(0.9)))
+        self.assertEqual(
+            pipeline.recommend(9, 4, exhaustive=True)[0].tolist(),
+            pipeline.recommend(9, 4, exhaustive=True, diversity=0.1)[0].tolist())
+
+    def test_trending_uses_last_rated(self):
+        counts = np.bincount(self.model.ratings_matrix.indices, minlength=100)
+        now = 1.7e9
+        last_rated = np.where(np.arange(100) < 10, now, now - 90 * 86400)
+        self.model.movie_stats = MovieStatistics(
+            np.arange(1, 101), counts, np.zeros(100), np.zeros(100),
+            last_rated)
+        pipeline = RecommendationPipeline(self.model, self.movies)
+        self.assertEqual(sorted(pipeline.trending.tolist()), list(range(10)))
+
+    def test_unknown_user_and_timers(self):
+        pipeline = RecommendationPipeline(self.model, self.movies)
+        ids, scores = pipeline.recommend(999, 10)
+        self.assertEqual(len(ids), 0)
+        self.assertEqual(len(scores), 0)
+
+        names = ("pipeline_candidates", "pipeline_rerank")
+        before = {name: REGISTRY.histogram(name).count for name in names}
+        pipeline.recommend(1, 10)
+        for name in names:
+            self.assertEqual(REGISTRY.histogram(name).count, before[name] + 1)
+
+    def test_movies_missing_from_catalogue_are_skipped(self):
+        pipeline = RecommendationPipeline(self.model, self.movies[:50])
+        ids, _ = pipeline.recommend(4, 100)
+        self.assertTrue(ids.max() <= 50)
@@ -0,0 +1,140 @@
+import contextvars
+import cProfile
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from recommendation_engine import profiling
+from recommendation_engine.profiling import ProfileRecorder, hotspot_report
+
+
+def busy_work():
+    return sum(i * i for i in range(2000))
+
+
+def worker_work():
+    return sum(i * i for i in range(2000))
+
+
+class MonitoringProfile(cProfile.Profile):
+    """
+    cProfile.Profile as on Python 3.12+, where only one can be enabled per
+    process.
+    """
+    enabled = 0
+
+    def enable(self):
+        if MonitoringProfile.enabled:
+            raise ValueError("Another profiling tool is already active")
+        MonitoringProfile.enabled += 1
+        self.running = True
+        super().enable()
+
+    def disable(self):
+        super().disable()
+        # pstats disables the profiler again.
+        if getattr(self, "running", False):
+            self.running = False
+            MonitoringProfile.enabled -= 1
+
+
+class TestProfileRecorder(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def test_disabled_without_directory(self):
+        recorder = ProfileRecorder(directory=None, sample_rate=1.0)
+        self.assertFalse(recorder.should_profile(forced=True))
+
+    def test_ring_directory_is_bounded(self):
+        recorder = ProfileRecorder(self.directory, max_profiles=2)
+        for _ in range(4):
+            with recorder.profile("fit"):
+                busy_work()
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+    def test_nested_profiles_fold_into_outer(self):
+        recorder = ProfileRecorder(self.directory, max_profiles=10)
+        with recorder.profile("initialize_model"):
+            with recorder.profile("fit"):
+                busy_work()
+        files = os.listdir(self.directory)
+        self.assertEqual(len(files), 1)
+        self.assertIn("initialize_model", files[0])
+
+    def test_hotspot_report_merges_profiles(self):
+        recorder = ProfileRecorder(self.directory, max_profiles=10)
+        for _ in range(2):
+            with recorder.profile("fit"):
+                busy_work()
+        report = hotspot_report(self.directory, top_n=5)
+        self.assertIn("Merged 2 profiles", report)
+        self.assertIn("busy_work", report)
+        self.assertEqual(hotspot_report(self.directory, name="predict"), "")
+
+    def test_worker_profile_joins_caller_profile(self):
+        recorder = ProfileRecorder(self.directory, max_profiles=10)
+
+        def job():
+            with recorder.profile_worker():
+                worker_work()
+
+        # Outside a profile the worker hook does nothing.
+        job()
+        self.assertEqual(os.listdir(self.directory), [])
+        with recorder.profile("recommendations"):
+            busy_work()
+            thread = threading.Thread(
+                target=contextvars.copy_context().run, args=(job,))
+            thread.start()
+            thread.join()
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+        report = hotspot_report(self.directory, top_n=50)
+        self.assertIn("busy_work", report)
+        self.assertIn("worker_work", report)
+
+    def test_one_profile_per_process(self):
+        recorder = ProfileRecorder(self.directory, max_profiles=10)
+        errors = []
+
+        def run(function, *args):
+            try:
+                function(*args)
+            except Exception as e:
+                errors.append(e)
+
+        def job():
+            with recorder.profile_worker():
+                worker_work()
+
+        def other_request():
+            with recorder.profile("movies"):
+                busy_work()
+
+        for process_wide in (False, True):
+            with mock.patch.object(profiling.cProfile, "Profile",
+                                   MonitoringProfile), \
+                    mock.patch.object(profiling, "PROCESS_WIDE_PROFILER",
+                                      process_wide):
+                # A sampled request, its scoring job and another sampled
+                # request at the same time.
+                with recorder.profile("recommendations"):
+                    busy_work()
+                    threads = [
+                        threading.Thread(target=contextvars.copy_context().run,
+                                         args=(run, job)),
+                        threading.Thread(target=run, args=(other_request,))]
+                    for thread in threads:
+                        thread.start()
+                    for thread in threads:
+                        thread.join()
+            self.assertEqual(errors, [])
+            self.assertEqual(MonitoringProfile.enabled, 0)
+        files = os.listdir(self.directory)
+        self.assertEqual(len(files), 2)
+        self.assertTrue(all("recommendations" in f for f in files))
+        # The lock is released: the next request is profiled.
+        with recorder.profile("movies"):
+            busy_work()
+        self.assertEqual(len(os.listdir(self.directory)), 3)
@@ -0,0 +1,74 @@
+import unittest
+import numpy as np
+from scipy.sparse import random as sparse_random
+from recommendation_engine.collaborative_filtering import UserBasedCF
+from recommendation_engine.sharding import (
+    ShardError, ShardProcess, ShardedUserCF, shard_bounds)
+
+
+def make_matrix(n_users=120, n_movies=80, seed=4):
+    matrix = sparse_random(n_users, n_movies, density=0.15,
+                           random_state=seed, format='csr')
+    # Continuous ratings, so no two users tie in similarity.
+    matrix.data = 1 + matrix.data * 4
+    return matrix
+
+
+class TestShardedUserCF(unittest.TestCase):
+    def setUp(self):
+        self.matrix = make_matrix()
+        self.user_index = {u + 1: u for u in range(120)}
+        self.movie_index = {m + 1: m for m in range(80)}
+        self.model = UserBasedCF(self.matrix, self.user_index,
+                                 self.movie_index, k=10)
+        self.model.fit()
+        self.model.get_fallback_rating = lambda movie_id: 3.0
+
+    def sharded(self, shards, local=True):
+        model = ShardedUserCF(self.matrix, self.user_index, self.movie_index,
+                              shards=shards, k=10, local=local)
+        model.fit()
+        self.addCleanup(model.close)
+        return model
+
+    def test_shard_bounds(self):
+        self.assertEqual(shard_bounds(10, 3).tolist(), [0, 3, 7, 10])
+        self.assertEqual(shard_bounds(2, 2).tolist(), [0, 1, 2])
+
+    def test_neighbors_match_unsharded(self):
+        sharded = self.sharded(3)
+        for (sims, rows), (expected_sims, expected_rows) in zip(
+                sharded._neighbors_batch([0, 57, 119]),
+                self.model._neighbors_batch([0, 57, 119])):
+            order = np.argsort(-expected_sims)
+            np.testing.assert_allclose(sims, expected_sims[order])
+            self.assertEqual(rows.tolist(), expected_rows[order].tolist())
+
+    def test_predictions_match_unsharded(self):
+        movie_ids = np.array([3, 80, 999, 41, 7, 1])
+        for shards in (1, 4):
+            sharded = self.sharded(shards)
+            for user_id in (1, 30, 61, 120):
+                np.testing.assert_allclose(
+                    sharded.predict_many(user_id, movie_ids),
+                    self.model.predict_many(user_id, movie_ids))
+        self.assertEqual(sharded.predict_many(5000, [1, 2]).tolist(),
+                         [3.0, 3.0])
+
+    def test_worker_processes(self):
+        sharded = self.sharded(2, local=False)
+        users = [2, 64, 100]
+        movie_lists = [np.arange(1, 81)] * 3
+        for predicted, expected in zip(
+                sharded.predict_batch(users, movie_lists),
+                self.model.predict_batch(users, movie_lists)):
+            np.testing.assert_allclose(predicted, expected)
+
+    def test_shard_errors_are_raised(self):
+        shard = ShardProcess(self.matrix[:10], 0)
+        self.addCleanup(shard.close)
+        shard.submit("rows", [50])
+        with self.assertRaises(ShardError):
+            shard.result()
+        shard.submit("rows", [3])
+        self.assertEqual(shard.result().shape, (1, 80))
@@ -0,0 +1,146 @@
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from scipy.sparse import random as sparse_random
+from recommendation_engine.collaborative_filtering import UserBasedCF
+from recommendation_engine.movie_stats import MovieStatistics
+from recommendation_engine.shared_model import (
+    SharedModelReader, SharedModelStore)
+
+SMAPS = '/proc/self/smaps_rollup'
+
+
+def make_model(n_users, n_movies, density, seed=0):
+    matrix = sparse_random(n_users, n_movies, density=density,
+                           random_state=seed, format='csr')
+    matrix.data = np.ceil(matrix.data * 5)
+    model = UserBasedCF(matrix, {u + 1: u for u in range(n_users)},
+                        {m + 1: m for m in range(n_movies)},
+                        similarity_metric='adjusted_cosine', k=10)
+    model.fit()
+    coo = matrix.tocoo()
+    model.movie_stats = MovieStatistics.from_ratings(coo.col + 1, coo.data)
+    return model
+
+
+def memory_kb():
+    """Shared and private resident memory of this process, in kB."""
+    counters = {}
+    with open(SMAPS) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                counters[parts[0].rstrip(':')] = int(parts[1])
+    # Freshly written files are still dirty in the page cache.
+    return (counters['Shared_Clean'] + counters['Shared_Dirty'],
+            counters['Private_Clean'] + counters['Private_Dirty'])
+
+
+def serve(directory, all_attached, published, results):
+    # Import everything attaching needs before taking the baseline.
+    import recommendation_engine.collaborative_filtering  # noqa: F401
+
+    reader = SharedModelReader(SharedModelStore(directory), poll_interval=0)
+    before = memory_kb()
+    reader.refresh()
+    matrix = reader.model.ratings_matrix
+    # Read every page of the shared arrays.
+    checksum = float(matrix.data.sum()) + float(matrix.indices.sum())
+    all_attached.wait()
+    after = memory_kb()
+    results.put(('memory', os.getpid(), checksum,
+                 after[0] - before[0], after[1] - before[1]))
+
+    published.wait(60)
+    reader.refresh(force=True)
+    results.put(('update', os.getpid(), reader.generation,
+                 float(reader.model.ratings_matrix.data[0])))
+
+
+class TestSharedModel(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = SharedModelStore(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_attached_model_predicts_like_original(self):
+        model = make_model(80, 60, 0.2)
+        self.store.publish(model, set(range(1, 81)))
+        reader = SharedModelReader(self.store)
+        self.assertTrue(reader.refresh())
+        self.assertFalse(reader.refresh(force=True))
+        shared = reader.model
+
+        self.assertFalse(shared.ratings_matrix.data.flags.writeable)
+        self.assertIn(80, reader.known_user_ids)
+        for user_id in (1, 17, 80):
+            random.seed(0)
+            expected = model.predict_many(user_id, list(range(1, 61)))
+            random.seed(0)
+            actual = shared.predict_many(user_id, list(range(1, 61)))
+            np.testing.assert_allclose(actual, expected)
+
+        # Movie statistics are copy-on-write: local updates stay local.
+        count = model.movie_stats.get(5)['count']
+        shared.movie_stats.apply(5, 4.0)
+        self.assertEqual(shared.movie_stats.get(5)['count'], count + 1)
+        self.assertEqual(
+            self.store.attach()[0].movie_stats.get(5)['count'], count)
+
+    def test_old_generations_are_removed(self):
+        model = make_model(20, 10, 0.3)
+        for _ in range(4):
+            generation = self.store.publish(model)
+        self.assertEqual(generation, 4)
+        self.assertEqual(self.store.current_generation(), 4)
+        self.assertEqual(
+            sorted(name for name in os.listdir(self.directory)
+                   if name.startswith('gen-')),
+            ['gen-00000003', 'gen-00000004'])
+
+    @unittest.skipUnless(os.path.exists(SMAPS), "needs /proc smaps_rollup")
+    def test_workers_share_pages_and_see_new_generations(self):
+        workers = 3
+        model = make_model(1000, 4000, 0.25)
+        self.store.publish(model)
+        ratings = model.ratings_matrix
+        shared_kb = (ratings.data.nbytes + ratings.indices.nbytes) // 1024
+
+        context = multiprocessing.get_context('spawn')
+        all_attached = context.Barrier(workers)
+        published = context.Event()
+        results = context.Queue()
+        processes = [
+            context.Process(target=serve, args=(
+                self.directory, all_attached, published, results))
+            for _ in range(workers)]
+        for process in processes:
+            process.start()
+        try:
+            memory = [results.get(timeout=120) for _ in range(workers)]
+            for _, _, checksum, shared, private in memory:
+                self.assertAlmostEqual(
+                    checksum, ratings.data.sum() + ratings.indices.sum())
+                # The pages are mapped by all workers at once, so they are
+                # counted as shared, not copied into each process.
+                self.assertGreater(shared, 0.9 * shared_kb)
+                self.assertLess(private, 0.25 * shared_kb)
+
+            ratings.data[0] = 5.0 if ratings.data[0] != 5.0 else 1.0
+            self.store.publish(model)
+            published.set()
+            updates = [results.get(timeout=120) for _ in range(workers)]
+            for _, _, generation, value in updates:
+                self.assertEqual(generation, 2)
+                self.assertEqual(value, ratings.data[0])
+        finally:
+            for process in processes:
+                process.join(timeout=30)
+                if process.is_alive():
+                    process.terminate()
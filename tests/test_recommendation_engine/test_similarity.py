@@ -0,0 +1,113 @@
+import unittest
+import numpy as np
+from scipy.sparse import csr_matrix
+from recommendation_engine.collaborative_filtering import UserBasedCF
+from recommendation_engine.similarity import (
+    SIMILARITY_METRICS, neighbor_block_size, neighbor_table,
+    similarity_matrix, top_k_per_row)
+
+
+class TestSimilarity(unittest.TestCase):
+    def setUp(self):
+        self.dense = np.array([
+            [5, 3, 0, 1],
+            [4, 0, 3, 1],
+            [1, 1, 0, 5],
+            [1, 0, 0, 4],
+            [0, 1, 5, 4],
+        ], dtype=np.float64)
+        self.ratings = csr_matrix(self.dense)
+        self.rated = self.dense > 0
+
+    def test_cosine_matches_dense_computation(self):
+        norms = np.linalg.norm(self.dense, axis=1)
+        expected = self.dense @ self.dense.T / np.outer(norms, norms)
+        np.fill_diagonal(expected, 0)
+        result = similarity_matrix(self.ratings, 'cosine', block_size=2)
+        np.testing.assert_allclose(result.toarray(), expected)
+
+    def test_pearson_uses_co_rated_items_only(self):
+        result = similarity_matrix(self.ratings, 'pearson', block_size=2)
+        u, v = 0, 2
+        co_rated = self.rated[u] & self.rated[v]
+        a = self.dense[u, co_rated] - self.dense[u, self.rated[u]].mean()
+        b = self.dense[v, co_rated] - self.dense[v, self.rated[v]].mean()
+        expected = (a * b).sum() / np.sqrt((a * a).sum() * (b * b).sum())
+        self.assertAlmostEqual(result[u, v], expected)
+
+    def test_jaccard(self):
+        result = similarity_matrix(self.ratings, 'jaccard')
+        # Users 0 and 1 share items {0, 3} out of {0, 1, 2, 3}.
+        self.assertAlmostEqual(result[0, 1], 0.5)
+        self.assertEqual(result[0, 0], 0)
+
+    def test_shrunk_cosine_is_damped(self):
+        cosine = similarity_matrix(self.ratings, 'cosine')
+        shrunk = similarity_matrix(self.ratings, 'shrunk_cosine', shrinkage=2)
+        # Users 0 and 1 have two co-rated items.
+        self.assertAlmostEqual(shrunk[0, 1], cosine[0, 1] * 2 / 4)
+
+    def test_top_k_keeps_largest_per_row(self):
+        full = similarity_matrix(self.ratings, 'adjusted_cosine')
+        truncated = similarity_matrix(
+            self.ratings, 'adjusted_cosine', block_size=2, top_k=2)
+        self.assertTrue((truncated.getnnz(axis=1) <= 2).all())
+        for row in range(5):
+            expected = np.sort(full[row].data)[::-1][:2]
+            np.testing.assert_allclose(truncated[row].data, expected)
+
+    def test_top_k_min_similarity(self):
+        block = csr_matrix(np.array([[0.9, 0.1, 0.5], [0.0, 0.3, 0.05]]))
+        truncated = top_k_per_row(block, 5, min_similarity=0.2)
+        np.testing.assert_allclose(truncated.toarray(),
+                                   [[0.9, 0, 0.5], [0, 0.3, 0]])
+
+    def test_unknown_metric(self):
+        with self.assertRaises(ValueError):
+            similarity_matrix(self.ratings, 'manhattan')
+
+    def test_model_with_neighbor_table(self):
+        model = UserBasedCF(self.dense, {u: u for u in range(5)},
+                            {m: m for m in range(4)},
+                            similarity_metric='pearson', k=2,
+                            sim_threshold=-1.0)
+        model.fit()
+        self.assertIsNone(model.nearest_neighbors)
+        self.assertTrue((model.neighbor_table.getnnz(axis=1) <= 2).all())
+        prediction = model.predict(0, 2)
+        self.assertTrue(1 <= prediction <= 5)
+        model.update_user_similarity()
+        self.assertEqual(model.similarity_matrix.shape, (5, 5))
+
+    def test_neighbor_table_matches_top_k(self):
+        rng = np.random.default_rng(0)
+        dense = np.where(rng.random((40, 12)) < 0.4,
+                         rng.integers(1, 6, (40, 12)) + rng.random((40, 12)),
+                         0)
+        for metric in SIMILARITY_METRICS:
+            expected = similarity_matrix(dense, metric, top_k=3,
+                                         min_similarity=0.1)
+            result = neighbor_table(dense, metric, top_k=3,
+                                    min_similarity=0.1, n_jobs=3,
+                                    max_memory=200_000)
+            np.testing.assert_array_equal(result.indptr, expected.indptr)
+            np.testing.assert_allclose(result.data, expected.data)
+
+    def test_neighbor_block_size_respects_memory(self):
+        self.assertEqual(neighbor_block_size(1000, 1000, top_k=10), 1024)
+        size = neighbor_block_size(1000, 1000, top_k=10, n_jobs=2,
+                                   max_memory=1_000_000)
+        # 120 kB table, 36 bytes per cell of a 1000-column row per job.
+        self.assertEqual(size, (1_000_000 - 120_000) // (2 * 36_000))
+        with self.assertRaises(MemoryError):
+            neighbor_table(self.ratings, top_k=2, max_memory=100)
+
+    def test_model_block_fit(self):
+        model = UserBasedCF(self.dense, {u: u for u in range(5)},
+                            {m: m for m in range(4)}, k=2,
+                            n_jobs=2, fit_memory_limit=10_000)
+        model.fit()
+        self.assertIsNone(model.nearest_neighbors)
+        expected = similarity_matrix(self.ratings, 'cosine', top_k=2)
+        np.testing.assert_allclose(model.neighbor_table.data, expected.data)
+        self.assertTrue(1 <= model.predict(0, 2) <= 5)
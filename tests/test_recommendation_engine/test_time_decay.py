@@ -0,0 +1,131 @@
+import unittest
+import numpy as np
+from scipy.sparse import csr_matrix, random as sparse_random
+from recommendation_engine.collaborative_filtering import UserBasedCF
+from recommendation_engine.time_decay import DAY, TimeDecay
+
+NOW = 1_700_000_000.0
+
+
+class TestTimeDecay(unittest.TestCase):
+    def setUp(self):
+        self.ratings = csr_matrix(np.array([[5.0, 0, 3.0], [0, 4.0, 0]]))
+        self.timestamps = np.array([NOW, NOW - 10 * DAY, np.nan])
+        self.decay = TimeDecay(self.ratings, self.timestamps,
+                               half_life=10 * DAY, now=NOW)
+
+    def test_weights(self):
+        np.testing.assert_allclose(self.decay.weights.toarray(),
+                                   [[1, 0, 0.5], [0, 1, 0]])
+        np.testing.assert_allclose(self.decay.weighted.toarray(),
+                                   [[5, 0, 1.5], [0, 4, 0]])
+        with self.assertRaisesRegex(ValueError, "Expected 3 timestamps"):
+            TimeDecay(self.ratings, [NOW])
+
+    def test_refresh_rescales_in_place(self):
+        data = self.decay.weights.data
+        self.decay.refresh(NOW + 20 * DAY)
+        self.assertIs(self.decay.weights.data, data)
+        np.testing.assert_allclose(self.decay.weights.toarray(),
+                                   [[0.25, 0, 0.125], [0, 0.25, 0]])
+        rebuilt = TimeDecay(self.ratings, self.decay.timestamps(),
+                            half_life=10 * DAY, now=NOW + 20 * DAY)
+        np.testing.assert_allclose(self.decay.weighted.toarray(),
+                                   rebuilt.weighted.toarray())
+        self.decay.refresh_interval = 3600
+        self.assertFalse(self.decay.maybe_refresh())
+
+    def test_reindex(self):
+        ratings = csr_matrix(np.array([[5.0, 2.0, 3.0], [0, 1.0, 0]]))
+        decay = self.decay.reindex(ratings, [1], [1])
+        timestamps = decay.timestamps()
+        self.assertAlmostEqual(timestamps[0], NOW, delta=1)
+        self.assertAlmostEqual(timestamps[2], NOW - 10 * DAY, delta=1)
+        # The new rating and the updated one are dated now.
+        self.assertGreater(timestamps[1], NOW)
+        self.assertGreater(timestamps[3], NOW)
+
+
+class TestTimeDecayedModel(unittest.TestCase):
+    def setUp(self):
+        matrix = sparse_random(80, 40, density=0.3, random_state=3,
+                               format='csr')
+        matrix.data = np.ceil(matrix.data * 5)
+        self.matrix = matrix
+        self.timestamps = NOW - np.random.default_rng(0).uniform(
+            0, 1000 * DAY, matrix.nnz)
+
+    def model(self, timestamps=None, metric='cosine'):
+        model = UserBasedCF(self.matrix, {u + 1: u for u in range(80)},
+                            {m + 1: m for m in range(40)},
+                            similarity_metric=metric, k=10, sim_threshold=0.0)
+        if timestamps is not None:
+            model.time_decay = TimeDecay(self.matrix, timestamps,
+                                         half_life=200 * DAY, now=NOW)
+        model.fit()
+        model.get_fallback_rating = lambda movie_id: 3.0
+        return model
+
+    def test_uniform_ages_match_plain_model(self):
+        plain = self.model()
+        decayed = self.model(np.full(self.matrix.nnz, NOW - 300 * DAY))
+        movie_ids = np.arange(1, 41)
+        for user_id in (1, 17, 60):
+            np.testing.assert_allclose(decayed.predict_many(user_id, movie_ids),
+                                       plain.predict_many(user_id, movie_ids))
+
+    def test_prediction_paths_agree(self):
+        for metric in ('cosine', 'pearson'):
+            model = self.model(self.timestamps, metric)
+            users = [u for u in range(1, 81, 7) for _ in range(40)]
+            movies = list(range(1, 41)) * (len(users) // 40)
+            pairs = model.predict_pairs(users, movies)
+            many = np.concatenate([model.predict_many(u, np.arange(1, 41))
+                                   for u in range(1, 81, 7)])
+            single = [model.predict(u, m) for u, m in zip(users, movies)]
+            np.testing.assert_allclose(pairs, many)
+            np.testing.assert_allclose(pairs, single)
+
+    def test_matches_weighted_mean(self):
+        model = self.model(self.timestamps)
+        similarities, neighbors = model._neighbors(4)
+        weights = model.time_decay.weights.toarray()
+        ratings = self.matrix.toarray()
+        column = next(c for c in range(40) if ratings[4, c] == 0
+                      and (ratings[neighbors[similarities > 0], c] > 0).any())
+        valid = (ratings[neighbors, column] > 0) & (similarities > 0)
+        w = similarities[valid] * weights[neighbors[valid], column]
+        expected = np.clip(
+            np.dot(w, ratings[neighbors[valid], column]) / w.sum(), 1, 5)
+        self.assertAlmostEqual(model.predict(5, column + 1), expected)
+
+    def test_refresh_keeps_predictions(self):
+        model = self.model(self.timestamps)
+        before = model.predict_many(3, np.arange(1, 41))
+        model.time_decay.refresh(NOW + 400 * DAY)
+        np.testing.assert_allclose(model.predict_many(3, np.arange(1, 41)),
+                                   before)
+
+    def test_update_rating_matrix(self):
+        model = self.model(self.timestamps)
+        before = model.time_decay.timestamps()
+        # An existing user rates a known movie and a new one; a new user
+        # rates a known movie.
+        model.update_rating_matrix(3, [5, 41], [4.0, 2.0])
+        model.update_rating_matrix(81, [5], [5.0])
+        self.assertEqual(model.ratings_matrix.shape, (81, 41))
+        self.assertEqual((model.user_index[81], model.movie_index[41]),
+                         (80, 40))
+        self.assertEqual(model.ratings_matrix[2, 4], 4.0)
+        self.assertEqual(model.ratings_matrix[80, 4], 5.0)
+        timestamps = model.time_decay.timestamps()
+        self.assertEqual(len(timestamps), model.ratings_matrix.nnz)
+        # Untouched ratings keep their time, updated ones are dated now.
+        first = model.ratings_matrix.indptr[1]
+        np.testing.assert_allclose(timestamps[:first], before[:first],
+                                   rtol=0, atol=1)
+        slot = model.ratings_matrix.indptr[2] + np.searchsorted(
+            model.ratings_matrix[2].indices, 4)
+        self.assertGreater(timestamps[slot], NOW)
+        self.assertTrue(1 <= model.predict(81, 7) <= 5)
+        self.assertTrue(np.isfinite(model.predict_many(3, [41])).all())